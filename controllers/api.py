@@ -60,25 +60,24 @@ def _schedule_get(year, week, sorting, TeacherID, ClassTypeID, LocationID, Level
     # classes
     data = dict()
     data['classes'] = dict()
-    for day in range(1, 8):
-        date = iso_to_gregorian(int(year), int(week), int(day))
-
-        class_schedule = ClassSchedule(
-            date,
-            filter_id_school_classtype=ClassTypeID,
-            filter_id_school_location=LocationID,
-            filter_id_school_level=LevelID,
-            filter_id_teacher=TeacherID,
-            filter_public=True,
-            sorting=sorting
-        )
 
-        key = unicode(NRtoDay(day))
+    date_start = iso_to_gregorian(int(year), int(week), 1)
+    date_end = iso_to_gregorian(int(year), int(week), 7)
+
+    class_schedule = ClassSchedule(
+        date_start,
+        filter_id_school_classtype=ClassTypeID,
+        filter_id_school_location=LocationID,
+        filter_id_school_level=LevelID,
+        filter_id_teacher=TeacherID,
+        filter_public=True,
+        sorting=sorting
+    )
 
-        class_data = dict(classes=class_schedule.get_day_list(),
-                          date=date)
+    for day in class_schedule.get_range_list(date_start, date_end):
+        key = unicode(NRtoDay(day['date'].isoweekday()))
 
-        data['classes'][key] = class_data
+        data['classes'][key] = day
 
     # Teachers and classtypes this week
     teacher_ids_this_week = []
@@ -279,9 +278,10 @@ def schedule_get():
                             'ClassTypeID_' + unicode(ClassTypeID) + '_' + \
                             'LocationID_' + unicode(LocationID) + '_' + \
                             'LevelID_' + unicode(LevelID)
-                data = cache.ram(cache_key,
-                                 lambda: _schedule_get(year, week, sorting, TeacherID, ClassTypeID, LocationID, LevelID),
-                                 time_expire=cache_2_min)
+                data = OsCacheManager().get(cache_key,
+                                            lambda: _schedule_get(year, week, sorting, TeacherID, ClassTypeID, LocationID, LevelID),
+                                            ['classschedule_api'],
+                                            time_expire=cache_2_min)
 
         except ValueError:
             data = T("Value error")
@@ -385,42 +385,37 @@ def schedule_get_days():
         if request.vars['SortBy'] == 'time':
             sorting = 'starttime'
 
-    current_date = date_start
-    delta = datetime.timedelta(days=1)
-    data = {}
-    data['schedule'] = []
-    while current_date <= date_end:
-        class_schedule = ClassSchedule(
-            current_date,
-            filter_id_school_classtype = ClassTypeID,
-            filter_id_school_location = LocationID,
-            filter_id_school_level = LevelID,
-            filter_id_teacher = TeacherID,
-            filter_public = True,
-            sorting=sorting,
-        )
-
-        # Don't cache when running tests or when day == today
-        if web2pytest.is_running_under_test(request, request.application) or current_date == TODAY_LOCAL:
-            classes = class_schedule.get_day_list()
-        else:
-            cache_key = 'openstudio_api_schedule_get_days_' + unicode(date_start) + '_' + \
-                        unicode(date_end) + '_' + \
-                        'sorting_' + sorting + '_' + \
-                        'TeacherID_' + unicode(TeacherID) + '_' + \
-                        'ClassTypeID_' + unicode(ClassTypeID) + '_' + \
-                        'LocationID_' + unicode(LocationID) + '_' + \
-                        'LevelID_' + unicode(LevelID)
-            classes = cache.ram(cache_key,
-                             lambda: class_schedule.get_day_list(),
-                             time_expire=CACHE_LONG)
-
-        data['schedule'].append({
-            'classes': classes,
-            'date': current_date
-        })
+    class_schedule = ClassSchedule(
+        date_start,
+        filter_id_school_classtype = ClassTypeID,
+        filter_id_school_location = LocationID,
+        filter_id_school_level = LevelID,
+        filter_id_teacher = TeacherID,
+        filter_public = True,
+        sorting=sorting,
+    )
 
-        current_date += delta
+    data = {}
+    # Don't cache when running tests
+    if web2pytest.is_running_under_test(request, request.application):
+        data['schedule'] = class_schedule.get_range_list(date_start, date_end)
+    else:
+        # Keep today's availability up to date
+        time_expire = CACHE_LONG
+        if date_start <= TODAY_LOCAL <= date_end:
+            time_expire = cache_2_min
+
+        cache_key = 'openstudio_api_schedule_get_days_' + unicode(date_start) + '_' + \
+                    unicode(date_end) + '_' + \
+                    'sorting_' + sorting + '_' + \
+                    'TeacherID_' + unicode(TeacherID) + '_' + \
+                    'ClassTypeID_' + unicode(ClassTypeID) + '_' + \
+                    'LocationID_' + unicode(LocationID) + '_' + \
+                    'LevelID_' + unicode(LevelID)
+        data['schedule'] = OsCacheManager().get(cache_key,
+                                                lambda: class_schedule.get_range_list(date_start, date_end),
+                                                ['classschedule_api'],
+                                                time_expire=time_expire)
 
     # Define caching
     caching = (cache.ram, 120)
@@ -645,9 +640,10 @@ def workshops_get():
         data = _workshops_get()
     else:
         cache_key = 'openstudio_workshops_api_workshops_get'
-        data = cache.ram(cache_key,
-                         lambda: _workshops_get(),
-                         time_expire=CACHE_LONG)
+        data = OsCacheManager().get(cache_key,
+                                    lambda: _workshops_get(),
+                                    ['workshops'],
+                                    time_expire=CACHE_LONG)
 
     return data
 
@@ -939,9 +935,10 @@ def school_subscriptions_get():
         data = _school_subscriptions_get()
     else:
         cache_key = 'openstudio_school_subcriptions_api_get'
-        data = cache.ram(cache_key,
-                         lambda: _school_subscriptions_get(),
-                         time_expire=CACHE_LONG)
+        data = OsCacheManager().get(cache_key,
+                                    lambda: _school_subscriptions_get(),
+                                    ['school_subscriptions'],
+                                    time_expire=CACHE_LONG)
 
     return {'data':data}
 
@@ -1020,9 +1017,10 @@ def school_classcards_get():
         data = _school_classcards_get()
     else:
         cache_key = 'openstudio_school_classcards_api_get'
-        data = cache.ram(cache_key,
-                         lambda: _school_classcards_get(),
-                         time_expire=CACHE_LONG)
+        data = OsCacheManager().get(cache_key,
+                                    lambda: _school_classcards_get(),
+                                    ['school_classcards'],
+                                    time_expire=CACHE_LONG)
 
     return {'data':data}
 
@@ -1137,9 +1135,10 @@ def school_teachers_get():
             ctID = None
             cache_key = 'openstudio_school_teachers_api_get_all'
 
-        data = cache.ram(cache_key,
-                         lambda: _school_teachers_get_by_classtype(ctID),
-                         time_expire=CACHE_LONG)
+        data = OsCacheManager().get(cache_key,
+                                    lambda: _school_teachers_get_by_classtype(ctID),
+                                    ['school_teachers'],
+                                    time_expire=CACHE_LONG)
 
     return {'data':data}
 
@@ -1207,8 +1206,9 @@ def school_classtypes_get():
     else:
         cache_key = 'openstudio_school_classtypes_api_get_all'
 
-        data = cache.ram(cache_key,
-                         lambda: _school_classtypes_get(),
-                         time_expire=CACHE_LONG)
+        data = OsCacheManager().get(cache_key,
+                                    lambda: _school_classtypes_get(),
+                                    ['school_classtypes'],
+                                    time_expire=CACHE_LONG)
 
     return {'data':data}
@@ -82,6 +82,9 @@ def get_databases(request):
         except:
             cond = isinstance(value, SQLDB)
         if cond:
+            if hasattr(value, 'define_all'):
+                # List all tables, including the ones not used yet
+                value.define_all()
             dbs[key] = value
     return dbs
 
@@ -120,6 +120,10 @@ def add_subscription_credits_for_month():
               default=TODAY_LOCAL.year,
               requires=IS_INT_IN_RANGE(2010, 2999),
               label=T("Year")),
+        Field('preview', 'boolean',
+              default=False,
+              label=T("Preview only"),
+              comment=T("Show the credits that would be added, without adding them")),
         formstyle="bootstrap3_stacked",
         submit_button=T("Add credits")
     )
@@ -135,8 +139,13 @@ def add_subscription_credits_for_month():
         form
     )
 
+    if 'year' in request.vars and 'month' in request.vars and request.vars['preview']:
+        content.append(add_subscription_credits_for_month_get_preview(
+            int(request.vars['year']),
+            int(request.vars['month'])
+        ))
 
-    if 'year' in request.vars and 'month' in request.vars:
+    elif 'year' in request.vars and 'month' in request.vars:
         year = request.vars['year']
         month = request.vars['month']
         description = request.vars['description'] or ''
@@ -169,6 +178,52 @@ def add_subscription_credits_for_month():
     )
 
 
+def add_subscription_credits_for_month_get_preview(year, month):
+    """
+    :param year: int
+    :param month: int
+    :return: table listing credits to be added for each subscription
+    """
+    from openstudio.os_customers_subscriptions_credits import CustomersSubscriptionsCredits
+
+    csch = CustomersSubscriptionsCredits()
+    data = csch.get_credits_for_month(year, month)
+
+    header = THEAD(TR(
+        TH(T("Customer")),
+        TH(T("Subscription")),
+        TH(T("Credits")),
+        TH(T("Skipped")),
+    ))
+
+    table = TABLE(header, _class='table table-striped table-hover table-condensed')
+
+    total = 0
+    for item in data:
+        total += item['Credits']
+        table.append(TR(
+            TD(item['CustomerName']),
+            TD(item['SubscriptionName']),
+            TD(item['Credits'] if not item['Skip'] else ''),
+            TD(item['Skip'] or ''),
+        ))
+
+    table.append(TFOOT(TR(
+        TH(T("Total")),
+        TH(),
+        TH(round(total, 1)),
+        TH(),
+    )))
+
+    return DIV(
+        BR(),
+        LABEL(T("Preview")),
+        P(T("Subscriptions to receive credits"), ': ',
+          len([ item for item in data if not item['Skip'] ])),
+        table
+    )
+
+
 def index_get_current_month_mollie_recurring(table):
     """
     :param table:
@@ -33,6 +33,7 @@ from openstudio.os_invoices import  Invoices
 from openstudio.os_customer_subscriptions import CustomerSubscriptions
 from openstudio.os_customer import Customer
 from openstudio.os_customers import Customers
+from openstudio.os_customers_search import CustomersSearch
 
 # helper functions
 
@@ -542,8 +543,7 @@ def class_edit_get_notification_no_access_defined(clsID):
     return notification
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('update', 'classes'))
+@auth.requires_admin_or_permission('update', 'classes')
 def class_teachers():
     """
         Overview with teachers for a class
@@ -735,8 +735,7 @@ def class_teachers_check_classtype(form):
         session.classes_teachers_msg = None
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-                auth.has_permission('delete', 'classes'))
+@auth.requires_admin_or_permission('delete', 'classes')
 def class_delete():
     """
         Removed the selected class and redirect to the manage page
@@ -776,8 +775,7 @@ def class_delete():
     redirect(URL('schedule'))
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('create', 'classes'))
+@auth.requires_admin_or_permission('create', 'classes')
 def duplicate_class():
     clsID = request.args[0]
     row = db.classes[clsID]
@@ -876,8 +874,7 @@ def check_class(form):
         session.flash = T("This teacher is not marked as a teacher for this type of class")
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('read', 'classes'))
+@auth.requires_admin_or_permission('read', 'classes')
 def schedule():
     """
         Main list of classes
@@ -1371,8 +1368,7 @@ def schedule_get_export(var=None):
     return export
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('update', 'workshops_activities'))
+@auth.requires_admin_or_permission('update', 'workshops_activities')
 def schedule_get_overlapping_workshops():
     """
         Returns overlapping workhshops for a week in the schedule
@@ -1453,8 +1449,7 @@ def schedule_get_status(modals):
     return schedule_status
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('read', 'classes'))
+@auth.requires_admin_or_permission('read', 'classes')
 def schedule_set_week():
     """
         Set the session variables for schedule week and year
@@ -1468,8 +1463,7 @@ def schedule_set_week():
     redirect(URL('schedule'))
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('update', 'schedule_classes_status'))
+@auth.requires_admin_or_permission('update', 'schedule_classes_status')
 def schedule_set_week_status():
     """
         Function to set the weekly status of the schedule
@@ -1506,8 +1500,7 @@ def schedule_get_sort_options():
     return sort_options
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('update', 'schedule_set_default_sort'))
+@auth.requires_admin_or_permission('update', 'schedule_set_default_sort')
 def schedule_set_sort_default():
     """
         Displays a page to edit the default sorting order for the schedule
@@ -1572,8 +1565,7 @@ def schedule_get_back(var=None):
     return os_gui.get_button('back', URL('schedule'))
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('update', 'classes_schedule_set_trend_precentages'))
+@auth.requires_admin_or_permission('update', 'classes_schedule_set_trend_precentages')
 def schedule_set_trend_percentages():
     """
         Set percentages for trend colors
@@ -1659,8 +1651,7 @@ def schedule_set_trend_percentages():
                 save=submit)
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('update', 'classes_schedule_set_trend_precentages'))
+@auth.requires_admin_or_permission('update', 'classes_schedule_set_trend_precentages')
 def schedule_set_trend_percentages_clear():
     """
         Clear trend percentages
@@ -1683,8 +1674,7 @@ def schedule_set_trend_percentages_clear():
     redirect(URL('schedule_set_trend_percentages'))
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('read', 'classes'))
+@auth.requires_admin_or_permission('read', 'classes')
 def schedule_current_week():
     session.schedule_week = None
     session.schedule_year = None
@@ -1692,8 +1682,7 @@ def schedule_current_week():
     redirect(URL('schedule'))
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('read', 'classes'))
+@auth.requires_admin_or_permission('read', 'classes')
 def _schedule_clear_filter():
     session.schedule_filter_location = None
     session.schedule_filter_teacher = None
@@ -1781,8 +1770,7 @@ def schedule_get_filter_form(school_locations_id='',
     return div
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-                auth.has_permission('read', 'classes'))
+@auth.requires_admin_or_permission('read', 'classes')
 def schedule_export_excel():
     iso_year = request.vars['year']
     iso_week = request.vars['week']
@@ -1889,8 +1877,7 @@ def schedule_export_excel():
         return stream.getvalue()
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('create', 'classes_attendance_override'))
+@auth.requires_admin_or_permission('create', 'classes_attendance_override')
 def attendance_override():
     """
         This function shows a page that allows the customer count of attendance to be overridden
@@ -1952,8 +1939,7 @@ def attendance_override():
     return dict(content=content, menu=menu, back=back)
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-                auth.has_permission('update', 'classes_waitinglist'))
+@auth.requires_admin_or_permission('update', 'classes_waitinglist')
 def waitinglist():
     """
         lists waitinglist for a class
@@ -2017,8 +2003,7 @@ def waitinglist():
                 menu=menu)
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('update', 'classes_reservation'))
+@auth.requires_admin_or_permission('update', 'classes_reservation')
 def reservations():
     """
         Manage reservations for a class
@@ -2193,8 +2178,7 @@ def reservations_get_export(clsID, date_formatted):
     return export
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('update', 'classes_reservation'))
+@auth.requires_admin_or_permission('update', 'classes_reservation')
 def reservations_export_mailinglist():
     """
         Excel export mailing list
@@ -2347,8 +2331,7 @@ def reservation_get_spaces_reserved(clsID, date):
     return reservations
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-                auth.has_permission('update', 'classes_waitinglist'))
+@auth.requires_admin_or_permission('update', 'classes_waitinglist')
 def waitinglist_edit():
     response.title = T("Waitinglist")
     clsID = request.vars['clsID']
@@ -2365,8 +2348,8 @@ def waitinglist_edit():
     if 'name' in request.vars: # check whether a search filter is in use
         if request.vars['name'] != '':
             name = request.vars['name']
-            search_name = '%' + request.vars['name'] + '%'
-            query &= ((db.auth_user.display_name.like(search_name)))
+            customers_search = CustomersSearch()
+            query &= customers_search.get_query(name)
 
     form = get_customers_searchform(clsID, date, name, request.function)
 
@@ -2443,8 +2426,7 @@ def waitinglist_edit():
     return dict(back=back, content=content)
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-                auth.has_permission('update', 'classes_attendance'))
+@auth.requires_admin_or_permission('update', 'classes_attendance')
 def attendance_get_chart_title():
     """
         This function returns the title for the attendance chart
@@ -2453,8 +2435,7 @@ def attendance_get_chart_title():
                  unicode(session.stats_attendance_year))
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('read', 'classes_attendance'))
+@auth.requires_admin_or_permission('read', 'classes_attendance')
 def attendance_set_chart_year():
     """
         This function is calles as json and sets the attendance year + or - 1
@@ -2520,8 +2501,7 @@ def attendance_get_notice(message):
     return os_gui.get_alert('info', message, dismissable=False)
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('read', 'classes_attendance'))
+@auth.requires_admin_or_permission('read', 'classes_attendance')
 def attendance():
     """
         This function shows a page of people expected to attend a class
@@ -2697,8 +2677,7 @@ def attendance():
                 header_tools=header_tools)
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('update', 'customers_contact'))
+@auth.requires_admin_or_permission('update', 'customers_contact')
 def attendance_export_excel_mailinglist():
     """
         :return: Mailing list for a class
@@ -2763,8 +2742,7 @@ def attendance_get_count(clsID, date, formatted=True):
 
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('update', 'classes_attendance'))
+@auth.requires_admin_or_permission('update', 'classes_attendance')
 def attendance_booking_options():
     """
         Page to list booking options for a customer
@@ -2831,8 +2809,7 @@ def reservation_get_return_url(clsID, date):
     return url
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-                auth.has_permission('update', 'classes_reservation'))
+@auth.requires_admin_or_permission('update', 'classes_reservation')
 def reservation_remove():
     """
         Remove reservation
@@ -2862,8 +2839,7 @@ def reservation_remove():
     redirect(reservation_get_return_url(clsID, date_formatted))
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-                auth.has_permission('create', 'classes_reservation'))
+@auth.requires_admin_or_permission('create', 'classes_reservation')
 def reservation_add_choose():
     """
     List applicable subscriptions and cards for customer
@@ -2902,8 +2878,7 @@ def reservation_add_choose():
     return dict(content=content, back=back)
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-                auth.has_permission('create', 'classes_reservation'))
+@auth.requires_admin_or_permission('create', 'classes_reservation')
 def class_enroll():
     """
         Add reservation for a customer
@@ -2994,8 +2969,7 @@ def reservation_on_create(form):
     session.flash = T("Booked") + ' ' + unicode(classes_booked) + ' ' + classes + "."
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('update', 'classes_reservation'))
+@auth.requires_admin_or_permission('update', 'classes_reservation')
 def reservation_edit():
     """
         Edit page for recurring reservations
@@ -3100,8 +3074,7 @@ def reservation_get_cancel_button(crID, date):
     return cancel_res
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-                auth.has_permission('update', 'classes_waitinglist'))
+@auth.requires_admin_or_permission('update', 'classes_waitinglist')
 def waitinglist_process():
     clsID = request.vars['clsID']
     customers_id = request.vars['customers_id']
@@ -3121,8 +3094,7 @@ def waitinglist_process():
 
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-                auth.has_permission('update', 'classes_attendance'))
+@auth.requires_admin_or_permission('update', 'classes_attendance')
 def attendance_remove_ajaj():
     """
         Called as JSON, used to remove the attendance to a class for a customer
@@ -3149,8 +3121,7 @@ def attendance_remove_ajaj():
     return dict(status=status, message=message)
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('delete', 'classes_attendance'))
+@auth.requires_admin_or_permission('delete', 'classes_attendance')
 def attendance_remove():
     """
         Removes a customer from a class
@@ -3320,8 +3291,7 @@ def attendance_sign_in_get_returl_url(clsID, date_formatted, cuID):
     return url
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('update', 'classes_attendance'))
+@auth.requires_admin_or_permission('update', 'classes_attendance')
 def attendance_list_classcards():
     customers_id = request.vars['cuID']
     clsID = request.vars['clsID']
@@ -3784,8 +3754,7 @@ def overlapping_workshops_count():
     return len(wsa_ids)
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('update', 'workshops_activities'))
+@auth.requires_admin_or_permission('update', 'workshops_activities')
 def overlapping_workshops():
     """
         Shows a list of overlapping workshop activities
@@ -3906,8 +3875,7 @@ def overlapping_workshops_get_query(row, class_date):
     return query
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('update', 'classes'))
+@auth.requires_admin_or_permission('update', 'classes')
 def class_prices():
     """
         List prices for a class
@@ -4032,8 +4000,7 @@ def class_price_edit():
                 save=result['submit'])
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('delete', 'classes_price'))
+@auth.requires_admin_or_permission('delete', 'classes_price')
 def class_price_delete():
     """
         Delete class price
@@ -4055,8 +4022,7 @@ def class_prices_add_edit_get_return_url(clsID):
     return URL('class_prices', vars ={'clsID':clsID})
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('read', 'classes_notes'))
+@auth.requires_admin_or_permission('read', 'classes_notes')
 def notes():
     """
         Add notes to a class
@@ -4280,8 +4246,7 @@ def note_edit():
                 left_sidebar_enabled=True)
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('delete', 'classes_notes'))
+@auth.requires_admin_or_permission('delete', 'classes_notes')
 def note_delete():
     """
         Used to remove a note
@@ -4345,8 +4310,7 @@ def notes_get_add(var=None):
     return DIV(add, form)
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('update', 'classes_school_subscriptions_groups'))
+@auth.requires_admin_or_permission('update', 'classes_school_subscriptions_groups')
 def class_copy_subscriptions_classcards():
     """
         :return: page to copy subscription and classcard settings from another class
@@ -4471,8 +4435,7 @@ def class_subscriptions_get_tools(clsID):
     return tools
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('update', 'classes_school_subscriptions_groups'))
+@auth.requires_admin_or_permission('update', 'classes_school_subscriptions_groups')
 def class_copy_subscriptions_classcards_execute():
     """
         Copy subscription and classcard settings from another class
@@ -4517,8 +4480,7 @@ def class_copy_subscriptions_classcards_execute():
     redirect(URL('class_subscriptions', vars={'clsID':clsID_to}))
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('read', 'classes_school_subscriptions_groups'))
+@auth.requires_admin_or_permission('read', 'classes_school_subscriptions_groups')
 def class_subscriptions():
     """
         List subscriptions allowed for this class
@@ -4608,8 +4570,7 @@ def class_subscriptions_get_content(clsID):
     return table
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('delete', 'classes_school_subscriptions_groups'))
+@auth.requires_admin_or_permission('delete', 'classes_school_subscriptions_groups')
 def class_subscription_group_delete():
     """
         Delete a subscription group from this class
@@ -4736,8 +4697,7 @@ def class_subscription_group_add_get_already_added(clsID):
     return ids
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('read', 'classes_school_classcards_groups'))
+@auth.requires_admin_or_permission('read', 'classes_school_classcards_groups')
 def class_classcards():
     """
         List classcards allowed for this class
@@ -4827,8 +4787,7 @@ def class_classcards_get_content(clsID):
     return table
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('delete', 'classes_school_classcards_groups'))
+@auth.requires_admin_or_permission('delete', 'classes_school_classcards_groups')
 def class_classcard_group_delete():
     """
         Delete a classcard group from this class
@@ -5024,8 +4983,7 @@ def sub_request_get_return_url(var=None):
     return URL('subs_manage')
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('update', 'classes_otc_sub_avail'))
+@auth.requires_admin_or_permission('update', 'classes_otc_sub_avail')
 def sub_avail_accept():
     cotcsaID = request.vars['cotcsaID']
 
@@ -5049,8 +5007,7 @@ def sub_avail_accept():
     redirect(sub_request_get_return_url())
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('update', 'classes_otc_sub_avail'))
+@auth.requires_admin_or_permission('update', 'classes_otc_sub_avail')
 def sub_avail_decline():
     cotcsaID = request.vars['cotcsaID']
 
@@ -5059,8 +5016,7 @@ def sub_avail_decline():
     redirect(sub_request_get_return_url())
 
     
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('read', 'classes_revenue'))
+@auth.requires_admin_or_permission('read', 'classes_revenue')
 def revenue():
     """
     Quick revenue for a class
@@ -5102,8 +5058,7 @@ def revenue():
                 menu=menu)
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('read', 'classes_revenue'))
+@auth.requires_admin_or_permission('read', 'classes_revenue')
 def revenue_export_preview():
     from openstudio.os_reports import Reports
 
@@ -5117,8 +5072,7 @@ def revenue_export_preview():
     return reports._get_class_revenue_summary_pdf_template(clsID, date, quick_stats=True)
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('read', 'classes_revenue'))
+@auth.requires_admin_or_permission('read', 'classes_revenue')
 def revenue_export():
     """
 
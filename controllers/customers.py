@@ -18,6 +18,7 @@ from os_storage import uploads_available_space
 
 from openstudio.os_class_attendance import ClassAttendance
 from openstudio.os_customers import Customers
+from openstudio.os_customers_search import CustomersSearch
 from openstudio.os_customer import Customer
 from openstudio.os_customer_classcard import CustomerClasscard
 from openstudio.os_classcards_helper import ClasscardsHelper
@@ -5311,7 +5312,8 @@ def load_list():
                              extension=''),
                          client_side=True)
 
-        query &= ((db.auth_user.display_name.like(search_name)) |
+        customers_search = CustomersSearch()
+        query &= ((customers_search.get_query(search_name.replace('%', ''))) |
                   (db.auth_user.email == search_name.replace('%', '')) |
                   (db.auth_user.id == session.customers_load_list_search_name_int))
 
@@ -5887,6 +5889,8 @@ def account_merge_execute():
     merge_into = db.auth_user(cuID)
     merge_from = db.auth_user(auth_merge_id)
     if not merge_from.merged:
+        # Tables are defined on first use, define all so none are skipped
+        db.define_all()
         # loop over all tables in db
         for table in db:
             # auth_user_id
@@ -537,9 +537,33 @@ def download():
     allows downloading of uploaded files
     http://..../[app]/default/download/[filename]
     """
+    from openstudio.os_thumbnails import OsThumbnails
+
+    name = request.args(0)
+    os_thumbnails = OsThumbnails()
+    if name and os_thumbnails.name_regex.match(name):
+        return os_thumbnails.stream(name)
+
     return response.download(request, db)
 
 
+@cache.action()
+def thumbnail():
+    """
+    Thumbnail of an uploaded picture in one of the sizes of
+    OsThumbnails.on_demand_sizes, c crops the picture to fill the size
+    http://..../[app]/default/thumbnail/[width]x[height][c]/[filename]
+    """
+    from openstudio.os_thumbnails import OsThumbnails
+
+    os_thumbnails = OsThumbnails()
+    name = os_thumbnails.get_on_demand(request.args(1), request.args(0))
+    if not name:
+        raise HTTP(404)
+
+    return os_thumbnails.stream(name)
+
+
 def call():
     """
     exposes services. for example:
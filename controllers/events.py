@@ -2848,7 +2848,10 @@ def ticket_resend_info_mail():
     # Send mail
     ##
     osmail = OsMail()
-    msgID = osmail.render_email_template('workshops_info_mail', workshops_products_customers_id=wspcID)
+    msgID = osmail.render_email_template_batch(
+        'workshops_info_mail',
+        [ {'workshops_products_customers_id': wspcID} ]
+    )[0]
     sent = osmail.send(msgID, cuID)
 
     ##
@@ -9,8 +9,7 @@ from openstudio.os_invoice import Invoice
 from openstudio.os_invoices import Invoices
 from openstudio.os_school_subscription import SchoolSubscription
 
-import csv
-import cStringIO
+import tempfile
 
 
 @auth.requires(auth.has_membership(group_id='Admins') or \
@@ -516,6 +515,16 @@ def batch_content_get_export(pbID):
                                                                                          'recurring':True}))
     ]
 
+    pb = db.payment_batches(pbID)
+    if pb.BatchType == 'collection':
+        links.extend([
+            A(os_gui.get_fa_icon('fa-file-code-o'), T('SEPA'), _href=URL('export_sepa', vars={'pbID':pbID})),
+            A(os_gui.get_fa_icon('fa-star-o'), T('SEPA First'), _href=URL('export_sepa', vars={'pbID':pbID,
+                                                                                               'first':True})),
+            A(os_gui.get_fa_icon('fa-repeat'), T('SEPA Recurring'), _href=URL('export_sepa', vars={'pbID':pbID,
+                                                                                                   'recurring':True}))
+        ])
+
     for link in links:
         dd_ul.append(LI(link))
 
@@ -738,265 +747,46 @@ def generate_batch_items(form):
     """
         Generates payment batch items
     """
-    # set some general values
-    pbID = form.vars.id
-    pb = db.payment_batches(pbID)
-
-    if db.sys_properties(Property='Currency'):
-        currency = db.sys_properties(Property='Currency').PropertyValue
-    else:
-        currency = "EUR"
-
-
-    # Default export (No category)
-    if pb.BatchTypeDescription == 'invoices':
-        generate_batch_items_invoices(pbID,
-                                      pb,
-                                      currency)
-    elif ( pb.BatchTypeDescription == 'teacher_payments' or
-           pb.BatchTypeDescription == 'employee_expenses' ):
-        from openstudio.os_payment_batch import PaymentBatch
-        pb = PaymentBatch(pbID)
-        pb.generate_batch_items()
-    else:
-        # Category
-        coldate = datetime.date(pb.ColYear, int(pb.ColMonth), 1)
-        firstdaythismonth = coldate
-        lastdaythismonth = get_last_day_month(coldate)
-
-        generate_batch_items_category(pbID,
-                                      pb,
-                                      firstdaythismonth,
-                                      lastdaythismonth,
-                                      currency)
+    from openstudio.os_payment_batch import PaymentBatch
 
+    pb = PaymentBatch(form.vars.id)
+    pb.generate_batch_items()
 
-def generate_batch_items_invoices(pbID,
-                                  pb,
-                                  currency):
-    """
-        Generate invoices batch and write to db.payment_batches_items
-    """
-    query = (db.invoices.Status == 'sent') & \
-            ((db.invoices.TeacherPayment == False) |
-             (db.invoices.TeacherPayment == None)) & \
-            ((db.invoices.EmployeeClaim == False) |
-             (db.invoices.EmployeeClaim == None)) & \
-            (db.invoices.payment_methods_id == 3) # 3 = Direct Debit
 
-    if not pb.school_locations_id is None and pb.school_locations_id != '':
-        query &= (db.auth_user.school_locations_id==pb.school_locations_id)
-
-    left = [
-        db.invoices_amounts.on(
-            db.invoices_amounts.invoices_id ==
-            db.invoices.id
-        ),
-        db.invoices_customers.on(
-            db.invoices_customers.invoices_id ==
-            db.invoices.id
-        ),
-        db.invoices_customers_subscriptions.on(
-            db.invoices_customers_subscriptions.invoices_id ==
-            db.invoices.id
-        ),
-        db.auth_user.on(
-            db.invoices_customers.auth_customer_id ==
-            db.auth_user.id
-        ),
-        db.customers_payment_info.on(
-            db.customers_payment_info.auth_customer_id ==
-            db.invoices_customers.auth_customer_id
-        ),
-        db.customers_payment_info_mandates.on(
-            db.customers_payment_info_mandates.customers_payment_info_id ==
-            db.customers_payment_info.id
-        ),
-        db.school_locations.on(
-            db.auth_user.school_locations_id ==
-            db.school_locations.id
-        )
-    ]
-
-    rows = db(query).select(db.invoices.ALL,
-                            db.invoices_amounts.ALL,
-                            db.invoices_customers_subscriptions.ALL,
-                            db.customers_payment_info.ALL,
-                            db.customers_payment_info_mandates.ALL,
-                            db.school_locations.Name,
-                            db.auth_user.id,
-                            left=left,
-                            orderby=db.auth_user.id)
-
-    for row in rows:
-        cuID = row.auth_user.id
-        csID = row.invoices_customers_subscriptions.customers_subscriptions_id
-        iID  = row.invoices.id
-
-        amount = row.invoices_amounts.TotalPriceVAT
-
-        # check for zero amount
-        if not pb.IncludeZero and amount == 0:
-            continue
-
-        # set description
-        description = row.invoices.Description
-        if not description:
-            description = pb.Description
-
-        try:
-            description = description.strip()
-        except:
-            pass
-
-        # set account number
-        try:
-            accountnr = row.customers_payment_info.AccountNumber.strip()
-        except AttributeError:
-            accountnr = ''
-        # set BIC
-        try:
-            bic = row.customers_payment_info.BIC.strip()
-        except AttributeError:
-            bic = ''
-
-        msdate = row.customers_payment_info_mandates.MandateSignatureDate
-
-        # set bank name
-        if row.customers_payment_info.BankName == '':
-            row.customers_payment_info.BankName = None
-
-        db.payment_batches_items.insert(
-            payment_batches_id = pbID,
-            auth_customer_id = cuID,
-            customers_subscriptions_id = csID,
-            invoices_id = iID,
-            AccountHolder = row.customers_payment_info.AccountHolder,
-            BIC = bic,
-            AccountNumber = accountnr,
-            MandateSignatureDate = msdate,
-            MandateReference = row.customers_payment_info_mandates.MandateReference,
-            Amount = amount,
-            Currency = currency,
-            Description = description,
-            BankName = row.customers_payment_info.BankName,
-            BankLocation = row.customers_payment_info.BankLocation
-        )
-
-
-def generate_batch_items_category(pbID,
-                                  pb,
-                                  firstdaythismonth,
-                                  lastdaythismonth,
-                                  currency):
-    """
-        Generates batch items for a category
-    """
-    category_id = pb.payment_categories_id
-    query = (db.alternativepayments.payment_categories_id == category_id) & \
-            (db.alternativepayments.PaymentYear == pb.ColYear) & \
-            (db.alternativepayments.PaymentMonth == pb.ColMonth)
-
-    if not pb.school_locations_id is None and pb.school_locations_id != '':
-        query &= (db.auth_user.school_locations_id==pb.school_locations_id)
-
-    left = [
-        db.auth_user.on(
-            db.auth_user.id ==
-            db.alternativepayments.auth_customer_id
-        ),
-        db.school_locations.on(
-            db.school_locations.id ==
-            db.auth_user.school_locations_id
-        ),
-        db.customers_payment_info.on(
-            db.customers_payment_info.auth_customer_id ==
-            db.alternativepayments.auth_customer_id
-        ),
-        db.customers_payment_info_mandates.on(
-            db.customers_payment_info_mandates.customers_payment_info_id ==
-            db.customers_payment_info.id
-        )
-    ]
-
-    rows = db(query).select(db.alternativepayments.Amount,
-                            db.alternativepayments.Description,
-                            db.alternativepayments.auth_customer_id,
-                            db.auth_user.id,
-                            db.auth_user.first_name,
-                            db.auth_user.last_name,
-                            db.school_locations.Name,
-                            db.customers_payment_info.ALL,
-                            db.customers_payment_info_mandates.ALL,
-                            left=left,
-                            orderby=db.auth_user.id)
-    for row in rows:
-        # check for 0 amount, skip if it's not supposed to be included
-        if row.alternativepayments.Amount == 0 and not pb.IncludeZero:
-            continue
-        cuID = row.auth_user.id
-        amount = format(row.alternativepayments.Amount, '.2f')
-        description = row.alternativepayments.Description
-
-        try:
-            description = description.strip()
-        except:
-            pass
-
-        # end alternative payments
-
-        try:
-            accountnr = row.customers_payment_info.AccountNumber.strip()
-        except AttributeError:
-            accountnr = ''
-        try:
-            bic = row.customers_payment_info.BIC.strip()
-        except AttributeError:
-            bic = ''
-
-        msdate = row.customers_payment_info_mandates.MandateSignatureDate
-
-        if row.customers_payment_info.BankName == '':
-            row.customers_payment_info.BankName = None
-
-        db.payment_batches_items.insert(
-            payment_batches_id = pbID,
-            auth_customer_id = row.auth_user.id,
-            AccountHolder = row.customers_payment_info.AccountHolder,
-            BIC = bic,
-            AccountNumber = accountnr,
-            MandateSignatureDate = msdate,
-            MandateReference = row.customers_payment_info_mandates.MandateReference,
-            Amount = amount,
-            Currency = currency,
-            Description = description,
-            BankName = row.customers_payment_info.BankName,
-            BankLocation = row.customers_payment_info.BankLocation
-        )
-
-
-def get_batch_items_recurring_set(pbID):
-    """
-    :param pbID: db.paymentbatches.id
-    :return: list of auth_user_ids that have been in previous batches
-    """
-    pb = db.payment_batches(pbID)
-
-    query = (db.payment_batches.id < pbID) & \
-            (db.payment_batches.BatchType == pb.BatchType) & \
-            (db.payment_batches.Status == 'sent_to_bank')
+@auth.requires(auth.has_membership(group_id='Admins') or \
+               auth.has_permission('create', 'payment_batches'))
+def batch_add_preview():
+    """
+        Returns totals, counts and the FRST/RCUR split of the items a new
+        batch would get, without creating the batch.
+        request.vars are the same as the fields of the batch_add form, with
+        request.vars['export'] and request.vars['what'] setting the batch type.
+    """
+    from gluon.storage import Storage
+    from openstudio.os_payment_batch_items import PaymentBatchItems
+
+    response.view = 'generic.json'
+
+    batch = Storage(
+        BatchType = request.vars['export'],
+        BatchTypeDescription = request.vars['what'],
+        payment_categories_id = request.vars['payment_categories_id'],
+        ColYear = request.vars['ColYear'],
+        ColMonth = request.vars['ColMonth'],
+        school_locations_id = request.vars['school_locations_id'],
+        IncludeZero = request.vars['IncludeZero'] in ['on', 'T', 'True'],
+        Description = request.vars['Description'],
+    )
 
-    left = [ db.payment_batches.on(db.payment_batches_items.payment_batches_id == db.payment_batches.id) ]
+    if batch.BatchTypeDescription == 'category' and \
+       not (batch.payment_categories_id and batch.ColYear and batch.ColMonth):
+        return dict(error=T("Please select a category, year and month"))
 
-    rows = db(query).select(db.payment_batches_items.auth_customer_id,
-                            left=left,
-                            distinct=True)
+    currency = get_sys_property('Currency') or 'EUR'
 
-    ids = []
-    for row in rows:
-        ids.append(row.auth_customer_id)
+    pbi = PaymentBatchItems(batch, currency)
 
-    return ids
+    return pbi.preview()
 
 
 def get_batch_items(pbID, display=False, first=False, recurring=False):
@@ -1012,19 +802,10 @@ def get_batch_items(pbID, display=False, first=False, recurring=False):
     else:
         location = 'All'
 
-    query = (db.payment_batches_items.payment_batches_id == pbID)
-
-    recurring_ids = get_batch_items_recurring_set(pbID)
-
-    if first:
-        # Append to query to only show first customers
-        # list customers where status == sent to bank and pbID < this batch, & batchtype = same then only customer id's not in set
-        query &= ~(db.payment_batches_items.auth_customer_id.belongs(recurring_ids))
+    from openstudio.os_payment_batch_export import PaymentBatchExport
 
-    if recurring:
-        # Append to query to only show recurring customers
-        # list customers where status == sent to bank and pbID < this batch, & batchtype (col or pay) is same then only customer id's in set
-        query &= (db.payment_batches_items.auth_customer_id.belongs(recurring_ids))
+    pbe = PaymentBatchExport(pbID)
+    query = pbe.get_items_query(first=first, recurring=recurring)
 
     left = [
         db.invoices.on(
@@ -1097,6 +878,73 @@ def export_csv():
     """
         Exports batch to CSV format
     """
+    from openstudio.os_payment_batch_export import PaymentBatchExport
+
+    first, recurring, pb = export_batch_log()
+
+    pbe = PaymentBatchExport(pb.id)
+    stream = tempfile.TemporaryFile()
+    pbe.csv(stream,
+            first=first,
+            recurring=recurring,
+            show_location=bool(session.show_location))
+    stream.seek(0)
+
+    fname = export_batch_get_filename(pb, first, recurring) + '.csv'
+    response.headers['Content-Type']='application/vnd.ms-excel'
+    response.headers['Content-disposition']='attachment; filename=' + fname
+
+    return response.stream(stream, request=request)
+
+
+@auth.requires(auth.has_membership(group_id='Admins') or \
+               auth.has_permission('read', 'payment_batches'))
+def export_sepa():
+    """
+        Exports collection batch to SEPA direct debit XML (pain.008.001.02)
+    """
+    from openstudio.os_payment_batch_export import PaymentBatchExport
+
+    pbID = request.vars['pbID']
+    pb = db.payment_batches(pbID)
+
+    creditor = dict(
+        name = get_sys_property('sepa_creditor_name'),
+        iban = get_sys_property('sepa_creditor_iban'),
+        bic = get_sys_property('sepa_creditor_bic'),
+        id = get_sys_property('sepa_creditor_id')
+    )
+
+    if pb.BatchType != 'collection':
+        session.flash = T('SEPA export is only available for collection batches')
+        redirect(URL('batch_content', vars={'pbID':pbID}))
+
+    if not (creditor['name'] and creditor['iban'] and creditor['id']):
+        session.flash = T('Please set the creditor details in the financial settings first')
+        redirect(URL('batch_content', vars={'pbID':pbID}))
+
+    first, recurring, pb = export_batch_log()
+
+    pbe = PaymentBatchExport(pb.id)
+    stream = tempfile.TemporaryFile()
+    pbe.sepa(stream,
+             creditor,
+             first=first,
+             recurring=recurring)
+    stream.seek(0)
+
+    fname = export_batch_get_filename(pb, first, recurring) + '.xml'
+    response.headers['Content-Type']='application/xml'
+    response.headers['Content-disposition']='attachment; filename=' + fname
+
+    return response.stream(stream, request=request)
+
+
+def export_batch_log():
+    """
+        Log export of batch in request.vars['pbID'] to db
+        :return: tuple (first, recurring, db.payment_batches row)
+    """
     first = False
     recurring= False
     if request.vars['first']:
@@ -1112,68 +960,21 @@ def export_csv():
                                       FirstCustomers=first,
                                       RecurringCustomers=recurring)
 
-    # create writer and buffer to hold data
-    stream = cStringIO.StringIO()
-    writer = csv.writer(stream)
-
-    # write the header
-    writer.writerow(['customers_id',
-                     'SubscriptionID',
-                     'Account holder',
-                     'Bank Location',
-                     'Currency',
-                     'Amount',
-                     'Account number',
-                     'BIC',
-                     'Mandate Signature Date',
-                     'Mandate Reference',
-                     'Description',
-                     'Execution Date',
-                     'Location'])
-
-    batch_items = get_batch_items(pbID, first=first, recurring=recurring)
-    for item in batch_items:
-        customers_id = item['cuID']
-        customer_subscriptions_id = item['csID']
-        account_holder = item['account_holder']
-        bank_location = item['bank_location']
-        currency = item['currency']
-        amount = item['amount']
-        account_number = item['account_number']
-        bic = item['bic']
-        mandate_signature_date = item['mandate_signature_date']
-        mandate_reference = item['mandate_reference']
-        description = item['description']
-        execution_date = item['execution_date']
-
-        row = [ customers_id,
-                customer_subscriptions_id,
-                account_holder,
-                bank_location,
-                currency,
-                amount,
-                account_number,
-                bic,
-                mandate_signature_date,
-                mandate_reference,
-                description,
-                execution_date ]
-        if session.show_location:
-            row.append(item.get('location', ''))
-
-        writer.writerow(row)
+    return first, recurring, pb
 
+
+def export_batch_get_filename(pb, first, recurring):
+    """
+        :return: file name for batch export, without extension
+    """
     batch_name = pb.Name.replace(' ', '_')
-    fname = 'Batch_' + pbID + '_' + batch_name
+    fname = 'Batch_' + str(pb.id) + '_' + batch_name
     if first:
         fname += '_FRST'
     if recurring:
         fname += '_RCUR'
-    fname += '.csv'
-    response.headers['Content-Type']='application/vnd.ms-excel'
-    response.headers['Content-disposition']='attachment; filename=' + fname
 
-    return stream.getvalue()
+    return fname
 
 
 @auth.requires(auth.has_membership(group_id='Admins') or \
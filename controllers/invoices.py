@@ -11,8 +11,8 @@ from openstudio.os_customer import Customer
 from decimal import Decimal, ROUND_HALF_UP
 
 import cStringIO
+import tempfile
 import weasyprint
-import openpyxl
 
 
 # @auth.requires(auth.has_membership(group_id='Admins') or \
@@ -1659,8 +1659,7 @@ def export_invoices():
             response.headers['Content-Type']='text/csv'
             response.headers['Content-disposition']='attachment; filename=' + fname
 
-        return stream.getvalue()
-        #response.stream(stream, attachment=True, filename=fname)
+        return response.stream(stream, request=request)
 
 
     # form.process() has to be called before creating a custom form
@@ -1680,140 +1679,23 @@ def export_invoices():
 def export_invoices_get_export(from_date, until_date, invoices_groups_id, filetype='excel', include_subscriptions=True):
     """
         Invoices export
+        :return: temporary file containing the export
     """
-    # create filestream
-    stream = cStringIO.StringIO()
-
-    if filetype == 'excel':
-        wb = openpyxl.workbook.Workbook(write_only=True)
-        ws = wb.create_sheet(title='Invoices')
-    else:
-        import csv
-        csv_writer = csv.writer(stream, delimiter='\t')
-
-    header = [
-        'InvoiceID',
-        'CustomerID',
-        'Customer Name',
-        'Business',
-        'Date Created',
-        'Date Due',
-        'Status',
-        'Description',
-        'G/L Account',
-        'Costcenter',
-        'Item #',
-        'Item Name',
-        'Item Description',
-        'Qty',
-        'Price (each)',
-        'Tax %',
-        'Tax name',
-        'Total excl. VAT',
-        'VAT',
-        'Total incl. VAT',
-        'Payment Method',
-        'School SubscriptionID',
-        'School Subscription Name',
-        'Subscription Year',
-        'Subscription Month',
-        'Payment date(s)'
-    ]
-
-    if filetype == 'excel':
-        ws.append(header)
-    else:
-        csv_writer.writerow(header)
-
-
-    where_query = "i.DateCreated >= '{from_date}'".format(from_date=from_date)
-
-    if until_date:
-        where_query += " AND i.DateCreated <= '{until_date}'".format(until_date=until_date)
-
-    if invoices_groups_id:
-        where_query += " AND i.invoices_groups_id = {invoices_groups_id}".format(
-            invoices_groups_id=invoices_groups_id
-        )
-
-    if not include_subscriptions:
-        where_query += " AND cs.id IS NULL"
-
-    i = 0
-    m = 1000
-    while True:
-        query = '''
-        SELECT i.InvoiceID,
-               au.id,
-               au.display_name,
-               CASE WHEN au.business = 'F' THEN "No" ELSE "Yes" END AS Business,
-               i.DateCreated,
-               i.DateDue,
-               i.Status,
-               i.Description,
-               ii.accounting_glaccounts_id,
-               ii.accounting_costcenters_id,
-               ii.Sorting,
-               ii.ProductName,
-               ii.Description,
-               ii.Quantity,
-               ii.Price,
-               tr.Percentage,
-               tr.Name,
-               ii.TotalPrice,
-               ii.VAT,
-               ii.TotalPriceVAT,
-               pm.Name,
-               ssu.id as ssuID,
-               ssu.Name,
-               i.SubscriptionYear,
-               i.SubscriptionMonth,
-               ip.payment_dates
-        FROM invoices_items ii
-        LEFT JOIN invoices i on ii.invoices_id = i.id
-        LEFT JOIN (SELECT invoices_id, GROUP_CONCAT(PaymentDate SEPARATOR ', ') AS payment_dates
-                   FROM invoices_payments GROUP BY invoices_id) ip ON ip.invoices_id = i.id
-        LEFT JOIN invoices_customers ic ON ic.invoices_id = i.id
-        LEFT JOIN invoices_customers_subscriptions ics ON ics.invoices_id = i.id
-        LEFT JOIN customers_subscriptions cs ON ics.customers_subscriptions_id = cs.id
-        LEFT JOIN school_subscriptions ssu ON cs.school_subscriptions_id = ssu.id
-        LEFT JOIN auth_user au ON ic.auth_customer_id = au.id
-        LEFT JOIN tax_rates tr ON ii.tax_rates_id = tr.id
-        LEFT JOIN payment_methods pm ON i.payment_methods_id = pm.id 
-        WHERE {where_query} 
-        ORDER BY i.InvoiceID, ii.Sorting
-        LIMIT {limit} OFFSET {offset}
-        '''.format(
-            where_query=where_query,
-            limit=m,
-            offset=m * i
-        )
-
-        rows = db.executesql(query)
-
-        for row in rows:
-            unicode_list = []
-            for item in row:
-                try:
-                    unicode_list.append(item.encode('utf-8'))
-                except:
-                    unicode_list.append(item)
-
-
-            if filetype == 'excel':
-                ws.append(unicode_list)
-            else:
-                csv_writer.writerow(unicode_list)
-
+    from openstudio.os_invoices_export import InvoicesExport
 
-        # While loop control
-        if len(rows) < m:
-            break
-        i += 1
+    stream = tempfile.TemporaryFile()
 
+    export = InvoicesExport()
+    export.invoices(
+        stream,
+        from_date,
+        until_date,
+        invoices_groups_id,
+        filetype,
+        include_subscriptions
+    )
 
-    if filetype == 'excel':
-        wb.save(stream)
+    stream.seek(0)
 
     return stream
 
@@ -1917,7 +1799,7 @@ def export_payments():
         response.headers['Content-Type']='application/vnd.ms-excel'
         response.headers['Content-disposition']='attachment; filename=' + fname
 
-        return stream.getvalue()
+        return response.stream(stream, request=request)
 
     # form.process() has to be called before creating a custom form
     # otherwise for hidden formkey fields used for CSRF protection aren't generated
@@ -1937,96 +1819,16 @@ def export_payments():
 def export_payments_get_export(from_date, until_date, invoices_groups_id):
     """
         Payments export
+        :return: temporary file containing the export
     """
-    # create filestream
-    stream = cStringIO.StringIO()
-
-    wb = openpyxl.workbook.Workbook(write_only=True)
-    ws = wb.create_sheet(title='Payments')
-
-    header = [
-        'Payment Date',
-        'Payment Method',
-        'Amount',
-        'InvoiceID',
-        'CustomerID',
-        'Customer Name',
-        'Date created',
-        'Date due',
-        'Description',
-        'Invoice Status',
-        'Invoice Amount',
-        'School SubscriptionID',
-        'School Subscription Name',
-        'Subscription Year',
-        'Subscription Month'
-    ]
-
-    ws.append(header)
-
-    query = (db.invoices_payments.PaymentDate >= from_date)
-
-    if until_date:
-        query &= (db.invoices_payments.PaymentDate <= until_date)
-
-    if invoices_groups_id:
-        query &= (db.invoices.invoices_groups_id == invoices_groups_id)
-
-    left = [ db.invoices.on(db.invoices_payments.invoices_id ==
-                            db.invoices.id),
-             db.invoices_amounts.on(db.invoices_amounts.invoices_id ==
-                                    db.invoices_payments.invoices_id),
-             db.payment_methods.on(db.invoices_payments.payment_methods_id ==
-                                   db.payment_methods.id),
-             db.invoices_customers_subscriptions.on(
-                 db.invoices_customers_subscriptions.invoices_id ==
-                 db.invoices.id),
-             db.customers_subscriptions.on(
-                db.invoices_customers_subscriptions.customers_subscriptions_id ==
-                db.customers_subscriptions.id),
-             db.school_subscriptions.on(
-                db.customers_subscriptions.school_subscriptions_id ==
-                db.school_subscriptions.id),
-             db.invoices_customers.on(db.invoices_customers.invoices_id ==
-                                      db.invoices.id),
-             db.auth_user.on(db.invoices_customers.auth_customer_id == db.auth_user.id),
-
-             ]
-
-    rows = db(query).select(db.invoices_payments.ALL,
-                            db.invoices.ALL,
-                            db.payment_methods.ALL,
-                            db.invoices_amounts.ALL,
-                            db.customers_subscriptions.ALL,
-                            db.school_subscriptions.Name,
-                            db.auth_user.id,
-                            db.auth_user.display_name,
-                            left=left,
-                            orderby=db.invoices_payments.PaymentDate|\
-                                    db.invoices.InvoiceID)
-    for row in rows:
-        line = [
-            row.invoices_payments.PaymentDate,
-            row.payment_methods.Name,
-            row.invoices_payments.Amount,
-            row.invoices.InvoiceID,
-            row.auth_user.id,
-            row.auth_user.display_name,
-            row.invoices.DateCreated,
-            row.invoices.DateDue,
-            row.invoices.Description,
-            row.invoices.Status,
-            row.invoices_amounts.TotalPriceVAT,
-            row.customers_subscriptions.school_subscriptions_id,
-            row.school_subscriptions.Name,
-            row.invoices.SubscriptionYear,
-            row.invoices.SubscriptionMonth,
-        ]
+    from openstudio.os_invoices_export import InvoicesExport
 
-        ws.append(line)
+    stream = tempfile.TemporaryFile()
 
-    wb.save(stream)
+    export = InvoicesExport()
+    export.payments(stream, from_date, until_date, invoices_groups_id)
 
+    stream.seek(0)
 
     return stream
 
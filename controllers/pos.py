@@ -3,6 +3,8 @@
 from general_helpers import set_form_id_and_get_submit_button
 from general_helpers import datestr_to_python
 
+import datetime
+
 # auth.settings.on_failed_authorization = URL('return_json_permissions_error')
 
 
@@ -284,6 +286,46 @@ def get_class_booking_options():
     return dict(options = options)
 
 
+@auth.requires(auth.has_membership(group_id='Admins') or \
+               auth.has_permission('create', 'classes_attendance'))
+def get_classes_booking_options():
+    """
+    List booking options for all classes on a date for a given customer
+    :return: dict with class ids as keys and booking options as values
+    """
+    from openstudio.os_attendance_helper import AttendanceHelper
+    from openstudio.os_class_schedule import ClassSchedule
+    from openstudio.os_customer import Customer
+
+    cuID = request.vars['cuID']
+    date_received = request.vars['date']
+    date = datestr_to_python("%Y-%m-%d", date_received) if date_received else TODAY_LOCAL
+
+    set_headers()
+
+    customer = Customer(cuID)
+    complementary_permission = (auth.has_membership(group_id='Admins') or
+                                auth.has_permission('complementary', 'classes_attendance'))
+
+    cs = ClassSchedule(date)
+    classes_dates = [ (cls['ClassesID'], date) for cls in cs.get_day_list() ]
+
+    ah = AttendanceHelper()
+    classes_options = ah.get_customer_classes_booking_options(
+        classes_dates,
+        customer,
+        trial=True,
+        complementary=complementary_permission,
+        list_type='attendance'
+    )
+
+    options = {}
+    for clsID, date in classes_options:
+        options[clsID] = classes_options[(clsID, date)]
+
+    return dict(options = options)
+
+
 
 
 @auth.requires(auth.has_membership(group_id='Admins') or \
@@ -557,18 +599,11 @@ def get_customers_thumbnail_url(row_data):
         )
 
 
-@auth.requires(auth.has_membership(group_id='Admins') or \
-               auth.has_permission('read', 'auth_user'))
-def get_customers():
+def get_customers_fields():
     """
-    List not trashed customers
+    :return: list of auth_user fields returned to the POS
     """
-    set_headers()
-
-    query = (db.auth_user.customer == True) & \
-            (db.auth_user.trashed == False)
-
-    rows = db(query).select(
+    return [
         db.auth_user.id,
         db.auth_user.first_name,
         db.auth_user.last_name,
@@ -586,8 +621,14 @@ def get_customers():
         db.auth_user.company,
         db.auth_user.thumbsmall,
         db.auth_user.thumblarge,
-    )
+    ]
 
+
+def get_customers_get_dict(rows):
+    """
+    :param rows: gluon.dal.rows containing get_customers_fields()
+    :return: dict of customers with auth_user.id as key
+    """
     customers = {}
 
     for row in rows:
@@ -615,6 +656,149 @@ def get_customers():
     return customers
 
 
+def get_customers_check_etag(query, *params):
+    """
+    Set an ETag header based on the customers in query and the request parameters.
+    Returns 304 Not Modified when the client already has this version.
+    :param query: gluon.dal.query on db.auth_user
+    :param params: request parameters the response depends on
+    :return: None
+    """
+    import hashlib
+
+    count = db.auth_user.id.count()
+    max_id = db.auth_user.id.max()
+    max_updated_on = db.auth_user.updated_on.max()
+    row = db(query).select(count, max_id, max_updated_on).first()
+
+    version = [ row[count], row[max_id], row[max_updated_on] ] + list(params)
+    version = '|'.join([ unicode(v) for v in version ]).encode('utf-8')
+    etag = '"' + hashlib.md5(version).hexdigest() + '"'
+
+    response.headers['ETag'] = etag
+    response.headers['Access-Control-Expose-Headers'] = 'ETag'
+
+    if request.env.http_if_none_match == etag:
+        raise HTTP(304, '', **response.headers)
+
+
+@auth.requires(auth.has_membership(group_id='Admins') or \
+               auth.has_permission('read', 'auth_user'))
+def get_customers():
+    """
+    List not trashed customers
+    """
+    set_headers()
+
+    query = (db.auth_user.customer == True) & \
+            (db.auth_user.trashed == False)
+
+    get_customers_check_etag(query)
+
+    rows = db(query).select(*get_customers_fields())
+
+    return get_customers_get_dict(rows)
+
+
+@auth.requires(auth.has_membership(group_id='Admins') or \
+               auth.has_permission('read', 'auth_user'))
+def get_customers_changes():
+    """
+    List customers changed since a given time, one page at a time.
+    request.vars['updated_since'] is expected to be a datetime string formatted
+    as %Y-%m-%d %H:%M:%S, when it's not set all customers are returned.
+    request.vars['after_id'] is expected to be the last_id of the previous page
+    request.vars['limit'] is expected to be the page size (default 1000)
+
+    Keep the sync_time of the first page and use it as updated_since for the
+    next sync. Customers in "removed" are no longer customers or have been trashed.
+    """
+    set_headers()
+
+    sync_time = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    updated_since = request.vars['updated_since']
+    after_id = request.vars['after_id'] or 0
+    limit = request.vars['limit'] or 1000
+
+    try:
+        if updated_since:
+            updated_since = datetime.datetime.strptime(updated_since, '%Y-%m-%d %H:%M:%S')
+        after_id = int(after_id)
+        limit = min(int(limit), 5000)
+    except ValueError:
+        return dict(error=True,
+                    message=T("Please make sure updated_since is formatted as YYYY-MM-DD HH:MM:SS and after_id and limit are integers"))
+
+    query = (db.auth_user.id > after_id)
+    if updated_since:
+        # Customers updated at the exact time of the last sync are returned again
+        query &= (db.auth_user.updated_on >= updated_since)
+
+    get_customers_check_etag(query, updated_since, after_id, limit)
+
+    rows = db(query).select(
+        db.auth_user.customer,
+        db.auth_user.trashed,
+        *get_customers_fields(),
+        orderby=db.auth_user.id,
+        limitby=(0, limit + 1)
+    )
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+
+    customers = rows.find(lambda row: row.customer and not row.trashed)
+    if updated_since:
+        removed = [ row.id for row in rows if not row.customer or row.trashed ]
+    else:
+        removed = []
+
+    return dict(customers=get_customers_get_dict(customers),
+                removed=removed,
+                last_id=rows.last().id if rows else after_id,
+                more=more,
+                sync_time=sync_time,
+                error=False)
+
+
+@auth.requires(auth.has_membership(group_id='Admins') or \
+               auth.has_permission('read', 'auth_user'))
+def search_customers():
+    """
+    Search not trashed customers by the start of their name or email address
+    request.vars['search'] is expected to be the search string, each word
+    has to match the start of a word in the name, email or key number.
+    When there are more results than the limit, customers with exactly
+    matching words are kept within the limit first. The customers are
+    returned as a dict keyed by id, like get_customers, so the response
+    doesn't keep this order.
+    request.vars['limit'] is expected to be the max number of results (default 25)
+    """
+    from openstudio.os_customers_search import CustomersSearch
+
+    set_headers()
+
+    search = (request.vars['search'] or '').strip()
+    try:
+        limit = min(int(request.vars['limit'] or 25), 250)
+    except ValueError:
+        limit = 25
+
+    if not search:
+        return dict(customers={})
+
+    query = (db.auth_user.customer == True) & \
+            (db.auth_user.trashed == False)
+
+    customers_search = CustomersSearch()
+    cuIDs = customers_search.search(search, query=query, limit=limit)
+
+    rows = db(db.auth_user.id.belongs(cuIDs)).select(*get_customers_fields())
+
+    return dict(customers=get_customers_get_dict(rows))
+
+
 @auth.requires(auth.has_membership(group_id='Admins') or \
                auth.has_permission('read', 'customers_memberships'))
 def get_customers_memberships():
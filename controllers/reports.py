@@ -2825,6 +2825,7 @@ def attendance_classes_get_content(date_start, date_end, slID, soID):
                           TH('Organization'),
                           TH('Teacher'),
                           TH('Teacher2'),
+                          TH('Attendance'),
                           TH('Revenue'),
                           TH()))
     else:
@@ -2835,21 +2836,22 @@ def attendance_classes_get_content(date_start, date_end, slID, soID):
                           TH(),
                           TH('Teacher'),
                           TH('Teacher2'),
+                          TH('Attendance'),
                           TH('Revenue'),
                           TH()))
     table = TABLE(header, _class='table table-hover table-striped')
-    # Find all classes starting on the first day of the month
-    while current_date <= date_end:
-        # get list of today's classes.
-        class_schedule = ClassSchedule(
-            date=current_date,
-            filter_id_school_location=slID,
-            filter_id_sys_organization=soID,
-        )
+    # Get classes for all days in the period at once
+    class_schedule = ClassSchedule(
+        date=date_start,
+        filter_id_school_location=slID,
+        filter_id_sys_organization=soID,
+    )
+    range_rows = class_schedule.get_range_rows(date_start, date_end)
 
+    while current_date <= date_end:
         date_formatted = current_date.strftime(DATE_FORMAT)
 
-        rows = class_schedule.get_day_rows()
+        rows = range_rows[current_date]
         for i, row in enumerate(rows):
             repr_row = list(rows[i:i + 1].render())[0]
             revenue = teacher_classes_get_class_revenue_total(row.classes.id, current_date)
@@ -2879,6 +2881,7 @@ def attendance_classes_get_content(date_start, date_end, slID, soID):
                 TD(organization),
                 TD(repr_row.classes_teachers.auth_teacher_id),
                 TD(repr_row.classes_teachers.auth_teacher_id2),
+                TD(row.classes_schedule_count.Attendance or 0),
                 TD(amount),
                 TD(os_gui.get_button('next_no_text',
                                      URL('classes', 'attendance', vars={'clsID': row.classes.id,
@@ -4631,6 +4634,8 @@ def revenue_get_data():
     """
         Returns data for revenue graphs / data tables
     """
+    from openstudio.os_reports_revenue import ReportsRevenue
+
     ### Common useful values
     today = datetime.date.today()
     year = session.reports_revenue_year
@@ -4730,131 +4735,17 @@ def revenue_get_data():
         return os_gui.get_box_table(title, table)
 
 
-    def get_month_subscriptions(date):
-        # helper function to get monthly membership revenue
-        year = unicode(date.year)
-        month = date.month
-
-        left = [db.invoices_amounts.on(db.invoices.id ==
-                                       db.invoices_amounts.invoices_id),
-                db.invoices_customers_subscriptions.on(
-                    db.invoices_customers_subscriptions.invoices_id ==
-                    db.invoices.id)
-                ]
-
-        query = (db.invoices_customers_subscriptions.id != None) & \
-                (db.invoices.SubscriptionMonth == date.month) & \
-                (db.invoices.SubscriptionYear == date.year)
-        rows = db(query).select(db.invoices_amounts.ALL,
-                                left=left)
-
-        total = 0
-        for row in rows:
-            total += row.TotalPriceVAT
-
-        if (int(year) == today.year and month > today.month) or \
-            int(year) > today.year:
-            return_value = 0
-        else:
-            return_value = round(total, 2)
-
-        return return_value
-
-
-    def get_month_classcards(date):
-        # helper function to get monthly class card revenue
-        year = date.year
-        month = date.month
-        firstdaythismonth = date
-        lastdaythismonth = get_last_day_month(date)
-
-        left = [ db.invoices_amounts.on(db.invoices_amounts.invoices_id == db.invoices.id),
-                 db.invoices_customers_classcards.on(db.invoices_customers_classcards.invoices_id == db.invoices.id)
-                ]
-
-        query = (db.invoices_customers_classcards.id != None) & \
-                (db.invoices.DateCreated >= firstdaythismonth) & \
-                (db.invoices.DateCreated <= lastdaythismonth)
-        sum = db.invoices_amounts.TotalPriceVAT.sum()
-        value = db(query).select(sum, left=left).first()[sum]
-
-
-        if (year == today.year and month > today.month) or \
-            year > today.year:
-            return_value = 0
-        else:
-            if value == None:
-                return_value = 0
-            else:
-                return_value = round(value, 2)
-
-        return return_value
-
-
-    def get_month_workshops(date):
-        # helper function to get monthly workshops revenue
-        year = date.year
-        month = date.month
-        firstdaythismonth = date
-        lastdaythismonth = get_last_day_month(date)
-
-        left = [ db.invoices_amounts.on(db.invoices_amounts.invoices_id == db.invoices.id),
-                 db.invoices_workshops_products_customers.on(db.invoices_workshops_products_customers.invoices_id ==
-                                                             db.invoices.id)]
-
-        query = (db.invoices_workshops_products_customers.id != None) & \
-                (db.invoices.DateCreated >= firstdaythismonth) & \
-                (db.invoices.DateCreated <= lastdaythismonth)
-        sum = db.invoices_amounts.TotalPriceVAT.sum()
-        value = db(query).select(sum, left=left).first()[sum]
-
+    def get_month_revenue(category, month):
+        # helper function to get monthly revenue for a category
         if (year == today.year and month > today.month) or \
             year > today.year:
-            return_value = 0
-        else:
-            if value == None:
-                return_value = 0
-            else:
-                return_value = round(value, 2)
-
-        return return_value
-
-
-    def get_month_classes(date, attendance_type):
-        # helper function to get monthly drop in class revenue
-        year = date.year
-        month = date.month
-        firstdaythismonth = date
-        lastdaythismonth = get_last_day_month(date)
-
-        left = [ db.invoices_amounts.on(db.invoices_amounts.invoices_id == db.invoices.id),
-                 db.invoices_classes_attendance.on(db.invoices_classes_attendance.invoices_id == db.invoices.id),
-                 db.classes_attendance.on(db.invoices_classes_attendance.classes_attendance_id ==
-                                          db.classes_attendance.id),
-                 ]
-
-        if attendance_type == 'dropin':
-            query = (db.classes_attendance.AttendanceType==2)
-        elif attendance_type == 'trial':
-            query = (db.classes_attendance.AttendanceType==1)
-
-        query &= (db.invoices.DateCreated >= firstdaythismonth)
-        query &= (db.invoices.DateCreated <= lastdaythismonth)
+            # Don't make future predictions
+            return 0
 
-        sum = db.invoices_amounts.TotalPriceVAT.sum()
-        value = db(query).select(sum, left=left).first()[sum]
+        return revenue_data[category][month - 1]
 
-        if (year == today.year and month > today.month) or \
-            year > today.year:
-            # Don't make future predictions
-            return_value = 0
-        else:
-            if value == None:
-                return_value = 0
-            else:
-                return_value = round(value, 2)
 
-        return return_value
+    revenue_data = ReportsRevenue().get_year(year)
 
     def calculate_average(total):
         # calculate average
@@ -4868,7 +4759,7 @@ def revenue_get_data():
     ### subscriptions
     total = 0
     for month in range(1,13):
-        revenue = get_month_subscriptions(datetime.date(year, month, 1))
+        revenue = get_month_revenue('subscriptions', month)
         json_data['subscriptions']['datasets'][0]['data'].append(revenue)
         total += revenue
 
@@ -4888,7 +4779,7 @@ def revenue_get_data():
     classcards_chart_data = list()
     total = 0
     for month in range(1,13):
-        revenue = get_month_classcards(datetime.date(year, month, 1))
+        revenue = get_month_revenue('classcards', month)
         json_data['classcards']['datasets'][0]['data'].append(revenue)
         total += revenue
 
@@ -4909,7 +4800,7 @@ def revenue_get_data():
     classcards_chart_data = list()
     total = 0
     for month in range(1,13):
-        revenue = get_month_workshops(datetime.date(year, month, 1))
+        revenue = get_month_revenue('workshops', month)
         json_data['workshops']['datasets'][0]['data'].append(revenue)
         total += revenue
 
@@ -4931,7 +4822,7 @@ def revenue_get_data():
     ### drop in classes begin
     total = 0
     for month in range(1,13):
-        revenue = get_month_classes(datetime.date(year, month, 1), 'dropin')
+        revenue = get_month_revenue('dropin', month)
         json_data['dropin']['datasets'][0]['data'].append(revenue)
         total += revenue
 
@@ -4953,7 +4844,7 @@ def revenue_get_data():
     ### trialclasses begin
     total = 0
     for month in range(1,13):
-        revenue = get_month_classes(datetime.date(year, month, 1), 'trial')
+        revenue = get_month_revenue('trialclasses', month)
         json_data['trialclasses']['datasets'][0]['data'].append(revenue)
         total += revenue
 
@@ -5065,21 +4956,30 @@ def class_attendance_get_json():
     """
     response.view = 'generic.json'
 
-    def count_attendance(clsID, date):
+    def get_attendance_counts(clsID, firstday, next_year):
+        """
+            Returns dict with attendance for each date of the class in a
+            year, overrides replace the counted attendance
+        """
+        count = db.classes_attendance.id.count()
         query = (db.classes_attendance.classes_id==clsID) & \
-                (db.classes_attendance.ClassDate==date)
-        attendancecount = int(db(query).count())
+                (db.classes_attendance.ClassDate>=firstday) & \
+                (db.classes_attendance.ClassDate<next_year)
+        rows = db(query).select(db.classes_attendance.ClassDate,
+                                count,
+                                groupby=db.classes_attendance.ClassDate)
+        counts = dict([ (row.classes_attendance.ClassDate, int(row[count]))
+                        for row in rows ])
 
         query = (db.classes_attendance_override.classes_id==clsID) & \
-                (db.classes_attendance_override.ClassDate==date)
-        override_check = db(query).isempty()
+                (db.classes_attendance_override.ClassDate>=firstday) & \
+                (db.classes_attendance_override.ClassDate<next_year)
+        rows = db(query).select(db.classes_attendance_override.ClassDate,
+                                db.classes_attendance_override.Amount)
+        for row in rows:
+            counts[row.ClassDate] = row.Amount
 
-        if not override_check: # not empty
-            row = db(query).select(db.classes_attendance_override.Amount,
-                                   cache=(cache.ram, 30))[0]
-            return row.Amount
-        else:
-            return attendancecount
+        return counts
 
     year = session.stats_attendance_year
     clsID = session.stats_attendance_clsID
@@ -5120,6 +5020,7 @@ def class_attendance_get_json():
     date = firstday
     delta = datetime.timedelta(days=7)
     next_year = datetime.date(year+1, 1, 1)
+    attendance_counts = get_attendance_counts(clsID, firstday, next_year)
     maximum = 0
     total = 0
     week = 1
@@ -5130,7 +5031,7 @@ def class_attendance_get_json():
         if date < startdate:
             attendance = 0
         else:
-            attendance = count_attendance(clsID, date)
+            attendance = attendance_counts.get(date, 0)
 
         if attendance > 0:
             weeks_with_data += 1
@@ -9,6 +9,7 @@ from general_helpers import get_submenu
 from general_helpers import set_form_id_and_get_submit_button
 
 from openstudio.os_customers import Customers
+from openstudio.os_customers_search import CustomersSearch
 from openstudio.os_school_subscription import SchoolSubscription
 
 
@@ -2110,9 +2111,8 @@ def list_keys():
     if 'search' in request.vars: # check whether a search filter is in use
         if request.vars['search'] != '':
             search = request.vars['search']
-            search_name = '%' + request.vars['search'] + '%'
-            query &= ((db.auth_user.display_name.like(search_name)) |
-                      (db.auth_user.keynr.like(search_name)))
+            customers_search = CustomersSearch()
+            query &= customers_search.get_query(search)
 
     form = SQLFORM.factory(
         Field('search', default=search, label=T("")),
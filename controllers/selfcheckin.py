@@ -7,6 +7,7 @@ from openstudio.os_attendance_helper import AttendanceHelper
 from openstudio.os_class import Class
 from openstudio.os_class_schedule import ClassSchedule
 from openstudio.os_customer import Customer
+from openstudio.os_selfcheckin_roster import SelfCheckinRoster
 
 import pytz
 
@@ -140,8 +141,12 @@ def checkin():
 
     #response.view = 'templates/selfcheckin/checkin.html'
 
+    # Bookings, subscriptions & cards are loaded once and kept in cache
+    roster = SelfCheckinRoster(clsID, date)
+    roster_data = roster.get()
+
     # Check if the class is full
-    full = cls.get_full()
+    full = roster.get_full(roster_data)
 
     message = ''
     if full:
@@ -172,17 +177,8 @@ def checkin():
     else:
         show_subscriptions = False
 
-    ah = AttendanceHelper()
-    customers = ah.get_checkin_list_customers_booked(clsID,
-                                                     date,
-                                                     pictures=False,
-                                                     invoices=False,
-                                                     show_notes=False,
-                                                     reservations=False,
-                                                     manage_checkin=False,
-                                                     show_booking_time=False,
-                                                     show_subscriptions=show_subscriptions,
-                                                     class_full=full)
+    customers = roster.get_checkin_list(roster_data,
+                                        show_subscriptions=show_subscriptions)
     form = checkin_get_search_form(clsID, date, name, request.function)
 
     content = DIV(
@@ -198,6 +194,26 @@ def checkin():
 
     return dict(content = content)
 
+
+@auth.requires(auth.has_membership(group_id='Admins') or \
+               auth.has_permission('update', 'classes_attendance'))
+def checkin_attending():
+    '''
+        Check in a customer on the roster of a class
+    '''
+    clsID = request.vars['clsID']
+    clattID = request.vars['clattID']
+    date_formatted = request.vars['date']
+    date = datestr_to_python(DATE_FORMAT, date_formatted)
+
+    roster = SelfCheckinRoster(clsID, date)
+    if not roster.check_in(clattID):
+        session.flash = T("Unable to check in, please ask a staff member for help")
+
+    redirect(URL('checkin', vars={'clsID':clsID,
+                                  'date':date_formatted}))
+
+
 @auth.requires(auth.has_membership(group_id='Admins') or \
                auth.has_permission('update', 'classes_attendance'))
 def checkin_booking_options():
@@ -224,7 +240,9 @@ def checkin_booking_options():
     return_url = URL('selfcheckin', 'checkin', vars={'clsID':clsID,
                                                      'date':date_formatted})
 
-    cls = Class(clsID, date)
+    # Booking options are loaded on the first tap and kept in the roster
+    roster = SelfCheckinRoster(clsID, date)
+    booking_options = roster.get_booking_options(customer)
 
     ah = AttendanceHelper()
     options = ah.get_customer_class_booking_options_formatted(clsID,
@@ -232,7 +250,8 @@ def checkin_booking_options():
                                                               customer,
                                                               trial=True,
                                                               list_type='selfcheckin',
-                                                              controller='classes')
+                                                              controller='classes',
+                                                              options=booking_options)
     cancel = os_gui.get_button('noicon',
                                return_url,
                                title=T('Cancel'),
@@ -4,7 +4,6 @@ import string
 import random
 import os
 import pytz
-import os_storage
 
 from general_helpers import highlight_submenu
 from general_helpers import User_helpers
@@ -175,6 +174,62 @@ def system_general():
                 save=submit)
 
 
+def system_storage_get_usage_table(usage):
+    """
+        :param usage: dict - {table name: used bytes}, see OsStorageUsage.get_usage()
+        :return: box with used space per type of upload
+    """
+    labels = [
+        ['customers_documents', T("Customer documents")],
+        ['auth_user', T("Customer pictures")],
+        ['customers_memberships', T("Membership barcodes")],
+        ['shop_products', T("Products")],
+        ['shop_products_variants', T("Product variants")],
+        ['workshops', T("Events")],
+        ['school_classtypes', T("Class types")],
+        ['employee_claims', T("Employee claims")],
+        ['sys_files', T("System files")],
+        ['sys_thumbnails', T("Thumbnails")],
+    ]
+
+    table = TABLE(TR(TH(T("Type")), TH(T("MB"))),
+                  _class="table table-condensed")
+
+    other = sum(usage.values())
+    for table_name, label in labels:
+        used = usage.get(table_name, 0)
+        other -= used
+        table.append(TR(label, round(used / 1000.0 / 1000.0, 1)))
+
+    table.append(TR(T("Other"), round(other / 1000.0 / 1000.0, 1)))
+
+    recalculate = os_gui.get_button('noicon',
+                                    URL('system_storage_reconcile'),
+                                    title=T("Recalculate"),
+                                    tooltip=T("Recalculate the used space from the files in the uploads folder"),
+                                    btn_size='btn-sm',
+                                    _class='pull-right')
+
+    return os_gui.get_box_table(T("Used space per type"),
+                                table,
+                                show_footer=True,
+                                footer_content=recalculate)
+
+
+@auth.requires(auth.has_membership(group_id='Admins') or
+               auth.has_permission('update', 'settings'))
+def system_storage_reconcile():
+    """
+        Recalculate the used storage per table and return to storage page
+    """
+    from openstudio.os_storage_usage import OsStorageUsage
+
+    OsStorageUsage().reconcile()
+
+    session.flash = T("Recalculated used space")
+    redirect(URL('system_storage'))
+
+
 @auth.requires(auth.has_membership(group_id='Admins') or
                auth.has_permission('read', 'settings'))
 def system_storage():
@@ -184,11 +239,13 @@ def system_storage():
     response.title = T("System Settings")
     response.subtitle = T("Storage")
 
+    from openstudio.os_storage_usage import OsStorageUsage
+
     row = db.sys_properties(Property='storage_allowed_space')
     allowed_space = int(row.PropertyValue)
 
-    uploads_dir = os.path.join(request.folder, 'uploads')
-    used_space = os_storage.get_size(uploads_dir)
+    usage = OsStorageUsage().get_usage()
+    used_space = sum(usage.values()) / 1000 / 1000
     available_space = allowed_space - used_space
 
     data = [available_space, used_space]
@@ -220,9 +277,12 @@ def system_storage():
     data_table = os_gui.get_box_table(T("Storage info"),
                                       data_table)
 
+    usage_table = system_storage_get_usage_table(usage)
+
     menu = system_get_menu(request.function)
 
     return dict(data_table=data_table,
+                usage_table=usage_table,
                 json_data=json_data,
                 menu=menu,
                 left_sidebar_enabled=True)
@@ -528,6 +588,9 @@ def financial_get_menu(page=None):
              ['financial_dd_categories',
               T('Direct debit extra'),
               URL('financial_dd_categories')],
+             ['financial_direct_debit',
+              T('SEPA'),
+              URL('financial_direct_debit')],
              ['financial_teacher_payments',
               T('Teacher payments'),
               URL('financial_teacher_payments')]
@@ -590,6 +653,58 @@ def financial_teacher_payments():
                 save=submit)
 
 
+@auth.requires(auth.has_membership(group_id='Admins') or
+               auth.has_permission('read', 'settings'))
+def financial_direct_debit():
+    """
+        Creditor settings for SEPA direct debit exports of collection batches
+    """
+    response.title = T('Financial Settings')
+    response.subtitle = T('SEPA')
+    response.view = 'general/tabs_menu.html'
+
+    properties = [
+        ['sepa_creditor_name', T('Creditor name')],
+        ['sepa_creditor_iban', T('Creditor IBAN')],
+        ['sepa_creditor_bic', T('Creditor BIC')],
+        ['sepa_creditor_id', T('Creditor identifier')],
+    ]
+
+    form = SQLFORM.factory(
+        *[ Field(sys_property,
+                 default=get_sys_property(sys_property),
+                 label=label)
+           for sys_property, label in properties ],
+        submit_button=T("Save"),
+        separator=' ',
+        formstyle='bootstrap3_stacked')
+
+    result = set_form_id_and_get_submit_button(form, 'MainForm')
+    form = result['form']
+    submit = result['submit']
+
+    if form.accepts(request.vars, session):
+        for sys_property, label in properties:
+            set_sys_property(
+                sys_property,
+                (request.vars[sys_property] or '').strip()
+            )
+
+        # Clear cache
+        cache_clear_sys_properties()
+        # User feedback
+        session.flash = T('Saved')
+        # reload so the user sees how the values are stored in the db now
+        redirect(URL('financial_direct_debit'))
+
+    menu = financial_get_menu(request.function)
+
+    return dict(content=DIV(DIV(form, _class="col-md-6"),
+                            _class='row'),
+                menu=menu,
+                save=submit)
+
+
 @auth.requires(auth.has_membership(group_id='Admins') or
                auth.has_permission('read', 'settings_finance'))
 def financial_costcenters():
@@ -1609,6 +1724,11 @@ def access_group_permissions():
                                         'shifts_sub', 0)
                     auth.add_permission(group_id, 'update',
                                         'shifts_sub', 0)
+                if obj == 'preferences' and name == 'read':
+                    # payment methods & categories are edited in preferences
+                    for table in ['payment_categories', 'payment_methods']:
+                        for permission in permissions:
+                            auth.add_permission(group_id, permission, table, 0)
 
                 # 0 means all records
                 auth.add_permission(group_id, name, obj, 0)
@@ -39,4 +39,24 @@ def test_add_subscription_credits_for_month():
     year = request.vars['year']
     month = request.vars['month']
 
-    ost.customers_subscriptions_add_credits_for_month(year, month)
\ No newline at end of file
+    ost.customers_subscriptions_add_credits_for_month(year, month)
+
+@auth.requires(auth.user_id == 1)
+def test_collect_mollie_recurring():
+    """
+    Function to expose class & method used by scheduler task
+    to collect subscription invoices using Mollie recurring payments
+    """
+    from openstudio.os_mollie_recurring_collector import MollieRecurringCollector
+
+    if ( not web2pytest.is_running_under_test(request, request.application)
+         and not auth.has_membership(group_id='Admins') ):
+        redirect(URL('default', 'user', args=['not_authorized']))
+
+    year = request.vars['year']
+    month = request.vars['month']
+
+    collector = MollieRecurringCollector(year, month)
+    success, failed = collector.run()
+
+    return 'success: ' + unicode(success) + ' failed: ' + unicode(failed)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+from openstudio.os_exact_online_queue import OSExactOnlineQueue
+
+
+class ExactApiStubResource:
+    """
+    Stands in for a resource of the Exact Online API (eg. api.relations)
+    """
+    def __init__(self, fail=False, on_call=None):
+        self.fail = fail
+        self.on_call = on_call
+        self.calls = []
+
+
+    def _call(self, name, *args):
+        if self.fail:
+            raise Exception('Exact Online stub: ' + name + ' failed')
+
+        self.calls.append((name, args))
+        if self.on_call:
+            self.on_call()
+
+        return {'ID': '00000000-0000-0000-0000-' + unicode(len(self.calls)).zfill(12)}
+
+
+    def create(self, data):
+        return self._call('create', data)
+
+
+    def update(self, ID, data):
+        return self._call('update', ID, data)
+
+
+    def delete(self, ID):
+        return self._call('delete', ID)
+
+
+    def filter(self, **kwargs):
+        self._call('filter', kwargs)
+
+        return []
+
+
+class ExactApiStub:
+    """
+    Local stand-in for the Exact Online API, no requests are sent to Exact Online
+    """
+    def __init__(self, fail=False, on_call=None):
+        """
+        :param fail: Boolean - raise an exception for each call
+        :param on_call: function called after each call, eg. to change data during a sync
+        """
+        for resource in ['invoices', 'salesentrylines', 'financialglaccounts',
+                         'relations', 'bankaccounts', 'directdebitmandates']:
+            setattr(self, resource, ExactApiStubResource(fail, on_call))
+
+
+@auth.requires(auth.user_id == 1)
+def test_queue_add():
+    """
+    Function to expose adding items to the Exact Online queue
+    """
+    if ( not web2pytest.is_running_under_test(request, request.application)
+         and not auth.has_membership(group_id='Admins') ):
+        redirect(URL('default', 'user', args=['not_authorized']))
+
+    eo_queue = OSExactOnlineQueue()
+    eo_queue.add(
+        request.vars['object_name'],
+        request.vars['object_id'],
+        request.vars['action']
+    )
+
+    return 'OK'
+
+
+@auth.requires(auth.user_id == 1)
+def test_queue_process():
+    """
+    Function to expose processing the Exact Online queue, using a stub
+    of the Exact Online API
+    request.vars['readd'] adds an item again during the sync, as 'name,id,action'
+    """
+    if ( not web2pytest.is_running_under_test(request, request.application)
+         and not auth.has_membership(group_id='Admins') ):
+        redirect(URL('default', 'user', args=['not_authorized']))
+
+    on_call = None
+    if request.vars['readd']:
+        # Add an item again while it's being synced, as 'name,id,action'
+        object_name, object_id, action = request.vars['readd'].split(',')
+        on_call = lambda: OSExactOnlineQueue().add(object_name, object_id, action)
+
+    api = ExactApiStub(fail=request.vars['fail'] == 'True', on_call=on_call)
+
+    eo_queue = OSExactOnlineQueue(api=api)
+    result = eo_queue.process()
+
+    return 'synced: ' + unicode(result['synced']) + \
+           ' errors: ' + unicode(result['errors']) + \
+           ' relations created: ' + unicode(len(api.relations.calls))
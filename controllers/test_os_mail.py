@@ -58,3 +58,66 @@ def test_osmail_render_sys_notification():
     return rendered_message
 
 
+def test_osmail_render_template_batch():
+    """
+        function to be used when testing rendering many messages at once
+        request.vars['customers_orders_ids'] is expected to be a comma separated
+        list of db.customers_orders.id
+    """
+    if not web2pytest.is_running_under_test(request, request.application) and not auth.has_membership(group_id='Admins'):
+        redirect(URL('default', 'user', args=['not_authorized']))
+
+    email_template = request.vars['email_template']
+    customers_orders_ids = request.vars['customers_orders_ids'].split(',')
+
+    os_mail = OsMail()
+    msgIDs = os_mail.render_email_template_batch(
+        email_template,
+        [ {'customers_orders_id': coID} for coID in customers_orders_ids ]
+    )
+
+    return ','.join([ unicode(msgID) for msgID in msgIDs ])
+
+
+
+
+def test_osmail_template_compiled_again():
+    """
+        function to be used when testing compiling a cached template again
+        after it's been edited
+        request.vars['email_template'] is expected to be a db.sys_email_templates.Name
+        request.vars['content'] is expected to be the new content of the template
+    """
+    from openstudio.os_mail_template import OsMailTemplate
+
+    if not web2pytest.is_running_under_test(request, request.application) and not auth.has_membership(group_id='Admins'):
+        redirect(URL('default', 'user', args=['not_authorized']))
+
+    email_template = request.vars['email_template']
+
+    before = OsMailTemplate(email_template, cache=True).template_content
+
+    query = (db.sys_email_templates.Name == email_template)
+    db(query).update(TemplateContent=request.vars['content'])
+
+    after = OsMailTemplate(email_template, cache=True).template_content
+
+    return response.json(dict(before=before, after=after))
+
+
+def test_osmail_outbox_process():
+    """
+        function to be used when testing sending mail in the outbox
+        request.vars['server'] is expected to be a local SMTP server as 'host:port'
+    """
+    from openstudio.os_mail_outbox import OsMailOutbox
+
+    if not web2pytest.is_running_under_test(request, request.application) and not auth.has_membership(group_id='Admins'):
+        redirect(URL('default', 'user', args=['not_authorized']))
+
+    server = request.vars['server']
+
+    outbox = OsMailOutbox(server=server)
+    result = outbox.process()
+
+    return 'sent: ' + unicode(result['sent']) + ' errors: ' + unicode(result['errors'])
@@ -17,6 +17,10 @@ def index():
     """
         This function executes commands needed for upgrades to new versions
     """
+    # Tables are defined when first used, define all so new tables &
+    # fields are migrated before upgrade queries run
+    db.define_all()
+
     # first check if a version is set
     if not db.sys_properties(Property='Version'):
         db.sys_properties.insert(Property='Version',
@@ -102,8 +106,18 @@ def index():
         else:
             session.flash = T('Already up to date')
 
+        if version < 2019.02:
+            print version
+            upgrade_to_201902()
+            session.flash = T("Upgraded db to 2019.02")
+        else:
+            session.flash = T('Already up to date')
+
         # always renew permissions for admin group after update
         set_permissions_for_admin_group()
+        # and the permissions that come with the preferences permission,
+        # these used to be set for each request
+        set_preferences_permissions()
 
     set_version()
 
@@ -559,4 +573,106 @@ def upgrade_to_201883():
     # Enable AutoResetPrefixYear for invoice groups by default.
     ###
     query = (db.invoices_groups.AutoResetPrefixYear == None)
-    db(query).update(AutoResetPrefixYear = True)
\ No newline at end of file
+    db(query).update(AutoResetPrefixYear = True)
+
+
+def upgrade_to_201902():
+    """
+        Upgrade operations to 2019.02
+    """
+    ##
+    # Fill the stored credit balance of subscriptions (new field in this release)
+    ##
+    from openstudio.os_customers_subscriptions_credits import CustomersSubscriptionsCredits
+    csch = CustomersSubscriptionsCredits()
+    csch.rebuild_balances()
+
+    ##
+    # Fill attendance stats (new table in this release)
+    ##
+    db.executesql("""CREATE UNIQUE INDEX classes_attendance_stats_classdate_classes_id
+                     ON classes_attendance_stats (ClassDate, classes_id)""")
+
+    from openstudio.os_classes_attendance_stats import ClassesAttendanceStats
+    cas = ClassesAttendanceStats()
+    cas.rebuild()
+
+    ##
+    # Set updated_on for existing users (new field in this release) and add
+    # indexes used by the POS to fetch changes and search customers
+    ##
+    query = (db.auth_user.updated_on == None)
+    db(query).update(updated_on=datetime.datetime.now())
+
+    db.executesql("CREATE INDEX auth_user_updated_on ON auth_user (updated_on)")
+    db.executesql("CREATE INDEX auth_user_first_name ON auth_user (first_name(64))")
+    db.executesql("CREATE INDEX auth_user_last_name ON auth_user (last_name(64))")
+    db.executesql("CREATE INDEX auth_user_display_name ON auth_user (display_name(64))")
+    db.executesql("CREATE INDEX auth_user_email ON auth_user (email(64))")
+
+    ##
+    # Indexes for the Exact Online queue (new table in this release)
+    ##
+    db.executesql("""CREATE INDEX integration_exact_online_queue_status_nextattempton
+                     ON integration_exact_online_queue (Status(16), NextAttemptOn)""")
+    db.executesql("""CREATE INDEX integration_exact_online_queue_object
+                     ON integration_exact_online_queue (ObjectName(16), ObjectID)""")
+
+    ##
+    # Index to find customers in earlier batches, used to split
+    # batch exports in first (FRST) and recurring (RCUR) customers
+    ##
+    db.executesql("""CREATE INDEX payment_batches_items_auth_customer_id
+                     ON payment_batches_items (auth_customer_id, payment_batches_id)""")
+
+    ##
+    # Index to find on demand thumbnails (new table in this release)
+    ##
+    db.executesql("""CREATE INDEX sys_thumbnails_source
+                     ON sys_thumbnails (Source(128), Width, Height)""")
+
+    ##
+    # Fill search tokens for customers (new table in this release)
+    ##
+    db.executesql("""CREATE INDEX customers_search_tokens_token
+                     ON customers_search_tokens (Token(64), auth_customer_id)""")
+    db.executesql("""CREATE INDEX customers_search_tokens_auth_customer_id
+                     ON customers_search_tokens (auth_customer_id)""")
+
+    from openstudio.os_customers_search import CustomersSearch
+    customers_search = CustomersSearch()
+    customers_search.rebuild()
+
+    ##
+    # Set update time of email templates (new field in this release),
+    # compiled templates are cached by id & update time
+    ##
+    query = (db.sys_email_templates.UpdatedOn == None)
+    db(query).update(UpdatedOn=datetime.datetime.now())
+
+    ##
+    # Calculate monthly revenue for reports (new table in this release),
+    # months are marked to be calculated by the reports_revenue_refresh task.
+    # The revenue report calculates marked months of the year it shows.
+    ##
+    db.executesql("""CREATE INDEX reports_revenue_months_year_month
+                     ON reports_revenue_months (RevenueYear, RevenueMonth)""")
+
+    from openstudio.os_reports_revenue import ReportsRevenue
+    reports_revenue = ReportsRevenue()
+    months = [ (year, month)
+               for year in range(reports_revenue.get_first_year(), TODAY_LOCAL.year + 1)
+               for month in range(1, 13) ]
+    reports_revenue.set_months_changed(months)
+
+    ##
+    # Index used to read the payments export in chunks
+    ##
+    db.executesql("""CREATE INDEX invoices_payments_paymentdate
+                     ON invoices_payments (PaymentDate, id)""")
+
+    ##
+    # Set version of items in the Exact Online queue (new field in this release)
+    ##
+    query = (db.integration_exact_online_queue.Version == None)
+    db(query).update(Version=0)
@@ -11,6 +11,7 @@ import random
 import pytz
 
 from openstudio.os_gui import OsGui
+from openstudio.os_cache_manager import OsCacheManager
 from general_helpers import represent_validity_units
 from general_helpers import represent_subscription_units
 
@@ -139,35 +140,28 @@ def cache_clear(var_one=None, var_two=None):
         Clears all cache entries on disk & in ram
         # Takes arguments in case it's called from a crud form or SQLFORM.grid
     """
-    cache.ram.clear()
-    cache.disk.clear()
+    OsCacheManager().clear()
 
 
 def cache_clear_customers_memberships(cuID):
     """
         Clears memberships cache entries on disk & in ram
     """
-    cu_sub_regex = 'openstudio_customer_get_memberships_on_date_' + str(cuID) + '*'
-    cache.ram.clear(regex=cu_sub_regex)
-    cache.disk.clear(regex=cu_sub_regex)
+    OsCacheManager().clear_customers_memberships(cuID)
 
 
 def cache_clear_customers_subscriptions(cuID):
     """
         Clears subscription cache entries on disk & in ram
     """
-    cu_sub_regex = 'openstudio_customer_get_subscriptions_on_date_' + str(cuID) + '*'
-    cache.ram.clear(regex=cu_sub_regex)
-    cache.disk.clear(regex=cu_sub_regex)
+    OsCacheManager().clear_customers_subscriptions(cuID)
 
 
 def cache_clear_customers_classcards(cuID):
     """
-        Clears subscription cache entries on disk & in ram
+        Clears classcard cache entries on disk & in ram
     """
-    cu_cc_regex = 'openstudio_customer_get_classcards_' + str(cuID) + '*'
-    cache.ram.clear(regex=cu_cc_regex)
-    cache.disk.clear(regex=cu_cc_regex)
+    OsCacheManager().clear_customers_classcards(cuID)
 
 
 def cache_clear_classschedule(var_one=None, var_two=None):
@@ -175,11 +169,7 @@ def cache_clear_classschedule(var_one=None, var_two=None):
         Clears the class schedule cache 
         takes 2 dummy arguments in case it's called from a CRUD form or from SQLFORM.grid
     """
-    class_schedule_regex = 'openstudio_classschedule_get_day_*'
-    cache.ram.clear(regex = class_schedule_regex)
-    cache.disk.clear(regex = class_schedule_regex)
-
-    cache_clear_classschedule_api()
+    OsCacheManager().clear_classschedule()
 
 
 def cache_clear_classschedule_api(var_one=None, var_two=None):
@@ -187,9 +177,7 @@ def cache_clear_classschedule_api(var_one=None, var_two=None):
         Clears the class schedule api cache
         takes 2 dummy arguments in case it's called from a CRUD form or from SQLFORM.grid
     """
-    api_schedule_regex = 'openstudio_api_schedule_get_*'
-    cache.ram.clear(regex=api_schedule_regex)
-    cache.disk.clear(regex=api_schedule_regex)
+    OsCacheManager().clear_classschedule_api()
 
 
 def cache_clear_classschedule_trend(var_one=None, var_two=None):
@@ -197,9 +185,7 @@ def cache_clear_classschedule_trend(var_one=None, var_two=None):
         Clears the class schedule trend column cache
         takes 2 dummy arguments in case it's called from a CRUD form or from SQLFORM.grid
     """
-    trend_regex = 'openstudio_classschedule_trend_*'
-    cache.ram.clear(regex = trend_regex)
-    cache.disk.clear(regex = trend_regex)
+    OsCacheManager().clear_classschedule_trend()
 
 
 def cache_clear_sys_properties():
@@ -207,18 +193,14 @@ def cache_clear_sys_properties():
         Clears the sys_properties keys in cache
         :return: None
     """
-    sprop_regex = 'openstudio_system_property_*'
-    cache.ram.clear(regex = sprop_regex)
-    cache.disk.clear(regex = sprop_regex)
+    OsCacheManager().clear_sys_properties()
 
 
 def cache_clear_menu_backend():
     """
         Clears the backend menu's in cache
     """
-    menu_regex = 'openstudio_menu_backend_*'
-    cache.ram.clear(regex = menu_regex)
-    cache.disk.clear(regex = menu_regex)
+    OsCacheManager().clear_menu_backend()
 
 
 def cache_clear_workshops(var_one=None, var_two=None):
@@ -226,9 +208,7 @@ def cache_clear_workshops(var_one=None, var_two=None):
         Clears the workshops cache
         # accepts two vars to the function can be called from SQLFORM.grid ondelete or crud functions
     """
-    workshops_regex = 'openstudio_workshops_*'
-    cache.ram.clear(regex = workshops_regex)
-    cache.disk.clear(regex = workshops_regex)
+    OsCacheManager().clear_workshops()
 
 
 def cache_clear_school_subscriptions(var_one=None, var_two=None):
@@ -236,14 +216,7 @@ def cache_clear_school_subscriptions(var_one=None, var_two=None):
         Clears the school subscriptions cache
         # accepts two vars to the function can be called from SQLFORM.grid ondelete or crud functions
     """
-    school_subscriptions_regex = 'openstudio_school_subcriptions_api_*'
-    cache.ram.clear(regex = school_subscriptions_regex)
-    cache.disk.clear(regex = school_subscriptions_regex)
-
-    # Clear all customer subscriptions, as the cache also stores some school subscription info
-    cu_sub_regex = 'openstudio_customer_get_subscriptions_on_date_*'
-    cache.ram.clear(regex=cu_sub_regex)
-    cache.disk.clear(regex=cu_sub_regex)
+    OsCacheManager().clear_school_subscriptions()
 
 
 def cache_clear_school_classcards(var_one=None, var_two=None):
@@ -251,9 +224,7 @@ def cache_clear_school_classcards(var_one=None, var_two=None):
         Clears the school classcards cache
         # accepts two vars to the function can be called from SQLFORM.grid ondelete or crud functions
     """
-    school_classcards_regex = 'openstudio_school_classcards_api_*'
-    cache.ram.clear(regex = school_classcards_regex)
-    cache.disk.clear(regex = school_classcards_regex)
+    OsCacheManager().clear_school_classcards()
 
 
 def cache_clear_school_teachers(var_one=None, var_two=None):
@@ -261,30 +232,23 @@ def cache_clear_school_teachers(var_one=None, var_two=None):
         Clears the school teachers (API) cache
         # accepts two vars to the function can be called from SQLFORM.grid ondelete or crud functions
     """
-    school_teachers_api_regex = 'openstudio_school_teachers_api_get'
-    cache.ram.clear(regex = school_teachers_api_regex)
-    cache.disk.clear(regex = school_teachers_api_regex)
+    OsCacheManager().clear_school_teachers()
 
 
 def cache_clear_school_classtypes(var_one=None, var_two=None):
     """
-        Clears the school teachers (API) cache
+        Clears the school classtypes (API) cache
         # accepts two vars to the function can be called from SQLFORM.grid ondelete or crud functions
     """
-    school_teachers_api_regex = 'openstudio_school_teachers_api_get'
-    cache.ram.clear(regex = school_teachers_api_regex)
-    cache.disk.clear(regex = school_teachers_api_regex)
+    OsCacheManager().clear_school_classtypes()
 
 
 def cache_clear_sys_organizations(var_one=None, var_two=None):
     """
-        Clears the workshops cache
+        Clears the organizations cache
         # accepts two vars to the function can be called from SQLFORM.grid ondelete or crud functions
     """
-    sys_org_regex = 'openstudio_sys_organizations*'
-    cache.ram.clear(regex = sys_org_regex)
-    cache.disk.clear(regex = sys_org_regex)
-
+    OsCacheManager().clear_sys_organizations()
 
 
 def set_sys_property(property, value):
@@ -334,9 +298,10 @@ def get_sys_property(value=None, value_type=None):
     if web2pytest.is_running_under_test(request, request.application):
         sprop = _get_sys_property(value, value_type)
     else:
-        sprop = cache.ram(cache_key,
-                          lambda: _get_sys_property(value, value_type),
-                          time_expire=CACHE_LONG)
+        sprop = OsCacheManager().get_shared(cache_key,
+                                            lambda: _get_sys_property(value, value_type),
+                                            ['sys_properties'],
+                                            time_expire=CACHE_LONG)
 
     return sprop
 
@@ -364,7 +329,8 @@ def set_message_statuses():
     """
         Returns a list of message statuses to use in OpenStudio
     """
-    statuses = [['sent', T("Sent")],
+    statuses = [['queued', T("Queued")],
+                ['sent', T("Sent")],
                 ['fail', T("Failed")],
                 ]
 
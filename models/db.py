@@ -16,6 +16,8 @@ from web2pytest import web2pytest
 import os
 import datetime
 
+from openstudio.os_dal import OsDAL
+
 
 # -------------------------------------------------------------------------
 # if SSL/HTTPS is properly configured and you want all HTTP requests to
@@ -32,26 +34,31 @@ if not request.env.web2py_runtime_gae:
         # When running under test, db cannot be ':memory:'
         # because it is recreated in each request and a webclient test
         # can make many requests to validate a single scenario.
-        db = DAL('sqlite://%s.sqlite' % request.application,
-                folder=os.path.dirname(web2pytest.testfile_name()),
-                pool_size=1,
-                check_reserved=['all'],
-                lazy_tables=False)
+        db = OsDAL('sqlite://%s.sqlite' % request.application,
+                   folder=os.path.dirname(web2pytest.testfile_name()),
+                   pool_size=1,
+                   check_reserved=['all'],
+                   lazy_tables=False)
     else:
-        db = DAL(myconf.get('db.uri'),
-                 pool_size=myconf.get('db.pool_size'),
-                 migrate_enabled=myconf.get('db.migrate'),
-                 check_reserved=['all'],
-                 db_codec=myconf.get('db.db_codec'),
-                 bigint_id=myconf.get('db.bigint_id'),
-                 lazy_tables=myconf.get('db.lazy_tables'),
-                 fake_migrate_all=myconf.get('db.fake_migrate_all'),
-                 )
+        db = OsDAL(myconf.get('db.uri'),
+                   pool_size=myconf.get('db.pool_size'),
+                   migrate_enabled=myconf.get('db.migrate'),
+                   check_reserved=['all'],
+                   db_codec=myconf.get('db.db_codec'),
+                   bigint_id=myconf.get('db.bigint_id'),
+                   lazy_tables=myconf.get('db.lazy_tables'),
+                   fake_migrate_all=myconf.get('db.fake_migrate_all'),
+                   )
+
+    # SQLite deletes cascading rows using the tables referencing a table,
+    # so all tables have to be defined. For other databases tables
+    # are defined when they're first used.
+    db.set_lazy(db._dbname != 'sqlite')
 else:
     # ---------------------------------------------------------------------
     # connect to Google BigTable (optional 'google:datastore://namespace')
     # ---------------------------------------------------------------------
-    db = DAL('google:datastore+ndb')
+    db = OsDAL('google:datastore+ndb')
     # ---------------------------------------------------------------------
     # store sessions and tickets there
     # ---------------------------------------------------------------------
@@ -107,9 +114,11 @@ response.form_label_separator = myconf.get('forms.separator') or ''
 # -------------------------------------------------------------------------
 
 from gluon.tools import Auth, Crud, Service, PluginManager
+from openstudio_sec.oss_auth import OSSAuth
 
 # host names must be a list of allowed host names (glob syntax allowed)
-auth = Auth(db, host_names=myconf.get('host.names'))
+# OSSAuth loads groups & permissions of the logged in user once per request
+auth = OSSAuth(db, host_names=myconf.get('host.names'))
 service = Service()
 plugins = PluginManager()
 crud = Crud(db)
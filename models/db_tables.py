@@ -24,6 +24,8 @@ from general_helpers import create_classtypes_dict
 
 from decimal import Decimal, ROUND_HALF_UP
 
+from openstudio.os_dal import OsLazyDict
+
 # init scheduler
 scheduler = Scheduler(
     db,
@@ -65,7 +67,10 @@ def get_organizations():
     else:
         cache_key = 'openstudio_sys_organizations'
 
-        organizations = cache.ram(cache_key, lambda: _get_organizations(), time_expire=CACHE_LONG)
+        organizations = OsCacheManager().get(cache_key,
+                                             lambda: _get_organizations(),
+                                             ['sys_organizations'],
+                                             time_expire=CACHE_LONG)
 
     return organizations
 
@@ -433,8 +438,11 @@ def represent_message_status(value, row):
     """
         Represent status of sent mails
     """
+    rvalue = ''
     if value == 'sent':
         rvalue = os_gui.get_label('success', T("Sent"))
+    elif value == 'queued':
+        rvalue = os_gui.get_label('default', T("Queued"))
     elif value == 'fail':
         rvalue = os_gui.get_label('danger', T("Sending failed"))
 
@@ -543,17 +551,131 @@ def os_time_widget(field, value):
         _class='input-group full-width')
 
 
-# Represent dict caching settings
-dict_caching = (cache.ram, 20)
-if web2pytest.is_running_under_test(request, request.application):
-    dict_caching = None
+def get_names_dict(table):
+    """
+        Returns a dict of the names in a table, cached in ram and in the cache
+        shared between processes. The cache is cleared when the table changes,
+        see set_names_dict_callbacks().
+    :param table: db table with a Name field
+    :return: dict {table.id: table.Name}
+    """
+    def get_names():
+        rows = db().select(table.id, table.Name)
+        return dict([ (row.id, row.Name) for row in rows ])
+
+    # Don't cache when running tests
+    if web2pytest.is_running_under_test(request, request.application):
+        return get_names()
+
+    cache_key = 'openstudio_names_dict_' + table._tablename
+
+    # Return a copy, as the cached dict is shared between requests
+    return dict(OsCacheManager().get_shared(cache_key, get_names, [table._tablename]))
+
+
+def set_names_dict_callbacks():
+    """
+        Clear cached names dicts, and other entries tagged with the name of
+        a table, when the table changes
+    """
+    tablenames = [
+        'school_languages',
+        'school_discovery',
+        'school_subscriptions',
+        'school_levels',
+        'payment_categories',
+        'payment_methods',
+        'sys_email_templates', # Compiled email templates
+    ]
+
+    def clear(tag):
+        OsCacheManager().clear_tags(tag)
+
+    def set_callbacks(table):
+        tag = table._tablename
+        table._after_insert.append(lambda fields, id: clear(tag))
+        table._after_update.append(lambda s, fields: clear(tag))
+        table._after_delete.append(lambda s: clear(tag))
+
+    for tablename in tablenames:
+        db.add_on_define(tablename, set_callbacks)
+
+
+def set_storage_usage_callbacks():
+    """
+        Keep the used storage per table up to date when uploads change
+    """
+    from openstudio.os_storage_usage import OsStorageUsage
+
+    tablenames = [
+        'auth_user',
+        'customers_documents',
+        'customers_memberships',
+        'employee_claims',
+        'school_classtypes',
+        'shop_products',
+        'shop_products_variants',
+        'sys_files',
+        'workshops',
+    ]
+
+    for tablename in tablenames:
+        db.add_on_define(tablename, OsStorageUsage().set_callbacks)
+
+
+def set_reports_revenue_callbacks():
+    """
+        Mark months to calculate again in db.reports_revenue_months when invoices change
+    """
+    from openstudio.os_reports_revenue import ReportsRevenue
+
+    tablenames = [ 'invoices', 'invoices_amounts' ] + ReportsRevenue.link_tables
+
+    for tablename in tablenames:
+        db.add_on_define(tablename, ReportsRevenue().set_callbacks)
+
+
+def set_selfcheckin_roster_callbacks():
+    """
+        Clear cached self check-in rosters when subscriptions, class cards or
+        memberships of customers change
+    """
+    from openstudio.os_cache_manager import OsCacheManager
+    from openstudio.os_selfcheckin_roster import SelfCheckinRoster
+
+    def clear():
+        OsCacheManager().clear_tags(SelfCheckinRoster.cache_tag)
+
+    def set_callbacks(table):
+        table._after_insert.append(lambda fields, id: clear())
+        table._after_update.append(lambda s, fields: clear())
+        table._after_delete.append(lambda s: clear())
+
+    for tablename in SelfCheckinRoster.customer_tables:
+        db.add_on_define(tablename, set_callbacks)
+
+
+def set_auth_permissions_callbacks():
+    """
+        Clear cached groups & permissions of users when they change
+    """
+    tables = [
+        db.auth_group,
+        db.auth_membership,
+        db.auth_permission,
+    ]
+
+    def clear():
+        auth.clear_permissions_cache()
+
+    for table in tables:
+        table._after_insert.append(lambda fields, id: clear())
+        table._after_update.append(lambda s, fields: clear())
+        table._after_delete.append(lambda s: clear())
 
 
 def create_languages_dict():
-    rows = db().select(db.school_languages.id, db.school_languages.Name, cache=dict_caching)
-    d = dict()
-    for row in rows:
-        d[row.id] = row.Name
+    d = get_names_dict(db.school_languages)
     d[None] = ""
     return d
 
@@ -570,47 +692,31 @@ def create_languages_dict():
 
 
 def create_discovery_dict():
-    rows = db().select(db.school_discovery.id, db.school_discovery.Name, cache=dict_caching)
-    d = dict()
-    for row in rows:
-        d[row.id] = row.Name
+    d = get_names_dict(db.school_discovery)
     d[None] = ""
     return d
 
 
 def create_mstypes_dict():
-    rows = db().select(db.school_subscriptions.id, db.school_subscriptions.Name, cache=dict_caching)
-    d = dict()
-    for row in rows:
-        d[row.id] = row.Name
+    d = get_names_dict(db.school_subscriptions)
     d[None] = ""
     return d
 
 
 def create_school_levels_dict():
-    rows = db().select(db.school_levels.id, db.school_levels.Name, cache=dict_caching)
-    d = dict()
-    for row in rows:
-        d[row.id] = row.Name
+    d = get_names_dict(db.school_levels)
     d[None] = XML('&nbsp;')
     return d
 
 
 def create_payment_categories_dict():
-    rows = db().select(db.payment_categories.id,
-                       db.payment_categories.Name, cache=dict_caching)
-    d = dict()
-    for row in rows:
-        d[row.id] = row.Name
+    d = get_names_dict(db.payment_categories)
     d[None] = T("")
     return d
 
 
 def create_payment_methods_dict():
-    rows = db().select(db.payment_methods.id, db.payment_methods.Name, cache=dict_caching)
-    d = dict()
-    for row in rows:
-        d[row.id] = row.Name
+    d = get_names_dict(db.payment_methods)
     d[None] = ""
     d[0] = ""
     return d
@@ -749,7 +855,12 @@ def define_sys_email_templates():
         Field('Description',
               label=T('Description')),
         Field('TemplateContent',
-              label=T('Content'))
+              label=T('Content')),
+        Field('UpdatedOn', 'datetime',
+              readable=False,
+              writable=False,
+              default=datetime.datetime.now,
+              update=datetime.datetime.now)
     )
 
 
@@ -1734,6 +1845,30 @@ def define_teachers_payment_classes():
     )
 
 
+def define_customers_search_tokens():
+    """
+        Normalized words in the names, email address and key number of
+        customers, used to search customers. See CustomersSearch.
+    """
+    db.define_table('customers_search_tokens',
+        Field('auth_customer_id', db.auth_user,
+              readable=False,
+              writable=False),
+        Field('Token', length=64,
+              readable=False,
+              writable=False),
+    )
+
+
+def set_customers_search_callbacks():
+    """
+        Keep search tokens up to date when customers change
+    """
+    from openstudio.os_customers_search import CustomersSearch
+
+    CustomersSearch().set_callbacks()
+
+
 def define_customers_notes():
     db.define_table('customers_notes',
         Field('auth_customer_id', db.auth_user, # to link note to customer
@@ -2356,6 +2491,7 @@ def define_classes_schedule_counts():
         Field('Attendance8WeeksAgo', 'integer'),
         Field('NRClasses4WeeksAgo', 'integer'),
         Field('NRClasses8WeeksAgo', 'integer'),
+        Field('ClassDate', 'date'),
         )
 
 
@@ -2477,6 +2613,160 @@ def define_classes_attendance():
     except AttributeError:
         pass
 
+    # Keep stored attendance counts up to date
+    db.classes_attendance._after_insert.append(
+        classes_attendance_after_insert_stats)
+    db.classes_attendance._before_update.append(
+        classes_attendance_before_update_stats)
+    db.classes_attendance._after_update.append(
+        classes_attendance_after_update_stats)
+    db.classes_attendance._before_delete.append(
+        classes_attendance_before_delete_stats)
+    db.classes_attendance._after_delete.append(
+        classes_attendance_after_delete_stats)
+    # Credits are removed by the database when attendance is deleted,
+    # delete them here first so the stored balance is updated
+    db.classes_attendance._before_delete.append(
+        classes_attendance_before_delete_credits)
+    # Clear cached self check-in rosters of classes with changed bookings
+    db.classes_attendance._after_insert.append(
+        classes_attendance_after_insert_selfcheckin_roster)
+    db.classes_attendance._after_update.append(
+        classes_attendance_after_update_selfcheckin_roster)
+    db.classes_attendance._after_delete.append(
+        classes_attendance_after_delete_selfcheckin_roster)
+
+
+def define_classes_attendance_stats():
+    """
+        Table to hold attendance counts for each class on a date,
+        kept up to date when attendance is added, changed or removed
+    """
+    db.define_table('classes_attendance_stats',
+        Field('classes_id', db.classes, required=True,
+            readable=False,
+            writable=False),
+        Field('ClassDate', 'date', required=True,
+            readable=False,
+            writable=False),
+        Field('Attending', 'integer', # Attendance, excluding cancelled bookings
+            default=0),
+        Field('OnlineBooking', 'integer', # Online bookings, excluding cancelled bookings
+            default=0),
+        Field('Total', 'integer', # All attendance, including cancelled bookings
+            default=0),
+        )
+
+
+def _classes_attendance_stats_get_classes_dates(s):
+    """
+        Returns list of (classes_id, ClassDate) tuples for attendance in a set
+    """
+    rows = s.select(db.classes_attendance.classes_id,
+                    db.classes_attendance.ClassDate,
+                    distinct=True)
+
+    return [ (row.classes_id, row.ClassDate) for row in rows ]
+
+
+def classes_attendance_after_insert_stats(fields, id):
+    """
+        Update attendance stats for the class of inserted attendance
+    """
+    from openstudio.os_classes_attendance_stats import ClassesAttendanceStats
+
+    cas = ClassesAttendanceStats()
+    cas.refresh([ (fields.get('classes_id'), fields.get('ClassDate')) ])
+
+
+def classes_attendance_before_update_stats(s, fields):
+    """
+        Keep track of classes for attendance about to be updated
+    """
+    stats_fields = ['classes_id', 'ClassDate', 'BookingStatus', 'online_booking']
+    if not any([ f in fields for f in stats_fields ]):
+        return
+
+    rows = s.select(db.classes_attendance.id)
+    s.classes_attendance_ids = [ row.id for row in rows ]
+    s.classes_attendance_stats_classes_dates = _classes_attendance_stats_get_classes_dates(s)
+
+
+def classes_attendance_after_update_stats(s, fields):
+    """
+        Update attendance stats for the classes of updated attendance
+    """
+    from openstudio.os_classes_attendance_stats import ClassesAttendanceStats
+
+    clattIDs = getattr(s, 'classes_attendance_ids', None)
+    if not clattIDs:
+        return
+
+    query = (db.classes_attendance.id.belongs(clattIDs))
+    classes_dates = s.classes_attendance_stats_classes_dates + \
+                    _classes_attendance_stats_get_classes_dates(db(query))
+
+    cas = ClassesAttendanceStats()
+    cas.refresh(classes_dates)
+
+
+def classes_attendance_before_delete_stats(s):
+    """
+        Keep track of classes for attendance about to be deleted
+    """
+    s.classes_attendance_stats_classes_dates = _classes_attendance_stats_get_classes_dates(s)
+
+
+def classes_attendance_after_delete_stats(s):
+    """
+        Update attendance stats for the classes of deleted attendance
+    """
+    from openstudio.os_classes_attendance_stats import ClassesAttendanceStats
+
+    cas = ClassesAttendanceStats()
+    cas.refresh(getattr(s, 'classes_attendance_stats_classes_dates', []))
+
+
+def _classes_attendance_clear_selfcheckin_rosters(classes_dates):
+    """
+        Clears cached self check-in rosters for list of (classes_id, ClassDate) tuples
+    """
+    from openstudio.os_selfcheckin_roster import SelfCheckinRoster
+
+    for clsID, date in set(classes_dates):
+        if clsID and date:
+            SelfCheckinRoster(clsID, date).clear()
+
+
+def classes_attendance_after_insert_selfcheckin_roster(fields, id):
+    """
+        Clear self check-in roster for the class of inserted attendance
+    """
+    _classes_attendance_clear_selfcheckin_rosters(
+        [ (fields.get('classes_id'), fields.get('ClassDate')) ])
+
+
+def classes_attendance_after_update_selfcheckin_roster(s, fields):
+    """
+        Clear self check-in rosters for the classes of updated attendance
+    """
+    clattIDs = getattr(s, 'classes_attendance_ids', None)
+    if not clattIDs:
+        return
+
+    query = (db.classes_attendance.id.belongs(clattIDs))
+    _classes_attendance_clear_selfcheckin_rosters(
+        s.classes_attendance_stats_classes_dates +
+        _classes_attendance_stats_get_classes_dates(db(query)))
+
+
+def classes_attendance_after_delete_selfcheckin_roster(s):
+    """
+        Clear self check-in rosters for the classes of deleted attendance
+    """
+    _classes_attendance_clear_selfcheckin_rosters(
+        getattr(s, 'classes_attendance_stats_classes_dates', []))
+
 
 def represent_customer_subscription(value, row):
     """
@@ -2722,6 +3012,10 @@ def define_customers_subscriptions():
               writable=False,
               default=False
               ),
+        Field('CreditsBalance', 'double',
+              readable=False,
+              writable=False,
+              default=0), # Maintained from customers_subscriptions_credits mutations
         singular=T("Subscription"), plural=T("Subscriptions"))
 
 
@@ -2778,6 +3072,95 @@ def define_customers_subscriptions_credits():
             label=T('Expired'))
     )
 
+    db.customers_subscriptions_credits._after_insert.append(
+        customers_subscriptions_credits_after_insert)
+    db.customers_subscriptions_credits._before_update.append(
+        customers_subscriptions_credits_before_update)
+    db.customers_subscriptions_credits._after_update.append(
+        customers_subscriptions_credits_after_update)
+    db.customers_subscriptions_credits._before_delete.append(
+        customers_subscriptions_credits_before_delete)
+
+
+def _customers_subscriptions_credits_balance_rows(s):
+    """
+        Returns rows needed to update the balance for a set of credit mutations
+    """
+    return s.select(db.customers_subscriptions_credits.id,
+                    db.customers_subscriptions_credits.customers_subscriptions_id,
+                    db.customers_subscriptions_credits.MutationType,
+                    db.customers_subscriptions_credits.MutationAmount)
+
+
+def customers_subscriptions_credits_after_insert(fields, id):
+    """
+        Add an inserted credit mutation to the balance of the subscription
+    """
+    from gluon.storage import Storage
+    from openstudio.os_customers_subscriptions_credits import CustomersSubscriptionsCredits
+
+    row = Storage(customers_subscriptions_id=fields.get('customers_subscriptions_id'),
+                  MutationType=fields.get('MutationType'),
+                  MutationAmount=fields.get('MutationAmount'))
+
+    csch = CustomersSubscriptionsCredits()
+    csch.update_balances([ row ])
+
+
+def customers_subscriptions_credits_before_update(s, fields):
+    """
+        Remove credit mutations about to be updated from the balance of their subscriptions
+    """
+    from openstudio.os_customers_subscriptions_credits import CustomersSubscriptionsCredits
+
+    balance_fields = ['customers_subscriptions_id', 'MutationType', 'MutationAmount']
+    if not any([ f in fields for f in balance_fields ]):
+        return
+
+    rows = _customers_subscriptions_credits_balance_rows(s)
+    s.customers_subscriptions_credits_ids = [ row.id for row in rows ]
+
+    csch = CustomersSubscriptionsCredits()
+    csch.update_balances(rows, sign=-1)
+
+
+def customers_subscriptions_credits_after_update(s, fields):
+    """
+        Add updated credit mutations to the balance of their subscriptions
+    """
+    from openstudio.os_customers_subscriptions_credits import CustomersSubscriptionsCredits
+
+    cscIDs = getattr(s, 'customers_subscriptions_credits_ids', None)
+    if not cscIDs:
+        return
+
+    query = (db.customers_subscriptions_credits.id.belongs(cscIDs))
+    rows = _customers_subscriptions_credits_balance_rows(db(query))
+
+    csch = CustomersSubscriptionsCredits()
+    csch.update_balances(rows)
+
+
+def customers_subscriptions_credits_before_delete(s):
+    """
+        Remove credit mutations about to be deleted from the balance of their subscriptions
+    """
+    from openstudio.os_customers_subscriptions_credits import CustomersSubscriptionsCredits
+
+    rows = _customers_subscriptions_credits_balance_rows(s)
+
+    csch = CustomersSubscriptionsCredits()
+    csch.update_balances(rows, sign=-1)
+
+
+def classes_attendance_before_delete_credits(s):
+    """
+        Delete credit mutations linked to attendance about to be deleted
+    """
+    query = (db.customers_subscriptions_credits.classes_attendance_id.belongs(
+        s._select(db.classes_attendance.id)))
+    db(query).delete()
+
 
 def represent_customers_subscriptions_credits_MutationType(value, row):
     """
@@ -3623,6 +4006,35 @@ def define_messages():
         )
 
 
+def define_sys_mail_outbox():
+    """
+        Outbox of mail to be sent by the sys_mail_outbox_process scheduler task
+    """
+    db.define_table('sys_mail_outbox',
+        Field('messages_id', db.messages),
+        Field('customers_messages_id', db.customers_messages),
+        Field('MailTo'),
+        Field('Status',
+            default='pending',
+            requires=IS_IN_SET([
+                ['pending', T("Pending")],
+                ['sent', T("Sent")],
+                ['fail', T("Fail")],
+            ])),
+        Field('Attempts', 'integer',
+            default=0),
+        Field('NextAttemptOn', 'datetime',
+            default=datetime.datetime.now),
+        Field('LastError', 'text'),
+        Field('SentOn', 'datetime'),
+        Field('CreatedOn', 'datetime',
+            default=datetime.datetime.now),
+        Field('UpdatedOn', 'datetime',
+            default=datetime.datetime.now,
+            update=datetime.datetime.now)
+    )
+
+
 def define_customers_messages():
     db.define_table('customers_messages',
         Field('auth_customer_id', db.auth_user, required=True,
@@ -4257,6 +4669,36 @@ def define_invoices_mollie_payment_ids():
     )
 
 
+def define_customers_subscriptions_mollie_collections():
+    """
+        Outcome of collecting the invoice of a subscription for a month using
+        a Mollie recurring payment. Also used as checkpoint, so a collection
+        run that stopped can be resumed. See MollieRecurringCollector.
+    """
+    db.define_table('customers_subscriptions_mollie_collections',
+        Field('customers_subscriptions_id', db.customers_subscriptions),
+        Field('auth_customer_id', db.auth_user),
+        Field('invoices_id', db.invoices),
+        Field('CollectionYear', 'integer'),
+        Field('CollectionMonth', 'integer'),
+        Field('Status',
+            default='pending',
+            requires=IS_IN_SET([
+                ['pending', T("Pending")],
+                ['processing', T("Processing")],
+                ['success', T("Success")],
+                ['fail', T("Fail")],
+            ])),
+        Field('mollie_payment_id'),
+        Field('LastError', 'text'),
+        Field('CreatedOn', 'datetime',
+            default=datetime.datetime.now),
+        Field('UpdatedOn', 'datetime',
+            default=datetime.datetime.now,
+            update=datetime.datetime.now)
+    )
+
+
 def represent_invoice_status(value, row):
     """
         Returns label for invoice status
@@ -5446,6 +5888,47 @@ def define_integration_exact_online_log():
     )
 
 
+def define_integration_exact_online_queue():
+    """
+        Outbox of changes to be synced to Exact Online by a scheduler task
+    """
+    db.define_table('integration_exact_online_queue',
+        Field('ObjectName',
+            requires=IS_IN_SET([
+                ['invoice', T("Invoice")],
+                ['relation', T("Relation")],
+                ['bankaccount', T("Bank account")],
+                ['mandate', T("Direct debit mandate")],
+            ])),
+        Field('ObjectID', 'integer'),
+        Field('ActionName',
+            requires=IS_IN_SET([
+                ['create', T("Create")],
+                ['update', T("Update")],
+                ['delete', T("Delete")],
+            ])),
+        Field('ActionData'), # Exact Online ID of objects that no longer exist locally
+        Field('Status',
+            default='pending',
+            requires=IS_IN_SET([
+                ['pending', T("Pending")],
+                ['fail', T("Fail")],
+            ])),
+        Field('Attempts', 'integer',
+            default=0),
+        Field('NextAttemptOn', 'datetime',
+            default=datetime.datetime.now),
+        Field('LastError', 'text'),
+        Field('Version', 'integer', # Increased each time the item is added again
+            default=0),
+        Field('CreatedOn', 'datetime',
+            default=datetime.datetime.now),
+        Field('UpdatedOn', 'datetime',
+            default=datetime.datetime.now,
+            update=datetime.datetime.now)
+    )
+
+
 def define_customers_profile_features():
     """
         Define table to hold which features are enabled for customer logins
@@ -5557,6 +6040,76 @@ def define_sys_files():
     )
 
 
+def define_sys_thumbnails():
+    """
+        Content addressed thumbnails of uploaded images, see OsThumbnails
+    """
+    db.define_table('sys_thumbnails',
+        Field('Name', unique=True,
+            length=128), # thumb.<sha1>.<width>x<height>[c].<ext>
+        Field('Source'), # uploaded image
+        Field('Width', 'integer'),
+        Field('Height', 'integer'),
+        Field('Fit', 'boolean',
+            default=True),
+        Field('OnDemand', 'boolean', # Not referenced by a field, removed when least recently used
+            default=False),
+        Field('Status',
+            default='pending',
+            requires=IS_IN_SET([
+                ['pending', T("Pending")],
+                ['generated', T("Generated")],
+                ['error', T("Error")],
+            ])),
+        Field('LastAccessedOn', 'datetime',
+            default=datetime.datetime.now),
+        Field('CreatedOn', 'datetime',
+            default=datetime.datetime.now)
+    )
+
+
+def define_sys_storage_usage():
+    """
+        Space used in the uploads folder per table, see OsStorageUsage
+    """
+    db.define_table('sys_storage_usage',
+        Field('TableName'),
+        Field('Bytes', 'bigint',
+            default=0),
+        Field('UpdatedOn', 'datetime',
+            default=datetime.datetime.now)
+    )
+
+
+def define_reports_revenue_months():
+    """
+        Revenue per month, category, location and organization, see ReportsRevenue
+    """
+    db.define_table('reports_revenue_months',
+        Field('RevenueYear', 'integer'),
+        Field('RevenueMonth', 'integer'),
+        Field('Category'),
+        Field('school_locations_id', db.school_locations),
+        Field('sys_organizations_id', db.sys_organizations),
+        Field('Amount', 'double',
+            default=0),
+        Field('CreatedOn', 'datetime',
+            default=datetime.datetime.now)
+    )
+
+
+def define_reports_revenue_months_refresh():
+    """
+        Months to calculate again in db.reports_revenue_months, see ReportsRevenue
+    """
+    db.define_table('reports_revenue_months_refresh',
+        Field('RevenueYear', 'integer'),
+        Field('RevenueMonth', 'integer'),
+        Field('CreatedOn', 'datetime',
+            default=datetime.datetime.now)
+    )
+
+
 def define_mailing_lists():
     """
         Define mailing lists table
@@ -5631,16 +6184,18 @@ def set_preferences_permissions():
         permission for preferences.
         Currently create, read, update, delete and select will be set for
         payment_methods and payment_categories.
+        Called from upgrades, not for each request.
     """
-    if not auth.user is None:
-        user_id = auth.user.id
-        check = auth.has_permission('read', 'preferences', 0, user_id)
-        if check:
-            tables = ['payment_categories', 'payment_methods']
-            group_id = get_group_id()
-            for table in tables:
-                for permission in permissions:
-                    auth.add_permission(group_id, permission, table, 0)
+    query = (db.auth_permission.name == 'read') & \
+            (db.auth_permission.table_name == 'preferences') & \
+            (db.auth_permission.record_id == 0)
+    rows = db(query).select(db.auth_permission.group_id, distinct=True)
+
+    tables = ['payment_categories', 'payment_methods']
+    for row in rows:
+        for table in tables:
+            for permission in permissions:
+                auth.add_permission(row.group_id, permission, table, 0)
 
 
 def create_admin_user_and_group():
@@ -5664,6 +6219,8 @@ def create_admin_user_and_group():
 
 
 def set_permissions_for_admin_group():
+    # Permissions are set for all tables, so make sure all are defined
+    db.define_all()
     for table in db.tables:
         for permission in permissions:
             auth.add_permission(1, permission, table, 0)
@@ -5800,12 +6357,12 @@ def setup():
         To check whether setup has run, use the Property "setup_complete" in
         the sys_properties table. If the value is "T", it has run.
     """
-    setup_complete = 'F'
-    row = db.sys_properties(Property="setup_complete")
-    if not row is None:
-        setup_complete = row.PropertyValue
+    setup_complete = get_sys_property('setup_complete') or 'F'
 
     if setup_complete != 'T':
+        # Create all tables
+        db.define_all()
+
         from os_upgrade import set_version
         set_version()
 
@@ -5934,15 +6491,15 @@ db.scheduler_task.last_run_time.requires=IS_DATETIME(format=DATETIME_FORMAT)
 
 ## create all tables needed by auth if not custom tables
 define_school_languages()
-languages_dict = create_languages_dict()
+languages_dict = OsLazyDict(create_languages_dict)
 define_school_classtypes()
-classtypes_dict = create_classtypes_dict()
+classtypes_dict = OsLazyDict(create_classtypes_dict)
 define_school_discovery()
-discovery_dict = create_discovery_dict()
+discovery_dict = OsLazyDict(create_discovery_dict)
 define_school_locations()
-locations_dict = create_locations_dict()
+locations_dict = OsLazyDict(create_locations_dict)
 define_school_levels()
-levels_dict = create_school_levels_dict()
+levels_dict = OsLazyDict(create_school_levels_dict)
 
 dis_query = (db.school_discovery.Archived == False)
 lev_query = (db.school_levels.Archived    == False)
@@ -6166,11 +6723,19 @@ auth.settings.extra_fields['auth_user'] = [
           readable=False,
           writable=False,
           default=datetime.datetime.now(),
+          represent=represent_datetime),
+    Field('updated_on', 'datetime', # used by the POS to fetch changes
+          readable=False,
+          writable=False,
+          default=datetime.datetime.now,
+          update=datetime.datetime.now,
           represent=represent_datetime)
     ]
 
 
 auth.define_tables(username=False, signature=False)
+set_auth_permissions_callbacks()
+set_customers_search_callbacks()
 
 # Set format for auth_user.id
 db.auth_user._format = '%(display_name)s'
@@ -6191,179 +6756,191 @@ if not CURRENCY:
 ### Sys properties and auth tables end
 
 # Now continue with the rest of the DAL
-
-define_sys_organizations()
-define_sys_api_users()
-define_sys_files()
-define_sys_accounting()
-define_sys_email_templates()
-define_sys_notifications()
-define_sys_notifications_email()
+# Tables are defined when they're first used, see OsDAL.lazy_define
+
+db.lazy_define('sys_organizations', define_sys_organizations)
+db.lazy_define('sys_api_users', define_sys_api_users)
+db.lazy_define('sys_files', define_sys_files)
+db.lazy_define('sys_thumbnails', define_sys_thumbnails)
+db.lazy_define('sys_storage_usage', define_sys_storage_usage)
+db.lazy_define('sys_accounting', define_sys_accounting)
+db.lazy_define('sys_email_templates', define_sys_email_templates)
+db.lazy_define('sys_notifications', define_sys_notifications)
+db.lazy_define('sys_notifications_email', define_sys_notifications_email)
 set_show_location()
 set_dateformat()
 set_class_status()
 SHIFT_STATUSES = set_shift_status()
 ORGANIZATIONS = get_organizations()
-define_payment_methods()
-payment_methods_dict = create_payment_methods_dict()
-
-define_mailing_lists()
-define_integration_exact_online_log()
-define_postcode_groups()
-define_tax_rates()
-define_accounting_costcenters()
-define_accounting_glaccounts()
-
-define_school_memberships()
-define_school_subscriptions()
+db.lazy_define('payment_methods', define_payment_methods)
+payment_methods_dict = OsLazyDict(create_payment_methods_dict)
+
+db.lazy_define('mailing_lists', define_mailing_lists)
+db.lazy_define('integration_exact_online_log', define_integration_exact_online_log)
+db.lazy_define('integration_exact_online_queue', define_integration_exact_online_queue)
+db.lazy_define('postcode_groups', define_postcode_groups)
+db.lazy_define('tax_rates', define_tax_rates)
+db.lazy_define('accounting_costcenters', define_accounting_costcenters)
+db.lazy_define('accounting_glaccounts', define_accounting_glaccounts)
+
+db.lazy_define('school_memberships', define_school_memberships)
+db.lazy_define('school_subscriptions', define_school_subscriptions)
 #mstypes_dict = create_mstypes_dict()
-define_school_subscriptions_price()
-define_school_subscriptions_groups()
-define_school_subscriptions_groups_subscriptions()
-define_school_classcards()
-define_school_classcards_groups()
-define_school_classcards_groups_classcards()
-define_payment_categories()
-paycat_dict = create_payment_categories_dict()
-define_teachers_holidays()
-teachers_dict = create_teachers_dict()
-employees_dict = create_employees_dict()
-
-define_messages()
-
-define_workshops()
+db.lazy_define('school_subscriptions_price', define_school_subscriptions_price)
+db.lazy_define('school_subscriptions_groups', define_school_subscriptions_groups)
+db.lazy_define('school_subscriptions_groups_subscriptions', define_school_subscriptions_groups_subscriptions)
+db.lazy_define('school_classcards', define_school_classcards)
+db.lazy_define('school_classcards_groups', define_school_classcards_groups)
+db.lazy_define('school_classcards_groups_classcards', define_school_classcards_groups_classcards)
+db.lazy_define('payment_categories', define_payment_categories)
+paycat_dict = OsLazyDict(create_payment_categories_dict)
+set_names_dict_callbacks()
+db.lazy_define('teachers_holidays', define_teachers_holidays)
+teachers_dict = OsLazyDict(create_teachers_dict)
+employees_dict = OsLazyDict(create_employees_dict)
+
+db.lazy_define('messages', define_messages)
+
+db.lazy_define('workshops', define_workshops)
 #workshops_dict = create_workshops_dict()
-define_workshops_activities()
+db.lazy_define('workshops_activities', define_workshops_activities)
 #workshops_activities_dict = create_workshops_activities_dict()
-define_workshops_products()
-define_workshops_products_activities()
-define_workshops_mail()
+db.lazy_define('workshops_products', define_workshops_products)
+db.lazy_define('workshops_products_activities', define_workshops_products_activities)
+db.lazy_define('workshops_mail', define_workshops_mail)
 
 #customers_dict = create_customers_dict()
-define_customers_documents()
-define_customers_notes()
-define_customers_payment_info()
-define_customers_payment_info_mandates()
-define_customers_messages()
-define_customers_memberships()
-define_customers_subscriptions()
-define_customers_subscriptions_paused()
-define_customers_subscriptions_alt_prices()
-define_customers_profile_features()
-define_customers_profile_announcements()
-define_customers_shop_features()
-
-define_alternativepayments()
-
-define_workshops_products_customers()
-define_workshops_activities_customers()
-define_classes()
-
-define_customers_shoppingcart()
+db.lazy_define('customers_documents', define_customers_documents)
+db.lazy_define('customers_search_tokens', define_customers_search_tokens)
+db.lazy_define('customers_notes', define_customers_notes)
+db.lazy_define('customers_payment_info', define_customers_payment_info)
+db.lazy_define('customers_payment_info_mandates', define_customers_payment_info_mandates)
+db.lazy_define('customers_messages', define_customers_messages)
+db.lazy_define('sys_mail_outbox', define_sys_mail_outbox)
+db.lazy_define('customers_memberships', define_customers_memberships)
+db.lazy_define('customers_subscriptions', define_customers_subscriptions)
+db.lazy_define('customers_subscriptions_paused', define_customers_subscriptions_paused)
+db.lazy_define('customers_subscriptions_alt_prices', define_customers_subscriptions_alt_prices)
+db.lazy_define('customers_profile_features', define_customers_profile_features)
+db.lazy_define('customers_profile_announcements', define_customers_profile_announcements)
+db.lazy_define('customers_shop_features', define_customers_shop_features)
+
+db.lazy_define('alternativepayments', define_alternativepayments)
+
+db.lazy_define('workshops_products_customers', define_workshops_products_customers)
+db.lazy_define('workshops_activities_customers', define_workshops_activities_customers)
+db.lazy_define('classes', define_classes)
+
+db.lazy_define('customers_shoppingcart', define_customers_shoppingcart)
 #classes_dict = create_classes_dict()
-define_classes_otc()
-define_classes_otc_sub_avail()
-define_classes_price()
-define_classes_teachers()
-define_classes_open()
-define_classes_cancelled()
-define_customers_classcards()
-define_classes_reservation()
-define_classes_reservation_cancelled()
-define_classes_waitinglist()
-define_classes_attendance()
-define_classes_attendance_override()
-define_teachers_classtypes()
-define_classes_subteachers()
-define_classes_notes()
-define_classes_schedule_counts()
-define_classes_school_subscriptions_groups()
-define_classes_school_classcards_groups()
-define_tasks()
-define_announcements()
-define_school_holidays()
-define_school_holidays_locations()
-define_schedule_classes_status()
+db.lazy_define('classes_otc', define_classes_otc)
+db.lazy_define('classes_otc_sub_avail', define_classes_otc_sub_avail)
+db.lazy_define('classes_price', define_classes_price)
+db.lazy_define('classes_teachers', define_classes_teachers)
+db.lazy_define('classes_open', define_classes_open)
+db.lazy_define('classes_cancelled', define_classes_cancelled)
+db.lazy_define('customers_classcards', define_customers_classcards)
+db.lazy_define('classes_reservation', define_classes_reservation)
+db.lazy_define('classes_reservation_cancelled', define_classes_reservation_cancelled)
+db.lazy_define('classes_waitinglist', define_classes_waitinglist)
+db.lazy_define('classes_attendance', define_classes_attendance)
+db.lazy_define('classes_attendance_stats', define_classes_attendance_stats)
+db.lazy_define('classes_attendance_override', define_classes_attendance_override)
+db.lazy_define('teachers_classtypes', define_teachers_classtypes)
+db.lazy_define('classes_subteachers', define_classes_subteachers)
+db.lazy_define('classes_notes', define_classes_notes)
+db.lazy_define('classes_schedule_count', define_classes_schedule_counts)
+db.lazy_define('classes_school_subscriptions_groups', define_classes_school_subscriptions_groups)
+db.lazy_define('classes_school_classcards_groups', define_classes_school_classcards_groups)
+db.lazy_define('tasks', define_tasks)
+db.lazy_define('announcements', define_announcements)
+db.lazy_define('school_holidays', define_school_holidays)
+db.lazy_define('school_holidays_locations', define_school_holidays_locations)
+db.lazy_define('schedule_classes_status', define_schedule_classes_status)
 
 # teacher payment definitions (depend on classes and auth_user)
-define_teachers_payment_fixed_rate_default()
-define_teachers_payment_fixed_rate_class()
-define_teachers_payment_travel()
-define_teachers_payment_attendance_lists()
-define_teachers_payment_attendance_lists_rates()
-define_teachers_payment_attendance_lists_school_classtypes()
-define_teachers_payment_classes()
+db.lazy_define('teachers_payment_fixed_rate_default', define_teachers_payment_fixed_rate_default)
+db.lazy_define('teachers_payment_fixed_rate_class', define_teachers_payment_fixed_rate_class)
+db.lazy_define('teachers_payment_travel', define_teachers_payment_travel)
+db.lazy_define('teachers_payment_attendance_lists', define_teachers_payment_attendance_lists)
+db.lazy_define('teachers_payment_attendance_lists_rates', define_teachers_payment_attendance_lists_rates)
+db.lazy_define('teachers_payment_attendance_lists_school_classtypes', define_teachers_payment_attendance_lists_school_classtypes)
+db.lazy_define('teachers_payment_classes', define_teachers_payment_classes)
 
-define_customers_subscriptions_credits()
-define_log_customers_accepted_documents()
+db.lazy_define('customers_subscriptions_credits', define_customers_subscriptions_credits)
+db.lazy_define('log_customers_accepted_documents', define_log_customers_accepted_documents)
 
 # order definitions
-define_customers_orders()
-define_customers_orders_items()
-define_customers_orders_amounts()
-define_customers_orders_mollie_payment_ids()
+db.lazy_define('customers_orders', define_customers_orders)
+db.lazy_define('customers_orders_items', define_customers_orders_items)
+db.lazy_define('customers_orders_amounts', define_customers_orders_amounts)
+db.lazy_define('customers_orders_mollie_payment_ids', define_customers_orders_mollie_payment_ids)
 
 # shop tables
-define_shop_links()
-define_shop_brands()
-define_shop_suppliers()
-define_shop_products_sets()
-define_shop_products_sets_options()
-define_shop_products_sets_options_values()
-define_shop_products()
-define_shop_products_variants()
-define_shop_categories()
-define_shop_categories_products()
-define_customers_orders_items_shop_products_variants()
+db.lazy_define('shop_links', define_shop_links)
+db.lazy_define('shop_brands', define_shop_brands)
+db.lazy_define('shop_suppliers', define_shop_suppliers)
+db.lazy_define('shop_products_sets', define_shop_products_sets)
+db.lazy_define('shop_products_sets_options', define_shop_products_sets_options)
+db.lazy_define('shop_products_sets_options_values', define_shop_products_sets_options_values)
+db.lazy_define('shop_products', define_shop_products)
+db.lazy_define('shop_products_variants', define_shop_products_variants)
+db.lazy_define('shop_categories', define_shop_categories)
+db.lazy_define('shop_categories_products', define_shop_categories_products)
+db.lazy_define('customers_orders_items_shop_products_variants', define_customers_orders_items_shop_products_variants)
 
 # employee claims definitions
-define_employee_claims()
+db.lazy_define('employee_claims', define_employee_claims)
 
 # shop sales
-define_shop_sales()
-define_shop_sales_products_variants()
+db.lazy_define('shop_sales', define_shop_sales)
+db.lazy_define('shop_sales_products_variants', define_shop_sales_products_variants)
 
 # invoice definitions
-define_invoices_groups()
-define_invoices_groups_product_types()
-define_invoices()
-define_invoices_amounts()
-define_invoices_items()
-define_invoices_payments()
-define_invoices_workshops_products_customers()
-define_invoices_customers_classcards()
-define_invoices_classes_attendance()
-define_invoices_customers()
-define_invoices_customers_memberships()
-define_invoices_customers_subscriptions()
-define_invoices_customers_orders()
-define_invoices_employee_claims()
-define_invoices_teachers_payment_classes()
-define_invoices_mollie_payment_ids()
+db.lazy_define('invoices_groups', define_invoices_groups)
+db.lazy_define('invoices_groups_product_types', define_invoices_groups_product_types)
+db.lazy_define('invoices', define_invoices)
+db.lazy_define('invoices_amounts', define_invoices_amounts)
+db.lazy_define('invoices_items', define_invoices_items)
+db.lazy_define('invoices_payments', define_invoices_payments)
+db.lazy_define('invoices_workshops_products_customers', define_invoices_workshops_products_customers)
+db.lazy_define('invoices_customers_classcards', define_invoices_customers_classcards)
+db.lazy_define('invoices_classes_attendance', define_invoices_classes_attendance)
+db.lazy_define('invoices_customers', define_invoices_customers)
+db.lazy_define('invoices_customers_memberships', define_invoices_customers_memberships)
+db.lazy_define('invoices_customers_subscriptions', define_invoices_customers_subscriptions)
+db.lazy_define('invoices_customers_orders', define_invoices_customers_orders)
+db.lazy_define('invoices_employee_claims', define_invoices_employee_claims)
+db.lazy_define('invoices_teachers_payment_classes', define_invoices_teachers_payment_classes)
+db.lazy_define('invoices_mollie_payment_ids', define_invoices_mollie_payment_ids)
+db.lazy_define('customers_subscriptions_mollie_collections', define_customers_subscriptions_mollie_collections)
+db.lazy_define('reports_revenue_months', define_reports_revenue_months)
+db.lazy_define('reports_revenue_months_refresh', define_reports_revenue_months_refresh)
 
 # receipts definitions
-define_receipts()
-define_receipts_items()
-define_receipts_items_shop_sales()
-define_receipts_amounts()
+db.lazy_define('receipts', define_receipts)
+db.lazy_define('receipts_items', define_receipts_items)
+db.lazy_define('receipts_items_shop_sales', define_receipts_items_shop_sales)
+db.lazy_define('receipts_amounts', define_receipts_amounts)
 
 # payment batches definitions
-define_payment_batches()
-define_payment_batches_items()
-define_payment_batches_exports()
+db.lazy_define('payment_batches', define_payment_batches)
+db.lazy_define('payment_batches_items', define_payment_batches_items)
+db.lazy_define('payment_batches_exports', define_payment_batches_exports)
 
 # shifts definitions
-define_school_shifts()
-define_shifts()
-define_shifts_staff()
-define_shifts_otc()
-define_schedule_staff_status()
+db.lazy_define('school_shifts', define_school_shifts)
+db.lazy_define('shifts', define_shifts)
+db.lazy_define('shifts_staff', define_shifts_staff)
+db.lazy_define('shifts_otc', define_shifts_otc)
+db.lazy_define('schedule_staff_status', define_schedule_staff_status)
 
 # mollie tables
-define_mollie_log_webhook()
+db.lazy_define('mollie_log_webhook', define_mollie_log_webhook)
 
-set_preferences_permissions()
+set_storage_usage_callbacks()
+set_reports_revenue_callbacks()
+set_selfcheckin_roster_callbacks()
 
-# some system maintendance
-create_admin_user_and_group()
+# First run only, permissions are set by setup() & upgrades
 setup()
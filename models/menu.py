@@ -233,51 +233,51 @@ def shop_menu_about():
     return menu
 
 
-def get_backend_menu():
-    user_helpers = User_helpers()
-
-    default_class = ''
-    pinboard_class = ''
-    tasks_class = ''
-    customers_class = ''
-    classes_class = ''
-    employees_class = ''
-    workshops_class = ''
-    sp_class = ''
-    reports_class = ''
-    finance_class = ''
-    shop_class = ''
-    settings_class = ''
-    jumpto_class = ''
+BACKEND_MENU_SECTIONS = {
+    'default': 'default',
+    'pinboard': 'pinboard',
+    'tasks': 'tasks',
+    'customers': 'customers',
+    'classes': 'classes',
+    'staff': 'classes',
+    'workshops': 'workshops',
+    'school_properties': 'sp',
+    'teachers': 'sp',
+    'reports': 'reports',
+    'finance': 'finance',
+    'shop': 'shop',
+    'settings': 'settings',
+}
+
+
+def get_backend_menu_active_class(section):
+    """
+        Placeholder for the class of a menu section, replaced by 'active'
+        for the section of the current controller in get_backend_menu_html()
+    """
+    return '__menu_active_' + section + '__'
 
-    active_class = 'active'
 
-    if not request.is_scheduler and not request.is_shell:
-        if request.controller == 'default':
-            default_class = active_class
-        elif request.controller == 'pinboard':
-            pinboard_class = active_class
-        elif request.controller == 'tasks':
-            tasks_class = active_class
-        elif request.controller == 'customers':
-            customers_class = active_class
-        elif request.controller == 'classes':
-            classes_class = active_class
-        elif request.controller == 'staff':
-            classes_class = active_class
-        elif request.controller == 'workshops':
-            workshops_class = active_class
-        elif request.controller == 'school_properties' or request.controller == 'teachers':
-            sp_class = active_class
-        elif request.controller == 'reports':
-            reports_class = active_class
-        elif request.controller == 'finance':
-            finance_class = active_class
-        elif request.controller == 'shop':
-            shop_class = active_class
-        elif request.controller == 'settings':
-            settings_class = active_class
+def get_backend_menu():
+    """
+        Build the backend menu for the logged in user. Active sections are
+        marked with placeholders, so the menu can be shared by all pages.
+    """
+    user_helpers = User_helpers()
 
+    default_class = get_backend_menu_active_class('default')
+    pinboard_class = get_backend_menu_active_class('pinboard')
+    tasks_class = get_backend_menu_active_class('tasks')
+    customers_class = get_backend_menu_active_class('customers')
+    classes_class = get_backend_menu_active_class('classes')
+    employees_class = get_backend_menu_active_class('employees')
+    workshops_class = get_backend_menu_active_class('workshops')
+    sp_class = get_backend_menu_active_class('sp')
+    reports_class = get_backend_menu_active_class('reports')
+    finance_class = get_backend_menu_active_class('finance')
+    shop_class = get_backend_menu_active_class('shop')
+    settings_class = get_backend_menu_active_class('settings')
+    jumpto_class = get_backend_menu_active_class('jumpto')
 
     if not auth.user is None:
         user_id = auth.user.id
@@ -702,6 +702,57 @@ def get_backend_menu():
         return menu
 
 
+def get_backend_menu_signature():
+    """
+        The backend menu only depends on the groups of a user (and their
+        permissions) and whether the user is the sysadmin, so users with
+        the same groups share a menu.
+    """
+    import hashlib
+
+    groups = sorted(auth.get_user_permissions(auth.user.id)['groups'].keys())
+    signature = ','.join([ unicode(group) for group in groups ])
+    if auth.user.id == 1:
+        signature += ',sysadmin'
+
+    return hashlib.sha1(signature).hexdigest()
+
+
+def get_backend_menu_html():
+    """
+        Backend menu rendered once per group signature & language and kept
+        in the shared cache. Cached menus are cleared when groups or
+        permissions change.
+    """
+    import re
+
+    def render():
+        return LTE_MENU(get_backend_menu(),
+                        _class='sidebar-menu',
+                        li_class='treeview',
+                        ul_class='treeview-menu').element('ul').xml()
+
+    # Don't cache when running tests
+    if web2pytest.is_running_under_test(request, request.application):
+        html = render()
+    else:
+        cache_key = 'openstudio_menu_backend_' + \
+                    get_backend_menu_signature() + '_' + \
+                    unicode(T.accepted_language)
+        html = OsCacheManager().get_shared(cache_key,
+                                           render,
+                                           ['menu_backend', 'auth_permissions'],
+                                           time_expire=259200)
+
+    section = None
+    if not request.is_scheduler and not request.is_shell:
+        section = BACKEND_MENU_SECTIONS.get(request.controller, None)
+    if section:
+        html = html.replace(get_backend_menu_active_class(section), 'active')
+
+    return XML(re.sub(r'__menu_active_\w+__', '', html))
+
+
 if request.controller == 'shop' or request.controller == 'profile':
     #response.menu = ''
     #response.menu_shop = shop_menu()
@@ -736,10 +787,7 @@ elif request.controller == 'ep':
 
 else:
     if auth.user:
-        cache_key = 'openstudio_menu_backend_user_' + unicode(auth.user.id)
-        response.menu = cache.ram(cache_key,
-                                 lambda: get_backend_menu(),
-                                 time_expire=259200)
+        response.menu_backend = get_backend_menu_html()
     else:
         response.menu = ''
 
@@ -1027,7 +1027,8 @@ class AttendanceHelper:
                                            trial=False,
                                            request_review=False,
                                            complementary=False,
-                                           list_type='shop'):
+                                           list_type='shop',
+                                           eligibility=None):
         """
         :param clsID: db.classes.id
         :param date: datetime.date
@@ -1035,97 +1036,32 @@ class AttendanceHelper:
         :param trial: bool
         :param complementary: bool
         :param list_type: should be in ["shop", "attendance", "selfcheckin"]
-        :param controller: web2py controller
+        :param eligibility: CustomerClassBookingEligibility object for customer,
+        pass one when getting options for multiple classes
         :return: list of booking options
         """
-        from os_class import Class
-        from os_customer_classcard import CustomerClasscard
-        from os_customer_subscription import CustomerSubscription
+        from os_customer_class_booking_eligibility import CustomerClassBookingEligibility
 
         T = current.T
         db = current.db
         get_sys_property = current.globalenv['get_sys_property']
 
+        if eligibility is None:
+            eligibility = CustomerClassBookingEligibility(customer, date, class_ids=[clsID])
+
         options = {
-            'subscriptions': [],
-            'classcards': [],
+            'subscriptions': eligibility.get_subscription_options(clsID, date, list_type),
+            'classcards': eligibility.get_classcard_options(clsID, date, list_type),
             'dropin': False,
             'trial': False,
             'complementary': False
         }
 
-        # Subscriptions
-        subscriptions = customer.get_subscriptions_on_date(date)
-        if subscriptions:
-            for subscription in subscriptions:
-                csID = subscription.customers_subscriptions.id
-                # Check remaining credits
-                credits = subscription.customers_subscriptions.CreditsRemaining or 0
-                recon_classes = subscription.school_subscriptions.ReconciliationClasses
-                # Create subscription object
-                cs = CustomerSubscription(csID)
-
-                if list_type == 'shop':
-                    subscription_permission_check = not int(clsID) in cs.get_allowed_classes_booking(public_only=True)
-                else:
-                    subscription_permission_check = not int(clsID) in cs.get_allowed_classes_attend(public_only=False)
-
-                allowed = True
-                if subscription_permission_check:
-                    allowed = False
-
-                credits_remaining = credits > (recon_classes * -1)
-
-                options['subscriptions'].append({
-                    'clsID': clsID,
-                    'Type': 'subscription',
-                    'id': csID,
-                    'auth_customer_id': subscription.customers_subscriptions.auth_customer_id,
-                    'Name': subscription.school_subscriptions.Name,
-                    'Allowed': allowed,
-                    'Credits': credits,
-                    'CreditsRemaining': credits_remaining,
-                    'Unlimited': subscription.school_subscriptions.Unlimited,
-                    'school_memberships_id': subscription.school_subscriptions.school_memberships_id,
-                })
-
-        # class cards
-        classcards = customer.get_classcards(date)
-        if classcards:
-            for classcard in classcards:
-                ccdID = classcard.customers_classcards.id
-
-                ccd = CustomerClasscard(ccdID)
-                classes_remaining = ccd.get_classes_remaining()
-
-                if list_type == 'shop':
-                    allowed_classes = ccd.get_allowed_classes_booking()
-                else:
-                    allowed_classes = ccd.get_allowed_classes_attend(public_only=False)
-
-                allowed = True
-                if not int(clsID) in allowed_classes:
-                    allowed = False
-
-                options['classcards'].append({
-                    'clsID': clsID,
-                    'Type': 'classcard',
-                    'id': ccdID,
-                    'auth_customer_id': classcard.customers_classcards.auth_customer_id,
-                    'Name': classcard.school_classcards.Name,
-                    'Allowed': allowed,
-                    'Enddate': classcard.customers_classcards.Enddate,
-                    'ClassesRemaining': classes_remaining,
-                    'Unlimited': classcard.school_classcards.Unlimited,
-                    'school_memberships_id': classcard.school_classcards.school_memberships_id,
-                })
-
         # Get class prices
-        cls = Class(clsID, date)
-        prices = cls.get_prices()
+        prices = eligibility.get_prices(clsID, date)
 
         price = prices['dropin']
-        has_membership = customer.has_membership_on_date(date)
+        has_membership = eligibility.has_membership_on_date(date)
         membership_price = has_membership and prices['dropin_membership']
         if membership_price:
             price = prices['dropin_membership']
@@ -1187,6 +1123,67 @@ class AttendanceHelper:
         return options
 
 
+    def get_customer_classes_booking_options(self,
+                                             classes_dates,
+                                             customer,
+                                             trial=False,
+                                             complementary=False,
+                                             list_type='shop'):
+        """
+        :param classes_dates: list of tuples (db.classes.id, datetime.date)
+        :param customer: os_customer.Customer object
+        :param trial: bool
+        :param complementary: bool
+        :param list_type: should be in ["shop", "attendance", "selfcheckin"]
+        :return: dict {(db.classes.id, datetime.date): booking options}
+        """
+        from os_customer_class_booking_eligibility import CustomerClassBookingEligibility
+
+        if not classes_dates:
+            return {}
+
+        dates = [ date for clsID, date in classes_dates ]
+        eligibility = CustomerClassBookingEligibility(
+            customer,
+            min(dates),
+            max(dates),
+            class_ids=[ clsID for clsID, date in classes_dates ]
+        )
+
+        options = {}
+        for clsID, date in classes_dates:
+            options[(clsID, date)] = self.get_customer_class_booking_options(
+                clsID,
+                date,
+                customer,
+                trial=trial,
+                complementary=complementary,
+                list_type=list_type,
+                eligibility=eligibility
+            )
+
+        return options
+
+
+    def _get_classcard_option_classes_remaining_formatted(self, classcard):
+        """
+        :param classcard: class card booking option
+        :return: Representation of remaining classes, like
+        CustomerClasscard.get_classes_remaining_formatted
+        """
+        T = current.T
+
+        remaining = classcard['ClassesRemaining']
+        if remaining == 'unlimited':
+            remaining = T('Unlimited')
+
+        text = T("Classes")
+        if remaining == 1:
+           text = T("Class")
+
+        return SPAN(unicode(remaining), ' ', text, ' ', T("remaining"))
+
+
     def get_customer_class_booking_options_formatted(self,
                                                      clsID,
                                                      date,
@@ -1195,13 +1192,16 @@ class AttendanceHelper:
                                                      request_review=False,
                                                      complementary=False,
                                                      list_type='shop',
-                                                     controller=''):
+                                                     controller='',
+                                                     options=None):
         """
         :param clsID: db.classes.id
         :param date: datetime.date
         :param date_formatted: datetime.date object formatted with current.DATE_FORMAT
         :param customer: Customer object
         :param: list_type: [shop, attendance, selfcheckin]
+        :param options: booking options from get_customer_class_booking_options,
+        loaded when None
         :return:
         """
         def classes_book_options_get_button_book(url, btn_text=""):
@@ -1221,10 +1221,6 @@ class AttendanceHelper:
 
             return button_book
 
-        from os_class import Class
-        from os_customer_classcard import CustomerClasscard
-        from os_customer_subscription import CustomerSubscription
-
         T = current.T
         db = current.db
         os_gui = current.globalenv['os_gui']
@@ -1234,15 +1230,16 @@ class AttendanceHelper:
 
         date_formatted = date.strftime(DATE_FORMAT)
 
-        options = self.get_customer_class_booking_options(
-            clsID,
-            date,
-            customer,
-            trial=trial,
-            request_review=request_review,
-            complementary=complementary,
-            list_type=list_type
-        )
+        if options is None:
+            options = self.get_customer_class_booking_options(
+                clsID,
+                date,
+                customer,
+                trial=trial,
+                request_review=request_review,
+                complementary=complementary,
+                list_type=list_type
+            )
         formatted_options = DIV(_class='shop-classes-booking-options row')
 
         if options['under_review']:
@@ -1338,8 +1335,8 @@ class AttendanceHelper:
             for classcard in options['classcards']:
                 ccdID = classcard['id']
 
-                ccd = CustomerClasscard(ccdID)
-                classes_remaining = ccd.get_classes_remaining_formatted()
+                classes_remaining = self._get_classcard_option_classes_remaining_formatted(
+                    classcard)
 
                 if not classcard['Allowed']:
                     # Check book permission
@@ -1409,10 +1406,6 @@ class AttendanceHelper:
 
                 formatted_options.append(option)
 
-        # Get class prices
-        cls = Class(clsID, date)
-        prices = cls.get_prices()
-
         # drop in
         if options['dropin']:
             dropin = options['dropin']
@@ -1,17 +1,374 @@
 # -*- coding: utf-8 -*-
 
+import threading
+import time
+from collections import OrderedDict
+
 from gluon import *
 
+
+class OsLocalCache:
+    """
+        Small in-process LRU cache, shared by all requests handled by a process
+    """
+    def __init__(self, size=1000):
+        """
+        :param size: int - max number of entries
+        """
+        self.size = size
+        self.storage = OrderedDict()
+        self.lock = threading.Lock()
+
+
+    def get(self, key):
+        """
+        :param key: string
+        :return: tuple (found, value)
+        """
+        with self.lock:
+            try:
+                expires, value = self.storage.pop(key)
+            except KeyError:
+                return False, None
+
+            if expires < time.time():
+                return False, None
+
+            # Re-insert to mark as most recently used
+            self.storage[key] = (expires, value)
+
+            return True, value
+
+
+    def set(self, key, value, time_expire):
+        """
+        :param key: string
+        :param value: value to cache
+        :param time_expire: int - seconds
+        :return: None
+        """
+        with self.lock:
+            self.storage.pop(key, None)
+            self.storage[key] = (time.time() + time_expire, value)
+
+            while len(self.storage) > self.size:
+                self.storage.popitem(last=False)
+
+
+    def delete(self, key):
+        """
+        :param key: string
+        :return: None
+        """
+        with self.lock:
+            self.storage.pop(key, None)
+
+
+    def clear(self):
+        """
+            Remove all entries
+        """
+        with self.lock:
+            self.storage.clear()
+
+
+local_cache = OsLocalCache()
+
+
 class OsCacheManager:
+    """
+        Cache helper for OpenStudio
+
+        Entries can be registered under one or more tags using get().
+        Each tag has a generation counter stored in the cache itself. The
+        generations of an entry's tags are part of its key, so clearing a tag
+        increments its counter and all keys under that tag are no longer
+        found. Keys stored under each tag generation are listed in an index,
+        which clearing the tag uses to delete the superseded entries, as the
+        ram and disk backends only drop expired entries when they're read.
+        Each key in an index has its own slot, numbered by a counter, so
+        adding a key doesn't rewrite the index. Indexes hold up to
+        max_index_size keys. Only specific tags, eg. of a customer or date,
+        should index keys; pass index_tags to leave out global tags, which
+        then only invalidate keys through their generation.
+        Counters are read & written using cache.increment(), which behaves the
+        same on the ram, disk and redis backends.
+
+        get_shared() keeps entries in an in-process LRU cache in front of
+        cache.disk (redis when configured), which is shared by all processes.
+        Its tag generations are read from the shared cache once per request,
+        so clearing a tag in one process reaches all others.
+    """
+    tag_key_prefix = 'openstudio_cache_tag_'
+    tag_index_key_prefix = 'openstudio_cache_tag_keys_'
+    epoch_key = 'openstudio_cache_epoch'
+    max_index_size = 1000
+
+
+    def _get_tag_generation(self, cache_model, tag):
+        """
+        :param cache_model: cache.ram or cache.disk
+        :param tag: string
+        :return: int - current generation of tag
+        """
+        # Incrementing by 0 returns the current value and initializes
+        # the counter when it doesn't exist yet
+        return cache_model.increment(self.tag_key_prefix + tag, 0)
+
+
+    def _get_shared_tag_generation(self, tag):
+        """
+            Generation of tag in the shared cache, read once per request
+        :param tag: string
+        :return: int - current generation of tag
+        """
+        cache = current.cache
+        request = current.request
+
+        generations = request.get('os_cache_tag_generations')
+        if generations is None:
+            generations = request.os_cache_tag_generations = {}
+
+        if tag not in generations:
+            generations[tag] = self._get_tag_generation(cache.disk, tag)
+
+        return generations[tag]
+
+
+    def _get_shared_epoch(self):
+        """
+            Epoch of the shared cache, read once per request. A new epoch
+            is created when the shared cache has been cleared, as that also
+            resets the tag generations.
+        :return: int
+        """
+        cache = current.cache
+        request = current.request
+
+        epoch = request.get('os_cache_epoch')
+        if epoch is None:
+            epoch = request.os_cache_epoch = cache.disk(
+                self.epoch_key,
+                lambda: int(time.time() * 1000),
+                time_expire=None
+            )
+
+        return epoch
+
+
+    def _format_tagged_key(self, cache_key, tags, get_generation):
+        """
+        :param cache_key: string - base key
+        :param tags: list of strings
+        :param get_generation: function returning the generation of a tag
+        :return: string - cache key including tag generations
+        """
+        generations = [
+            tag + '.' + unicode(get_generation(tag))
+            for tag in tags
+        ]
+
+        return cache_key + '_' + '_'.join(generations)
+
+
+    def _get_tag_index_key(self, tag, generation):
+        """
+        :param tag: string
+        :param generation: int
+        :return: string - prefix of the keys of the index of a tag generation
+        """
+        return self.tag_index_key_prefix + tag + '.' + unicode(generation)
+
+
+    def _add_to_tag_indexes(self, cache_model, key, tags, get_generation):
+        """
+            Add key to the index of the current generation of each tag
+        :param cache_model: cache.ram or cache.disk
+        :param key: string - tagged key
+        :param tags: list of strings
+        :param get_generation: function returning the generation of a tag
+        :return: None
+        """
+        for tag in tags:
+            index_key = self._get_tag_index_key(tag, get_generation(tag))
+            # The counter hands out a free slot, also to concurrent requests
+            slot = cache_model.increment(index_key + '_count')
+            if slot > self.max_index_size:
+                # Full, the entry is only invalidated by its generation
+                continue
+
+            # time_expire=0 stores the key in the slot
+            cache_model(index_key + '_' + unicode(slot), lambda: key, time_expire=0)
+
+
+    def _delete_tag_index(self, cache_model, tag, generation):
+        """
+            Delete entries stored under a tag generation and its index
+        :param cache_model: cache.ram or cache.disk
+        :param tag: string
+        :param generation: int
+        :return: None
+        """
+        index_key = self._get_tag_index_key(tag, generation)
+        count = cache_model.increment(index_key + '_count', 0)
+
+        keys = [ index_key + '_count' ]
+        for slot in range(1, min(count, self.max_index_size) + 1):
+            slot_key = index_key + '_' + unicode(slot)
+            keys.append(slot_key)
+
+            key = cache_model(slot_key, lambda: None, time_expire=None)
+            if key:
+                keys.append(key)
+
+        for key in keys:
+            # Passing None as function removes a key
+            cache_model(key, None)
+            if cache_model is current.cache.disk:
+                local_cache.delete(key)
+
+
+    def _get_indexed(self, cache_model, key, f, index_tags, get_generation, time_expire):
+        """
+            Get a value from cache_model, keys stored for the first time are
+            added to the indexes of index_tags
+        :param cache_model: cache.ram or cache.disk
+        :param key: string - tagged key
+        :param f: function returning the value to cache
+        :param index_tags: list of strings
+        :param get_generation: function returning the generation of a tag
+        :param time_expire: int - seconds
+        :return: cached value
+        """
+        def f_indexed():
+            value = f()
+            self._add_to_tag_indexes(cache_model, key, index_tags, get_generation)
+
+            return value
+
+        return cache_model(key, f_indexed, time_expire=time_expire)
+
+
+    def get_tagged_key(self, cache_key, tags, cache_model=None):
+        """
+        :param cache_key: string - base key
+        :param tags: list of strings
+        :param cache_model: cache.ram or cache.disk, defaults to cache.ram
+        :return: string - cache key including tag generations
+        """
+        cache = current.cache
+        if cache_model is None:
+            cache_model = cache.ram
+
+        return self._format_tagged_key(
+            cache_key,
+            tags,
+            lambda tag: self._get_tag_generation(cache_model, tag)
+        )
+
+
+    def get(self, cache_key, f, tags, time_expire=None, cache_model=None, index_tags=None):
+        """
+        :param cache_key: string - base key
+        :param f: function returning the value to cache
+        :param tags: list of strings eg. ['customer:1', 'school_subscriptions']
+        :param time_expire: int - seconds, defaults to CACHE_LONG
+        :param cache_model: cache.ram or cache.disk, defaults to cache.ram
+        :param index_tags: list of tags indexing the key, defaults to tags
+        :return: cached value
+        """
+        cache = current.cache
+        if cache_model is None:
+            cache_model = cache.ram
+        if time_expire is None:
+            time_expire = current.CACHE_LONG
+        if index_tags is None:
+            index_tags = tags
+
+        key = self.get_tagged_key(cache_key, tags, cache_model)
+
+        return self._get_indexed(
+            cache_model,
+            key,
+            f,
+            index_tags,
+            lambda tag: self._get_tag_generation(cache_model, tag),
+            time_expire
+        )
+
+
+    def get_shared(self, cache_key, f, tags, time_expire=None, index_tags=None):
+        """
+            Get a value from the in-process cache, falling back to the
+            shared cache (cache.disk or redis) and finally to f
+        :param cache_key: string - base key
+        :param f: function returning the value to cache
+        :param tags: list of strings eg. ['sys_properties']
+        :param time_expire: int - seconds, defaults to CACHE_LONG
+        :param index_tags: list of tags indexing the key, defaults to tags
+        :return: cached value
+        """
+        cache = current.cache
+        if time_expire is None:
+            time_expire = current.CACHE_LONG
+        if index_tags is None:
+            index_tags = tags
+
+        key = self._format_tagged_key(cache_key + '_' + unicode(self._get_shared_epoch()),
+                                      tags,
+                                      self._get_shared_tag_generation)
+
+        found, value = local_cache.get(key)
+        if not found:
+            value = self._get_indexed(cache.disk,
+                                      key,
+                                      f,
+                                      index_tags,
+                                      self._get_shared_tag_generation,
+                                      time_expire)
+            local_cache.set(key, value, time_expire)
+
+        return value
+
+
+    def clear_tags(self, *tags):
+        """
+            Invalidates all entries on disk & in ram registered under tags
+            and deletes them
+        :param tags: strings
+        :return: None
+        """
+        cache = current.cache
+        request = current.request
+
+        generations = request.get('os_cache_tag_generations')
+
+        for tag in tags:
+            generation = cache.ram.increment(self.tag_key_prefix + tag)
+            self._delete_tag_index(cache.ram, tag, generation - 1)
+
+            generation = cache.disk.increment(self.tag_key_prefix + tag)
+            self._delete_tag_index(cache.disk, tag, generation - 1)
+
+            if generations is not None:
+                generations[tag] = generation
+
+
     def clear(self, var_one=None, var_two=None):
         """
             Clears all cache entries on disk & in ram
             # Takes arguments in case it's called from a crud form or SQLFORM.grid
         """
         cache = current.cache
+        request = current.request
 
         cache.ram.clear()
         cache.disk.clear()
+        local_cache.clear()
+
+        # Tag generations & epoch have to be read again
+        request.os_cache_epoch = None
+        request.os_cache_tag_generations = None
 
     def clear_auth_user_login_attempts(self, email):
         """
@@ -28,33 +385,21 @@ class OsCacheManager:
         """
             Clears memberships cache entries on disk & in ram
         """
-        cache = current.cache
-
-        cu_sub_regex = 'openstudio_customer_get_memberships_on_date_' + str(cuID) + '*'
-        cache.ram.clear(regex=cu_sub_regex)
-        cache.disk.clear(regex=cu_sub_regex)
+        self.clear_tags('customer:' + unicode(cuID) + ':memberships')
 
 
     def clear_customers_subscriptions(self, cuID):
         """
             Clears subscription cache entries on disk & in ram
         """
-        cache = current.cache
-
-        cu_sub_regex = 'openstudio_customer_get_subscriptions_on_date_' + str(cuID) + '*'
-        cache.ram.clear(regex=cu_sub_regex)
-        cache.disk.clear(regex=cu_sub_regex)
+        self.clear_tags('customer:' + unicode(cuID) + ':subscriptions')
 
 
     def clear_customers_classcards(self, cuID):
         """
-            Clears subscription cache entries on disk & in ram
+            Clears classcard cache entries on disk & in ram
         """
-        cache = current.cache
-
-        cu_cc_regex = 'openstudio_customer_get_classcards_' + str(cuID) + '*'
-        cache.ram.clear(regex=cu_cc_regex)
-        cache.disk.clear(regex=cu_cc_regex)
+        self.clear_tags('customer:' + unicode(cuID) + ':classcards')
 
 
     def clear_classschedule(self, var_one=None, var_two=None):
@@ -62,13 +407,21 @@ class OsCacheManager:
             Clears the class schedule cache
             takes 2 dummy arguments in case it's called from a CRUD form or from SQLFORM.grid
         """
-        cache = current.cache
+        self.clear_tags('classschedule')
 
-        class_schedule_regex = 'openstudio_classschedule_get_day_*'
-        cache.ram.clear(regex=class_schedule_regex)
-        cache.disk.clear(regex=class_schedule_regex)
+        self.clear_classschedule_api()
 
-        cache_clear_classschedule_api()
+
+    def clear_classschedule_date(self, date):
+        """
+            Clears the class schedule cache for a single date
+        :param date: datetime.date
+        """
+        DATE_FORMAT = current.DATE_FORMAT
+
+        self.clear_tags('classschedule:' + date.strftime(DATE_FORMAT))
+
+        self.clear_classschedule_api()
 
 
     def clear_classschedule_api(self, var_one=None, var_two=None):
@@ -76,11 +429,7 @@ class OsCacheManager:
             Clears the class schedule api cache
             takes 2 dummy arguments in case it's called from a CRUD form or from SQLFORM.grid
         """
-        cache = current.cache
-
-        api_schedule_regex = 'openstudio_api_schedule_get_*'
-        cache.ram.clear(regex=api_schedule_regex)
-        cache.disk.clear(regex=api_schedule_regex)
+        self.clear_tags('classschedule_api')
 
 
     def clear_classschedule_trend(self, var_one=None, var_two=None):
@@ -88,11 +437,7 @@ class OsCacheManager:
             Clears the class schedule trend column cache
             takes 2 dummy arguments in case it's called from a CRUD form or from SQLFORM.grid
         """
-        cache = current.cache
-
-        trend_regex = 'openstudio_classschedule_trend_*'
-        cache.ram.clear(regex=trend_regex)
-        cache.disk.clear(regex=trend_regex)
+        self.clear_tags('classschedule_trend')
 
 
     def clear_sys_properties(self):
@@ -100,22 +445,21 @@ class OsCacheManager:
             Clears the sys_properties keys in cache
             :return: None
         """
-        cache = current.cache
-
-        sprop_regex = 'openstudio_system_property_*'
-        cache.ram.clear(regex=sprop_regex)
-        cache.disk.clear(regex=sprop_regex)
+        self.clear_tags('sys_properties')
 
 
     def clear_menu_backend(self):
         """
             Clears the backend menu's in cache
         """
-        cache = current.cache
+        self.clear_tags('menu_backend')
 
-        menu_regex = 'openstudio_menu_backend_*'
-        cache.ram.clear(regex=menu_regex)
-        cache.disk.clear(regex=menu_regex)
+
+    def clear_auth_permissions(self):
+        """
+            Clears the cached groups & permissions of users
+        """
+        self.clear_tags('auth_permissions')
 
 
     def clear_workshops(self, var_one=None, var_two=None):
@@ -123,11 +467,7 @@ class OsCacheManager:
             Clears the workshops cache
             # accepts two vars to the function can be called from SQLFORM.grid ondelete or crud functions
         """
-        cache = current.cache
-
-        workshops_regex = 'openstudio_workshops_*'
-        cache.ram.clear(regex=workshops_regex)
-        cache.disk.clear(regex=workshops_regex)
+        self.clear_tags('workshops')
 
 
     def clear_school_subscriptions(self, var_one=None, var_two=None):
@@ -135,16 +475,9 @@ class OsCacheManager:
             Clears the school subscriptions cache
             # accepts two vars to the function can be called from SQLFORM.grid ondelete or crud functions
         """
-        cache = current.cache
-
-        school_subscriptions_regex = 'openstudio_school_subcriptions_api_*'
-        cache.ram.clear(regex=school_subscriptions_regex)
-        cache.disk.clear(regex=school_subscriptions_regex)
-
-        # Clear all customer subscriptions, as the cache also stores some school subscription info
-        cu_sub_regex = 'openstudio_customer_get_subscriptions_on_date_*'
-        cache.ram.clear(regex=cu_sub_regex)
-        cache.disk.clear(regex=cu_sub_regex)
+        # Customer subscriptions are also tagged with school_subscriptions,
+        # as the cache also stores some school subscription info
+        self.clear_tags('school_subscriptions')
 
 
     def clear_school_classcards(self, var_one=None, var_two=None):
@@ -152,11 +485,7 @@ class OsCacheManager:
             Clears the school classcards cache
             # accepts two vars to the function can be called from SQLFORM.grid ondelete or crud functions
         """
-        cache = current.cache
-
-        school_classcards_regex = 'openstudio_school_classcards_api_*'
-        cache.ram.clear(regex=school_classcards_regex)
-        cache.disk.clear(regex=school_classcards_regex)
+        self.clear_tags('school_classcards')
 
 
     def clear_school_teachers(self, var_one=None, var_two=None):
@@ -164,32 +493,20 @@ class OsCacheManager:
             Clears the school teachers (API) cache
             # accepts two vars to the function can be called from SQLFORM.grid ondelete or crud functions
         """
-        cache = current.cache
-
-        school_teachers_api_regex = 'openstudio_school_teachers_api_get'
-        cache.ram.clear(regex=school_teachers_api_regex)
-        cache.disk.clear(regex=school_teachers_api_regex)
+        self.clear_tags('school_teachers')
 
 
     def clear_school_classtypes(self, var_one=None, var_two=None):
         """
-            Clears the school teachers (API) cache
+            Clears the school classtypes (API) cache
             # accepts two vars to the function can be called from SQLFORM.grid ondelete or crud functions
         """
-        cache = current.cache
-
-        school_teachers_api_regex = 'openstudio_school_teachers_api_get'
-        cache.ram.clear(regex=school_teachers_api_regex)
-        cache.disk.clear(regex=school_teachers_api_regex)
+        self.clear_tags('school_classtypes')
 
 
     def clear_sys_organizations(self, var_one=None, var_two=None):
         """
-            Clears the workshops cache
+            Clears the organizations cache
             # accepts two vars to the function can be called from SQLFORM.grid ondelete or crud functions
         """
-        cache = current.cache
-
-        sys_org_regex = 'openstudio_sys_organizations*'
-        cache.ram.clear(regex=sys_org_regex)
-        cache.disk.clear(regex=sys_org_regex)
+        self.clear_tags('sys_organizations')
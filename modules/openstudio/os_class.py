@@ -481,13 +481,11 @@ class Class:
         """
         :return: integer ; count of customers attending this class
         """
-        db = current.db
+        from os_classes_attendance_stats import ClassesAttendanceStats
 
-        query = (db.classes_attendance.classes_id == self.clsID) & \
-                (db.classes_attendance.ClassDate == self.date) & \
-                (db.classes_attendance.BookingStatus != 'cancelled')
+        cas = ClassesAttendanceStats()
 
-        return db(query).count()
+        return cas.get_attending(self.clsID, self.date)
 
 
     def get_teachers(self):
@@ -3,6 +3,7 @@
 import datetime
 
 from gluon import *
+from gluon.html import xmlescape
 
 from general_helpers import max_string_length
 from general_helpers import NRtoDay
@@ -20,7 +21,8 @@ class ClassSchedule:
                        filter_starttime_from = None,
                        sorting = 'starttime',
                        trend_medium = None,
-                       trend_high = None):
+                       trend_high = None,
+                       day_rows = None):
 
         self.date = date
 
@@ -35,6 +37,7 @@ class ClassSchedule:
         self.sorting = sorting
         self.trend_medium = trend_medium
         self.trend_high = trend_high
+        self.day_rows = day_rows
 
         self.bookings_open = self._get_bookings_open()
 
@@ -202,9 +205,9 @@ class ClassSchedule:
                         ELSE cla.Maxstudents
                         END AS Maxstudents, 
                    clatt_4w_ago.att_4w,
-                   clatt_4w_nrclasses.att_4w_nrclasses,
+                   clatt_4w_ago.att_4w_nrclasses,
                    clatt_8w_ago.att_8w,
-                   clatt_8w_nrclasses.att_8w_nrclasses
+                   clatt_8w_ago.att_8w_nrclasses
             FROM classes cla
             LEFT JOIN
                 ( SELECT id,
@@ -226,37 +229,25 @@ class ClassSchedule:
                   WHERE ClassDate = '{class_date}' ) cotc
             ON cla.id = cotc.classes_id            
             LEFT JOIN
-                    ( SELECT classes_id, COUNT(*) as att_4w
-                      FROM classes_attendance
-                      WHERE classes_attendance.Classdate <  '{class_date}' AND
-                            classes_attendance.Classdate >= '{one_month_ago}'
+                    ( SELECT classes_id,
+                             SUM(Total) as att_4w,
+                             SUM(CASE WHEN Total > 0 THEN 1 ELSE 0 END) as att_4w_nrclasses
+                      FROM classes_attendance_stats
+                      WHERE ClassDate <  '{class_date}' AND
+                            ClassDate >= '{one_month_ago}'
                       GROUP BY classes_id
                     ) clatt_4w_ago
                     ON clatt_4w_ago.classes_id = cla.id
                 LEFT JOIN
-                    ( SELECT classes_id, COUNT(DISTINCT ClassDate) as att_4w_nrclasses
-                      FROM classes_attendance
-                      WHERE classes_attendance.Classdate <  '{class_date}' AND
-                            classes_attendance.Classdate >= '{one_month_ago}'
-                      GROUP BY classes_id
-                    ) clatt_4w_nrclasses
-                    ON clatt_4w_nrclasses.classes_id = cla.id
-                LEFT JOIN
-                    ( SELECT classes_id, COUNT(*) as att_8w
-                      FROM classes_attendance
-                      WHERE classes_attendance.Classdate <  '{one_month_ago}' AND
-                            classes_attendance.Classdate >= '{two_months_ago}'
+                    ( SELECT classes_id,
+                             SUM(Total) as att_8w,
+                             SUM(CASE WHEN Total > 0 THEN 1 ELSE 0 END) as att_8w_nrclasses
+                      FROM classes_attendance_stats
+                      WHERE ClassDate <  '{one_month_ago}' AND
+                            ClassDate >= '{two_months_ago}'
                       GROUP BY classes_id
                     ) clatt_8w_ago
                     ON clatt_8w_ago.classes_id = cla.id
-                LEFT JOIN
-                    ( SELECT classes_id, COUNT(DISTINCT ClassDate) as att_8w_nrclasses
-                      FROM classes_attendance
-                      WHERE classes_attendance.Classdate <  '{one_month_ago}' AND
-                            classes_attendance.Classdate >= '{two_months_ago}'
-                      GROUP BY classes_id
-                    ) clatt_8w_nrclasses
-                    ON clatt_8w_nrclasses.classes_id = cla.id
             WHERE cla.Week_day = '{week_day}' AND
                   cla.Startdate <= '{class_date}' AND
                   (cla.Enddate >= '{class_date}' OR cla.Enddate IS NULL)
@@ -354,14 +345,19 @@ class ClassSchedule:
         if web2pytest.is_running_under_test(request, request.application):
             data = self._get_day_get_table_class_trend_data()
         else:
+            from os_cache_manager import OsCacheManager
+
             twelve_hours = 12*60*60
-            cache = current.cache
             DATE_FORMAT = current.DATE_FORMAT
             # A key that isn't cleared when schedule changes occur.
             cache_key = 'openstudio_classschedule_trend_get_day_table_' + \
                         self.date.strftime(DATE_FORMAT)
 
-            data = cache.ram(cache_key , lambda: self._get_day_get_table_class_trend_data(), time_expire=twelve_hours)
+            ocm = OsCacheManager()
+            data = ocm.get(cache_key,
+                           lambda: self._get_day_get_table_class_trend_data(),
+                           ['classschedule_trend'],
+                           time_expire=twelve_hours)
 
         return data
 
@@ -628,22 +624,35 @@ class ClassSchedule:
         return available_spaces
 
 
-    def _get_day_rows(self):
+    def _get_range_calendar_query(self, date_start, date_end):
         """
-            Helper function that returns a dict containing a title for the weekday,
-            a date for the class and
-            a SQLFORM.grid for a selected day which is within 1 - 7 (ISO standard).
+            Returns a derived table (as SQL) with a ClassDate and Week_day
+            column for each date in the range
         """
-        date = self.date
-        DATE_FORMAT = current.DATE_FORMAT
-        db = current.db
-        weekday = date.isoweekday()
+        delta = datetime.timedelta(days=1)
 
-        date_formatted = date.strftime(DATE_FORMAT)
+        dates = []
+        date = date_start
+        while date <= date_end:
+            dates.append("SELECT '{class_date}' AS ClassDate, {week_day} AS Week_day".format(
+                class_date=date,
+                week_day=date.isoweekday()))
+            date += delta
+
+        return '( ' + ' UNION ALL '.join(dates) + ' )'
 
-        delta = datetime.timedelta(days=28)
-        one_month_ago = date - delta
-        two_months_ago = one_month_ago - delta
+
+    def _get_range_rows(self, date_start, date_end):
+        """
+            Returns the schedule rows for all dates from date_start up to and
+            including date_end. Overrides, teachers, holidays and attendance &
+            enrollment counts are fetched for the whole range at once and
+            joined on (classes_id, ClassDate), so the number of queries
+            doesn't depend on the number of days.
+            Each row contains the date it applies to in
+            row.classes_schedule_count.ClassDate
+        """
+        db = current.db
 
         if self.sorting == 'location':
             orderby_sql = 'location_name, Starttime'
@@ -678,10 +687,12 @@ class ClassSchedule:
             db.school_holidays.Description,
             db.classes_schedule_count.Attendance,
             db.classes_schedule_count.OnlineBooking,
-            db.classes_schedule_count.Reservations
+            db.classes_schedule_count.Reservations,
+            db.classes_schedule_count.ClassDate
         ]
 
         where_filter = self._get_day_filter_query()
+        calendar = self._get_range_calendar_query(date_start, date_end)
 
         query = """
         SELECT cla.id,
@@ -745,28 +756,19 @@ class ClassSchedule:
                     END AS teacher_role2,
                sho.id,
                sho.Description,
-                /* Count attendance for this class */
-               ( SELECT count(clatt.id) as count_att
-                 FROM classes_attendance clatt
-                 WHERE clatt.classes_id = cla.id AND
-                       clatt.ClassDAte ='{class_date}' AND
-                       clatt.BookingStatus != 'cancelled') AS count_attendance,
+               /* Count attendance for this class */
+               CASE WHEN clatt.count_attendance IS NOT NULL
+                    THEN clatt.count_attendance
+                    ELSE 0
+                    END AS count_attendance,
                /* Count of online bookings for this class */
-               ( SELECT COUNT(clatt.id) as count_atto
-                 FROM classes_attendance clatt
-                 WHERE clatt.classes_id = cla.id AND
-                       clatt.ClassDate = '{class_date}' AND
-                       clatt.BookingStatus != 'cancelled' AND
-                       clatt.online_booking = 'T'
-                 GROUP BY clatt.classes_id ) as count_clatto,
+               clatt.count_online_booking,
                /* Count of enrollments (reservations) for this class */
-               ( SELECT COUNT(clr.id) as count_clr
-                 FROM classes_reservation clr
-                 WHERE clr.classes_id = cla.id AND
-                       (clr.Startdate <= '{class_date}' AND
-                        (clr.Enddate >= '{class_date}' OR clr.Enddate IS NULL))
-                 GROUP BY clr.classes_id ) as count_clr
-        FROM classes cla
+               clr.count_clr,
+               cal.ClassDate
+        FROM {calendar} cal
+        JOIN classes cla
+            ON cla.Week_day = cal.Week_day
         LEFT JOIN
             ( SELECT id,
                      classes_id,
@@ -784,52 +786,150 @@ class ClassSchedule:
                      Maxstudents,
                      MaxOnlinebooking
               FROM classes_otc
-              WHERE ClassDate = '{class_date}' ) cotc
-            ON cla.id = cotc.classes_id
+              WHERE ClassDate >= '{date_start}' AND
+                    ClassDate <= '{date_end}' ) cotc
+            ON cla.id = cotc.classes_id AND
+               cotc.ClassDate = cal.ClassDate
         LEFT JOIN school_locations sl
             ON sl.id = cla.school_locations_id
         LEFT JOIN school_classtypes sct
             ON sct.id = cla.school_classtypes_id
-		LEFT JOIN school_locations slcotc
-			ON slcotc.id = cotc.school_locations_id
+        LEFT JOIN school_locations slcotc
+            ON slcotc.id = cotc.school_locations_id
         LEFT JOIN
             ( SELECT id,
                      classes_id,
+                     Startdate,
+                     Enddate,
                      auth_teacher_id,
                      teacher_role,
                      auth_teacher_id2,
                      teacher_role2
               FROM classes_teachers
-              WHERE Startdate <= '{class_date}' AND (
-                    Enddate >= '{class_date}' OR Enddate IS NULL)
+              WHERE Startdate <= '{date_end}' AND (
+                    Enddate >= '{date_start}' OR Enddate IS NULL)
               ) clt
-            ON clt.classes_id = cla.id
+            ON clt.classes_id = cla.id AND
+               clt.Startdate <= cal.ClassDate AND
+               (clt.Enddate >= cal.ClassDate OR clt.Enddate IS NULL)
         LEFT JOIN
-            ( SELECT sh.id, sh.Description, shl.school_locations_id
+            ( SELECT sh.id,
+                     sh.Description,
+                     sh.Startdate,
+                     sh.Enddate,
+                     shl.school_locations_id
               FROM school_holidays sh
               LEFT JOIN
                 school_holidays_locations shl
                 ON shl.school_holidays_id = sh.id
-              WHERE sh.Startdate <= '{class_date}' AND
-                    sh.Enddate >= '{class_date}') sho
-            ON sho.school_locations_id = cla.school_locations_id
-        WHERE cla.Week_day = '{week_day}' AND
-              cla.Startdate <= '{class_date}' AND
-              (cla.Enddate >= '{class_date}' OR cla.Enddate IS NULL)
+              WHERE sh.Startdate <= '{date_end}' AND
+                    sh.Enddate >= '{date_start}') sho
+            ON sho.school_locations_id = cla.school_locations_id AND
+               sho.Startdate <= cal.ClassDate AND
+               sho.Enddate >= cal.ClassDate
+        LEFT JOIN
+            ( SELECT classes_id,
+                     ClassDate,
+                     Attending AS count_attendance,
+                     OnlineBooking AS count_online_booking
+              FROM classes_attendance_stats
+              WHERE ClassDate >= '{date_start}' AND
+                    ClassDate <= '{date_end}' ) clatt
+            ON clatt.classes_id = cla.id AND
+               clatt.ClassDate = cal.ClassDate
+        LEFT JOIN
+            ( SELECT clrcal.ClassDate,
+                     clr.classes_id,
+                     COUNT(clr.id) AS count_clr
+              FROM classes_reservation clr
+              JOIN {calendar} clrcal
+                ON clr.Startdate <= clrcal.ClassDate AND
+                   (clr.Enddate >= clrcal.ClassDate OR clr.Enddate IS NULL)
+              WHERE clr.Startdate <= '{date_end}' AND
+                    (clr.Enddate >= '{date_start}' OR clr.Enddate IS NULL)
+              GROUP BY clrcal.ClassDate, clr.classes_id ) clr
+            ON clr.classes_id = cla.id AND
+               clr.ClassDate = cal.ClassDate
+        WHERE cla.Startdate <= cal.ClassDate AND
+              (cla.Enddate >= cal.ClassDate OR cla.Enddate IS NULL)
               {where_filter}
-        ORDER BY {orderby_sql}
-        """.format(class_date = date,
-                   week_day = weekday,
+        ORDER BY cal.ClassDate, {orderby_sql}
+        """.format(calendar = calendar,
+                   date_start = date_start,
+                   date_end = date_end,
                    orderby_sql = orderby_sql,
-                   where_filter = where_filter,
-                   one_month_ago = one_month_ago,
-                   two_months_ago = two_months_ago)
+                   where_filter = where_filter)
 
         rows = db.executesql(query, fields=fields)
 
         return rows
 
 
+    def get_range_rows(self, date_start, date_end):
+        """
+            Get schedule rows for a range of dates using a single query
+            :param date_start: datetime.date
+            :param date_end: datetime.date
+            :return: dict {datetime.date: gluon.dal.Rows}
+        """
+        rows = self._get_range_rows(date_start, date_end)
+
+        range_rows = {}
+        delta = datetime.timedelta(days=1)
+        date = date_start
+        while date <= date_end:
+            range_rows[date] = rows.find(
+                lambda row, date=date: row.classes_schedule_count.ClassDate == date
+            )
+            date += delta
+
+        return range_rows
+
+
+    def get_range_list(self, date_start, date_end):
+        """
+            Format rows for a range of dates as list
+            :param date_start: datetime.date
+            :param date_end: datetime.date
+            :return: [ {'date': datetime.date, 'classes': get_day_list()} ]
+        """
+        range_rows = self.get_range_rows(date_start, date_end)
+
+        schedule = []
+        delta = datetime.timedelta(days=1)
+        date = date_start
+        while date <= date_end:
+            class_schedule = ClassSchedule(
+                date,
+                filter_id_sys_organization = self.filter_id_sys_organization,
+                filter_id_school_classtype = self.filter_id_school_classtype,
+                filter_id_school_location = self.filter_id_school_location,
+                filter_id_school_level = self.filter_id_school_level,
+                filter_id_teacher = self.filter_id_teacher,
+                filter_id_status = self.filter_id_status,
+                filter_public = self.filter_public,
+                filter_starttime_from = self.filter_starttime_from,
+                sorting = self.sorting,
+                day_rows = range_rows[date]
+            )
+
+            schedule.append({
+                'classes': class_schedule.get_day_list(),
+                'date': date
+            })
+
+            date += delta
+
+        return schedule
+
+
+    def _get_day_rows(self):
+        """
+            Helper function that returns the schedule rows for self.date
+        """
+        return self._get_range_rows(self.date, self.date)
+
+
     def get_day_rows(self):
         """
             Get day rows with caching 
@@ -847,16 +947,148 @@ class ClassSchedule:
         #     cache_key = 'openstudio_classschedule_get_day_rows_' + self.date.strftime(DATE_FORMAT)
         #     rows = cache.ram(cache_key , lambda: self._get_day_rows(), time_expire=CACHE_LONG)
 
+        # Rows might have been fetched for a range of dates already
+        if self.day_rows is not None:
+            return self.day_rows
+
         rows = self._get_day_rows()
 
         return rows
 
 
+    def _get_day_table_get_lookups(self):
+        """
+            :return: dict of dicts to look up names by id, built once for
+            all rows instead of rendering each row
+        """
+        globalenv = current.globalenv
+        ORGANIZATIONS = globalenv['ORGANIZATIONS']
+
+        organizations = {}
+        for key, organization in ORGANIZATIONS.iteritems():
+            if key != 'default':
+                organizations[key] = organization['Name']
+
+        return dict(
+            locations=globalenv['locations_dict'].copy(),
+            classtypes=globalenv['classtypes_dict'].copy(),
+            levels=globalenv['levels_dict'].copy(),
+            teachers=globalenv['teachers_dict'].copy(),
+            organizations=organizations
+        )
+
+
+    def _get_day_table_get_templates(self, date_formatted, permissions):
+        """
+            Buttons and links are the same for each class, apart from the
+            class id and a few values. They're rendered once with
+            placeholders, which are replaced for each class.
+            :return: dict of xml strings and translated labels
+        """
+        os_gui = current.globalenv['os_gui']
+        auth = current.auth
+        T = current.T
+
+        clsID = '__clsID__'
+        vars = {'clsID': clsID,
+                'date': date_formatted}
+
+        buttons = self._get_day_get_table_get_buttons(clsID, date_formatted, permissions)
+
+        reservations = DIV()
+        if permissions.get('classes_attendance', False):
+            reservations.append(
+                A(SPAN(T('Bookings'), ' ', SPAN('__attendance__', '/', '__maxstudents__')),
+                  _href=URL('attendance', vars=vars),
+                  _class='__link_class__'))
+
+        holiday = SPAN(SPAN(_class=os_gui.get_icon('education') + ' grey'), ' ',
+                       T('Holiday'), ' (',
+                       A('__description__',
+                         _href=URL('schedule', 'holiday_edit',
+                                   vars={'shID': '__shID__'})),
+                       ')')
+
+        edited = ''
+        if auth.has_membership(group_id='Admins') or \
+           auth.has_permission('update', 'classes_otc'):
+            edited = A(SPAN(SPAN(_class=os_gui.get_icon('pencil') + ' grey'), ' ', T('Edited')),
+                       _href=URL('class_edit_on_date', vars=vars)).xml()
+
+        return dict(
+            buttons=buttons.xml(),
+            reservations=reservations.xml(),
+            holiday=holiday.xml(),
+            edited=edited,
+            subteacher=xmlescape(T('Subteacher')),
+            cancelled=xmlescape(T('Cancelled')),
+            open=xmlescape(T('Open')),
+            no_location=T("No location"),
+            no_classtype=T("No classtype"),
+            no_level=T("No level"),
+            teacher_role_titles={1: T('Sub teacher'),
+                                 2: T("Assistant"),
+                                 3: T('Karma teacher')}
+        )
+
+
+    def _get_day_table_get_teacher(self, name, role, templates):
+        """
+            :return: teacher name with a label for the role applied
+        """
+        os_gui = current.globalenv['os_gui']
+
+        if role == 1:
+            return SPAN(os_gui.get_os_label('blue', name),
+                        _title=templates['teacher_role_titles'][1])
+        elif role == 2:
+            return SPAN(os_gui.get_os_label('yellow', name),
+                        _title=templates['teacher_role_titles'][2])
+        elif role == 3:
+            return SPAN(os_gui.get_os_label('purple', name),
+                        _title=templates['teacher_role_titles'][3])
+
+        return name
+
+
+    def _get_day_table_get_class_messages_xml(self, row, templates):
+        """
+            Returns messages for a class, using the templates from
+            _get_day_table_get_templates
+        """
+        class_messages = []
+
+        if row.school_holidays.Description:
+            class_messages.append(
+                templates['holiday'].replace(
+                    '__shID__', unicode(row.school_holidays.id)).replace(
+                    '__description__', xmlescape(row.school_holidays.Description)))
+
+        if row.classes_teachers.teacher_role == 1:
+            class_messages.append(templates['subteacher'])
+
+        if row.classes_otc.Status == 'cancelled':
+            class_messages.append(templates['cancelled'])
+
+        if row.classes_otc.Status == 'open':
+            class_messages.append(templates['open'])
+
+        if row.classes_otc.id and templates['edited']:
+            class_messages.append(
+                templates['edited'].replace('__clsID__', unicode(row.classes.id)))
+
+            if row.classes_otc.Description:
+                class_messages.append(xmlescape(row.classes_otc.Description))
+
+        return XML('<span>' + ' | '.join(class_messages) + '</span>')
+
+
     def _get_day_table(self):
         """
             Returns table for today
+            Names are looked up in dicts built once and buttons and links are
+            filled in from templates, so the cost of each class is low.
         """
-        os_gui = current.globalenv['os_gui']
         DATE_FORMAT = current.DATE_FORMAT
         ORGANIZATIONS = current.globalenv['ORGANIZATIONS']
         T = current.T
@@ -883,23 +1115,34 @@ class ClassSchedule:
             trend_data = self._get_day_get_table_class_trend()
             get_trend_data = trend_data.get
 
+            button_permissions = self._get_day_get_table_get_permissions()
+            templates = self._get_day_table_get_templates(date_formatted,
+                                                          button_permissions)
+            lookups = self._get_day_table_get_lookups()
+
             # avoiding some dots in the loop
             get_status = self._get_day_row_status
-            get_teacher_roles = self._get_day_row_teacher_roles
-            get_buttons = self._get_day_get_table_get_buttons
-            get_reservations = self._get_day_get_table_get_reservations
-            get_class_messages = self._get_day_table_get_class_messages
-
-            button_permissions = self._get_day_get_table_get_permissions()
+            get_teacher = self._get_day_table_get_teacher
+            get_class_messages = self._get_day_table_get_class_messages_xml
+            get_location = lookups['locations'].get
+            get_classtype = lookups['classtypes'].get
+            get_level = lookups['levels'].get
+            get_teacher_name = lookups['teachers'].get
+            get_organization = lookups['organizations'].get
+            template_buttons = templates['buttons']
+            template_reservations = templates['reservations']
+            no_location = templates['no_location']
+            no_classtype = templates['no_classtype']
+            no_level = templates['no_level']
 
             multiple_organizations = len(ORGANIZATIONS) > 1
             filter_id_status = self.filter_id_status
             msg_no_teacher = SPAN(T('No teacher'), _class='red')
 
             # Generate list of classes
-            for i, row in enumerate(rows):
-                repr_row = list(rows[i:i+1].render())[0]
+            for row in rows:
                 clsID = row.classes.id
+                str_clsID = unicode(clsID)
 
                 status_result = get_status(row)
                 status = status_result['status']
@@ -908,35 +1151,50 @@ class ClassSchedule:
                 if filter_id_status and status != filter_id_status:
                     continue
 
-                result = get_teacher_roles(row, repr_row)
-                teacher = result['teacher_role']
-                teacher2 = result['teacher_role2']
+                teacher = get_teacher(get_teacher_name(row.classes_teachers.auth_teacher_id),
+                                      row.classes_teachers.teacher_role,
+                                      templates)
+                teacher2 = get_teacher(get_teacher_name(row.classes_teachers.auth_teacher_id2),
+                                       row.classes_teachers.teacher_role2,
+                                       templates)
 
                 api = INPUT(value=row.classes.AllowAPI,
                             _type='checkbox',
                             _value='api',
                             _disabled='disabled')
 
-                trend = get_trend_data(row.classes.id, '')
-                buttons = get_buttons(clsID, date_formatted, button_permissions)
-                reservations = get_reservations(clsID, date_formatted, row, button_permissions)
-                class_messages = get_class_messages(row, clsID, date_formatted)
+                trend = get_trend_data(clsID, '')
+                buttons = XML(template_buttons.replace('__clsID__', str_clsID))
+
+                attendance = row.classes_schedule_count.Attendance or 0
+                maxstudents = row.classes.Maxstudents
+                reservations = XML(template_reservations.replace(
+                    '__clsID__', str_clsID).replace(
+                    '__attendance__', unicode(attendance)).replace(
+                    '__maxstudents__', unicode(maxstudents)).replace(
+                    '__link_class__', 'red' if attendance > maxstudents else ''))
+
+                class_messages = get_class_messages(row, templates)
 
                 if multiple_organizations:
-                    organization = DIV(repr_row.classes.sys_organizations_id or '',
+                    organization = DIV(get_organization(row.classes.sys_organizations_id, ''),
                                        _class='small_font grey pull-right btn-margin')
                 else:
                     organization = ''
 
+                starttime = row.classes.Starttime
+                endtime = row.classes.Endtime
+
                 row_class = TR(
                     TD(status_marker),
-                    TD(max_string_length(repr_row.classes.school_locations_id, 16)),
-                    TD(max_string_length(repr_row.classes.school_classtypes_id, 24)),
-                    TD(SPAN(repr_row.classes.Starttime, ' - ', repr_row.classes.Endtime)),
+                    TD(max_string_length(get_location(row.classes.school_locations_id, no_location), 16)),
+                    TD(max_string_length(get_classtype(row.classes.school_classtypes_id, no_classtype), 24)),
+                    TD(SPAN(starttime.strftime('%H:%M') if starttime else '', ' - ',
+                            endtime.strftime('%H:%M') if endtime else '')),
                     TD(teacher if (not status == 'open' and
                                    not row.classes_teachers.auth_teacher_id is None) \
                                else msg_no_teacher),
-                    TD(max_string_length(repr_row.classes.school_levels_id, 12)),
+                    TD(max_string_length(get_level(row.classes.school_levels_id, no_level), 12)),
                     TD(api),
                     TD(trend),
                     TD(buttons),
@@ -951,7 +1209,7 @@ class ClassSchedule:
                            _class='os-schedule_links')),
                     TD(organization),
                     _class='os-schedule_links',
-                    _id='class_' + unicode(clsID))
+                    _id='class_' + str_clsID)
 
                 table.append(row_class)
                 table.append(row_tools)
@@ -973,7 +1231,8 @@ class ClassSchedule:
         if web2pytest.is_running_under_test(request, request.application):
             rows = self._get_day_table()
         else:
-            cache = current.cache
+            from os_cache_manager import OsCacheManager
+
             DATE_FORMAT = current.DATE_FORMAT
             CACHE_LONG = current.globalenv['CACHE_LONG']
             cache_key = 'openstudio_classschedule_get_day_table_' + \
@@ -989,7 +1248,14 @@ class ClassSchedule:
                         unicode(self.trend_medium) + '_' + \
                         unicode(self.trend_high)
 
-            rows = cache.ram(cache_key , lambda: self._get_day_table(), time_expire=CACHE_LONG)
+            date_tag = 'classschedule:' + self.date.strftime(DATE_FORMAT)
+            tags = ['classschedule', date_tag]
+
+            # Only index the key under the date tag, clearing classschedule
+            # invalidates it through its generation
+            ocm = OsCacheManager()
+            rows = ocm.get(cache_key, lambda: self._get_day_table(), tags,
+                           time_expire=CACHE_LONG, index_tags=[date_tag])
 
         return rows
 
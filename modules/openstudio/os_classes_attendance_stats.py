@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+from gluon import *
+
+
+class ClassesAttendanceStats:
+    """
+        Class to maintain & query db.classes_attendance_stats, which holds
+        attendance counts for each class on each date
+    """
+    def _get_stats_counts_sql(self):
+        """
+            Returns sql for the columns of classes_attendance_stats,
+            to be used when selecting from classes_attendance
+        """
+        return """
+            SUM(CASE WHEN BookingStatus != 'cancelled' THEN 1 ELSE 0 END),
+            SUM(CASE WHEN BookingStatus != 'cancelled' AND online_booking = 'T'
+                     THEN 1 ELSE 0 END),
+            COUNT(id)
+        """
+
+
+    def refresh(self, classes_dates):
+        """
+            Recount attendance for classes on dates
+            :param classes_dates: list of tuples (db.classes.id, ClassDate)
+            :return: None
+        """
+        db = current.db
+
+        done = []
+        for clsID, date in classes_dates:
+            if not clsID or not date:
+                continue
+
+            key = (int(clsID), unicode(date))
+            if key in done:
+                continue
+            done.append(key)
+
+            query = """
+                SELECT {counts}
+                FROM classes_attendance
+                WHERE classes_id = {clsID} AND
+                      ClassDate = '{date}'
+            """.format(counts=self._get_stats_counts_sql(),
+                       clsID=key[0],
+                       date=key[1])
+
+            attending, online_booking, total = db.executesql(query)[0]
+
+            self._set_counts(key[0], key[1], dict(
+                Attending = attending or 0,
+                OnlineBooking = online_booking or 0,
+                Total = total or 0
+            ))
+
+
+    def _set_counts(self, clsID, date, counts):
+        """
+            Update the stats of a class on a date, or insert them when there
+            are none yet. The unique index on (ClassDate, classes_id) stops
+            bookings at the same time from both inserting a row; the one that
+            loses updates the row inserted by the other.
+            :param clsID: db.classes.id
+            :param date: string - ClassDate
+            :param counts: dict - values for the count columns
+            :return: None
+        """
+        db = current.db
+
+        stats_query = (db.classes_attendance_stats.classes_id == clsID) & \
+                      (db.classes_attendance_stats.ClassDate == date)
+        if db(stats_query).update(**counts):
+            return
+
+        try:
+            db.classes_attendance_stats.insert(
+                classes_id = clsID,
+                ClassDate = date,
+                **counts
+            )
+        except db._adapter.driver.IntegrityError:
+            db(stats_query).update(**counts)
+
+
+    def rebuild(self, date_start=None, date_end=None):
+        """
+            Recount all attendance from db.classes_attendance
+            :param date_start: datetime.date, None for no limit
+            :param date_end: datetime.date, None for no limit
+            :return: None
+        """
+        db = current.db
+
+        where = 'WHERE 1 = 1'
+        if date_start:
+            where += " AND ClassDate >= '{date}'".format(date=date_start)
+        if date_end:
+            where += " AND ClassDate <= '{date}'".format(date=date_end)
+
+        db.executesql("DELETE FROM classes_attendance_stats {where}".format(where=where))
+
+        query = """
+            INSERT INTO classes_attendance_stats
+                ( classes_id, ClassDate, Attending, OnlineBooking, Total )
+            SELECT classes_id,
+                   ClassDate,
+                   {counts}
+            FROM classes_attendance
+            {where}
+            GROUP BY classes_id, ClassDate
+        """.format(counts=self._get_stats_counts_sql(),
+                   where=where)
+
+        db.executesql(query)
+
+
+    def get_attending(self, clsID, date):
+        """
+        :param clsID: db.classes.id
+        :param date: datetime.date
+        :return: int - number of customers attending (not cancelled) a class on date
+        """
+        db = current.db
+
+        row = db.classes_attendance_stats(classes_id=clsID, ClassDate=date)
+
+        if not row:
+            return 0
+
+        return row.Attending or 0
@@ -29,20 +29,22 @@ class Customer:
         """
         Functions to be called when creating a customer
         """
-        from os_exact_online import OSExactOnline
+        from os_exact_online_queue import OSExactOnlineQueue
 
-        os_eo = OSExactOnline()
-        os_eo.create_relation(self)
+        eo_queue = OSExactOnlineQueue()
+        if eo_queue.is_authorized():
+            eo_queue.add('relation', self.cuID, 'create')
 
 
     def on_update(self):
         """
         Functions to be called when updating a customer
         """
-        from os_exact_online import OSExactOnline
+        from os_exact_online_queue import OSExactOnlineQueue
 
-        os_eo = OSExactOnline()
-        os_eo.update_relation(self)
+        eo_queue = OSExactOnlineQueue()
+        if eo_queue.is_authorized():
+            eo_queue.add('relation', self.cuID, 'update')
 
 
     def get_name(self):
@@ -167,14 +169,7 @@ class Customer:
                         ssu.ReconciliationClasses,
                         ssu.Unlimited,
                         ssu.school_memberships_id,
-(IFNULL(( SELECT SUM(csc.MutationAmount)
- FROM customers_subscriptions_credits csc
- WHERE csc.customers_subscriptions_id = cs.id AND
-	   csc.MutationType = 'add'), 0) -
-IFNULL(( SELECT SUM(csc.MutationAmount)
- FROM customers_subscriptions_credits csc
- WHERE csc.customers_subscriptions_id = cs.id AND
-	   csc.MutationType = 'sub'), 0)) AS credits
+                        IFNULL(cs.CreditsBalance, 0) AS credits
 FROM customers_subscriptions cs
 LEFT JOIN
 school_subscriptions ssu ON cs.school_subscriptions_id = ssu.id
@@ -205,13 +200,21 @@ ORDER BY cs.Startdate""".format(cuID=self.cuID, date=date)
         if web2pytest.is_running_under_test(request, request.application) or not from_cache:
             rows = self._get_subscriptions_on_date(date)
         else:
-            cache = current.cache
+            from os_cache_manager import OsCacheManager
+
             DATE_FORMAT = current.DATE_FORMAT
             CACHE_LONG = current.globalenv['CACHE_LONG']
             cache_key = 'openstudio_customer_get_subscriptions_on_date_' + \
                         str(self.cuID) + '_' + \
                         date.strftime(DATE_FORMAT)
-            rows = cache.ram(cache_key , lambda: self._get_subscriptions_on_date(date), time_expire=CACHE_LONG)
+            customer_tag = 'customer:' + unicode(self.cuID) + ':subscriptions'
+            tags = [customer_tag, 'school_subscriptions']
+
+            # Only index the key under the customer tag, clearing
+            # school_subscriptions invalidates it through its generation
+            ocm = OsCacheManager()
+            rows = ocm.get(cache_key, lambda: self._get_subscriptions_on_date(date), tags,
+                           time_expire=CACHE_LONG, index_tags=[customer_tag])
 
         return rows
 
@@ -346,13 +349,17 @@ ORDER BY cs.Startdate""".format(cuID=self.cuID, date=date)
         if web2pytest.is_running_under_test(request, request.application) or not from_cache:
             rows = self._get_memberships_on_date(date)
         else:
-            cache = current.cache
+            from os_cache_manager import OsCacheManager
+
             DATE_FORMAT = current.DATE_FORMAT
             CACHE_LONG = current.globalenv['CACHE_LONG']
             cache_key = 'openstudio_customer_get_memberships_on_date_' + \
                         str(self.cuID) + '_' + \
                         date.strftime(DATE_FORMAT)
-            rows = cache.ram(cache_key, lambda: self._get_memberships_on_date(date), time_expire=CACHE_LONG)
+            tags = ['customer:' + unicode(self.cuID) + ':memberships']
+
+            ocm = OsCacheManager()
+            rows = ocm.get(cache_key, lambda: self._get_memberships_on_date(date), tags, time_expire=CACHE_LONG)
 
         return rows
 
@@ -415,13 +422,17 @@ ORDER BY cs.Startdate""".format(cuID=self.cuID, date=date)
         if web2pytest.is_running_under_test(request, request.application) or not from_cache:
             rows = self._get_classcards(date)
         else:
-            cache = current.cache
+            from os_cache_manager import OsCacheManager
+
             DATE_FORMAT = current.DATE_FORMAT
             CACHE_LONG = current.globalenv['CACHE_LONG']
             cache_key = 'openstudio_customer_get_classcards_' + \
                         str(self.cuID) + '_' + \
                         date.strftime(DATE_FORMAT)
-            rows = cache.ram(cache_key , lambda: self._get_classcards(date), time_expire=CACHE_LONG)
+            tags = ['customer:' + unicode(self.cuID) + ':classcards']
+
+            ocm = OsCacheManager()
+            rows = ocm.get(cache_key, lambda: self._get_classcards(date), tags, time_expire=CACHE_LONG)
 
         return rows
 
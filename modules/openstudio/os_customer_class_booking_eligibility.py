@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+
+from gluon import *
+
+
+class CustomerClassBookingEligibility:
+    """
+        Answers which subscriptions, class cards and other options a customer
+        can use to book classes in a period.
+        Everything needed is loaded once, so getting the booking options for
+        many classes costs a constant number of queries.
+    """
+    def __init__(self, customer, date_start, date_end=None, class_ids=None):
+        """
+        :param customer: os_customer.Customer object
+        :param date_start: datetime.date
+        :param date_end: datetime.date, same as date_start when None
+        :param class_ids: list of db.classes.id to load prices for, prices for
+        other classes are loaded when options are requested for them
+        """
+        self.customer = customer
+        self.cuID = customer.row.id
+        self.date_start = date_start
+        self.date_end = date_end or date_start
+
+        self.subscriptions = self._get_subscriptions()
+        self.classcards = self._get_classcards()
+        self.classcards_used = self._get_classcards_used()
+        self.memberships = self._get_memberships()
+
+        self.subscriptions_permissions = self._get_subscriptions_permissions()
+        self.classcards_permissions = self._get_classcards_permissions()
+
+        self.prices = {}
+        if class_ids:
+            self._load_prices(class_ids)
+
+
+    def _is_valid_on_date(self, startdate, enddate, date):
+        """
+        :return: Boolean - True when date is between startdate and enddate (or no enddate)
+        """
+        return startdate <= date and (enddate is None or enddate >= date)
+
+
+    def _get_subscriptions(self):
+        """
+        :return: subscriptions for customer in period, with the same fields as
+        Customer.get_subscriptions_on_date
+        """
+        db = current.db
+
+        fields = [
+            db.customers_subscriptions.id,
+            db.customers_subscriptions.auth_customer_id,
+            db.customers_subscriptions.Startdate,
+            db.customers_subscriptions.Enddate,
+            db.customers_subscriptions.payment_methods_id,
+            db.customers_subscriptions.Note,
+            db.school_subscriptions.id,
+            db.school_subscriptions.Name,
+            db.school_subscriptions.ReconciliationClasses,
+            db.school_subscriptions.Unlimited,
+            db.school_subscriptions.school_memberships_id,
+            db.customers_subscriptions.CreditsRemaining,
+        ]
+
+        sql = """SELECT cs.id,
+                        cs.auth_customer_id,
+                        cs.Startdate,
+                        cs.Enddate,
+                        cs.payment_methods_id,
+                        cs.Note,
+                        ssu.id,
+                        ssu.Name,
+                        ssu.ReconciliationClasses,
+                        ssu.Unlimited,
+                        ssu.school_memberships_id,
+                        IFNULL(cs.CreditsBalance, 0) AS credits
+FROM customers_subscriptions cs
+LEFT JOIN
+school_subscriptions ssu ON cs.school_subscriptions_id = ssu.id
+WHERE cs.auth_customer_id = {cuID} AND
+(cs.Startdate <= '{date_end}' AND (cs.Enddate >= '{date_start}' OR cs.Enddate IS NULL))
+ORDER BY cs.Startdate""".format(cuID=self.cuID,
+                                date_start=self.date_start,
+                                date_end=self.date_end)
+
+        return db.executesql(sql, fields=fields)
+
+
+    def _get_classcards(self):
+        """
+        :return: class cards for customer in period, with the same fields as
+        Customer.get_classcards
+        """
+        db = current.db
+
+        left = [ db.school_classcards.on(
+            db.customers_classcards.school_classcards_id==\
+            db.school_classcards.id)]
+        query = (db.customers_classcards.auth_customer_id == self.cuID) & \
+                (db.customers_classcards.Startdate <= self.date_end) & \
+                ((db.customers_classcards.Enddate >= self.date_start) |
+                 (db.customers_classcards.Enddate == None)) & \
+                ((db.school_classcards.Classes > db.customers_classcards.ClassesTaken) |
+                 (db.school_classcards.Classes == 0) |
+                 (db.school_classcards.Unlimited == True))
+
+        return db(query).select(db.customers_classcards.ALL,
+                                db.school_classcards.Name,
+                                db.school_classcards.Classes,
+                                db.school_classcards.Unlimited,
+                                db.school_classcards.school_memberships_id,
+                                left=left,
+                                orderby=db.customers_classcards.Enddate)
+
+
+    def _get_classcards_used(self):
+        """
+        :return: dict {db.customers_classcards.id: number of classes taken}
+        """
+        db = current.db
+
+        ccd_ids = [ row.customers_classcards.id for row in self.classcards ]
+        if not ccd_ids:
+            return {}
+
+        count = db.classes_attendance.id.count()
+        query = (db.classes_attendance.customers_classcards_id.belongs(ccd_ids)) & \
+                (db.classes_attendance.BookingStatus != 'cancelled')
+        rows = db(query).select(db.classes_attendance.customers_classcards_id,
+                                count,
+                                groupby=db.classes_attendance.customers_classcards_id)
+
+        used = {}
+        for row in rows:
+            used[row.classes_attendance.customers_classcards_id] = row[count]
+
+        return used
+
+
+    def _get_memberships(self):
+        """
+        :return: db.customers_memberships rows for customer in period
+        """
+        db = current.db
+
+        query = (db.customers_memberships.auth_customer_id == self.cuID) & \
+                (db.customers_memberships.Startdate <= self.date_end) & \
+                ((db.customers_memberships.Enddate >= self.date_start) |
+                 (db.customers_memberships.Enddate == None))
+
+        return db(query).select(db.customers_memberships.Startdate,
+                                db.customers_memberships.Enddate)
+
+
+    def _get_permissions(self, rows, group_item_field, permissions_table):
+        """
+        :param rows: rows containing permissions joined with groups & classes
+        :param group_item_field: field in group table linking to subscription or card
+        :param permissions_table: classes_school_subscriptions_groups or classes_school_classcards_groups
+        :return: dict {item id: {clsID: {'Enroll': True, 'ShopBook': True, 'Attend': True, 'AllowAPI': Boolean}}}
+        """
+        permissions = {}
+        for row in rows:
+            item_id = row[group_item_field]
+            clsID = row[permissions_table.classes_id]
+
+            item_permissions = permissions.setdefault(item_id, {})
+            class_permissions = item_permissions.setdefault(clsID, {})
+
+            for permission in ['Enroll', 'ShopBook', 'Attend']:
+                if row[permissions_table[permission]]:
+                    class_permissions[permission] = True
+
+            class_permissions['AllowAPI'] = row.classes.AllowAPI
+
+        return permissions
+
+
+    def _get_subscriptions_permissions(self):
+        """
+        :return: class permissions for the subscriptions of this customer in the period
+        """
+        db = current.db
+
+        ssu_ids = [ row.school_subscriptions.id for row in self.subscriptions ]
+        if not ssu_ids:
+            return {}
+
+        left = [
+            db.classes_school_subscriptions_groups.on(
+                db.classes_school_subscriptions_groups.school_subscriptions_groups_id ==
+                db.school_subscriptions_groups_subscriptions.school_subscriptions_groups_id),
+            db.classes.on(db.classes_school_subscriptions_groups.classes_id == db.classes.id)
+        ]
+        query = (db.school_subscriptions_groups_subscriptions.school_subscriptions_id.belongs(ssu_ids)) & \
+                (db.classes_school_subscriptions_groups.id != None)
+        rows = db(query).select(db.school_subscriptions_groups_subscriptions.school_subscriptions_id,
+                                db.classes_school_subscriptions_groups.ALL,
+                                db.classes.AllowAPI,
+                                left=left)
+
+        return self._get_permissions(
+            rows,
+            db.school_subscriptions_groups_subscriptions.school_subscriptions_id,
+            db.classes_school_subscriptions_groups
+        )
+
+
+    def _get_classcards_permissions(self):
+        """
+        :return: class permissions for the class cards of this customer in the period
+        """
+        db = current.db
+
+        scd_ids = [ row.customers_classcards.school_classcards_id for row in self.classcards ]
+        if not scd_ids:
+            return {}
+
+        left = [
+            db.classes_school_classcards_groups.on(
+                db.classes_school_classcards_groups.school_classcards_groups_id ==
+                db.school_classcards_groups_classcards.school_classcards_groups_id),
+            db.classes.on(db.classes_school_classcards_groups.classes_id == db.classes.id)
+        ]
+        query = (db.school_classcards_groups_classcards.school_classcards_id.belongs(scd_ids)) & \
+                (db.classes_school_classcards_groups.id != None)
+        rows = db(query).select(db.school_classcards_groups_classcards.school_classcards_id,
+                                db.classes_school_classcards_groups.ALL,
+                                db.classes.AllowAPI,
+                                left=left)
+
+        return self._get_permissions(
+            rows,
+            db.school_classcards_groups_classcards.school_classcards_id,
+            db.classes_school_classcards_groups
+        )
+
+
+    def _load_prices(self, class_ids):
+        """
+        Load class prices valid in the period for classes
+        :param class_ids: list of db.classes.id
+        :return: None
+        """
+        db = current.db
+
+        class_ids = [ int(clsID) for clsID in class_ids ]
+        for clsID in class_ids:
+            self.prices.setdefault(clsID, [])
+
+        query = (db.classes_price.classes_id.belongs(class_ids)) & \
+                (db.classes_price.Startdate <= self.date_end) & \
+                ((db.classes_price.Enddate >= self.date_start) |
+                 (db.classes_price.Enddate == None))
+        rows = db(query).select(db.classes_price.classes_id,
+                                db.classes_price.Startdate,
+                                db.classes_price.Enddate,
+                                db.classes_price.Dropin,
+                                db.classes_price.Trial,
+                                db.classes_price.DropinMembership,
+                                db.classes_price.TrialMembership,
+                                orderby=db.classes_price.Startdate)
+
+        for row in rows:
+            self.prices[row.classes_id].append(row)
+
+
+    def get_prices(self, clsID, date):
+        """
+        :param clsID: db.classes.id
+        :param date: datetime.date
+        :return: dict with dropin, trial, dropin_membership & trial_membership
+        prices, like Class.get_prices
+        """
+        clsID = int(clsID)
+        if clsID not in self.prices:
+            self._load_prices([clsID])
+
+        for row in self.prices[clsID]:
+            if self._is_valid_on_date(row.Startdate, row.Enddate, date):
+                return dict(
+                    dropin = row.Dropin or 0,
+                    trial = row.Trial or 0,
+                    dropin_membership = row.DropinMembership or 0,
+                    trial_membership = row.TrialMembership or 0
+                )
+
+        return dict(dropin=0, trial=0, dropin_membership=0, trial_membership=0)
+
+
+    def has_membership_on_date(self, date):
+        """
+        :param date: datetime.date
+        :return: Boolean
+        """
+        for row in self.memberships:
+            if self._is_valid_on_date(row.Startdate, row.Enddate, date):
+                return True
+
+        return False
+
+
+    def _is_allowed(self, permissions, clsID, list_type):
+        """
+        :param permissions: dict {clsID: {permission: True}}
+        :param clsID: int - db.classes.id
+        :param list_type: should be in ["shop", "attendance", "selfcheckin"]
+        :return: Boolean
+        """
+        class_permissions = permissions.get(clsID, {})
+
+        if list_type == 'shop':
+            return bool(class_permissions.get('ShopBook') and class_permissions.get('AllowAPI'))
+
+        return bool(class_permissions.get('Attend'))
+
+
+    def get_subscription_options(self, clsID, date, list_type='shop'):
+        """
+        :param clsID: db.classes.id
+        :param date: datetime.date
+        :param list_type: should be in ["shop", "attendance", "selfcheckin"]
+        :return: list of subscription booking options
+        """
+        options = []
+        for subscription in self.subscriptions:
+            if not self._is_valid_on_date(subscription.customers_subscriptions.Startdate,
+                                          subscription.customers_subscriptions.Enddate,
+                                          date):
+                continue
+
+            csID = subscription.customers_subscriptions.id
+            credits = subscription.customers_subscriptions.CreditsRemaining or 0
+            recon_classes = subscription.school_subscriptions.ReconciliationClasses
+            permissions = self.subscriptions_permissions.get(subscription.school_subscriptions.id, {})
+
+            options.append({
+                'clsID': clsID,
+                'Type': 'subscription',
+                'id': csID,
+                'auth_customer_id': subscription.customers_subscriptions.auth_customer_id,
+                'Name': subscription.school_subscriptions.Name,
+                'Allowed': self._is_allowed(permissions, int(clsID), list_type),
+                'Credits': credits,
+                'CreditsRemaining': credits > (recon_classes * -1),
+                'Unlimited': subscription.school_subscriptions.Unlimited,
+                'school_memberships_id': subscription.school_subscriptions.school_memberships_id,
+            })
+
+        return options
+
+
+    def get_classcard_options(self, clsID, date, list_type='shop'):
+        """
+        :param clsID: db.classes.id
+        :param date: datetime.date
+        :param list_type: should be in ["shop", "attendance", "selfcheckin"]
+        :return: list of class card booking options
+        """
+        options = []
+        for classcard in self.classcards:
+            if not self._is_valid_on_date(classcard.customers_classcards.Startdate,
+                                          classcard.customers_classcards.Enddate,
+                                          date):
+                continue
+
+            ccdID = classcard.customers_classcards.id
+            if classcard.school_classcards.Unlimited:
+                classes_remaining = 'unlimited'
+            else:
+                classes_remaining = (classcard.school_classcards.Classes or 0) - \
+                                    self.classcards_used.get(ccdID, 0)
+
+            permissions = self.classcards_permissions.get(
+                classcard.customers_classcards.school_classcards_id, {}
+            )
+
+            options.append({
+                'clsID': clsID,
+                'Type': 'classcard',
+                'id': ccdID,
+                'auth_customer_id': classcard.customers_classcards.auth_customer_id,
+                'Name': classcard.school_classcards.Name,
+                'Allowed': self._is_allowed(permissions, int(clsID), list_type),
+                'Enddate': classcard.customers_classcards.Enddate,
+                'ClassesRemaining': classes_remaining,
+                'Unlimited': classcard.school_classcards.Unlimited,
+                'school_memberships_id': classcard.school_classcards.school_memberships_id,
+            })
+
+        return options
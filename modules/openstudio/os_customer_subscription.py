@@ -121,17 +121,9 @@ class CustomerSubscription:
         """
         db = current.db
 
-        sum = db.customers_subscriptions_credits.MutationAmount.sum()
+        row = db.customers_subscriptions(self.csID)
 
-        query = (db.customers_subscriptions_credits.MutationType == 'add') & \
-                (db.customers_subscriptions_credits.customers_subscriptions_id == self.csID)
-        add_total = db(query).select(sum).first()[sum] or 0
-
-        query = (db.customers_subscriptions_credits.MutationType == 'sub') & \
-                (db.customers_subscriptions_credits.customers_subscriptions_id == self.csID)
-        sub_total = db(query).select(sum).first()[sum] or 0
-
-        return round(add_total - sub_total, 1)
+        return round(row.CreditsBalance or 0, 1)
 
 
     def get_credits_mutations_rows(self,
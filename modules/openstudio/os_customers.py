@@ -418,14 +418,7 @@ WHERE (au.last_login < '{date}' OR au.last_login IS NULL) AND
                           ssu.ReconciliationClasses, 
                           cs.Startdate, 
                           cs.Enddate,
-                          IFNULL((( SELECT SUM(csc.MutationAmount)
-                                    FROM customers_subscriptions_credits csc
-                                    WHERE csc.customers_subscriptions_id = cs.id AND
-	                                csc.MutationType = 'add') - 
-                                  ( SELECT SUM(csc.MutationAmount)
-                                    FROM customers_subscriptions_credits csc
-                                    WHERE csc.customers_subscriptions_id = cs.id AND
-	                                csc.MutationType = 'sub')), 0) AS credits
+                          IFNULL(cs.CreditsBalance, 0) AS credits
                           FROM customers_subscriptions cs
                           LEFT JOIN 
                             school_subscriptions ssu ON cs.school_subscriptions_id = ssu.id
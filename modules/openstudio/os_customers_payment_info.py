@@ -16,13 +16,11 @@ class OsCustomersPaymentInfo:
 
         :return:
         """
-        from os_customer import Customer
-        from os_exact_online import OSExactOnline
+        from os_exact_online_queue import OSExactOnlineQueue
 
-        os_customer = Customer(self.row.auth_customer_id)
-
-        os_eo = OSExactOnline()
-        os_eo.create_bankaccount(os_customer, self)
+        eo_queue = OSExactOnlineQueue()
+        if eo_queue.is_authorized():
+            eo_queue.add('bankaccount', self.cpiID, 'create')
 
 
     def on_update(self):
@@ -30,13 +28,11 @@ class OsCustomersPaymentInfo:
 
         :return:
         """
-        from os_customer import Customer
-        from os_exact_online import OSExactOnline
+        from os_exact_online_queue import OSExactOnlineQueue
 
-        os_customer = Customer(self.row.auth_customer_id)
-
-        os_eo = OSExactOnline()
-        os_eo.update_bankaccount(os_customer, self)
+        eo_queue = OSExactOnlineQueue()
+        if eo_queue.is_authorized():
+            eo_queue.add('bankaccount', self.cpiID, 'update')
 
 
     def exact_online_get_bankaccount(self):
@@ -16,18 +16,11 @@ class OsCustomersPaymentInfoMandate:
 
         :return:
         """
-        from os_customers_payment_info import OsCustomersPaymentInfo
-        from os_exact_online import OSExactOnline
-
-        print 'Syncing mandate to Exact!'
-
-        os_customer_payment_info = OsCustomersPaymentInfo(self.row.customers_payment_info_id)
+        from os_exact_online_queue import OSExactOnlineQueue
 
-        os_eo = OSExactOnline()
-        os_eo.create_dd_mandate(
-            os_customer_payment_info,
-            self
-        )
+        eo_queue = OSExactOnlineQueue()
+        if eo_queue.is_authorized():
+            eo_queue.add('mandate', self.cpimID, 'create')
 
 
     def on_update(self):
@@ -49,11 +42,17 @@ class OsCustomersPaymentInfoMandate:
 
         :return:
         """
-        from os_exact_online import OSExactOnline
+        from os_exact_online_queue import OSExactOnlineQueue
+
+        eo_queue = OSExactOnlineQueue()
+        # Nothing to create when the mandate is removed before it was synced
+        eo_queue.remove('mandate', self.cpimID, 'create')
 
-        if self.row.exact_online_directdebitmandates_id:
-            os_eo = OSExactOnline()
-            os_eo.delete_dd_mandate(
+        if self.row.exact_online_directdebitmandates_id and eo_queue.is_authorized():
+            eo_queue.add(
+                'mandate',
+                self.cpimID,
+                'delete',
                 self.row.exact_online_directdebitmandates_id
             )
     #
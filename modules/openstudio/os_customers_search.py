@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+import re
+import unicodedata
+
+from gluon import *
+
+
+class CustomersSearch:
+    """
+        Search customers by the start of the words in their names, email
+        address and key number. The words are stored normalized (lower case,
+        without accents) in db.customers_search_tokens, which is kept up to
+        date by callbacks on db.auth_user. Looking up the start of a token
+        uses the index on customers_search_tokens.Token, where a LIKE '%name%'
+        on auth_user has to scan the whole table.
+    """
+    fields = [ 'first_name', 'last_name', 'display_name', 'company',
+               'email', 'keynr' ]
+    token_length = 64
+    split_regex = re.compile(r'[\W_]+', re.UNICODE)
+
+
+    def get_tokens(self, value):
+        """
+        :param value: string
+        :return: list of normalized words in value
+        """
+        if not value:
+            return []
+
+        if not isinstance(value, unicode):
+            value = unicode(value, 'utf-8', 'ignore')
+
+        value = unicodedata.normalize('NFKD', value)
+        value = u''.join([ c for c in value if not unicodedata.combining(c) ])
+
+        tokens = []
+        for token in self.split_regex.split(value.lower()):
+            token = token[:self.token_length]
+            if token and token not in tokens:
+                tokens.append(token)
+
+        return tokens
+
+
+    def _get_row_tokens(self, row):
+        """
+        :param row: gluon.dal.Row of db.auth_user
+        :return: list of tokens for a customer
+        """
+        tokens = []
+        for field in self.fields:
+            for token in self.get_tokens(row[field]):
+                if token not in tokens:
+                    tokens.append(token)
+
+        return tokens
+
+
+    def update(self, cuIDs):
+        """
+        Replace the tokens of customers
+        :param cuIDs: list of db.auth_user.id
+        :return: None
+        """
+        db = current.db
+
+        if not cuIDs:
+            return
+
+        query = (db.customers_search_tokens.auth_customer_id.belongs(cuIDs))
+        db(query).delete()
+
+        fields = [ db.auth_user[field] for field in self.fields ]
+        rows = db(db.auth_user.id.belongs(cuIDs)).select(db.auth_user.id, *fields)
+
+        records = []
+        for row in rows:
+            for token in self._get_row_tokens(row):
+                records.append(dict(auth_customer_id=row.id, Token=token))
+
+        if records:
+            db.customers_search_tokens.bulk_insert(records)
+
+
+    def set_callbacks(self):
+        """
+        Keep tokens up to date when customers are added or their details change
+        :return: None
+        """
+        db = current.db
+
+        def after_insert(fields, id):
+            self.update([ id ])
+
+        def after_update(dbset, fields):
+            if any([ field in fields for field in self.fields ]):
+                self.update([ row.id for row in dbset.select(db.auth_user.id) ])
+
+        db.auth_user._after_insert.append(after_insert)
+        db.auth_user._after_update.append(after_update)
+
+
+    def rebuild(self, chunk_size=1000):
+        """
+        Recreate the tokens of all customers
+        :param chunk_size: int - number of customers to process at once
+        :return: int - number of customers processed
+        """
+        db = current.db
+
+        db(db.customers_search_tokens).delete()
+
+        count = 0
+        last_id = 0
+        while True:
+            rows = db(db.auth_user.id > last_id).select(db.auth_user.id,
+                                                        orderby=db.auth_user.id,
+                                                        limitby=(0, chunk_size))
+            if not rows:
+                break
+
+            cuIDs = [ row.id for row in rows ]
+            self.update(cuIDs)
+
+            count += len(cuIDs)
+            last_id = cuIDs[-1]
+
+        return count
+
+
+    def get_query(self, search):
+        """
+        :param search: string
+        :return: gluon.dal.Query - customers with a token starting with each
+                 word in search
+        """
+        db = current.db
+
+        query = (db.auth_user.id > 0)
+        for word in self.get_tokens(search):
+            tokens_query = (db.customers_search_tokens.Token.startswith(word))
+            query &= db.auth_user.id.belongs(
+                db(tokens_query)._select(db.customers_search_tokens.auth_customer_id)
+            )
+
+        return query
+
+
+    def search(self, search, query=None, limit=25):
+        """
+        Customers matching all words in search. Customers with words matching
+        the search exactly are listed first, then by display name.
+        :param search: string
+        :param query: gluon.dal.Query - additional filter, eg. not trashed
+        :param limit: int - max number of results
+        :return: list of db.auth_user.id
+        """
+        db = current.db
+
+        words = self.get_tokens(search)
+        if not words:
+            return []
+
+        search_query = self.get_query(search)
+        if query is not None:
+            search_query &= query
+
+        left = [ db.customers_search_tokens.on(
+            (db.customers_search_tokens.auth_customer_id == db.auth_user.id) &
+            (db.customers_search_tokens.Token.belongs(words))) ]
+        exact = db.customers_search_tokens.id.count()
+
+        rows = db(search_query).select(db.auth_user.id,
+                                       db.auth_user.display_name,
+                                       exact,
+                                       left=left,
+                                       groupby=db.auth_user.id|db.auth_user.display_name,
+                                       orderby=~exact|db.auth_user.display_name,
+                                       limitby=(0, limit))
+
+        return [ row.auth_user.id for row in rows ]
@@ -22,67 +22,208 @@ class CustomersSubscriptionsCredits:
         """
             Get list of classes a customer has a reservation for in a selected month
         """
-        from os_attendance_helper import AttendanceHelper
         from os_class_schedule import ClassSchedule
-        from os_classes_reservations import ClassesReservations
         db = current.db
 
-        ah = AttendanceHelper()
-        crh = ClassesReservations()
         first_day = datetime.date(year, month, 1)
         last_day = get_last_day_month(first_day)
 
+        # Schedule for the whole month
+        cs = ClassSchedule(first_day)
+        schedule = cs.get_range_list(first_day, last_day)
+
+        # Customers booked or attending classes this month
+        query = (db.classes_attendance.ClassDate >= first_day) & \
+                (db.classes_attendance.ClassDate <= last_day) & \
+                (db.classes_attendance.BookingStatus.belongs(['booked', 'attending']))
+        rows = db(query).select(db.classes_attendance.classes_id,
+                                db.classes_attendance.ClassDate,
+                                db.classes_attendance.auth_customer_id)
+        attending = set([
+            (row.classes_id, row.ClassDate, row.auth_customer_id) for row in rows
+        ])
+
+        # Recurring reservations active during this month
+        query = (db.classes_reservation.Startdate <= last_day) & \
+                ((db.classes_reservation.Enddate >= first_day) |
+                 (db.classes_reservation.Enddate == None)) & \
+                (db.classes_reservation.ResType == 'recurring')
+        reservations = db(query).select(db.classes_reservation.ALL)
+
         data = {}
 
-        date = first_day
-        while date <= last_day:
-            # get list of classes on date
-            #print date
+        for day in schedule:
+            date = day['date']
+            reservations_on_date = [
+                res for res in reservations
+                if res.Startdate <= date and (res.Enddate is None or res.Enddate >= date)
+            ]
 
-            cs = ClassSchedule(date)
-            #print 'getting classes'
-            classes = cs.get_day_list()
-            reservations = crh.get_recurring_reservations_on_date(date)
-            for cls in classes:
+            for cls in day['classes']:
                 if cls['Cancelled'] or cls['Holiday']:
                     # Class is cancelled or in a holiday, nothing to do
                     continue
 
-                # Get list of bookings with status "attending" or "booked"
-                #print 'getting attendance for class'
-
-                attending = []
-                rows = ah.get_attendance_rows(cls['ClassesID'], date)
-                for row in rows:
-                    # print row
-                    if row.classes_attendance.BookingStatus == 'booked' or \
-                       row.classes_attendance.BookingStatus == 'attending':
-                        attending.append(row.auth_user.id)
-
                 # if classes_id found on both lists, add class to reservations list for that customer
-                for res in reservations:
+                for res in reservations_on_date:
                     if res.classes_id == cls['ClassesID']:
                         # add customer to list in case not already attending
-                        if not res.auth_customer_id in attending:
-                            #print res.auth_customer_id
-
-
+                        if not (cls['ClassesID'], date, res.auth_customer_id) in attending:
                             value = {'clsID':cls['ClassesID'],
                                      'date':date}
 
-                            # print value
-                            # print '###############'
-
                             try:
                                 data[res.auth_customer_id].append(value)
                             except KeyError:
                                 data[res.auth_customer_id] = [value]
 
-            date += datetime.timedelta(days=1)
-
         return data
 
 
+    def _get_mutations_balance(self, rows):
+        """
+        :param rows: gluon.dal.rows with customers_subscriptions_credits
+                     customers_subscriptions_id, MutationType & MutationAmount fields
+        :return: dict {customers_subscriptions_id: net amount of credits in rows}
+        """
+        balance = {}
+        for row in rows:
+            amount = float(row.MutationAmount or 0)
+            if row.MutationType == 'add':
+                delta = amount
+            elif row.MutationType == 'sub':
+                delta = -amount
+            else:
+                continue
+
+            try:
+                balance[row.customers_subscriptions_id] += delta
+            except KeyError:
+                balance[row.customers_subscriptions_id] = delta
+
+        return balance
+
+
+    def update_balances(self, rows, sign=1):
+        """
+            Apply the net amount of credit mutations in rows to the stored
+            balance (customers_subscriptions.CreditsBalance) of their subscriptions
+            :param rows: gluon.dal.rows, see _get_mutations_balance
+            :param sign: int, 1 to add mutations to the balance, -1 to remove them
+            :return: None
+        """
+        db = current.db
+
+        balance = self._get_mutations_balance(rows)
+        for csID in balance:
+            delta = round(balance[csID] * sign, 6)
+            if not delta:
+                continue
+
+            query = """
+                UPDATE customers_subscriptions
+                SET CreditsBalance = IFNULL(CreditsBalance, 0) + {delta}
+                WHERE id = {csID}
+            """.format(delta=delta, csID=int(csID))
+
+            db.executesql(query)
+
+
+    def _get_balance_ledger_sql(self):
+        """
+            Returns sql to calculate the balance of subscriptions from all
+            mutations in customers_subscriptions_credits
+        """
+        return """
+            SELECT csc.customers_subscriptions_id,
+                   SUM(CASE WHEN csc.MutationType = 'add' THEN csc.MutationAmount
+                            WHEN csc.MutationType = 'sub' THEN -csc.MutationAmount
+                            ELSE 0 END) AS credits
+            FROM customers_subscriptions_credits csc
+            GROUP BY csc.customers_subscriptions_id
+        """
+
+
+    def rebuild_balances(self, csIDs=None):
+        """
+            Recalculate stored credit balance from all credit mutations
+            :param csIDs: list of db.customers_subscriptions.id, None to rebuild all
+            :return: None
+        """
+        db = current.db
+
+        where = ''
+        if csIDs is not None:
+            if not csIDs:
+                return
+            where = 'WHERE id IN ({ids})'.format(
+                ids=', '.join([ unicode(int(csID)) for csID in csIDs ])
+            )
+
+        query = """
+            UPDATE customers_subscriptions
+            SET CreditsBalance = IFNULL((
+                SELECT SUM(CASE WHEN csc.MutationType = 'add' THEN csc.MutationAmount
+                                WHEN csc.MutationType = 'sub' THEN -csc.MutationAmount
+                                ELSE 0 END)
+                FROM customers_subscriptions_credits csc
+                WHERE csc.customers_subscriptions_id = customers_subscriptions.id ), 0)
+            {where}
+        """.format(where=where)
+
+        db.executesql(query)
+
+
+    def check_balances(self):
+        """
+            Compare the stored credit balance of subscriptions with the balance
+            calculated from all credit mutations
+            :return: list of dicts for subscriptions where the balance doesn't match
+        """
+        db = current.db
+
+        query = """
+            SELECT cs.id,
+                   cs.auth_customer_id,
+                   IFNULL(cs.CreditsBalance, 0),
+                   IFNULL(ledger.credits, 0)
+            FROM customers_subscriptions cs
+            LEFT JOIN ( {ledger} ) ledger
+                ON ledger.customers_subscriptions_id = cs.id
+            WHERE ABS(IFNULL(cs.CreditsBalance, 0) - IFNULL(ledger.credits, 0)) > 0.001
+            ORDER BY cs.id
+        """.format(ledger=self._get_balance_ledger_sql())
+
+        inconsistencies = []
+        for record in db.executesql(query):
+            inconsistencies.append({
+                'customers_subscriptions_id': record[0],
+                'auth_customer_id': record[1],
+                'CreditsBalance': record[2],
+                'CreditsLedger': record[3]
+            })
+
+        return inconsistencies
+
+
+    def reconcile_balances(self):
+        """
+            Rebuild stored credit balance for subscriptions where it doesn't
+            match the credit mutations
+            :return: int - number of subscriptions reconciled
+        """
+        from os_cache_manager import OsCacheManager
+
+        inconsistencies = self.check_balances()
+        self.rebuild_balances([ i['customers_subscriptions_id'] for i in inconsistencies ])
+
+        ocm = OsCacheManager()
+        for cuID in set([ i['auth_customer_id'] for i in inconsistencies ]):
+            ocm.clear_customers_subscriptions(cuID)
+
+        return len(inconsistencies)
+
+
     def refund_credits_in_period(self, query):
         """
             :param query: query containing constraints for period and classes from classes_attendance
@@ -99,6 +240,39 @@ class CustomersSubscriptionsCredits:
         db(query).delete()
 
 
+    def _get_credits_for_period(self,
+                                year,
+                                month,
+                                p_start,
+                                p_end,
+                                classes,
+                                subscription_unit):
+        """
+            Calculate credits for (part of) a month
+            :param year: int
+            :param month: int
+            :param p_start: datetime.date (Period start)
+            :param p_end: datetime.date (Period end)
+            :param classes: int
+            :param subscription_unit: string either 'week' or 'month'
+            :return: float
+        """
+        first_day = datetime.date(year, month, 1)
+        last_day = get_last_day_month(first_day)
+
+        t_days = (last_day - first_day) + datetime.timedelta(days=1)  # Total days (Add 1, when subsctraced it's one day less)
+        p_days = (p_end - p_start) + datetime.timedelta(days=1)  # Period days
+
+        percent = float(p_days.days) / float(t_days.days)
+        if subscription_unit == 'month':
+            credits = round(classes * percent, 1)
+        else:
+            weeks_in_month = round(t_days.days / float(7), 1)
+            credits = round((weeks_in_month * (classes or 0)) * percent, 1)
+
+        return credits
+
+
     def add_subscription_credits_month(self,
                                        csID,
                                        cuID,
@@ -132,17 +306,13 @@ class CustomersSubscriptionsCredits:
         TODAY_LOCAL = current.TODAY_LOCAL
 
         first_day = datetime.date(year, month, 1)
-        last_day = get_last_day_month(first_day)
 
-        t_days = (last_day - first_day) + datetime.timedelta(days=1)  # Total days (Add 1, when subsctraced it's one day less)
-        p_days = (p_end - p_start) + datetime.timedelta(days=1)  # Period days
-
-        percent = float(p_days.days) / float(t_days.days)
-        if subscription_unit == 'month':
-            credits = round(classes * percent, 1)
-        else:
-            weeks_in_month = round(t_days.days / float(7), 1)
-            credits = round((weeks_in_month * (classes or 0)) * percent, 1)
+        credits = self._get_credits_for_period(year,
+                                               month,
+                                               p_start,
+                                               p_end,
+                                               classes,
+                                               subscription_unit)
 
         db.customers_subscriptions_credits.insert(
             customers_subscriptions_id=csID,
@@ -202,6 +372,7 @@ class CustomersSubscriptionsCredits:
             db.customers_subscriptions.auth_customer_id,
             db.customers_subscriptions_credits.id,
             db.customers_subscriptions_paused.id,
+            db.auth_user.display_name,
             db.school_subscriptions.Name,
             db.school_subscriptions.Classes,
             db.school_subscriptions.SubscriptionUnit,
@@ -215,6 +386,7 @@ class CustomersSubscriptionsCredits:
                    cs.auth_customer_id,
                    csc.id, 
                    csp.id, 
+                   au.display_name,
                    ssu.Name, 
                    ssu.Classes, 
                    ssu.subscriptionunit, 
@@ -232,7 +404,10 @@ class CustomersSubscriptionsCredits:
                 ON csp.customers_subscriptions_id = cs.id
             LEFT JOIN school_subscriptions ssu
                 ON cs.school_subscriptions_id = ssu.id
+            LEFT JOIN auth_user au
+                ON cs.auth_customer_id = au.id
             WHERE cs.Startdate <= '{last_day}' AND (cs.Enddate >= '{first_day}' OR cs.Enddate IS NULL)
+            ORDER BY cs.id
         """.format(year=year,
                    month=month,
                    first_day=first_day,
@@ -243,39 +418,43 @@ class CustomersSubscriptionsCredits:
         return rows
 
 
-    def add_credits(self, year, month):
+    def get_credits_for_month(self, year, month):
         """
-            Add subscription credits for month
+            Calculate credits to be added for all subscriptions in a month,
+            without adding them (dry run).
+            :param year: int
+            :param month: int
+            :return: list of dicts, 'Skip' holds the reason a subscription is skipped
         """
-        from os_customers import Customers
-
         T = current.T
-        db = current.db
 
         first_day = datetime.date(year, month, 1)
         last_day = get_last_day_month(first_day)
 
-        # Get list of bookable classes for each customer, based on recurring reservations
-
-        self.add_credits_reservations = self._get_customers_list_classes_recurring_reservations(year, month)
-        # Get list of total credits balance for each customer
-        customers = Customers()
-        self.add_credits_balance = customers.get_credits_balance(first_day, include_reconciliation_classes=True)
-
-
-        customers_credits_added = 0
-
         rows = self.add_credits_get_subscription_rows_month(year, month)
 
-
+        data = []
         for row in rows:
-            if (row.customers_subscriptions_credits.id or
-                row.customers_subscriptions_paused.id or
-                row.school_subscriptions.Classes is None or
-                row.school_subscriptions.Classes == 0 or
-                row.school_subscriptions.SubscriptionUnit is None):
-                # Don't do anything if this subscription already got credits for this month or is paused
-                # or has no classes or subscription unit defined
+            item = {
+                'customers_subscriptions_id': row.customers_subscriptions.id,
+                'auth_customer_id': row.customers_subscriptions.auth_customer_id,
+                'CustomerName': row.auth_user.display_name,
+                'SubscriptionName': row.school_subscriptions.Name,
+                'Credits': 0,
+                'Skip': None
+            }
+
+            if row.customers_subscriptions_credits.id:
+                item['Skip'] = T("Credits already added")
+            elif row.customers_subscriptions_paused.id:
+                item['Skip'] = T("Paused")
+            elif (row.school_subscriptions.Classes is None or
+                  row.school_subscriptions.Classes == 0 or
+                  row.school_subscriptions.SubscriptionUnit is None):
+                item['Skip'] = T("No classes or subscription unit defined")
+
+            if item['Skip']:
+                data.append(item)
                 continue
 
             # calculate number of credits
@@ -290,10 +469,7 @@ class CustomersSubscriptionsCredits:
             else:
                 p_end = row.customers_subscriptions.Enddate
 
-
-            self.add_subscription_credits_month(
-                row.customers_subscriptions.id,
-                row.customers_subscriptions.auth_customer_id,
+            item['Credits'] = self._get_credits_for_period(
                 year,
                 month,
                 p_start,
@@ -302,10 +478,83 @@ class CustomersSubscriptionsCredits:
                 row.school_subscriptions.SubscriptionUnit,
             )
 
-            # Increase counter
-            customers_credits_added += 1
+            data.append(item)
+
+        return data
+
+
+    def add_credits(self, year, month, chunk_size=500):
+        """
+            Add subscription credits for month
+        """
+        from os_attendance_helper import AttendanceHelper
+        from os_cache_manager import OsCacheManager
+        from os_customers import Customers
+        from tools import OsBulkInsert
+
+        T = current.T
+        db = current.db
+        now = current.NOW_LOCAL
+
+        first_day = datetime.date(year, month, 1)
+
+        credits = [ item for item in self.get_credits_for_month(year, month) if not item['Skip'] ]
+        if not credits:
+            return 0
+
+        # Get list of bookable classes for each customer, based on recurring reservations
+        self.add_credits_reservations = self._get_customers_list_classes_recurring_reservations(year, month)
+        # Get list of total credits balance for each customer
+        customers = Customers()
+        self.add_credits_balance = customers.get_credits_balance(first_day, include_reconciliation_classes=True)
+
+        description = T('Credits') + ' ' + first_day.strftime('%B %Y')
+        mutations = []
+        for item in credits:
+            mutations.append(dict(
+                customers_subscriptions_id=item['customers_subscriptions_id'],
+                MutationDateTime=now,
+                MutationType='add',
+                MutationAmount=item['Credits'],
+                Description=description,
+                SubscriptionYear=year,
+                SubscriptionMonth=month
+            ))
+
+        # Mutations are inserted without DAL callbacks, update balance in one go afterwards
+        OsBulkInsert(db.customers_subscriptions_credits, chunk_size).insert(mutations)
+        self.rebuild_balances([ item['customers_subscriptions_id'] for item in credits ])
+
+        # Book classes for recurring reservations
+        ah = AttendanceHelper()
+        for item in credits:
+            cuID = item['auth_customer_id']
+            csID = item['customers_subscriptions_id']
+
+            try:
+                self.add_credits_balance[cuID] += item['Credits']
+            except KeyError:
+                self.add_credits_balance[cuID] = item['Credits']
+
+            reservations = self.add_credits_reservations.get(cuID, [])
+            while len(reservations) > 0 and self.add_credits_balance[cuID] > 0:
+                ##
+                # remove this reservation from the list, as we have just booked it, so it won't be booked again using
+                # another subscription
+                ##
+                reservation = reservations.pop(0)
+                ah.attendance_sign_in_subscription(cuID, reservation['clsID'], csID, reservation['date'])
+
+                # Subtract one credit from current balance in this object (self.add_credits_balance)
+                self.add_credits_balance[cuID] -= 1
+
+        # Clear cache
+        ocm = OsCacheManager()
+        for cuID in set([ item['auth_customer_id'] for item in credits ]):
+            ocm.clear_customers_subscriptions(cuID)
+
+        return len(credits)
 
-        return customers_credits_added
 
     def expire_credits(self, date):
         """
@@ -364,14 +613,7 @@ class CustomersSubscriptionsCredits:
                             cs.payment_methods_id,
                             ssu.id,
                             ssu.Name,
-                            ( IFNULL((SELECT SUM(csc.MutationAmount)
-                               FROM customers_subscriptions_credits csc
-                               WHERE csc.customers_subscriptions_id = cs.id AND
-                                     csc.MutationType = 'add'), 0) - 
-                               IFNULL(( SELECT SUM(csc.MutationAmount)
-                               FROM customers_subscriptions_credits csc
-                               WHERE csc.customers_subscriptions_id = cs.id AND
-                                     csc.MutationType = 'sub'), 0)) AS credits,
+                            IFNULL(cs.CreditsBalance, 0) AS credits,
                             IFNULL(( SELECT SUM(csc.MutationAmount)
                              FROM customers_subscriptions_credits csc
                              WHERE csc.customers_subscriptions_id = cs.id AND
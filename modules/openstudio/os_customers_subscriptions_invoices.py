@@ -0,0 +1,529 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+from decimal import Decimal, ROUND_HALF_UP
+
+from gluon import *
+
+
+class CustomersSubscriptionsInvoices:
+    """
+        Creates invoices for customer subscriptions in bulk.
+        Invoices, items, amounts and links are built in memory and written
+        using multi-row inserts, one transaction per chunk of invoices.
+    """
+    def __init__(self, chunk_size=500):
+        """
+        :param chunk_size: int - number of invoices to write per transaction
+        """
+        self.chunk_size = chunk_size
+
+
+    def _get_subscriptions_rows(self, year, month):
+        """
+        :param year: int
+        :param month: int
+        :return: customers_subscriptions rows which might need an invoice for month
+        """
+        from general_helpers import get_last_day_month
+
+        db = current.db
+
+        firstdaythismonth = datetime.date(year, month, 1)
+        lastdaythismonth  = get_last_day_month(firstdaythismonth)
+
+        csap = db.customers_subscriptions_alt_prices
+
+        fields = [
+            db.customers_subscriptions.id,
+            db.customers_subscriptions.auth_customer_id,
+            db.customers_subscriptions.school_subscriptions_id,
+            db.customers_subscriptions.Startdate,
+            db.customers_subscriptions.Enddate,
+            db.customers_subscriptions.payment_methods_id,
+            db.customers_subscriptions.RegistrationFeePaid,
+            db.school_subscriptions.Name,
+            db.school_subscriptions.RegistrationFee,
+            db.school_subscriptions_price.Price,
+            db.school_subscriptions_price.tax_rates_id,
+            db.school_subscriptions_price.accounting_glaccounts_id,
+            db.school_subscriptions_price.accounting_costcenters_id,
+            db.tax_rates.Percentage,
+            db.customers_subscriptions_paused.id,
+            db.invoices.id,
+            csap.id,
+            csap.Amount,
+            csap.Description,
+            db.auth_user.full_name,
+            db.auth_user.company,
+            db.auth_user.company_registration,
+            db.auth_user.company_tax_registration,
+            db.auth_user.address,
+            db.auth_user.postcode,
+            db.auth_user.city,
+            db.auth_user.country,
+        ]
+
+        rows = db.executesql(
+            """
+                SELECT cs.id,
+                       cs.auth_customer_id,
+                       cs.school_subscriptions_id,
+                       cs.Startdate,
+                       cs.Enddate,
+                       cs.payment_methods_id,
+                       cs.RegistrationFeePaid,
+                       ssu.Name,
+                       ssu.RegistrationFee,
+                       ssp.Price,
+                       ssp.tax_rates_id,
+                       ssp.accounting_glaccounts_id,
+                       ssp.accounting_costcenters_id,
+                       tr.Percentage,
+                       csp.id,
+                       i.invoices_id,
+                       csap.id,
+                       csap.Amount,
+                       csap.Description,
+                       au.full_name,
+                       au.company,
+                       au.company_registration,
+                       au.company_tax_registration,
+                       au.address,
+                       au.postcode,
+                       au.city,
+                       au.country
+                FROM customers_subscriptions cs
+                LEFT JOIN auth_user au
+                 ON au.id = cs.auth_customer_id
+                LEFT JOIN school_subscriptions ssu
+                 ON cs.school_subscriptions_id = ssu.id
+                LEFT JOIN
+                 (SELECT id,
+                         school_subscriptions_id,
+                         Startdate,
+                         Enddate,
+                         Price,
+                         tax_rates_id,
+                         accounting_glaccounts_id,
+                         accounting_costcenters_id
+                  FROM school_subscriptions_price
+                  WHERE Startdate <= '{firstdaythismonth}' AND
+                        (Enddate >= '{firstdaythismonth}' OR Enddate IS NULL)) ssp
+                 ON ssp.school_subscriptions_id = ssu.id
+                LEFT JOIN tax_rates tr
+                 ON ssp.tax_rates_id = tr.id
+                LEFT JOIN
+                 (SELECT id,
+                         customers_subscriptions_id
+                  FROM customers_subscriptions_paused
+                  WHERE Startdate <= '{firstdaythismonth}' AND
+                        (Enddate >= '{firstdaythismonth}' OR Enddate IS NULL)) csp
+                 ON cs.id = csp.customers_subscriptions_id
+                LEFT JOIN
+                 (SELECT ics.id,
+                         ics.invoices_id,
+                         ics.customers_subscriptions_id
+                  FROM invoices_customers_subscriptions ics
+                  LEFT JOIN invoices on ics.invoices_id = invoices.id
+                  WHERE invoices.SubscriptionYear = {year} AND invoices.SubscriptionMonth = {month}) i
+                 ON i.customers_subscriptions_id = cs.id
+                LEFT JOIN
+                 (SELECT id,
+                         customers_subscriptions_id,
+                         Amount,
+                         Description
+                  FROM customers_subscriptions_alt_prices
+                  WHERE SubscriptionYear = {year} AND SubscriptionMonth = {month}) csap
+                 ON csap.customers_subscriptions_id = cs.id
+                WHERE cs.Startdate <= '{lastdaythismonth}' AND
+                      (cs.Enddate >= '{firstdaythismonth}' OR cs.Enddate IS NULL) AND
+                      ssp.Price <> 0 AND
+                      ssp.Price IS NOT NULL AND
+                      au.trashed = 'F'
+                ORDER BY cs.id
+            """.format(firstdaythismonth=firstdaythismonth,
+                       lastdaythismonth =lastdaythismonth,
+                       year=year,
+                       month=month),
+          fields=fields)
+
+        return rows
+
+
+    def _get_registration_fee_info(self, rows):
+        """
+            Fetches the info required to check whether a registration fee is
+            due for all customers in rows at once
+        :param rows: rows from self._get_subscriptions_rows()
+        :return: dict
+        """
+        db = current.db
+
+        cuIDs = [ row.customers_subscriptions.auth_customer_id for row in rows
+                  if row.school_subscriptions.RegistrationFee ]
+
+        fee_paid = set()
+        subscriptions_count = {}
+        if not cuIDs:
+            return dict(fee_paid=fee_paid,
+                        subscriptions_count=subscriptions_count)
+
+        query = (db.customers_subscriptions.auth_customer_id.belongs(cuIDs)) & \
+                (db.customers_subscriptions.RegistrationFeePaid == True)
+        for row in db(query).select(db.customers_subscriptions.auth_customer_id,
+                                    distinct=True):
+            fee_paid.add(row.auth_customer_id)
+
+        count = db.customers_subscriptions.id.count()
+        query = (db.customers_subscriptions.auth_customer_id.belongs(cuIDs))
+        for row in db(query).select(db.customers_subscriptions.auth_customer_id,
+                                    db.customers_subscriptions.school_subscriptions_id,
+                                    count,
+                                    groupby=db.customers_subscriptions.auth_customer_id|\
+                                            db.customers_subscriptions.school_subscriptions_id):
+            key = (row.customers_subscriptions.auth_customer_id,
+                   row.customers_subscriptions.school_subscriptions_id)
+            subscriptions_count[key] = row[count]
+
+        return dict(fee_paid=fee_paid,
+                    subscriptions_count=subscriptions_count)
+
+
+    def _get_item_amounts(self, price, quantity, percentage):
+        """
+            Calculates amounts for an invoice item, the same way as the
+            computed fields of db.invoices_items
+        :return: dict
+        """
+        total_price_vat = float(price) * float(quantity)
+
+        vat = 0
+        if percentage:
+            vat_rate = percentage / 100
+            vat = total_price_vat - (total_price_vat / (1 + vat_rate))
+            vat = Decimal(Decimal(vat).quantize(Decimal('.01'),
+                                                rounding=ROUND_HALF_UP))
+
+        total_price = Decimal(Decimal(Decimal(total_price_vat) - Decimal(vat)).quantize(
+            Decimal('.01'),
+            rounding=ROUND_HALF_UP))
+
+        return dict(TotalPriceVAT = total_price_vat,
+                    VAT = float(vat),
+                    TotalPrice = float(total_price))
+
+
+    def _get_item_subscription(self, row, firstdaythismonth, lastdaythismonth):
+        """
+            Returns invoice item values, as Invoice.item_add_subscription()
+            would insert them
+        :return: dict
+        """
+        T = current.T
+        DATE_FORMAT = current.DATE_FORMAT
+
+        cs = row.customers_subscriptions
+        csap = row.customers_subscriptions_alt_prices
+
+        period_start = firstdaythismonth
+        period_end = lastdaythismonth
+
+        if csap.id:
+            price = csap.Amount
+            description = csap.Description
+        else:
+            price = row.school_subscriptions_price.Price
+
+            broken_period = False
+            if cs.Startdate > firstdaythismonth and cs.Startdate <= period_end:
+                # Start later in month
+                broken_period = True
+                period_start = cs.Startdate
+                delta = period_end - cs.Startdate
+                cs_days = delta.days + 1
+                total_days = period_end.day
+
+            if cs.Enddate:
+                if cs.Enddate >= firstdaythismonth and cs.Enddate < period_end:
+                    # End somewhere in month
+                    broken_period = True
+
+                    delta = cs.Enddate - firstdaythismonth
+                    cs_days = delta.days + 1
+                    total_days = period_end.day
+
+                    period_end = cs.Enddate
+
+            if broken_period:
+                price = round(float(cs_days) / float(total_days) * float(price), 2)
+
+            description = row.school_subscriptions.Name.decode('utf-8') + u' ' + \
+                          period_start.strftime(DATE_FORMAT) + u' - ' + \
+                          period_end.strftime(DATE_FORMAT)
+
+        item = dict(
+            ProductName = T("Subscription") + ' ' + unicode(cs.id),
+            Description = description,
+            Quantity = 1,
+            Price = price,
+            Sorting = 1,
+            tax_rates_id = row.school_subscriptions_price.tax_rates_id,
+            accounting_glaccounts_id = row.school_subscriptions_price.accounting_glaccounts_id,
+            accounting_costcenters_id = row.school_subscriptions_price.accounting_costcenters_id
+        )
+        item.update(self._get_item_amounts(price, 1, row.tax_rates.Percentage))
+
+        return item
+
+
+    def _get_item_registration_fee(self, row):
+        """
+            Returns invoice item values for a registration fee
+        :return: dict
+        """
+        T = current.T
+
+        price = row.school_subscriptions.RegistrationFee
+
+        item = dict(
+            ProductName = T("Registration fee"),
+            Description = T('One time registration fee'),
+            Quantity = 1,
+            Price = price,
+            Sorting = 2,
+            tax_rates_id = row.school_subscriptions_price.tax_rates_id,
+        )
+        item.update(self._get_item_amounts(price, 1, row.tax_rates.Percentage))
+
+        return item
+
+
+    def _get_customer_info(self, row):
+        """
+            Returns customer info for an invoice, as Invoice.set_customer_info()
+            would set it
+        :return: dict
+        """
+        au = row.auth_user
+
+        address = ''
+        if au.address:
+            address = ''.join([address, au.address, '\n'])
+        if au.city:
+            address = ''.join([address, au.city, ' '])
+        if au.postcode:
+            address = ''.join([address, au.postcode, '\n'])
+        if au.country:
+            address = ''.join([address, au.country])
+
+        list_name = au.full_name
+        if au.company:
+            list_name = au.company
+
+        return dict(
+            CustomerCompany = au.company,
+            CustomerCompanyRegistration = au.company_registration,
+            CustomerCompanyTaxRegistration = au.company_tax_registration,
+            CustomerName = au.full_name,
+            CustomerListName = list_name,
+            CustomerAddress = address,
+        )
+
+
+    def get_invoices_for_month(self, year, month, description):
+        """
+            Builds invoices for all subscriptions that require one in month
+        :param year: int
+        :param month: int
+        :param description: string - invoice description
+        :return: list of dicts {invoice, customer_id, subscription_id, items, registration_fee}
+        """
+        from general_helpers import get_last_day_month
+
+        db = current.db
+        TODAY_LOCAL = current.TODAY_LOCAL
+
+        firstdaythismonth = datetime.date(year, month, 1)
+        lastdaythismonth  = get_last_day_month(firstdaythismonth)
+
+        rows = self._get_subscriptions_rows(year, month)
+
+        igpt = db.invoices_groups_product_types(ProductType = 'subscription')
+        invoice_group = db.invoices_groups(igpt.invoices_groups_id)
+
+        fee_info = self._get_registration_fee_info(rows)
+        fee_paid = fee_info['fee_paid']
+        subscriptions_count = fee_info['subscriptions_count']
+
+        now = datetime.datetime.now()
+        date_due = TODAY_LOCAL + datetime.timedelta(days=invoice_group.DueDays)
+
+        invoices = []
+        csIDs = set()
+        for row in rows:
+            cs = row.customers_subscriptions
+            if cs.id in csIDs:
+                continue
+            csIDs.add(cs.id)
+
+            if row.invoices.id:
+                # an invoice already exists, do nothing
+                continue
+            if row.customers_subscriptions_paused.id:
+                # the subscription is paused, don't create an invoice
+                continue
+            if row.customers_subscriptions_alt_prices.Amount == 0:
+                # Don't create an invoice if there's an alt price for the subscription with amount 0.
+                continue
+
+            if row.customers_subscriptions_alt_prices.Description:
+                inv_description = row.customers_subscriptions_alt_prices.Description
+            else:
+                inv_description = description
+
+            invoice = dict(
+                invoices_groups_id = invoice_group.id,
+                payment_methods_id = cs.payment_methods_id,
+                SubscriptionYear = year,
+                SubscriptionMonth = month,
+                Description = inv_description,
+                Status = 'sent',
+                DateCreated = TODAY_LOCAL,
+                DateDue = date_due,
+                Terms = invoice_group.Terms,
+                Footer = invoice_group.Footer,
+                Created_at = now,
+                Updated_at = now
+            )
+            invoice.update(self._get_customer_info(row))
+
+            items = [ self._get_item_subscription(row, firstdaythismonth, lastdaythismonth) ]
+
+            # Check if a registration fee should be added
+            registration_fee = False
+            if row.school_subscriptions.RegistrationFee:
+                cuID = cs.auth_customer_id
+                other_subscriptions = subscriptions_count.get((cuID, cs.school_subscriptions_id), 1) > 1
+                if not (cs.RegistrationFeePaid or other_subscriptions or cuID in fee_paid):
+                    items.append(self._get_item_registration_fee(row))
+                    registration_fee = True
+                    fee_paid.add(cuID)
+
+            invoices.append(dict(
+                invoice = invoice,
+                customer_id = cs.auth_customer_id,
+                subscription_id = cs.id,
+                items = items,
+                registration_fee = registration_fee
+            ))
+
+        return invoices
+
+
+    def _write_invoices(self, invoices):
+        """
+            Writes a chunk of invoices, their items, amounts and links
+        :param invoices: list of dicts from self.get_invoices_for_month()
+        :return: None
+        """
+        from os_invoices import Invoices
+        from os_reports_revenue import ReportsRevenue
+        from tools import OsBulkInsert
+
+        db = current.db
+
+        igID = invoices[0]['invoice']['invoices_groups_id']
+
+        invoice_ids = Invoices().reserve_invoice_ids(igID, len(invoices))
+        for invoice, invoice_id in zip(invoices, invoice_ids):
+            invoice['invoice']['InvoiceID'] = invoice_id
+
+        OsBulkInsert(db.invoices).insert([ i['invoice'] for i in invoices ])
+
+        # Get ids of the invoices inserted above
+        query = (db.invoices.invoices_groups_id == igID) & \
+                (db.invoices.InvoiceID.belongs(invoice_ids))
+        rows = db(query).select(db.invoices.id,
+                                db.invoices.InvoiceID,
+                                orderby=db.invoices.id)
+        iIDs = dict([ (row.InvoiceID, row.id) for row in rows ])
+
+        invoices_customers = []
+        invoices_customers_subscriptions = []
+        invoices_items = []
+        invoices_amounts = []
+        registration_fees_paid = []
+        for invoice in invoices:
+            iID = iIDs[invoice['invoice']['InvoiceID']]
+
+            invoices_customers.append(dict(
+                invoices_id = iID,
+                auth_customer_id = invoice['customer_id']
+            ))
+            invoices_customers_subscriptions.append(dict(
+                invoices_id = iID,
+                customers_subscriptions_id = invoice['subscription_id']
+            ))
+
+            subtotal = 0
+            vat = 0
+            total = 0
+            for item in invoice['items']:
+                item['invoices_id'] = iID
+                invoices_items.append(item)
+
+                subtotal += item['TotalPrice']
+                vat += item['VAT']
+                total += item['TotalPriceVAT']
+
+            invoices_amounts.append(dict(
+                invoices_id = iID,
+                TotalPrice = subtotal,
+                VAT = vat,
+                TotalPriceVAT = total,
+                Paid = 0,
+                Balance = total
+            ))
+
+            if invoice['registration_fee']:
+                registration_fees_paid.append(invoice['subscription_id'])
+
+        OsBulkInsert(db.invoices_customers).insert(invoices_customers)
+        OsBulkInsert(db.invoices_customers_subscriptions).insert(invoices_customers_subscriptions)
+        OsBulkInsert(db.invoices_items).insert(invoices_items)
+        OsBulkInsert(db.invoices_amounts).insert(invoices_amounts)
+
+        if registration_fees_paid:
+            query = (db.customers_subscriptions.id.belongs(registration_fees_paid))
+            db(query).update(RegistrationFeePaid=True)
+
+        # Bulk inserts don't run the callbacks marking the months of changed
+        # invoices for the revenue report
+        months = set()
+        for invoice in invoices:
+            months.add((invoice['invoice']['DateCreated'].year,
+                        invoice['invoice']['DateCreated'].month))
+            months.add((invoice['invoice']['SubscriptionYear'],
+                        invoice['invoice']['SubscriptionMonth']))
+        ReportsRevenue().set_months_changed(months)
+
+
+    def create_invoices_for_month(self, year, month, description):
+        """
+            Create invoices for subscriptions for a given month
+        :param year: int
+        :param month: int
+        :param description: string - invoice description
+        :return: int - number of invoices created
+        """
+        db = current.db
+
+        invoices = self.get_invoices_for_month(int(year), int(month), description)
+
+        for i in range(0, len(invoices), self.chunk_size):
+            self._write_invoices(invoices[i:i + self.chunk_size])
+            # Each chunk gets its own transaction
+            db.commit()
+
+        return len(invoices)
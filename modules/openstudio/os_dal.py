@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+from gluon import *
+from gluon.dal import DAL
+
+
+class OsDAL(DAL):
+    """
+        DAL that defines tables when they're first used.
+        Define functions are registered using lazy_define() and called the
+        first time db.<table> or db['<table>'] is accessed, so a request only
+        defines the tables it uses (and the tables those reference).
+    """
+    def _os_get(self, name, default):
+        """
+        Get or create an instance attribute without going through DAL.__getattr__
+        :param name: string - attribute name
+        :param default: value to set when the attribute doesn't exist yet
+        :return: attribute value
+        """
+        try:
+            return object.__getattribute__(self, name)
+        except AttributeError:
+            object.__setattr__(self, name, default)
+            return default
+
+
+    def __getattr__(self, key):
+        lazy_defines = self._os_get('_os_lazy_defines', {})
+        if key in lazy_defines:
+            self._os_define(key)
+
+        return DAL.__getattr__(self, key)
+
+
+    def __getitem__(self, key):
+        return self.__getattr__(str(key))
+
+
+    def __contains__(self, key):
+        return (key in self._os_get('_os_lazy_defines', {}) or
+                DAL.__contains__(self, key))
+
+
+    def _os_define(self, tablename):
+        """
+        Call the registered define function for tablename and run on_define hooks
+        :param tablename: string
+        :return: None
+        """
+        lazy_defines = self._os_get('_os_lazy_defines', {})
+        define_function = lazy_defines.pop(tablename)
+        define_function()
+
+        table = DAL.__getattr__(self, tablename)
+        for hook in self._os_get('_os_on_define_hooks', {}).pop(tablename, []):
+            hook(table)
+
+
+    def set_lazy(self, lazy):
+        """
+        :param lazy: Boolean - when False, lazy_define defines tables right away
+        :return: None
+        """
+        object.__setattr__(self, '_os_lazy', lazy)
+
+
+    def lazy_define(self, tablename, define_function):
+        """
+        :param tablename: string - name of the table defined by define_function
+        :param define_function: function that defines the table
+        :return: None
+        """
+        if tablename in self.tables or tablename in self._os_get('_os_lazy_defines', {}):
+            return
+
+        self._os_get('_os_lazy_defines', {})[tablename] = define_function
+        if not self._os_get('_os_lazy', True):
+            self._os_define(tablename)
+
+
+    def add_on_define(self, tablename, hook):
+        """
+        Run hook(table) once tablename is defined, right away when it already is
+        :param tablename: string
+        :param hook: function accepting a table as argument
+        :return: None
+        """
+        if tablename in self._os_get('_os_lazy_defines', {}):
+            hooks = self._os_get('_os_on_define_hooks', {})
+            hooks.setdefault(tablename, []).append(hook)
+        else:
+            hook(self[tablename])
+
+
+    def define_all(self):
+        """
+        Define all tables that haven't been defined yet. Use this for code that
+        needs all tables, such as migrations and listing db.tables.
+        :return: None
+        """
+        lazy_defines = self._os_get('_os_lazy_defines', {})
+        while lazy_defines:
+            self._os_define(lazy_defines.keys()[0])
+
+
+class OsLazyDict(dict):
+    """
+        Dict that is filled by calling loader the first time it's read.
+        Used for lookup dicts in models that aren't needed by every request.
+    """
+    def __init__(self, loader):
+        """
+        :param loader: function returning a dict
+        """
+        dict.__init__(self)
+        self.loader = loader
+        self.loaded = False
+
+
+    def _load(self):
+        if not self.loaded:
+            self.loaded = True
+            dict.update(self, self.loader())
+
+
+    def __getitem__(self, key):
+        self._load()
+        return dict.__getitem__(self, key)
+
+
+    def __contains__(self, key):
+        self._load()
+        return dict.__contains__(self, key)
+
+
+    def __iter__(self):
+        self._load()
+        return dict.__iter__(self)
+
+
+    def __len__(self):
+        self._load()
+        return dict.__len__(self)
+
+
+    def get(self, key, default=None):
+        self._load()
+        return dict.get(self, key, default)
+
+
+    def keys(self):
+        self._load()
+        return dict.keys(self)
+
+
+    def values(self):
+        self._load()
+        return dict.values(self)
+
+
+    def items(self):
+        self._load()
+        return dict.items(self)
+
+
+    def iteritems(self):
+        self._load()
+        return dict.iteritems(self)
+
+
+    def copy(self):
+        self._load()
+        return dict(self.items())
@@ -4,6 +4,15 @@ from gluon import *
 
 
 class OSExactOnline:
+    def __init__(self, api=None):
+        """
+        :param api: ExactApi (or a stand-in for it when testing), created
+        from config and token storage when None
+        """
+        self.api = api
+        self.glaccounts = {}
+
+
     def get_api(self):
         """
         Return ExactAPI linked to config and token storage
@@ -13,9 +22,11 @@ class OSExactOnline:
         from exactonline.exceptions import ObjectDoesNotExist
         from exactonline.storage import IniStorage
 
-        storage = self.get_storage()
+        if self.api is None:
+            storage = self.get_storage()
+            self.api = ExactApi(storage=storage)
 
-        return ExactApi(storage=storage)
+        return self.api
 
 
     def get_storage(self):
@@ -42,6 +53,20 @@ class OSExactOnline:
         return MyIniStorage(config_file)
 
 
+    def get_selected_division(self):
+        """
+        :return: int - Exact Online division set in storage, None when not set
+        """
+        from ConfigParser import NoOptionError, NoSectionError
+
+        storage = self.get_storage()
+
+        try:
+            return int(storage.get('transient', 'division'))
+        except (NoOptionError, NoSectionError):
+            return None
+
+
     def create_sales_entry(self, os_invoice):
         """
         :param os_customer: OsCustomer object
@@ -91,10 +116,7 @@ class OSExactOnline:
             )
             return
 
-        try:
-            selected_division = int(storage.get('transient', 'division'))
-        except NoOptionError:
-            selected_division = None
+        selected_division = self.get_selected_division()
 
         amounts = os_invoice.get_amounts()
 
@@ -166,6 +188,9 @@ class OSExactOnline:
 
     def update_sales_entry(self, os_invoice):
         """
+        Invoices without a sales entry are created with all lines in one call.
+        For existing sales entries the lines are sent with one call each,
+        see update_sales_entry_lines.
         :param os_customer: OsCustomer object
         :return: None
         """
@@ -210,10 +235,7 @@ class OSExactOnline:
         cuID = os_invoice.get_linked_customer_id()
         os_customer = Customer(os_invoice.get_linked_customer_id())
 
-        try:
-            selected_division = int(storage.get('transient', 'division'))
-        except NoOptionError:
-            selected_division = None
+        selected_division = self.get_selected_division()
 
         amounts = os_invoice.get_amounts()
 
@@ -273,6 +295,8 @@ class OSExactOnline:
         :param line: dict
         :return:
         """
+        from exactonline.http import HTTPError
+
         api = self.get_api()
         error = False
         result = ''
@@ -296,6 +320,8 @@ class OSExactOnline:
         :param line: dict
         :return:
         """
+        from exactonline.http import HTTPError
+
         api = self.get_api()
 
         error = False
@@ -327,6 +353,11 @@ class OSExactOnline:
 
     def update_sales_entry_lines(self, os_invoice):
         """
+        Create or update the lines of an existing sales entry.
+        Exact Online doesn't change the lines of a sales entry when
+        SalesEntryLines are included in an update of the entry, so this makes
+        one call to the SalesEntryLines endpoint per invoice item.
+        Processing the queue only re-uses the connection for these calls.
         :param os_invoice: Invoice object
         :return:
         """
@@ -390,9 +421,9 @@ class OSExactOnline:
                 result = self.create_sales_entry_line(line)
                 if result['error']:
                     count_errors += 1
-
-                item.ExactOnlineSalesEntryLineID = result['ID']
-                item.update_record()
+                else:
+                    item.ExactOnlineSalesEntryLineID = result['result']['ID']
+                    item.update_record()
 
             else: # Update
                 result = self.update_sales_entry_line(ID, line)
@@ -408,9 +439,12 @@ class OSExactOnline:
         :param code: Exact G/L Account code. eg. 0150
         :return: glaccount dict
         """
-        api = self.get_api()
+        # Look up each account only once, invoices mostly share the same accounts
+        if code not in self.glaccounts:
+            api = self.get_api()
+            self.glaccounts[code] = api.financialglaccounts.filter(Code=code)
 
-        return api.financialglaccounts.filter(Code=code)
+        return self.glaccounts[code]
 
 
     def get_journal(self, code):
@@ -527,10 +561,7 @@ class OSExactOnline:
             storage = self.get_storage()
             api = self.get_api()
 
-            try:
-                selected_division = int(storage.get('transient', 'division'))
-            except NoOptionError:
-                selected_division = None
+            selected_division = self.get_selected_division()
 
 
             relation_dict = {
@@ -607,10 +638,7 @@ class OSExactOnline:
         storage = self.get_storage()
         api = self.get_api()
 
-        try:
-            selected_division = int(storage.get('transient', 'division'))
-        except NoOptionError:
-            selected_division = None
+        selected_division = self.get_selected_division()
 
         relation_dict = {
             "AddressLine1": os_customer.row.address,
@@ -746,7 +774,7 @@ class OSExactOnline:
     def update_bankaccount(self, os_customer, os_customer_payment_info):
         """
         :param os_customer: OsCustomer object
-        :return: None
+        :return: True when an error occurred, otherwise False
         """
         from exactonline.http import HTTPError
         from tools import OsTools
@@ -778,6 +806,8 @@ class OSExactOnline:
             'BICCode': os_customer_payment_info.row.BIC
         }
 
+        error = False
+
         try:
             # print 'actually updating account'
             # print os_customer_payment_info.row.exact_online_bankaccount_id
@@ -794,12 +824,14 @@ class OSExactOnline:
                 e
             )
 
+        return error
+
 
     def create_dd_mandate(self, os_customer_payment_info, os_cpim):
         """
         :param os_customer_payment_info: payment info object
         :param os_cpim: payment info mandates object
-        :return:
+        :return: exact online direct debit mandate id
         """
         from exactonline.http import HTTPError
         from tools import OsTools
@@ -843,6 +875,8 @@ class OSExactOnline:
         }
 
 
+        error = False
+
         try:
             result = api.directdebitmandates.create(mandate_dict)
             os_cpim.row.exact_online_directdebitmandates_id = result['ID']
@@ -857,6 +891,11 @@ class OSExactOnline:
                 e
             )
 
+        if error:
+            return False
+
+        return result['ID']
+
 
     def update_dd_mandate(self):
         """
@@ -868,17 +907,18 @@ class OSExactOnline:
 
     def delete_dd_mandate(self, mandateID):
         """
-
-        :return:
+        :param mandateID: Exact Online direct debit mandate id
+        :return: True when an error occurred, otherwise False
         """
-        T = current.T
-        session = current.globalenv['session']
         from exactonline.http import HTTPError
 
+        error = False
+
         api = self.get_api()
         try:
             api.directdebitmandates.delete(mandateID)
         except HTTPError as e:
+            error = True
             self._log_error(
                 'delete',
                 'direct debit mandate',
@@ -886,7 +926,7 @@ class OSExactOnline:
                 e
             )
 
-            session.flash = T("Failed to delete this mandate in Exact Online, it's probably in use somewhere.")
+        return error
 
 
     def _log_error(self, action, object, object_id, result):
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+
+from gluon import *
+
+
+class OSExactOnlineQueue:
+    """
+        Outbox for changes that have to be synced to Exact Online.
+        Changes are added to db.integration_exact_online_queue during a request
+        and sent to Exact Online by the exact_online_process_queue scheduler task.
+    """
+    # Minutes to wait before retrying an item after the first failure,
+    # this doubles for each following failure up to max_retry_delay
+    retry_delay = 5
+    max_retry_delay = 60 * 24
+    max_attempts = 10
+
+
+    def __init__(self, api=None):
+        """
+        :param api: ExactApi to use when processing the queue, passed on to
+        OSExactOnline. Tests can pass a local stand-in for the Exact API here.
+        """
+        self.api = api
+
+
+    def is_authorized(self):
+        """
+        :return: Boolean - True when the Exact Online integration is authorized
+        """
+        from tools import OsTools
+
+        os_tools = OsTools()
+
+        return os_tools.get_sys_property('exact_online_authorized') == 'True'
+
+
+    def add(self, object_name, object_id, action='update', action_data=None):
+        """
+        Add a change to the queue. When the same change for an object is
+        already in the queue, that item is re-used, so an object that
+        changes a number of times before the queue is processed is only sent
+        to Exact Online once. Failed items are tried again.
+        :param object_name: one of 'invoice', 'relation', 'bankaccount', 'mandate'
+        :param object_id: id of the object in OpenStudio
+        :param action: one of 'create', 'update', 'delete'
+        :param action_data: string - eg. Exact Online id of a deleted object
+        :return: db.integration_exact_online_queue.id
+        """
+        db = current.db
+        now = datetime.datetime.now()
+
+        query = (db.integration_exact_online_queue.ObjectName == object_name) & \
+                (db.integration_exact_online_queue.ObjectID == object_id) & \
+                (db.integration_exact_online_queue.ActionName == action)
+        row = db(query).select(db.integration_exact_online_queue.id).first()
+
+        if row:
+            # The object changed again, so retry right away with the new data
+            # Version tells process() the item changed while it was being synced
+            db(db.integration_exact_online_queue.id == row.id).update(
+                ActionData = action_data,
+                Status = 'pending',
+                Attempts = 0,
+                NextAttemptOn = now,
+                Version = db.integration_exact_online_queue.Version + 1
+            )
+
+            return row.id
+
+        return db.integration_exact_online_queue.insert(
+            ObjectName = object_name,
+            ObjectID = object_id,
+            ActionName = action,
+            ActionData = action_data,
+            NextAttemptOn = now
+        )
+
+
+    def remove(self, object_name, object_id, action):
+        """
+        Remove a change from the queue
+        :param object_name: one of 'invoice', 'relation', 'bankaccount', 'mandate'
+        :param object_id: id of the object in OpenStudio
+        :param action: one of 'create', 'update', 'delete'
+        :return: None
+        """
+        db = current.db
+
+        query = (db.integration_exact_online_queue.ObjectName == object_name) & \
+                (db.integration_exact_online_queue.ObjectID == object_id) & \
+                (db.integration_exact_online_queue.ActionName == action)
+        db(query).delete()
+
+
+    def add_unsynced_invoices(self):
+        """
+        Add all invoices that aren't linked to a sales entry in Exact Online yet
+        and aren't in the queue already. Invoices that failed too many times
+        stay failed until they're updated again.
+        :return: None
+        """
+        db = current.db
+
+        query = """
+            INSERT INTO integration_exact_online_queue
+                ( ObjectName, ObjectID, ActionName, Status, Attempts,
+                  Version, NextAttemptOn, CreatedOn, UpdatedOn )
+            SELECT 'invoice', i.id, 'update', 'pending', 0,
+                   0, '{now}', '{now}', '{now}'
+            FROM invoices i
+            WHERE i.ExactOnlineSalesEntryID IS NULL AND
+                  NOT EXISTS ( SELECT q.id
+                               FROM integration_exact_online_queue q
+                               WHERE q.ObjectName = 'invoice' AND
+                                     q.ObjectID = i.id AND
+                                     q.ActionName = 'update' )
+        """.format(now=datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+        db.executesql(query)
+
+
+    def _get_retry_delay(self, attempts):
+        """
+        :param attempts: int - number of failed attempts
+        :return: datetime.timedelta
+        """
+        minutes = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+
+        return datetime.timedelta(minutes=minutes)
+
+
+    def _get_batch(self, batch_size):
+        """
+        :param batch_size: int - max number of items
+        :return: gluon.dal.rows - items due to be synced, oldest first
+        """
+        db = current.db
+
+        query = (db.integration_exact_online_queue.Status == 'pending') & \
+                (db.integration_exact_online_queue.NextAttemptOn <= datetime.datetime.now())
+
+        return db(query).select(
+            db.integration_exact_online_queue.ALL,
+            orderby=db.integration_exact_online_queue.id,
+            limitby=(0, batch_size)
+        )
+
+
+    def process(self, batch_size=50, max_items=None):
+        """
+        Send queued changes to Exact Online. Items are processed in batches
+        sharing one API connection; the db is committed after each batch.
+        Synced items are removed from the queue, failed items are retried
+        later with an increasing delay, until max_attempts is reached.
+        :param batch_size: int - number of items per batch
+        :param max_items: int - max number of items to process, None for all
+        :return: dict(synced=int, errors=int)
+        """
+        from os_exact_online import OSExactOnline
+
+        db = current.db
+
+        synced = 0
+        errors = 0
+
+        if not self.is_authorized():
+            return dict(synced=synced, errors=errors)
+
+        os_eo = OSExactOnline(api=self.api)
+
+        # Processed items are either removed or scheduled for a later attempt,
+        # so each batch only holds new items
+        processed = 0
+        while max_items is None or processed < max_items:
+            if max_items is not None:
+                batch_size = min(batch_size, max_items - processed)
+
+            rows = self._get_batch(batch_size)
+            if not rows:
+                break
+
+            for row in rows:
+                processed += 1
+
+                try:
+                    error = self._process_item(os_eo, row)
+                except Exception as e:
+                    # Keep going with the rest of the batch, this item is retried later
+                    error = unicode(e) or e.__class__.__name__
+
+                if error:
+                    self._set_failed(row, error)
+                    errors += 1
+                else:
+                    # Keep the item when it was added again during the sync,
+                    # the new change still has to be sent
+                    db(self._get_unchanged_query(row)).delete()
+                    synced += 1
+
+            db.commit()
+
+        return dict(synced=synced, errors=errors)
+
+
+    def _get_unchanged_query(self, row):
+        """
+        :param row: gluon.dal.row - db.integration_exact_online_queue record
+        :return: gluon.dal.Query - the item, as long as it wasn't added again
+                 after row was read
+        """
+        db = current.db
+
+        return (db.integration_exact_online_queue.id == row.id) & \
+               (db.integration_exact_online_queue.Version == row.Version)
+
+
+    def _set_failed(self, row, error):
+        """
+        Schedule next attempt for an item, or mark it as failed when it
+        has been tried max_attempts times
+        :param row: gluon.dal.row - db.integration_exact_online_queue record
+        :param error: string
+        :return: None
+        """
+        db = current.db
+
+        attempts = (row.Attempts or 0) + 1
+        status = 'pending'
+        if attempts >= self.max_attempts:
+            status = 'fail'
+
+        if error is True:
+            error = 'Sync failed, please check the Exact Online log'
+
+        # An item added again during the sync is retried right away instead
+        db(self._get_unchanged_query(row)).update(
+            Status = status,
+            Attempts = attempts,
+            NextAttemptOn = datetime.datetime.now() + self._get_retry_delay(attempts),
+            LastError = error
+        )
+
+
+    def _process_item(self, os_eo, row):
+        """
+        :param os_eo: OSExactOnline object
+        :param row: gluon.dal.row - db.integration_exact_online_queue record
+        :return: False when synced, otherwise True or an error message
+        """
+        if row.ObjectName == 'invoice':
+            return self._process_invoice(os_eo, row)
+        elif row.ObjectName == 'relation':
+            return self._process_relation(os_eo, row)
+        elif row.ObjectName == 'bankaccount':
+            return self._process_bankaccount(os_eo, row)
+        elif row.ObjectName == 'mandate':
+            return self._process_mandate(os_eo, row)
+
+        return 'Unknown object: ' + unicode(row.ObjectName)
+
+
+    def _process_invoice(self, os_eo, row):
+        """
+        Create or update sales entry for invoice
+        """
+        from os_invoice import Invoice
+
+        db = current.db
+
+        if not db.invoices(row.ObjectID):
+            return False # Invoice was removed, nothing to sync
+
+        invoice = Invoice(row.ObjectID)
+        if not invoice.invoice_group.JournalID:
+            os_eo._log_error(
+                'update',
+                'invoice',
+                invoice.invoices_id,
+                'No JournalID specified for invoice group'
+            )
+            return 'No JournalID specified for invoice group'
+
+        return os_eo.update_sales_entry(invoice)
+
+
+    def _process_relation(self, os_eo, row):
+        """
+        Create or update relation for customer
+        """
+        from os_customer import Customer
+
+        db = current.db
+
+        if not db.auth_user(row.ObjectID):
+            return False
+
+        customer = Customer(row.ObjectID)
+        if not customer.row.exact_online_relation_id:
+            return not os_eo.create_relation(customer)
+
+        result = os_eo.update_relation(customer)
+
+        return result['error']
+
+
+    def _process_bankaccount(self, os_eo, row):
+        """
+        Create or update bank account for customer payment info
+        """
+        from os_customer import Customer
+        from os_customers_payment_info import OsCustomersPaymentInfo
+
+        db = current.db
+
+        if not db.customers_payment_info(row.ObjectID):
+            return False
+
+        cpi = OsCustomersPaymentInfo(row.ObjectID)
+        customer = Customer(cpi.row.auth_customer_id)
+
+        if row.ActionName == 'create':
+            return not os_eo.create_bankaccount(customer, cpi)
+
+        return os_eo.update_bankaccount(customer, cpi)
+
+
+    def _process_mandate(self, os_eo, row):
+        """
+        Create or delete direct debit mandate
+        """
+        from os_customers_payment_info import OsCustomersPaymentInfo
+        from os_customers_payment_info_mandate import OsCustomersPaymentInfoMandate
+
+        db = current.db
+
+        if row.ActionName == 'delete':
+            return os_eo.delete_dd_mandate(row.ActionData)
+
+        if not db.customers_payment_info_mandates(row.ObjectID):
+            return False
+
+        cpim = OsCustomersPaymentInfoMandate(row.ObjectID)
+        if cpim.row.exact_online_directdebitmandates_id:
+            return False # Already created
+
+        cpi = OsCustomersPaymentInfo(cpim.row.customers_payment_info_id)
+
+        return not os_eo.create_dd_mandate(cpi, cpim)
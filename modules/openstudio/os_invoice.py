@@ -38,27 +38,15 @@ class Invoice:
         """
         functions to be called when updating an invoice or invoice items
         """
-        from tools import OsTools
-        from os_exact_online import OSExactOnline
-
-        os_tools = OsTools()
-        eo_authorized = os_tools.get_sys_property('exact_online_authorized')
+        from os_exact_online_queue import OSExactOnlineQueue
 
         # Set last updated datetime
         self._set_updated_at()
 
-        # Exact online integration
-        if eo_authorized == 'True':
-            os_eo = OSExactOnline()
-            if not self.invoice_group.JournalID:
-                os_eo._log_error(
-                    'update',
-                    'invoice',
-                    self.invoices_id,
-                    'No JournalID specified for invoice group'
-                )
-            else:
-                os_eo.update_sales_entry(self)
+        # Exact online integration, synced by the exact_online_process_queue task
+        eo_queue = OSExactOnlineQueue()
+        if eo_queue.is_authorized():
+            eo_queue.add('invoice', self.invoices_id)
 
 
     def _set_updated_at(self):
@@ -116,6 +104,16 @@ class Invoice:
         """
             Returns the number for an invoice
         """
+        db = current.db
+
+        # Increment NextID before reading it, the update locks the invoice
+        # group until the transaction is committed, so numbers can't be used
+        # twice by invoices created at the same time or by
+        # Invoices.reserve_invoice_ids()
+        query = (db.invoices_groups.id == self.invoice_group.id)
+        db(query).update(NextID = db.invoices_groups.NextID + 1)
+        self.invoice_group = db(query).select(db.invoices_groups.ALL).first()
+
         invoice_id = self.invoice_group.InvoicePrefix
 
         if self.invoice_group.PrefixYear:
@@ -125,10 +123,7 @@ class Invoice:
             # Check if NextID should be reset
             self._get_next_invoice_id_year_prefix_reset_numbering()
 
-        invoice_id += unicode(self.invoice_group.NextID)
-
-        self.invoice_group.NextID += 1
-        self.invoice_group.update_record()
+        invoice_id += unicode(self.invoice_group.NextID - 1)
 
         return invoice_id
 
@@ -151,8 +146,9 @@ class Invoice:
         invoices_for_this_group_in_year = db(query).count()
 
         if invoices_for_this_group_in_year == 1:
-            # This is the first invoice in this group for this year
-            self.invoice_group.NextID = 1
+            # This is the first invoice in this group for this year, it gets
+            # number 1
+            self.invoice_group.NextID = 2
             self.invoice_group.update_record()
 
 
@@ -801,9 +797,9 @@ class Invoice:
         ##
         # Check if a registration fee should be added
         ##
-        query = (((db.customers_subscriptions.auth_customer_id == cs.auth_customer_id) &
-                 (db.customers_subscriptions.id != cs.csID) &
-                 (db.customers_subscriptions.school_subscriptions_id == cs.ssuID)) |
+        query = (db.customers_subscriptions.auth_customer_id == cs.auth_customer_id) & \
+                (((db.customers_subscriptions.id != cs.csID) &
+                  (db.customers_subscriptions.school_subscriptions_id == cs.ssuID)) |
                  (db.customers_subscriptions.RegistrationFeePaid == True))
 
         fee_paid_in_past = db(query).count()
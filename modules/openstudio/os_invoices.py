@@ -636,3 +636,41 @@ class Invoices:
                                    tooltip=T('Add payment'))
 
         return button
+
+
+    def reserve_invoice_ids(self, igID, count):
+        """
+            Reserves a block of invoice numbers for an invoice group.
+            Numbering works the same as Invoice._get_next_invoice_id(), but
+            invoices_groups.NextID is only updated once for the whole block.
+        :param igID: db.invoices_groups.id
+        :param count: int - number of invoice numbers to reserve
+        :return: list of strings - db.invoices.InvoiceID
+        """
+        db = current.db
+        TODAY_LOCAL = current.TODAY_LOCAL
+
+        # Increment NextID before reading it, the update locks the invoice
+        # group until the transaction is committed. Invoices created
+        # meanwhile wait and then read the new NextID.
+        group_query = (db.invoices_groups.id == igID)
+        db(group_query).update(NextID = db.invoices_groups.NextID + count)
+
+        invoice_group = db(group_query).select(db.invoices_groups.ALL).first()
+
+        prefix = invoice_group.InvoicePrefix or ''
+        next_id = invoice_group.NextID - count
+
+        if invoice_group.PrefixYear:
+            year = TODAY_LOCAL.year
+            prefix += unicode(year)
+
+            # Reset numbering when there are no invoices in this group this year
+            query = (db.invoices.DateCreated >= datetime.date(year, 1, 1)) & \
+                    (db.invoices.DateCreated <= datetime.date(year, 12, 31)) & \
+                    (db.invoices.invoices_groups_id == igID)
+            if not db(query).count():
+                next_id = 1
+                db(group_query).update(NextID = next_id + count)
+
+        return [ prefix + unicode(i) for i in range(next_id, next_id + count) ]
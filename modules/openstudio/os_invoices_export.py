@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+
+from gluon import *
+
+
+class InvoicesExport:
+    """
+        Exports invoice items and payments for a period.
+        Rows are read in chunks using keyset pagination on indexed columns and
+        written to the given file as they come in, so large exports don't need
+        to fit in memory.
+    """
+    def __init__(self, chunk_size=1000):
+        """
+        :param chunk_size: int - number of invoices (invoice export) or
+        payments (payment export) to read per query
+        """
+        self.chunk_size = chunk_size
+
+
+    def _encode_row(self, row):
+        """
+        :param row: tuple
+        :return: list with unicode values encoded as utf-8
+        """
+        unicode_list = []
+        for item in row:
+            try:
+                unicode_list.append(item.encode('utf-8'))
+            except:
+                unicode_list.append(item)
+
+        return unicode_list
+
+
+    def _get_writer(self, stream, filetype, title):
+        """
+        :param stream: file like object
+        :param filetype: 'excel' or 'tsv'
+        :param title: string - title of the excel worksheet
+        :return: tuple (function to write a row, function to call when done)
+        """
+        if filetype == 'excel':
+            import openpyxl
+
+            wb = openpyxl.workbook.Workbook(write_only=True)
+            ws = wb.create_sheet(title=title)
+
+            return ws.append, lambda: wb.save(stream)
+        else:
+            import csv
+
+            csv_writer = csv.writer(stream, delimiter='\t')
+
+            return csv_writer.writerow, lambda: None
+
+
+    def _get_payment_dates(self, invoice_ids):
+        """
+        :param invoice_ids: list of db.invoices.id
+        :return: dict {db.invoices.id: payment dates separated by ', '}
+        """
+        db = current.db
+
+        if not invoice_ids:
+            return {}
+
+        query = (db.invoices_payments.invoices_id.belongs(invoice_ids))
+        rows = db(query).select(db.invoices_payments.invoices_id,
+                                db.invoices_payments.PaymentDate,
+                                orderby=db.invoices_payments.invoices_id|\
+                                        db.invoices_payments.PaymentDate)
+
+        payment_dates = {}
+        for row in rows:
+            payment_dates.setdefault(row.invoices_id, []).append(unicode(row.PaymentDate))
+
+        return dict([ (iID, ', '.join(dates)) for iID, dates in payment_dates.iteritems() ])
+
+
+    def invoices(self,
+                 stream,
+                 from_date,
+                 until_date,
+                 invoices_groups_id,
+                 filetype='excel',
+                 include_subscriptions=True):
+        """
+        Write invoice items to stream, in chunks of invoices ordered by id.
+        Within a chunk items are ordered by InvoiceID & Sorting.
+        :param stream: file like object
+        :param from_date: datetime.date
+        :param until_date: datetime.date
+        :param invoices_groups_id: db.invoices_groups.id
+        :param filetype: 'excel' or 'tsv'
+        :param include_subscriptions: Boolean
+        :return: int - number of rows written
+        """
+        db = current.db
+
+        write, done = self._get_writer(stream, filetype, 'Invoices')
+
+        write([
+            'InvoiceID',
+            'CustomerID',
+            'Customer Name',
+            'Business',
+            'Date Created',
+            'Date Due',
+            'Status',
+            'Description',
+            'G/L Account',
+            'Costcenter',
+            'Item #',
+            'Item Name',
+            'Item Description',
+            'Qty',
+            'Price (each)',
+            'Tax %',
+            'Tax name',
+            'Total excl. VAT',
+            'VAT',
+            'Total incl. VAT',
+            'Payment Method',
+            'School SubscriptionID',
+            'School Subscription Name',
+            'Subscription Year',
+            'Subscription Month',
+            'Payment date(s)'
+        ])
+
+        where_query = "i.DateCreated >= '{from_date}'".format(from_date=from_date)
+
+        if until_date:
+            where_query += " AND i.DateCreated <= '{until_date}'".format(until_date=until_date)
+
+        if invoices_groups_id:
+            where_query += " AND i.invoices_groups_id = {invoices_groups_id}".format(
+                invoices_groups_id=int(invoices_groups_id)
+            )
+
+        if not include_subscriptions:
+            where_query += " AND cs.id IS NULL"
+
+        count = 0
+        last_id = 0
+        while True:
+            # Select a chunk of invoices continuing after the last invoice of
+            # the previous chunk, this uses the primary key of invoices
+            query = '''
+            SELECT DISTINCT i.id
+            FROM invoices i
+            LEFT JOIN invoices_customers_subscriptions ics ON ics.invoices_id = i.id
+            LEFT JOIN customers_subscriptions cs ON ics.customers_subscriptions_id = cs.id
+            WHERE {where_query} AND i.id > {last_id}
+            ORDER BY i.id
+            LIMIT {limit}
+            '''.format(
+                where_query=where_query,
+                last_id=int(last_id),
+                limit=self.chunk_size
+            )
+
+            invoice_ids = [ row[0] for row in db.executesql(query) ]
+            if not invoice_ids:
+                break
+
+            query = '''
+            SELECT i.InvoiceID,
+                   au.id,
+                   au.display_name,
+                   CASE WHEN au.business = 'F' THEN "No" ELSE "Yes" END AS Business,
+                   i.DateCreated,
+                   i.DateDue,
+                   i.Status,
+                   i.Description,
+                   ii.accounting_glaccounts_id,
+                   ii.accounting_costcenters_id,
+                   ii.Sorting,
+                   ii.ProductName,
+                   ii.Description,
+                   ii.Quantity,
+                   ii.Price,
+                   tr.Percentage,
+                   tr.Name,
+                   ii.TotalPrice,
+                   ii.VAT,
+                   ii.TotalPriceVAT,
+                   pm.Name,
+                   ssu.id as ssuID,
+                   ssu.Name,
+                   i.SubscriptionYear,
+                   i.SubscriptionMonth,
+                   i.id
+            FROM invoices_items ii
+            LEFT JOIN invoices i on ii.invoices_id = i.id
+            LEFT JOIN invoices_customers ic ON ic.invoices_id = i.id
+            LEFT JOIN invoices_customers_subscriptions ics ON ics.invoices_id = i.id
+            LEFT JOIN customers_subscriptions cs ON ics.customers_subscriptions_id = cs.id
+            LEFT JOIN school_subscriptions ssu ON cs.school_subscriptions_id = ssu.id
+            LEFT JOIN auth_user au ON ic.auth_customer_id = au.id
+            LEFT JOIN tax_rates tr ON ii.tax_rates_id = tr.id
+            LEFT JOIN payment_methods pm ON i.payment_methods_id = pm.id
+            WHERE ii.invoices_id IN ({ids})
+            ORDER BY i.InvoiceID, IFNULL(ii.Sorting, 0), ii.id
+            '''.format(ids=', '.join([ unicode(int(iID)) for iID in invoice_ids ]))
+
+            rows = db.executesql(query)
+            payment_dates = self._get_payment_dates(invoice_ids)
+
+            for row in rows:
+                line = list(row[:-1]) + [ payment_dates.get(row[-1]) ]
+                write(self._encode_row(line))
+
+            count += len(rows)
+            last_id = invoice_ids[-1]
+
+            if len(invoice_ids) < self.chunk_size:
+                break
+
+        done()
+
+        return count
+
+
+    def payments(self, stream, from_date, until_date, invoices_groups_id):
+        """
+        Write payments to stream as excel workbook, ordered by PaymentDate
+        :param stream: file like object
+        :param from_date: datetime.date
+        :param until_date: datetime.date
+        :param invoices_groups_id: db.invoices_groups.id
+        :return: int - number of rows written
+        """
+        db = current.db
+
+        write, done = self._get_writer(stream, 'excel', 'Payments')
+
+        write([
+            'Payment Date',
+            'Payment Method',
+            'Amount',
+            'InvoiceID',
+            'CustomerID',
+            'Customer Name',
+            'Date created',
+            'Date due',
+            'Description',
+            'Invoice Status',
+            'Invoice Amount',
+            'School SubscriptionID',
+            'School Subscription Name',
+            'Subscription Year',
+            'Subscription Month'
+        ])
+
+        where_query = "ip.PaymentDate >= '{from_date}'".format(from_date=from_date)
+
+        if until_date:
+            where_query += " AND ip.PaymentDate <= '{until_date}'".format(until_date=until_date)
+
+        if invoices_groups_id:
+            where_query += " AND i.invoices_groups_id = {invoices_groups_id}".format(
+                invoices_groups_id=int(invoices_groups_id)
+            )
+
+        count = 0
+        last = None
+        while True:
+            # Continue after the last row of the previous chunk
+            keyset_query = ''
+            if last:
+                # The first condition lets the database use the index on PaymentDate
+                keyset_query = """
+                AND ip.PaymentDate >= '{date}'
+                AND (ip.PaymentDate > '{date}' OR ip.id > {ipID})
+                """.format(date=last[0],
+                           ipID=int(last[1]))
+
+            query = '''
+            SELECT ip.PaymentDate,
+                   pm.Name,
+                   ip.Amount,
+                   i.InvoiceID,
+                   au.id,
+                   au.display_name,
+                   i.DateCreated,
+                   i.DateDue,
+                   i.Description,
+                   i.Status,
+                   ia.TotalPriceVAT,
+                   cs.school_subscriptions_id,
+                   ssu.Name,
+                   i.SubscriptionYear,
+                   i.SubscriptionMonth,
+                   ip.id
+            FROM invoices_payments ip
+            LEFT JOIN invoices i ON ip.invoices_id = i.id
+            LEFT JOIN invoices_amounts ia ON ia.invoices_id = ip.invoices_id
+            LEFT JOIN payment_methods pm ON ip.payment_methods_id = pm.id
+            LEFT JOIN invoices_customers_subscriptions ics ON ics.invoices_id = i.id
+            LEFT JOIN customers_subscriptions cs ON ics.customers_subscriptions_id = cs.id
+            LEFT JOIN school_subscriptions ssu ON cs.school_subscriptions_id = ssu.id
+            LEFT JOIN invoices_customers ic ON ic.invoices_id = i.id
+            LEFT JOIN auth_user au ON ic.auth_customer_id = au.id
+            WHERE {where_query} {keyset_query}
+            ORDER BY ip.PaymentDate, ip.id
+            LIMIT {limit}
+            '''.format(
+                where_query=where_query,
+                keyset_query=keyset_query,
+                limit=self.chunk_size
+            )
+
+            rows = db.executesql(query)
+            if not rows:
+                break
+
+            for row in rows:
+                write(list(row[:-1]))
+
+            count += len(rows)
+            last_row = rows[-1]
+            last = (last_row[0], last_row[-1])
+
+            if len(rows) < self.chunk_size:
+                break
+
+        done()
+
+        return count
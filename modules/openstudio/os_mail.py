@@ -39,15 +39,20 @@ class OsMail:
                           sys_notification,
                           customers_orders_id=None):
         """
-        :param msg_html: html message
-        :param msg_subject: email subject
-        :param email: address
-        :return: boolean: True if send, False if error sending
+        Add a notification to the mail outbox for each address set for it
+        :param sys_notification: db.sys_notification.Notification
+        :param customers_orders_id: db.customers_orders.id
+        :return: boolean: True if queued, False when there are no addresses
         """
+        from os_mail_outbox import OsMailOutbox
+
         T = current.T
-        MAIL = current.globalenv['MAIL']
+        db = current.db
 
         emails = self._send_notification_get_email_addresses(sys_notification)
+        if not emails:
+            return False
+
         message = self.render_sys_notification(
             sys_notification,
             customers_orders_id = customers_orders_id,
@@ -56,46 +61,41 @@ class OsMail:
         if sys_notification == 'order_created':
             msg_subject = T("New order")
 
-        status_report = []
+        msgID = db.messages.insert(
+            msg_subject = msg_subject,
+            msg_content = message
+        )
+
+        outbox = OsMailOutbox()
         for email in emails:
-            status_report = MAIL.send(
-                to=email,
-                subject=msg_subject,
-                message=message
-            )
+            outbox.add(msgID, email)
 
-        return status_report
+        return True
 
 
     def send(self, msgID, cuID): # Used to be 'mail_customer()'
         """
-            Send a message to a customer
-            returns True when a mail is sent and False when it failed
+            Add a message to a customer to the mail outbox, it's sent by the
+            sys_mail_outbox_process scheduler task. With the 'logging' mail
+            server it's logged right away.
+            returns True when the message is queued and False when the
+            customer doesn't have an email address
         """
+        from os_mail_outbox import OsMailOutbox
+
         db = current.db
-        MAIL = current.globalenv['MAIL']
 
         customer = db.auth_user(cuID)
-        message = db.messages(msgID)
-
-        check = MAIL.send(
-        to=customer.email,
-        subject=message.msg_subject,
-        # If reply_to is omitted, then mail.settings.sender is used
-        reply_to=None,
-        message=message.msg_content)
-
-        if check:
-            status = 'sent'
-            rvalue = True
-        else:
-            status = 'fail'
-            rvalue = False
-        db.customers_messages.insert(auth_customer_id = cuID,
-                                     messages_id      = msgID,
-                                     Status           = status)
+        if not customer.email:
+            db.customers_messages.insert(auth_customer_id = cuID,
+                                         messages_id      = msgID,
+                                         Status           = 'fail')
+            return False
 
-        return rvalue
+        outbox = OsMailOutbox()
+        outbox.add(msgID, customer.email, cuID=cuID)
+
+        return True
 
 
     def _send_notification_get_email_addresses(self, sys_notification):
@@ -190,15 +190,10 @@ class OsMail:
             :param invoices_id: db.invoices_payments_id
             :return: mail body for invoice
         """
-        db = current.db
-        T = current.T
-        DATE_FORMAT = current.DATE_FORMAT
+        get_sys_property = current.globalenv['get_sys_property']
 
         # get hostname
-        sys_hostname = None
-        row = db.sys_properties(Property='sys_hostname')
-        if row:
-            sys_hostname = row.PropertyValue
+        sys_hostname = get_sys_property('sys_hostname') or None
 
         # TODO: Add to manual & button on page available variables;
         return XML(template_content.format(
@@ -212,13 +207,10 @@ class OsMail:
         :param workshops_products_id: db.workshops_products.id
         :return: mail body for workshop
         """
-        from os_customer import Customer
-
         db = current.db
         T = current.T
         DATE_FORMAT = current.DATE_FORMAT
         TIME_FORMAT = current.TIME_FORMAT
-        customer = Customer(wspc.auth_customer_id)
 
         try:
             time_info = TR(TH(T('Date')),
@@ -252,42 +244,41 @@ class OsMail:
         )
 
 
-    def render_email_template(self,
-                              email_template,
-                              title='',
-                              subject='',
-                              description='',
-                              comments='',
-                              template_content=None,
-                              customers_orders_id=None,
-                              invoices_id=None,
-                              invoices_payments_id=None,
-                              workshops_products_customers_id=None,
-                              return_html=False):
+    def _get_email_template_layout(self, email_template):
         """
-            Renders default email template
-            uses the render function from gluon.template instead of response.render
-            response throws a RestrictedError when run from the scheduler or shell...
-            and we do want scheduled emails to be rendered :)
+        :param email_template: db.sys_email_templates.Name
+        :return: string - file name of layout in views/templates/email
+        """
+        if (email_template == 'sys_verify_email' or
+            email_template == 'sys_reset_password'):
+            return 'default_simple.html'
+
+        return 'default.html'
+
+
+    def _render_compiled_email_template(self,
+                                        template,
+                                        logo,
+                                        email_template,
+                                        title='',
+                                        subject='',
+                                        description='',
+                                        comments='',
+                                        template_content=None,
+                                        customers_orders_id=None,
+                                        invoices_id=None,
+                                        invoices_payments_id=None,
+                                        workshops_products_customers_id=None):
+        """
+        :param template: OsMailTemplate
+        :param logo: logo for email template
+        :return: tuple (subject, html message)
         """
-        # from gluon.template import parse_template
-        from gluon.template import render
-
         db = current.db
         T = current.T
-        DATETIME_FORMAT = current.DATETIME_FORMAT
-
-        get_sys_property = current.globalenv['get_sys_property']
-        request = current.request
-
-        logo = self._render_email_template_get_logo()
 
-        template_name = 'default.html'
-        template_path = os.path.join(request.folder, 'views', 'templates', 'email')
-        # Get template
         if template_content is None:
-            # Get email template from db
-            template_content = self.get_email_template(email_template)
+            template_content = template.template_content
 
         # Render template
         if email_template == 'order_received':
@@ -322,39 +313,59 @@ class OsMail:
             result = self._render_email_workshops_info_mail(wspc, wsp, ws)
             content = result['content']
             description = result['description']
-            
-        elif (email_template == 'sys_verify_email' or
-              email_template == 'sys_reset_password'):
-            template_name = 'default_simple.html'
-            content = XML(template_content)
-            subject = subject
 
         else:
-            template_name = 'default.html'
             content = XML(template_content)
-            subject = subject
-
-        footer = XML(self.get_email_template('sys_email_footer'))
 
-        template = os.path.join(
-            template_path,
-            template_name
-        )
-
-        context = dict(
+        message = template.render(
             logo = logo,
             title = title,
             description = description,
             content = content,
-            comments = comments,
-            footer = footer,
-            request = request
+            comments = comments
         )
 
-        message = render(
-            filename = template,
-            path = template_path,
-            context = context
+        return subject, message
+
+
+    def render_email_template(self,
+                              email_template,
+                              title='',
+                              subject='',
+                              description='',
+                              comments='',
+                              template_content=None,
+                              customers_orders_id=None,
+                              invoices_id=None,
+                              invoices_payments_id=None,
+                              workshops_products_customers_id=None,
+                              return_html=False):
+        """
+            Renders default email template
+            The layout is rendered using gluon.template by OsMailTemplate,
+            response.render throws a RestrictedError when run from the
+            scheduler or shell... and we do want scheduled emails to be rendered :)
+        """
+        from os_mail_template import OsMailTemplate
+
+        db = current.db
+
+        template = OsMailTemplate(email_template,
+                                  self._get_email_template_layout(email_template))
+
+        subject, message = self._render_compiled_email_template(
+            template,
+            self._render_email_template_get_logo(),
+            email_template,
+            title = title,
+            subject = subject,
+            description = description,
+            comments = comments,
+            template_content = template_content,
+            customers_orders_id = customers_orders_id,
+            invoices_id = invoices_id,
+            invoices_payments_id = invoices_payments_id,
+            workshops_products_customers_id = workshops_products_customers_id
         )
 
         if return_html:
@@ -368,6 +379,61 @@ class OsMail:
             return msgID
 
 
+    def _get_email_template_render_key(self, email_template, item):
+        """
+        :param email_template: db.sys_email_templates.Name
+        :param item: dict - keyword arguments for render_email_template
+        :return: tuple - items with the same key render the same message
+        """
+        db = current.db
+
+        if email_template == 'workshops_info_mail':
+            # The info mail is the same for all customers of a product
+            wspc = db.workshops_products_customers(item['workshops_products_customers_id'])
+            return ('workshops_products_id', wspc.workshops_products_id)
+
+        return tuple(sorted(item.items()))
+
+
+    def render_email_template_batch(self, email_template, items):
+        """
+        Render many messages using one compiled template. Each distinct message
+        is rendered and stored only once; messages to customers can share a
+        db.messages row.
+        :param email_template: db.sys_email_templates.Name
+        :param items: list of dicts - keyword arguments for render_email_template
+        for each message eg. [ {'workshops_products_customers_id': 1}, ... ]
+        :return: list of db.messages.id in the same order as items
+        """
+        from os_mail_template import OsMailTemplate
+
+        db = current.db
+
+        template = OsMailTemplate(email_template,
+                                  self._get_email_template_layout(email_template))
+        logo = self._render_email_template_get_logo()
+
+        messages = {}
+        msgIDs = []
+        for item in items:
+            key = self._get_email_template_render_key(email_template, item)
+            if key not in messages:
+                subject, message = self._render_compiled_email_template(
+                    template,
+                    logo,
+                    email_template,
+                    **item
+                )
+                messages[key] = db.messages.insert(
+                    msg_content = message,
+                    msg_subject = subject
+                )
+
+            msgIDs.append(messages[key])
+
+        return msgIDs
+
+
     def render_sys_notification(self,
                                 sys_notification,
                                 title='',
@@ -392,7 +458,7 @@ class OsMail:
         :param workshops_products_customers_id: db.workshops_products_customers.id
         :return: html message for sys_notification
         """
-        from gluon.template import render
+        from os_mail_template import OsMailTemplate
 
         T = current.T
         db = current.db
@@ -462,30 +528,15 @@ class OsMail:
                     XML(order.order.CustomerNote.replace('\n', '<br>'))
                 )
 
-        context = dict(
-            logo=logo,
-            title=title,
-            description=description,
-            content=content,
-            comments=comments,
-            footer='',
-            request=request
-        )
-
-        template_name = 'default.html'
-        template_path = os.path.join(request.folder, 'views', 'templates', 'email')
-        template = os.path.join(
-            template_path,
-            template_name
-        )
-
-        message = render(
-            filename = template,
-            path = template_path,
-            context = context
+        template = OsMailTemplate()
+        message = template.render(
+            logo = logo,
+            title = title,
+            description = description,
+            content = content,
+            comments = comments
         )
 
-
         return message
 
 
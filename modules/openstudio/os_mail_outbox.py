@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+
+import time
+import datetime
+
+from gluon import *
+
+
+class OsMailOutbox:
+    """
+        Outbox for mail. Messages are added to db.sys_mail_outbox during a
+        request and sent by the sys_mail_outbox_process scheduler task, which
+        uses one SMTP connection for each batch of messages. Failed messages
+        are retried later with an increasing delay, until max_attempts is
+        reached. The status of messages to customers is kept up to date in
+        db.customers_messages. With the 'logging' mail server, used in
+        development and tests, messages are logged by gluon.tools.Mail as soon
+        as they're added, so no worker is needed.
+    """
+    # Minutes to wait before retrying a message after the first failure,
+    # this doubles for each following failure up to max_retry_delay
+    retry_delay = 5
+    max_retry_delay = 60 * 6
+    max_attempts = 6
+
+    # Minutes a message is claimed by a running task, it's sent again after
+    # this time when the task stopped before recording the result
+    claim_time = 30
+
+
+    def __init__(self, server=None, messages_per_minute=None):
+        """
+        :param server: string - SMTP server as 'host:port', defaults to
+        mail.settings.server. Tests can pass a local SMTP server here.
+        :param messages_per_minute: int - max number of messages to send per
+        minute, defaults to smtp.messages_per_minute in appconfig.ini
+        (no limit when not set)
+        """
+        MAIL = current.globalenv['MAIL']
+        myconf = current.globalenv['myconf']
+
+        self.settings = MAIL.settings
+        self.server = server or self.settings.server
+
+        if messages_per_minute is None:
+            messages_per_minute = myconf.get('smtp.messages_per_minute')
+        self.interval = 0
+        if messages_per_minute:
+            self.interval = 60.0 / int(messages_per_minute)
+        self._next_message = 0
+
+
+    def add(self, msgID, email, cuID=None):
+        """
+        Add a message to the outbox
+        :param msgID: db.messages.id
+        :param email: string - email address
+        :param cuID: db.auth_user.id - set to keep track of messages to a customer
+        :return: db.sys_mail_outbox.id
+        """
+        db = current.db
+
+        cumID = None
+        if cuID:
+            cumID = db.customers_messages.insert(
+                auth_customer_id = cuID,
+                messages_id = msgID,
+                Status = 'queued'
+            )
+
+        smoID = db.sys_mail_outbox.insert(
+            messages_id = msgID,
+            customers_messages_id = cumID,
+            MailTo = email,
+            NextAttemptOn = datetime.datetime.now()
+        )
+
+        if self.server == 'logging':
+            self._send_now(smoID)
+        else:
+            self._queue_task()
+
+        return smoID
+
+
+    def _send_now(self, smoID):
+        """
+        Send a message in the outbox right away using gluon.tools.Mail
+        :param smoID: db.sys_mail_outbox.id
+        :return: None
+        """
+        db = current.db
+
+        left = [ db.messages.on(db.sys_mail_outbox.messages_id == db.messages.id) ]
+        row = db(db.sys_mail_outbox.id == smoID).select(
+            db.sys_mail_outbox.ALL,
+            db.messages.msg_subject,
+            db.messages.msg_content,
+            left=left
+        ).first()
+
+        error = self._send(None, row)
+        if error:
+            self._set_failed(row, error)
+            self._queue_retry()
+        else:
+            self._set_sent(row)
+
+
+    def _queue_task(self, start_time=None):
+        """
+        Queue the sys_mail_outbox_process task, unless it's already queued to
+        start before start_time. Running tasks aren't taken into account, they
+        might have selected their last batch already.
+        :param start_time: datetime.datetime - don't run the task before this time
+        :return: None
+        """
+        db = current.db
+        scheduler = current.globalenv['scheduler']
+
+        if start_time is None:
+            start_time = datetime.datetime.now()
+
+        query = (db.scheduler_task.function_name == 'sys_mail_outbox_process') & \
+                (db.scheduler_task.status == 'QUEUED') & \
+                (db.scheduler_task.start_time <= start_time)
+        if not db(query).count():
+            scheduler.queue_task('sys_mail_outbox_process',
+                                 start_time=start_time,
+                                 timeout=1800)
+
+
+    def _get_retry_delay(self, attempts):
+        """
+        :param attempts: int - number of failed attempts
+        :return: datetime.timedelta
+        """
+        minutes = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+
+        return datetime.timedelta(minutes=minutes)
+
+
+    def _get_batch(self, batch_size):
+        """
+        :param batch_size: int - max number of messages
+        :return: gluon.dal.rows - messages due to be sent, oldest first
+        """
+        db = current.db
+
+        left = [ db.messages.on(db.sys_mail_outbox.messages_id == db.messages.id) ]
+        query = (db.sys_mail_outbox.Status == 'pending') & \
+                (db.sys_mail_outbox.NextAttemptOn <= datetime.datetime.now())
+
+        return db(query).select(
+            db.sys_mail_outbox.ALL,
+            db.messages.msg_subject,
+            db.messages.msg_content,
+            left=left,
+            orderby=db.sys_mail_outbox.id,
+            limitby=(0, batch_size)
+        )
+
+
+    def _connect(self):
+        """
+        :return: smtplib.SMTP - connection to the SMTP server, logged in when
+                 a login is set
+        """
+        import smtplib
+
+        host, port = self.server, None
+        if ':' in self.server:
+            host, port = self.server.rsplit(':', 1)
+            port = int(port)
+
+        if self.settings.ssl:
+            smtp = smtplib.SMTP_SSL(host, port)
+        else:
+            smtp = smtplib.SMTP(host, port)
+
+        if self.settings.tls:
+            smtp.ehlo()
+            smtp.starttls()
+            smtp.ehlo()
+
+        if self.settings.login:
+            username, password = self.settings.login.split(':', 1)
+            smtp.login(username, password)
+
+        return smtp
+
+
+    def _get_mime_message(self, row):
+        """
+        :param row: gluon.dal.row - outbox message joined with db.messages
+        :return: string - message to send
+        """
+        from email.header import Header
+        from email.mime.text import MIMEText
+        from email.utils import formatdate, make_msgid
+
+        subject = row.messages.msg_subject or ''
+        content = row.messages.msg_content or ''
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+
+        # Like gluon.tools.Mail, send messages starting with <html as html
+        subtype = 'plain'
+        if content.strip().startswith('<html'):
+            subtype = 'html'
+
+        message = MIMEText(content, subtype, 'utf-8')
+        try:
+            message['Subject'] = subject.encode('ascii')
+        except UnicodeError:
+            message['Subject'] = Header(subject, 'utf-8')
+        message['From'] = self.settings.sender
+        message['To'] = row.sys_mail_outbox.MailTo
+        message['Date'] = formatdate(localtime=True)
+        message['Message-Id'] = make_msgid()
+
+        return message.as_string()
+
+
+    def _wait_for_rate_limit(self):
+        """
+        Sleep until sending the next message is allowed
+        :return: None
+        """
+        if not self.interval:
+            return
+
+        now = time.time()
+        if self._next_message > now:
+            time.sleep(self._next_message - now)
+
+        self._next_message = max(now, self._next_message) + self.interval
+
+
+    def _send(self, smtp, row):
+        """
+        :param smtp: smtplib.SMTP connection, None when using gluon.tools.Mail
+        :param row: gluon.dal.row - outbox message joined with db.messages
+        :return: None when sent, otherwise an error message
+        """
+        MAIL = current.globalenv['MAIL']
+
+        self._wait_for_rate_limit()
+
+        if smtp is None:
+            sent = MAIL.send(to=row.sys_mail_outbox.MailTo,
+                             subject=row.messages.msg_subject,
+                             reply_to=None,
+                             message=row.messages.msg_content)
+            if not sent:
+                return unicode(MAIL.error) or 'Unable to send mail'
+
+            return None
+
+        refused = smtp.sendmail(self.settings.sender,
+                                [ row.sys_mail_outbox.MailTo ],
+                                self._get_mime_message(row))
+        if refused:
+            return unicode(refused)
+
+        return None
+
+
+    def _claim(self, row):
+        """
+        Claim a message, so other tasks running at the same time skip it
+        :param row: gluon.dal.row - outbox message joined with db.messages
+        :return: Boolean - True when claimed by this task
+        """
+        db = current.db
+
+        query = (db.sys_mail_outbox.id == row.sys_mail_outbox.id) & \
+                (db.sys_mail_outbox.Status == 'pending') & \
+                (db.sys_mail_outbox.NextAttemptOn == row.sys_mail_outbox.NextAttemptOn)
+        claimed = db(query).update(
+            NextAttemptOn = datetime.datetime.now() +
+                            datetime.timedelta(minutes=self.claim_time)
+        )
+        db.commit()
+
+        return bool(claimed)
+
+
+    def _set_sent(self, row):
+        """
+        :param row: gluon.dal.row - outbox message joined with db.messages
+        :return: None
+        """
+        db = current.db
+
+        db(db.sys_mail_outbox.id == row.sys_mail_outbox.id).update(
+            Status = 'sent',
+            Attempts = (row.sys_mail_outbox.Attempts or 0) + 1,
+            SentOn = datetime.datetime.now(),
+            LastError = None
+        )
+
+        cumID = row.sys_mail_outbox.customers_messages_id
+        if cumID:
+            db(db.customers_messages.id == cumID).update(Status='sent')
+
+
+    def _set_failed(self, row, error):
+        """
+        Schedule next attempt for a message, or mark it as failed when it
+        has been tried max_attempts times
+        :param row: gluon.dal.row - outbox message joined with db.messages
+        :param error: string
+        :return: None
+        """
+        db = current.db
+
+        attempts = (row.sys_mail_outbox.Attempts or 0) + 1
+        status = 'pending'
+        if attempts >= self.max_attempts:
+            status = 'fail'
+
+        db(db.sys_mail_outbox.id == row.sys_mail_outbox.id).update(
+            Status = status,
+            Attempts = attempts,
+            NextAttemptOn = datetime.datetime.now() + self._get_retry_delay(attempts),
+            LastError = error
+        )
+
+        cumID = row.sys_mail_outbox.customers_messages_id
+        if cumID and status == 'fail':
+            db(db.customers_messages.id == cumID).update(Status='fail')
+
+
+    def _queue_retry(self):
+        """
+        Queue the task again for the first message that's to be retried
+        :return: None
+        """
+        db = current.db
+
+        query = (db.sys_mail_outbox.Status == 'pending')
+        row = db(query).select(db.sys_mail_outbox.NextAttemptOn,
+                               orderby=db.sys_mail_outbox.NextAttemptOn,
+                               limitby=(0, 1)).first()
+        if row:
+            self._queue_task(start_time=row.NextAttemptOn)
+
+
+    def process(self, batch_size=50, max_items=None):
+        """
+        Send messages in the outbox. Each batch of messages is sent using one
+        SMTP connection. The status of each message is committed as soon as
+        it's been sent, so a message isn't sent again when the task stops.
+        :param batch_size: int - number of messages per batch
+        :param max_items: int - max number of messages to process, None for all
+        :return: dict(sent=int, errors=int)
+        """
+        import smtplib
+
+        db = current.db
+
+        sent = 0
+        errors = 0
+
+        # Processed messages are either sent or scheduled for a later attempt,
+        # so each batch only holds new messages
+        processed = 0
+        server_available = True
+        while server_available and (max_items is None or processed < max_items):
+            if max_items is not None:
+                batch_size = min(batch_size, max_items - processed)
+
+            rows = self._get_batch(batch_size)
+            if not rows:
+                break
+
+            smtp = None
+            try:
+                if self.server != 'logging':
+                    smtp = self._connect()
+            except (smtplib.SMTPException, IOError) as e:
+                # Server unavailable, try the whole batch again later
+                for row in rows:
+                    self._set_failed(row, unicode(e) or e.__class__.__name__)
+                errors += len(rows)
+                db.commit()
+                break
+
+            for i, row in enumerate(rows):
+                processed += 1
+
+                if not self._claim(row):
+                    # Processed by another task
+                    continue
+
+                try:
+                    error = self._send(smtp, row)
+                except smtplib.SMTPServerDisconnected as e:
+                    error = unicode(e) or e.__class__.__name__
+                    try:
+                        smtp = self._connect()
+                    except (smtplib.SMTPException, IOError) as e:
+                        # Server unavailable, try the rest of the batch again later
+                        smtp = None
+                        server_available = False
+                        connect_error = unicode(e) or e.__class__.__name__
+                except (smtplib.SMTPException, IOError) as e:
+                    # Keep going with the rest of the batch, this message is retried later
+                    error = unicode(e) or e.__class__.__name__
+
+                if error:
+                    self._set_failed(row, error)
+                    errors += 1
+                else:
+                    self._set_sent(row)
+                    sent += 1
+                db.commit()
+
+                if not server_available:
+                    for row in rows[i + 1:]:
+                        self._set_failed(row, connect_error)
+                    processed += len(rows) - i - 1
+                    errors += len(rows) - i - 1
+                    db.commit()
+                    break
+
+            if smtp is not None:
+                try:
+                    smtp.quit()
+                except smtplib.SMTPException:
+                    pass
+
+        self._queue_retry()
+        db.commit()
+
+        return dict(sent=sent, errors=errors)
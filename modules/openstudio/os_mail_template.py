@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+
+from gluon import *
+from gluon.html import xmlescape
+
+
+class OsMailTemplate:
+    """
+        Email template compiled to render many messages. The layout in
+        views/templates/email is rendered once with markers for the values
+        that differ per message, and split into fixed parts. The compiled
+        template is cached by template id and update time, and cleared by
+        callbacks on db.sys_email_templates, so an edited template is
+        compiled again on first use. Rendering a message only fills in its
+        values.
+    """
+    variables = [ 'logo', 'title', 'description', 'content', 'comments' ]
+    marker = '[[os_mail_template:%s]]'
+    marker_regex = re.compile(r'\[\[os_mail_template:(\w+)\]\]')
+
+
+    def __init__(self, email_template=None, layout='default.html', cache=None):
+        """
+        :param email_template: db.sys_email_templates.Name, messages for email
+        templates include the sys_email_footer template. None to only use the
+        layout, eg. for notifications.
+        :param layout: string - file name in views/templates/email
+        :param cache: Boolean - cache the compiled template, None to cache
+        unless running tests
+        """
+        self.email_template = email_template
+        self.layout = layout
+        self.cache = cache
+
+        compiled = self._get_compiled()
+        self.template_content = compiled['template_content']
+        self.segments = compiled['segments']
+
+
+    def _get_template_names(self):
+        """
+        :return: list of db.sys_email_templates.Name used by this template
+        """
+        if self.email_template is None:
+            return []
+
+        return [ self.email_template, 'sys_email_footer' ]
+
+
+    def _get_version(self):
+        """
+        :return: string - id & update time of the templates used
+        """
+        db = current.db
+
+        names = self._get_template_names()
+        if not names:
+            return ''
+
+        query = (db.sys_email_templates.Name.belongs(names))
+        rows = db(query).select(db.sys_email_templates.id,
+                                db.sys_email_templates.UpdatedOn,
+                                orderby=db.sys_email_templates.id)
+
+        return '_'.join([ unicode(row.id) + ':' + unicode(row.UpdatedOn) for row in rows ])
+
+
+    def _get_compiled(self):
+        """
+        :return: dict(template_content, segments)
+        """
+        web2pytest = current.globalenv['web2pytest']
+        request = current.request
+
+        cache = self.cache
+        if cache is None:
+            # Don't cache when running tests
+            cache = not web2pytest.is_running_under_test(request, request.application)
+
+        if not cache:
+            return self._compile()
+
+        from os_cache_manager import OsCacheManager
+
+        cache_key = 'openstudio_mail_template_%s_%s_%s' % (self.email_template,
+                                                           self.layout,
+                                                           self._get_version())
+
+        return OsCacheManager().get_shared(cache_key,
+                                           self._compile,
+                                           ['sys_email_templates'],
+                                           time_expire=current.CACHE_LONG)
+
+
+    def _compile(self):
+        """
+        :return: dict(template_content, segments)
+        template_content is the content of the email template.
+        segments holds the fixed parts of the layout, with the names of
+        variables in between; at odd indexes.
+        """
+        from gluon.template import render
+
+        db = current.db
+        request = current.request
+
+        templates = {}
+        names = self._get_template_names()
+        if names:
+            query = (db.sys_email_templates.Name.belongs(names))
+            rows = db(query).select(db.sys_email_templates.Name,
+                                    db.sys_email_templates.TemplateContent)
+            for row in rows:
+                templates[row.Name] = row.TemplateContent
+
+        footer = ''
+        if self.email_template is not None:
+            footer = XML(templates.get('sys_email_footer') or '')
+
+        context = dict(
+            footer = footer,
+            request = request
+        )
+        for variable in self.variables:
+            context[variable] = XML(self.marker % variable)
+
+        template_path = os.path.join(request.folder, 'views', 'templates', 'email')
+        html = render(
+            filename = os.path.join(template_path, self.layout),
+            path = template_path,
+            context = context
+        )
+
+        return dict(
+            template_content = templates.get(self.email_template),
+            segments = self.marker_regex.split(html)
+        )
+
+
+    def render(self, **values):
+        """
+        :param values: values for the variables in the layout, helpers are
+        rendered as html, other values are escaped
+        :return: string - html message
+        """
+        parts = list(self.segments)
+        for i in range(1, len(parts), 2):
+            parts[i] = xmlescape(values.get(parts[i], ''))
+
+        return ''.join(parts)
@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+
+import time
+import datetime
+import threading
+
+from gluon import *
+
+
+class MollieRecurringCollector:
+    """
+        Creates invoices for a month for subscriptions paid using Mollie and
+        collects them using recurring payments.
+
+        The outcome for each subscription is stored in
+        db.customers_subscriptions_mollie_collections, which also serves as
+        checkpoint; a run that stopped can be resumed by running it again.
+        Requests to Mollie are sent by a pool of threads, limited to a number
+        of requests per second. The threads only talk to Mollie, all database
+        access is done from the calling thread.
+    """
+    def __init__(self, year, month, workers=4, requests_per_second=10, chunk_size=100):
+        """
+        :param year: int - year of subscription invoices
+        :param month: int - month of subscription invoices
+        :param workers: int - max number of concurrent requests to Mollie
+        :param requests_per_second: int - max number of requests to Mollie per second
+        :param chunk_size: int - number of collections to commit at once
+        """
+        get_sys_property = current.globalenv['get_sys_property']
+
+        self.year = int(year)
+        self.month = int(month)
+        self.workers = workers
+        self.interval = 1.0 / requests_per_second
+        self.chunk_size = chunk_size
+
+        self.currency = current.globalenv['CURRENCY']
+        self.webhook_url = URL('mollie', 'webhook',
+                               scheme='https',
+                               host=get_sys_property('sys_hostname'))
+
+        self._lock = threading.Lock()
+        self._next_request = 0
+
+        self.mollie = self._get_client()
+
+
+    def _get_client(self):
+        """
+        :return: mollie.api.client.Client
+        """
+        from mollie.api.client import Client
+
+        get_sys_property = current.globalenv['get_sys_property']
+
+        # Only set to test against a local server
+        api_endpoint = get_sys_property('mollie_api_endpoint') or None
+
+        mollie = Client(api_endpoint=api_endpoint)
+        mollie.set_api_key(get_sys_property('mollie_website_profile'))
+
+        return mollie
+
+
+    def _wait_for_rate_limit(self):
+        """
+        Sleep until the next request to Mollie is allowed
+        :return: None
+        """
+        with self._lock:
+            now = time.time()
+            wait = self._next_request - now
+            self._next_request = max(now, self._next_request) + self.interval
+
+        if wait > 0:
+            time.sleep(wait)
+
+
+    def _get_collections_query(self):
+        """
+        :return: gluon.dal.Query - collections for year & month
+        """
+        db = current.db
+
+        return (db.customers_subscriptions_mollie_collections.CollectionYear == self.year) & \
+               (db.customers_subscriptions_mollie_collections.CollectionMonth == self.month)
+
+
+    def create_invoices(self):
+        """
+        Create invoices for subscriptions paid using Mollie and add them as
+        pending collections. Subscriptions already collected for this month
+        are skipped.
+        :return: int - number of collections added
+        """
+        from general_helpers import get_last_day_month
+        from os_customer_subscription import CustomerSubscription
+        from os_invoice import Invoice
+
+        db = current.db
+
+        firstdaythismonth = datetime.date(self.year, self.month, 1)
+        lastdaythismonth = get_last_day_month(firstdaythismonth)
+
+        collected = db(self._get_collections_query())._select(
+            db.customers_subscriptions_mollie_collections.customers_subscriptions_id
+        )
+
+        query = (db.customers_subscriptions.payment_methods_id == 100) & \
+                (db.customers_subscriptions.Startdate <= lastdaythismonth) & \
+                ((db.customers_subscriptions.Enddate >= firstdaythismonth) |
+                 (db.customers_subscriptions.Enddate == None)) & \
+                ~(db.customers_subscriptions.id.belongs(collected))
+        rows = db(query).select(db.customers_subscriptions.id,
+                                db.customers_subscriptions.auth_customer_id,
+                                orderby=db.customers_subscriptions.id)
+
+        added = 0
+        for row in rows:
+            cs = CustomerSubscription(row.id)
+            # This function returns the invoice id if it already exists
+            iID = cs.create_invoice_for_month(self.year, self.month)
+            if not iID:
+                continue
+
+            # Only collect invoices with status sent
+            invoice = Invoice(iID)
+            if not invoice.invoice.Status == 'sent':
+                continue
+
+            db.customers_subscriptions_mollie_collections.insert(
+                customers_subscriptions_id = row.id,
+                auth_customer_id = row.auth_customer_id,
+                invoices_id = iID,
+                CollectionYear = self.year,
+                CollectionMonth = self.month
+            )
+
+            added += 1
+            if added % self.chunk_size == 0:
+                db.commit()
+
+        db.commit()
+
+        return added
+
+
+    def _get_mandate_valid(self, mollie_customer_id):
+        """
+        Runs in a worker thread
+        :param mollie_customer_id: string
+        :return: tuple (mollie_customer_id, valid, error)
+        """
+        from mollie.api.error import Error as MollieError
+
+        self._wait_for_rate_limit()
+        try:
+            mandates = self.mollie.customer_mandates.with_parent_id(mollie_customer_id).list()
+        except MollieError as e:
+            return mollie_customer_id, False, unicode(e)
+
+        valid = False
+        if mandates['count'] > 0:
+            for mandate in mandates['_embedded']['mandates']:
+                if mandate['status'] == 'valid':
+                    valid = True
+                    break
+
+        return mollie_customer_id, valid, None
+
+
+    def _find_payment(self, item):
+        """
+        Runs in a worker thread. Look for a payment created for the invoice of
+        item by a run that stopped after the request was sent to Mollie.
+        :param item: dict - see _get_payment_item
+        :return: string - Mollie payment id or None
+        """
+        self._wait_for_rate_limit()
+        payments = self.mollie.customer_payments.with_parent_id(
+            item['mollie_customer_id']).list()
+
+        for payment in payments['_embedded']['payments']:
+            metadata = payment.get('metadata') or {}
+            if unicode(metadata.get('invoice_id')) == unicode(item['invoices_id']):
+                return payment['id']
+
+        return None
+
+
+    def _create_payment(self, item):
+        """
+        Runs in a worker thread
+        :param item: dict - see _get_payment_item
+        :return: tuple (item, Mollie payment id, error)
+        """
+        from mollie.api.error import Error as MollieError
+
+        try:
+            if item['resume']:
+                mollie_payment_id = self._find_payment(item)
+                if mollie_payment_id:
+                    return item, mollie_payment_id, None
+
+            self._wait_for_rate_limit()
+            payment = self.mollie.payments.create({
+                'amount': {
+                    'currency': self.currency,
+                    'value': format(item['amount'], '.2f')
+                },
+                'customerId': item['mollie_customer_id'],
+                'sequenceType': 'recurring',  # important
+                'description': item['description'],
+                'webhookUrl': self.webhook_url,
+                'metadata': {
+                    'invoice_id': item['invoices_id'],
+                    'customers_orders_id': 'invoice' # This lets the webhook function know it's dealing with an invoice
+                }
+            })
+        except MollieError as e:
+            return item, None, unicode(e)
+
+        return item, payment['id'], None
+
+
+    def _get_payment_item(self, row):
+        """
+        :param row: gluon.dal.Row - collection joined with auth_user
+        :return: dict - data needed by worker threads to create a payment
+        """
+        from os_invoice import Invoice
+
+        collection = row.customers_subscriptions_mollie_collections
+
+        invoice = Invoice(collection.invoices_id)
+        amounts = invoice.get_amounts()
+
+        return dict(
+            id = collection.id,
+            auth_customer_id = collection.auth_customer_id,
+            invoices_id = collection.invoices_id,
+            mollie_customer_id = row.auth_user.mollie_customer_id,
+            amount = amounts.TotalPriceVAT,
+            description = invoice.invoice.Description + ' - ' + invoice.invoice.InvoiceID,
+            resume = collection.Status == 'processing'
+        )
+
+
+    def _set_status(self, clmcID, status, mollie_payment_id=None, error=None):
+        """
+        :param clmcID: db.customers_subscriptions_mollie_collections.id
+        :param status: string
+        :param mollie_payment_id: string
+        :param error: string
+        :return: None
+        """
+        db = current.db
+
+        query = (db.customers_subscriptions_mollie_collections.id == clmcID)
+        db(query).update(
+            Status = status,
+            mollie_payment_id = mollie_payment_id,
+            LastError = error
+        )
+
+
+    def _send_mails_failed(self, cuIDs):
+        """
+        When a recurring payment fails, mail customer with request to pay manually
+        :param cuIDs: list of db.auth_user.id
+        :return: None
+        """
+        from os_mail import OsMail
+
+        if not cuIDs:
+            return
+
+        os_mail = OsMail()
+        msgIDs = os_mail.render_email_template_batch(
+            'payment_recurring_failed',
+            [ dict() for cuID in cuIDs ]
+        )
+        for cuID, msgID in zip(cuIDs, msgIDs):
+            os_mail.send(msgID, cuID)
+
+
+    def _register_customers(self, rows):
+        """
+        Register customers without Mollie customer id with Mollie
+        :param rows: gluon.dal.Rows - collections joined with auth_user
+        :return: None
+        """
+        from mollie.api.error import Error as MollieError
+        from os_customer import Customer
+
+        db = current.db
+
+        for row in rows:
+            if row.auth_user.mollie_customer_id:
+                continue
+
+            collection = row.customers_subscriptions_mollie_collections
+            customer = Customer(collection.auth_customer_id)
+            try:
+                row.auth_user.mollie_customer_id = customer.register_mollie_customer(self.mollie)
+            except MollieError as e:
+                # Try again in the next run
+                self._set_status(collection.id, collection.Status, error=unicode(e))
+
+            db.commit()
+
+
+    def collect(self):
+        """
+        Collect pending collections for this month using recurring payments
+        :return: tuple (number of payments collected, number failed)
+        """
+        from multiprocessing.pool import ThreadPool
+
+        db = current.db
+
+        query = self._get_collections_query() & \
+                (db.customers_subscriptions_mollie_collections.Status.belongs(
+                    ['pending', 'processing'])) & \
+                (db.customers_subscriptions_mollie_collections.auth_customer_id ==
+                 db.auth_user.id)
+        rows = db(query).select(db.customers_subscriptions_mollie_collections.ALL,
+                                db.auth_user.mollie_customer_id,
+                                orderby=db.customers_subscriptions_mollie_collections.id)
+
+        self._register_customers(rows)
+
+        success = 0
+        failed = 0
+
+        pool = ThreadPool(self.workers)
+        try:
+            # Fetch mandates for all customers up front
+            mollie_customer_ids = list(set([ row.auth_user.mollie_customer_id
+                                             for row in rows
+                                             if row.auth_user.mollie_customer_id ]))
+            mandates = { None: (False, 'Customer not registered with Mollie') }
+            for mollie_customer_id, valid, error in pool.imap_unordered(
+                    self._get_mandate_valid, mollie_customer_ids):
+                mandates[mollie_customer_id] = (valid, error)
+
+            for i in range(0, len(rows), self.chunk_size):
+                items = []
+                failed_cuIDs = []
+                for row in rows[i:i + self.chunk_size]:
+                    collection = row.customers_subscriptions_mollie_collections
+                    valid, error = mandates[row.auth_user.mollie_customer_id]
+                    if error:
+                        # Try again in the next run
+                        self._set_status(collection.id, collection.Status, error=error)
+                    elif not valid:
+                        self._set_status(collection.id, 'fail', error='No valid mandate')
+                        failed_cuIDs.append(collection.auth_customer_id)
+                        failed += 1
+                    else:
+                        items.append(self._get_payment_item(row))
+
+                # Checkpoint; collections still processing after a crash are
+                # looked up in Mollie before creating a payment in the next run
+                query = (db.customers_subscriptions_mollie_collections.id.belongs(
+                    [ item['id'] for item in items ]))
+                db(query).update(Status='processing')
+                db.commit()
+
+                for item, mollie_payment_id, error in pool.imap_unordered(
+                        self._create_payment, items):
+                    if error:
+                        self._set_status(item['id'], 'fail', error=error)
+                        failed_cuIDs.append(item['auth_customer_id'])
+                        failed += 1
+                        continue
+
+                    # link invoice to mollie_payment_id
+                    db.invoices_mollie_payment_ids.insert(
+                        invoices_id = item['invoices_id'],
+                        mollie_payment_id = mollie_payment_id,
+                        RecurringType = 'recurring',
+                        WebhookURL = self.webhook_url
+                    )
+                    self._set_status(item['id'], 'success',
+                                     mollie_payment_id=mollie_payment_id)
+                    success += 1
+
+                self._send_mails_failed(failed_cuIDs)
+                db.commit()
+        finally:
+            pool.close()
+            pool.join()
+
+        return success, failed
+
+
+    def run(self):
+        """
+        Create invoices and collect them
+        :return: tuple (number of payments collected, number failed)
+        """
+        self.create_invoices()
+
+        return self.collect()
@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+
+from gluon import *
+
+
+class PaymentBatchExport:
+    """
+        Exports the items of a payment batch as CSV or SEPA direct debit XML
+        (pain.008.001.02). Items are read in chunks and written to the given
+        file as they come in, so large batches don't need to fit in memory.
+    """
+    def __init__(self, pbID, chunk_size=1000):
+        """
+        :param pbID: db.payment_batches.id
+        :param chunk_size: int - number of items to read per query
+        """
+        db = current.db
+
+        self.id = int(pbID)
+        self.row = db.payment_batches(self.id)
+        self.chunk_size = chunk_size
+
+
+    def _get_recurring_query(self):
+        """
+        Customers in earlier batches of the same type that were sent to the bank
+        are recurring customers. Uses the index on
+        payment_batches_items (auth_customer_id, payment_batches_id).
+        :return: gluon.dal.Query - items of recurring customers
+        """
+        db = current.db
+
+        pbi_prev = db.payment_batches_items.with_alias('pbi_prev')
+        pb_prev = db.payment_batches.with_alias('pb_prev')
+
+        # A NULL in the subselect would make NOT IN unknown for all items
+        query = (pb_prev.id < self.id) & \
+                (pb_prev.BatchType == self.row.BatchType) & \
+                (pb_prev.Status == 'sent_to_bank') & \
+                (pbi_prev.payment_batches_id == pb_prev.id) & \
+                (pbi_prev.auth_customer_id != None)
+
+        previous_customers = db(query)._select(pbi_prev.auth_customer_id,
+                                               distinct=True)
+
+        return db.payment_batches_items.auth_customer_id.belongs(previous_customers)
+
+
+    def get_items_query(self, first=False, recurring=False):
+        """
+        :param first: Boolean - only items for first customers (FRST)
+        :param recurring: Boolean - only items for recurring customers (RCUR)
+        :return: gluon.dal.Query
+        """
+        db = current.db
+
+        query = (db.payment_batches_items.payment_batches_id == self.id)
+
+        if first:
+            # Items without a customer are first, like in PaymentBatchItems.preview()
+            query &= (~self._get_recurring_query() |
+                      (db.payment_batches_items.auth_customer_id == None))
+        if recurring:
+            query &= self._get_recurring_query()
+
+        return query
+
+
+    def get_items(self, first=False, recurring=False):
+        """
+        Generator returning the items of this batch in chunks, ordered by id
+        :param first: Boolean - only items for first customers (FRST)
+        :param recurring: Boolean - only items for recurring customers (RCUR)
+        :return: gluon.dal.Row for each item
+        """
+        db = current.db
+
+        query = self.get_items_query(first, recurring)
+
+        last_id = 0
+        while True:
+            rows = db(query & (db.payment_batches_items.id > last_id)).select(
+                db.payment_batches_items.ALL,
+                orderby=db.payment_batches_items.id,
+                limitby=(0, self.chunk_size)
+            )
+
+            for row in rows:
+                yield row
+
+            if len(rows) < self.chunk_size:
+                break
+
+            last_id = rows.last().id
+
+
+    def get_totals(self, first=False, recurring=False):
+        """
+        :param first: Boolean - only items for first customers (FRST)
+        :param recurring: Boolean - only items for recurring customers (RCUR)
+        :return: tuple (count, sum of amounts)
+        """
+        db = current.db
+
+        count = db.payment_batches_items.id.count()
+        total = db.payment_batches_items.Amount.sum()
+
+        row = db(self.get_items_query(first, recurring)).select(count, total).first()
+
+        return row[count], round(row[total] or 0, 2)
+
+
+    def _encode_row(self, row):
+        """
+        :param row: list
+        :return: list with unicode values encoded as utf-8
+        """
+        encoded = []
+        for item in row:
+            if isinstance(item, unicode):
+                item = item.encode('utf-8')
+            encoded.append(item)
+
+        return encoded
+
+
+    def _represent_date(self, date):
+        """
+        :param date: datetime.date or None
+        :return: string
+        """
+        DATE_FORMAT = current.DATE_FORMAT
+
+        if not date:
+            return ''
+
+        return date.strftime(DATE_FORMAT)
+
+
+    def csv(self, stream, first=False, recurring=False, show_location=False):
+        """
+        Write batch items to stream as CSV
+        :param stream: file like object
+        :param first: Boolean - only items for first customers (FRST)
+        :param recurring: Boolean - only items for recurring customers (RCUR)
+        :param show_location: Boolean - add location of the batch to each line
+        :return: int - number of items written
+        """
+        import csv
+
+        db = current.db
+
+        if self.row.school_locations_id:
+            location = db.school_locations(self.row.school_locations_id).Name
+        else:
+            location = 'All'
+
+        execution_date = self._represent_date(self.row.Exdate)
+
+        writer = csv.writer(stream)
+        writer.writerow(['customers_id',
+                         'SubscriptionID',
+                         'Account holder',
+                         'Bank Location',
+                         'Currency',
+                         'Amount',
+                         'Account number',
+                         'BIC',
+                         'Mandate Signature Date',
+                         'Mandate Reference',
+                         'Description',
+                         'Execution Date',
+                         'Location'])
+
+        count = 0
+        for item in self.get_items(first, recurring):
+            row = [ item.auth_customer_id,
+                    item.customers_subscriptions_id or '',
+                    item.AccountHolder,
+                    item.BankLocation,
+                    item.Currency,
+                    item.Amount,
+                    (item.AccountNumber or '').upper(),
+                    item.BIC,
+                    self._represent_date(item.MandateSignatureDate),
+                    item.MandateReference,
+                    item.Description,
+                    execution_date ]
+            if show_location:
+                row.append(location)
+
+            writer.writerow(self._encode_row(row))
+            count += 1
+
+        return count
+
+
+    def _xml(self, value, max_length=None):
+        """
+        :param value: string or None
+        :param max_length: int - cut off value after max_length characters
+        :return: utf-8 encoded string, escaped to use in XML
+        """
+        from xml.sax.saxutils import escape
+
+        value = value or u''
+        if not isinstance(value, unicode):
+            value = unicode(value, 'utf-8')
+        if max_length:
+            value = value[:max_length]
+
+        return escape(value).encode('utf-8')
+
+
+    def _sepa_financial_institution(self, bic):
+        """
+        :param bic: string
+        :return: FinInstnId element
+        """
+        if bic:
+            return '<FinInstnId><BIC>%s</BIC></FinInstnId>' % self._xml(bic.replace(' ', ''))
+        else:
+            return '<FinInstnId><Othr><Id>NOTPROVIDED</Id></Othr></FinInstnId>'
+
+
+    def _sepa_payment_information(self, stream, sequence_type, count, total, creditor):
+        """
+        Write a PmtInf block with the items of a sequence type
+        :param stream: file like object
+        :param sequence_type: 'FRST' or 'RCUR'
+        :param count: int - number of items for sequence type
+        :param total: float - sum of amounts for sequence type
+        :param creditor: dict with keys name, iban, bic and id
+        :return: None
+        """
+        if not count:
+            return
+
+        first = sequence_type == 'FRST'
+
+        stream.write(
+            '<PmtInf>'
+            '<PmtInfId>%(pmt_inf_id)s</PmtInfId>'
+            '<PmtMtd>DD</PmtMtd>'
+            '<NbOfTxs>%(count)s</NbOfTxs>'
+            '<CtrlSum>%(total).2f</CtrlSum>'
+            '<PmtTpInf>'
+            '<SvcLvl><Cd>SEPA</Cd></SvcLvl>'
+            '<LclInstrm><Cd>CORE</Cd></LclInstrm>'
+            '<SeqTp>%(sequence_type)s</SeqTp>'
+            '</PmtTpInf>'
+            '<ReqdColltnDt>%(collection_date)s</ReqdColltnDt>'
+            '<Cdtr><Nm>%(creditor_name)s</Nm></Cdtr>'
+            '<CdtrAcct><Id><IBAN>%(creditor_iban)s</IBAN></Id></CdtrAcct>'
+            '<CdtrAgt>%(creditor_agent)s</CdtrAgt>'
+            '<ChrgBr>SLEV</ChrgBr>'
+            '<CdtrSchmeId><Id><PrvtId><Othr>'
+            '<Id>%(creditor_id)s</Id>'
+            '<SchmeNm><Prtry>SEPA</Prtry></SchmeNm>'
+            '</Othr></PrvtId></Id></CdtrSchmeId>' % dict(
+                pmt_inf_id='OS-%s-%s' % (self.id, sequence_type),
+                count=count,
+                total=total,
+                sequence_type=sequence_type,
+                collection_date=self.row.Exdate.strftime('%Y-%m-%d'),
+                creditor_name=self._xml(creditor['name'], 70),
+                creditor_iban=self._xml(creditor['iban'].replace(' ', '')),
+                creditor_agent=self._sepa_financial_institution(creditor['bic']),
+                creditor_id=self._xml(creditor['id'])
+            )
+        )
+
+        for item in self.get_items(first=first, recurring=not first):
+            mandate_signature_date = ''
+            if item.MandateSignatureDate:
+                mandate_signature_date = '<DtOfSgntr>%s</DtOfSgntr>' % \
+                    item.MandateSignatureDate.strftime('%Y-%m-%d')
+
+            stream.write(
+                '<DrctDbtTxInf>'
+                '<PmtId><EndToEndId>OS-%(pbiID)s</EndToEndId></PmtId>'
+                '<InstdAmt Ccy="%(currency)s">%(amount).2f</InstdAmt>'
+                '<DrctDbtTx><MndtRltdInf>'
+                '<MndtId>%(mandate_reference)s</MndtId>'
+                '%(mandate_signature_date)s'
+                '</MndtRltdInf></DrctDbtTx>'
+                '<DbtrAgt>%(debtor_agent)s</DbtrAgt>'
+                '<Dbtr><Nm>%(account_holder)s</Nm></Dbtr>'
+                '<DbtrAcct><Id><IBAN>%(account_number)s</IBAN></Id></DbtrAcct>'
+                '<RmtInf><Ustrd>%(description)s</Ustrd></RmtInf>'
+                '</DrctDbtTxInf>' % dict(
+                    pbiID=item.id,
+                    currency=self._xml(item.Currency),
+                    amount=item.Amount or 0,
+                    mandate_reference=self._xml(item.MandateReference, 35),
+                    mandate_signature_date=mandate_signature_date,
+                    debtor_agent=self._sepa_financial_institution(item.BIC),
+                    account_holder=self._xml(item.AccountHolder, 70),
+                    account_number=self._xml((item.AccountNumber or '').replace(' ', '').upper()),
+                    description=self._xml(item.Description, 140)
+                )
+            )
+
+        stream.write('</PmtInf>')
+
+
+    def sepa(self, stream, creditor, first=False, recurring=False):
+        """
+        Write batch items to stream as SEPA direct debit XML (pain.008.001.02).
+        FRST and RCUR items are written in separate payment information blocks.
+        :param stream: file like object
+        :param creditor: dict with keys name, iban, bic and id (creditor identifier)
+        :param first: Boolean - only items for first customers (FRST)
+        :param recurring: Boolean - only items for recurring customers (RCUR)
+        :return: int - number of items written
+        """
+        sequence_types = []
+        if first or not recurring:
+            sequence_types.append('FRST')
+        if recurring or not first:
+            sequence_types.append('RCUR')
+
+        totals = {}
+        for sequence_type in sequence_types:
+            is_first = sequence_type == 'FRST'
+            totals[sequence_type] = self.get_totals(first=is_first,
+                                                    recurring=not is_first)
+
+        count = sum([ totals[sequence_type][0] for sequence_type in sequence_types ])
+        total = sum([ totals[sequence_type][1] for sequence_type in sequence_types ])
+
+        now = datetime.datetime.now()
+
+        stream.write(
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Document xmlns="urn:iso:std:iso:20022:tech:xsd:pain.008.001.02" '
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+            '<CstmrDrctDbtInitn>'
+            '<GrpHdr>'
+            '<MsgId>%(message_id)s</MsgId>'
+            '<CreDtTm>%(created)s</CreDtTm>'
+            '<NbOfTxs>%(count)s</NbOfTxs>'
+            '<CtrlSum>%(total).2f</CtrlSum>'
+            '<InitgPty><Nm>%(creditor_name)s</Nm></InitgPty>'
+            '</GrpHdr>' % dict(
+                message_id='OS-%s-%s' % (self.id, now.strftime('%Y%m%d%H%M%S')),
+                created=now.strftime('%Y-%m-%dT%H:%M:%S'),
+                count=count,
+                total=total,
+                creditor_name=self._xml(creditor['name'], 70)
+            )
+        )
+
+        for sequence_type in sequence_types:
+            sequence_count, sequence_total = totals[sequence_type]
+            self._sepa_payment_information(stream,
+                                           sequence_type,
+                                           sequence_count,
+                                           sequence_total,
+                                           creditor)
+
+        stream.write('</CstmrDrctDbtInitn></Document>')
+
+        return count
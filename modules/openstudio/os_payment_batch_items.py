@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+from gluon import *
+
+
+class PaymentBatchItems:
+    """
+        Selects the items for a payment batch in one query. The selected items
+        can be inserted into db.payment_batches_items using a single
+        INSERT ... SELECT or summarized without writing anything.
+    """
+    def __init__(self, batch, currency):
+        """
+        :param batch: gluon.dal.Row or Storage with the db.payment_batches fields
+                      BatchType, BatchTypeDescription, payment_categories_id,
+                      ColYear, ColMonth, school_locations_id, IncludeZero and Description.
+                      When id is set, only earlier batches count for recurring customers.
+        :param currency: string - currency to set for items
+        """
+        self.batch = batch
+        self.currency = currency
+
+
+    def _represent(self, value):
+        """
+        :param value: string or None
+        :return: quoted string to use in sql
+        """
+        db = current.db
+
+        return db._adapter.represent(value, 'string')
+
+
+    def _get_invoices_where(self):
+        """
+        :return: string - where clause for the invoices of this batch
+        """
+        description = self.batch.BatchTypeDescription
+
+        where = "i.Status = 'sent'"
+        if description == 'teacher_payments':
+            where += " AND i.TeacherPayment = 'T'"
+        elif description == 'employee_expenses':
+            where += " AND i.EmployeeClaim = 'T'"
+        else:
+            # Direct debit invoices
+            where += """
+                AND (i.TeacherPayment = 'F' OR i.TeacherPayment IS NULL)
+                AND (i.EmployeeClaim = 'F' OR i.EmployeeClaim IS NULL)
+                AND i.payment_methods_id = 3
+            """
+            if self.batch.school_locations_id:
+                where += " AND au.school_locations_id = {slID}".format(
+                    slID=int(self.batch.school_locations_id)
+                )
+
+        if not self.batch.IncludeZero:
+            where += " AND (ia.TotalPriceVAT IS NULL OR ia.TotalPriceVAT <> 0)"
+
+        return where
+
+
+    def _get_select_invoices(self):
+        """
+        :return: string - query selecting the items of an invoices, teacher
+                 payments or employee expenses batch
+        """
+        if self.batch.BatchTypeDescription == 'invoices':
+            # Subscription linked to the invoice
+            customers_subscriptions_id = 'ics.customers_subscriptions_id'
+        else:
+            customers_subscriptions_id = 'i.customers_subscriptions_id'
+
+        return """
+        SELECT au.id AS auth_customer_id,
+               {customers_subscriptions_id} AS customers_subscriptions_id,
+               i.id AS invoices_id,
+               cpi.AccountHolder AS AccountHolder,
+               IFNULL(TRIM(cpi.BIC), '') AS BIC,
+               IFNULL(TRIM(cpi.AccountNumber), '') AS AccountNumber,
+               cpim.MandateSignatureDate AS MandateSignatureDate,
+               cpim.MandateReference AS MandateReference,
+               ROUND(ia.TotalPriceVAT, 2) AS Amount,
+               {currency} AS Currency,
+               TRIM(IFNULL(NULLIF(i.Description, ''), {description})) AS Description,
+               NULLIF(cpi.BankName, '') AS BankName,
+               cpi.BankLocation AS BankLocation,
+               i.id AS sort_id
+        FROM invoices i
+        LEFT JOIN invoices_amounts ia ON ia.invoices_id = i.id
+        LEFT JOIN invoices_customers ic ON ic.invoices_id = i.id
+        LEFT JOIN invoices_customers_subscriptions ics ON ics.invoices_id = i.id
+        LEFT JOIN auth_user au ON ic.auth_customer_id = au.id
+        LEFT JOIN customers_payment_info cpi ON cpi.auth_customer_id = ic.auth_customer_id
+        LEFT JOIN customers_payment_info_mandates cpim ON cpim.customers_payment_info_id = cpi.id
+        WHERE {where}
+        """.format(
+            customers_subscriptions_id=customers_subscriptions_id,
+            currency=self._represent(self.currency),
+            description=self._represent(self.batch.Description),
+            where=self._get_invoices_where()
+        )
+
+
+    def _get_select_category(self):
+        """
+        :return: string - query selecting the items of a category batch
+        """
+        where = """
+            ap.payment_categories_id = {pcID}
+            AND ap.PaymentYear = {year}
+            AND ap.PaymentMonth = {month}
+        """.format(
+            pcID=int(self.batch.payment_categories_id),
+            year=int(self.batch.ColYear),
+            month=int(self.batch.ColMonth)
+        )
+
+        if self.batch.school_locations_id:
+            where += " AND au.school_locations_id = {slID}".format(
+                slID=int(self.batch.school_locations_id)
+            )
+
+        if not self.batch.IncludeZero:
+            where += " AND (ap.Amount IS NULL OR ap.Amount <> 0)"
+
+        return """
+        SELECT au.id AS auth_customer_id,
+               NULL AS customers_subscriptions_id,
+               NULL AS invoices_id,
+               cpi.AccountHolder AS AccountHolder,
+               IFNULL(TRIM(cpi.BIC), '') AS BIC,
+               IFNULL(TRIM(cpi.AccountNumber), '') AS AccountNumber,
+               cpim.MandateSignatureDate AS MandateSignatureDate,
+               cpim.MandateReference AS MandateReference,
+               ROUND(ap.Amount, 2) AS Amount,
+               {currency} AS Currency,
+               TRIM(ap.Description) AS Description,
+               NULLIF(cpi.BankName, '') AS BankName,
+               cpi.BankLocation AS BankLocation,
+               ap.id AS sort_id
+        FROM alternativepayments ap
+        LEFT JOIN auth_user au ON au.id = ap.auth_customer_id
+        LEFT JOIN customers_payment_info cpi ON cpi.auth_customer_id = ap.auth_customer_id
+        LEFT JOIN customers_payment_info_mandates cpim ON cpim.customers_payment_info_id = cpi.id
+        WHERE {where}
+        """.format(
+            currency=self._represent(self.currency),
+            where=where
+        )
+
+
+    def _get_select(self):
+        """
+        :return: string - query selecting the items for this batch
+        """
+        if self.batch.BatchTypeDescription in ['invoices',
+                                               'teacher_payments',
+                                               'employee_expenses']:
+            return self._get_select_invoices()
+        else:
+            return self._get_select_category()
+
+
+    def insert(self, pbID):
+        """
+        Insert items for this batch into db.payment_batches_items
+        :param pbID: db.payment_batches.id
+        :return: None
+        """
+        db = current.db
+
+        query = """
+        INSERT INTO payment_batches_items
+            (payment_batches_id,
+             auth_customer_id,
+             customers_subscriptions_id,
+             invoices_id,
+             AccountHolder,
+             BIC,
+             AccountNumber,
+             MandateSignatureDate,
+             MandateReference,
+             Amount,
+             Currency,
+             Description,
+             BankName,
+             BankLocation)
+        SELECT {pbID},
+               items.auth_customer_id,
+               items.customers_subscriptions_id,
+               items.invoices_id,
+               items.AccountHolder,
+               items.BIC,
+               items.AccountNumber,
+               items.MandateSignatureDate,
+               items.MandateReference,
+               items.Amount,
+               items.Currency,
+               items.Description,
+               items.BankName,
+               items.BankLocation
+        FROM ({select}) items
+        ORDER BY items.auth_customer_id, items.sort_id
+        """.format(pbID=int(pbID), select=self._get_select())
+
+        db.executesql(query)
+
+
+    def preview(self):
+        """
+        Summarize the items for this batch without writing anything.
+        Customers in batches of the same type sent to the bank before are
+        recurring (RCUR), other customers are first (FRST).
+        :return: dict(count=int, total=float,
+                      first=dict(count=int, total=float),
+                      recurring=dict(count=int, total=float))
+        """
+        db = current.db
+
+        previous_where = "pb.BatchType = {batch_type} AND pb.Status = 'sent_to_bank'".format(
+            batch_type=self._represent(self.batch.BatchType)
+        )
+        if self.batch.get('id'):
+            previous_where += " AND pb.id < {pbID}".format(pbID=int(self.batch.id))
+
+        query = """
+        SELECT COUNT(*),
+               IFNULL(SUM(items.Amount), 0),
+               IFNULL(SUM(CASE WHEN rc.auth_customer_id IS NULL THEN 1 ELSE 0 END), 0),
+               IFNULL(SUM(CASE WHEN rc.auth_customer_id IS NULL THEN items.Amount ELSE 0 END), 0)
+        FROM ({select}) items
+        LEFT JOIN
+            (SELECT DISTINCT pbi.auth_customer_id
+             FROM payment_batches_items pbi
+             LEFT JOIN payment_batches pb ON pbi.payment_batches_id = pb.id
+             WHERE {previous_where}) rc
+        ON rc.auth_customer_id = items.auth_customer_id
+        """.format(select=self._get_select(), previous_where=previous_where)
+
+        count, total, first_count, first_total = db.executesql(query)[0]
+
+        count = int(count)
+        total = float(total)
+        first_count = int(first_count)
+        first_total = float(first_total)
+
+        return dict(
+            count=count,
+            total=total,
+            first=dict(count=first_count,
+                       total=first_total),
+            recurring=dict(count=count - first_count,
+                           total=total - first_total)
+        )
@@ -0,0 +1,396 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+
+from gluon import *
+
+
+class ReportsRevenue:
+    """
+        Revenue per month, category, location and organization in
+        db.reports_revenue_months, so the revenue report doesn't have to add up
+        invoices on each page load.
+
+        Months with changed invoices are marked in
+        db.reports_revenue_months_refresh by callbacks on the invoice tables.
+        The reports_revenue_refresh scheduler task calculates them again. The
+        report also does this for the year it shows, so it's never out of date.
+        Use backfill() (or the reports_revenue_backfill task) to calculate
+        historic years, eg. after changes made without callbacks.
+
+        Subscription revenue is counted in the month of the subscription
+        invoice, other revenue in the month the invoice was created.
+    """
+    categories = [ 'subscriptions', 'classcards', 'workshops', 'dropin', 'trialclasses' ]
+
+    # Tables linking invoices to a category
+    link_tables = [
+        'invoices_customers_subscriptions',
+        'invoices_customers_classcards',
+        'invoices_workshops_products_customers',
+        'invoices_classes_attendance',
+    ]
+
+
+    def _get_category_select(self, category, year, month):
+        """
+        :param category: string - one of self.categories
+        :param year: int
+        :param month: int
+        :return: dict(query, left, location, organization) to select revenue for
+                 category in a month. location & organization are fields or None.
+        """
+        from general_helpers import get_last_day_month
+
+        db = current.db
+
+        firstdaythismonth = datetime.date(year, month, 1)
+        lastdaythismonth = get_last_day_month(firstdaythismonth)
+
+        date_query = (db.invoices.DateCreated >= firstdaythismonth) & \
+                     (db.invoices.DateCreated <= lastdaythismonth)
+
+        left = [ db.invoices_amounts.on(db.invoices_amounts.invoices_id == db.invoices.id) ]
+
+        if category == 'subscriptions':
+            left.extend([
+                db.invoices_customers_subscriptions.on(
+                    db.invoices_customers_subscriptions.invoices_id == db.invoices.id),
+                db.customers_subscriptions.on(
+                    db.invoices_customers_subscriptions.customers_subscriptions_id ==
+                    db.customers_subscriptions.id),
+                db.school_subscriptions.on(
+                    db.customers_subscriptions.school_subscriptions_id ==
+                    db.school_subscriptions.id),
+            ])
+            query = (db.invoices_customers_subscriptions.id != None) & \
+                    (db.invoices.SubscriptionYear == year) & \
+                    (db.invoices.SubscriptionMonth == month)
+            location = None
+            organization = db.school_subscriptions.sys_organizations_id
+
+        elif category == 'classcards':
+            left.extend([
+                db.invoices_customers_classcards.on(
+                    db.invoices_customers_classcards.invoices_id == db.invoices.id),
+                db.customers_classcards.on(
+                    db.invoices_customers_classcards.customers_classcards_id ==
+                    db.customers_classcards.id),
+                db.school_classcards.on(
+                    db.customers_classcards.school_classcards_id ==
+                    db.school_classcards.id),
+            ])
+            query = (db.invoices_customers_classcards.id != None) & date_query
+            location = None
+            organization = db.school_classcards.sys_organizations_id
+
+        elif category == 'workshops':
+            left.extend([
+                db.invoices_workshops_products_customers.on(
+                    db.invoices_workshops_products_customers.invoices_id == db.invoices.id),
+                db.workshops_products_customers.on(
+                    db.invoices_workshops_products_customers.workshops_products_customers_id ==
+                    db.workshops_products_customers.id),
+                db.workshops_products.on(
+                    db.workshops_products_customers.workshops_products_id ==
+                    db.workshops_products.id),
+                db.workshops.on(db.workshops_products.workshops_id == db.workshops.id),
+            ])
+            query = (db.invoices_workshops_products_customers.id != None) & date_query
+            location = db.workshops.school_locations_id
+            organization = None
+
+        else:
+            # Drop-in & trial classes
+            left.extend([
+                db.invoices_classes_attendance.on(
+                    db.invoices_classes_attendance.invoices_id == db.invoices.id),
+                db.classes_attendance.on(
+                    db.invoices_classes_attendance.classes_attendance_id ==
+                    db.classes_attendance.id),
+                db.classes.on(db.classes_attendance.classes_id == db.classes.id),
+            ])
+            attendance_type = 2 if category == 'dropin' else 1
+            query = (db.classes_attendance.AttendanceType == attendance_type) & date_query
+            location = db.classes.school_locations_id
+            organization = db.classes.sys_organizations_id
+
+        return dict(query=query, left=left, location=location, organization=organization)
+
+
+    def refresh_month(self, year, month):
+        """
+        Calculate the revenue for a month again
+        :param year: int
+        :param month: int
+        :return: None
+        """
+        db = current.db
+
+        query = (db.reports_revenue_months.RevenueYear == year) & \
+                (db.reports_revenue_months.RevenueMonth == month)
+        db(query).delete()
+
+        amount = db.invoices_amounts.TotalPriceVAT.sum()
+
+        records = []
+        for category in self.categories:
+            select = self._get_category_select(category, year, month)
+            location = select['location']
+            organization = select['organization']
+            # Each category has a location, an organization or both
+            if location is not None and organization is not None:
+                groupby = location|organization
+                fields = [ location, organization ]
+            else:
+                groupby = location if location is not None else organization
+                fields = [ groupby ]
+
+            rows = db(select['query']).select(amount,
+                                              left=select['left'],
+                                              groupby=groupby,
+                                              *fields)
+            for row in rows:
+                if not row[amount]:
+                    continue
+
+                records.append(dict(
+                    RevenueYear = year,
+                    RevenueMonth = month,
+                    Category = category,
+                    school_locations_id = row[location] if location is not None else None,
+                    sys_organizations_id = row[organization] if organization is not None else None,
+                    Amount = round(row[amount], 2)
+                ))
+
+        if records:
+            db.reports_revenue_months.bulk_insert(records)
+
+
+    def _get_invoices_months(self, dbset):
+        """
+        :param dbset: gluon.dal.Set of db.invoices
+        :return: set of tuples (year, month) revenue of the invoices is counted in
+        """
+        db = current.db
+
+        months = set()
+        for row in dbset.select(db.invoices.DateCreated,
+                                db.invoices.SubscriptionYear,
+                                db.invoices.SubscriptionMonth):
+            if row.DateCreated:
+                months.add((row.DateCreated.year, row.DateCreated.month))
+            if row.SubscriptionYear and row.SubscriptionMonth:
+                months.add((int(row.SubscriptionYear), int(row.SubscriptionMonth)))
+
+        return months
+
+
+    def set_invoices_changed(self, iIDs):
+        """
+        Mark the months of invoices to be calculated again
+        :param iIDs: list of db.invoices.id
+        :return: None
+        """
+        db = current.db
+
+        iIDs = [ iID for iID in iIDs if iID ]
+        if not iIDs:
+            return
+
+        self.set_months_changed(self._get_invoices_months(db(db.invoices.id.belongs(iIDs))))
+
+
+    def set_months_changed(self, months):
+        """
+        Mark months to be calculated again
+        :param months: iterable of tuples (year, month)
+        :return: None
+        """
+        db = current.db
+
+        added = False
+        for year, month in months:
+            query = (db.reports_revenue_months_refresh.RevenueYear == year) & \
+                    (db.reports_revenue_months_refresh.RevenueMonth == month)
+            if db(query).isempty():
+                db.reports_revenue_months_refresh.insert(RevenueYear=year,
+                                                         RevenueMonth=month)
+                added = True
+
+        if added:
+            self._queue_task()
+
+
+    def _queue_task(self):
+        """
+        Queue the reports_revenue_refresh task, unless it's already queued
+        :return: None
+        """
+        db = current.db
+        scheduler = current.globalenv['scheduler']
+
+        query = (db.scheduler_task.function_name == 'reports_revenue_refresh') & \
+                (db.scheduler_task.status.belongs(['QUEUED', 'ASSIGNED', 'RUNNING']))
+        if not db(query).count():
+            scheduler.queue_task('reports_revenue_refresh',
+                                 start_time=datetime.datetime.now(),
+                                 timeout=1800)
+
+
+    def set_callbacks(self, table):
+        """
+        Mark months to be calculated again when invoices, their amounts or
+        their links to a category change
+        :param table: db.invoices, db.invoices_amounts or a table in self.link_tables
+        :return: None
+        """
+        db = current.db
+
+        if table._tablename == 'invoices':
+            month_fields = [ 'DateCreated', 'SubscriptionYear', 'SubscriptionMonth' ]
+
+            def after_insert(fields, id):
+                self.set_invoices_changed([ id ])
+
+            def before_update(dbset, fields):
+                # Months the invoices are counted in before the update
+                if any([ field in fields for field in month_fields ]):
+                    self.set_months_changed(self._get_invoices_months(dbset))
+
+            def after_update(dbset, fields):
+                if any([ field in fields for field in month_fields ]):
+                    self.set_months_changed(self._get_invoices_months(dbset))
+
+            def before_delete(dbset):
+                self.set_months_changed(self._get_invoices_months(dbset))
+
+            table._after_insert.append(after_insert)
+            table._before_update.append(before_update)
+            table._after_update.append(after_update)
+            table._before_delete.append(before_delete)
+
+            return
+
+        def get_invoices_ids(dbset):
+            return [ row.invoices_id for row in dbset.select(table.invoices_id) ]
+
+        def after_insert(fields, id):
+            self.set_invoices_changed([ fields.get('invoices_id') ])
+
+        def after_update(dbset, fields):
+            if table._tablename != 'invoices_amounts' or 'TotalPriceVAT' in fields:
+                self.set_invoices_changed(get_invoices_ids(dbset))
+
+        def before_delete(dbset):
+            self.set_invoices_changed(get_invoices_ids(dbset))
+
+        table._after_insert.append(after_insert)
+        table._after_update.append(after_update)
+        table._before_delete.append(before_delete)
+
+
+    def refresh(self, year=None):
+        """
+        Calculate months marked as changed again
+        :param year: int - only refresh months in year, None for all
+        :return: int - number of months calculated
+        """
+        db = current.db
+
+        query = (db.reports_revenue_months_refresh.id > 0)
+        if year is not None:
+            query &= (db.reports_revenue_months_refresh.RevenueYear == year)
+        rows = db(query).select(db.reports_revenue_months_refresh.ALL)
+
+        for row in rows:
+            # Remove the mark first; changes made while calculating mark the month again
+            db(db.reports_revenue_months_refresh.id == row.id).delete()
+            self.refresh_month(row.RevenueYear, row.RevenueMonth)
+
+        return len(rows)
+
+
+    def get_first_year(self):
+        """
+        :return: int - first year with revenue, the current year when there
+                 are no invoices
+        """
+        db = current.db
+
+        first = db.invoices.DateCreated.min()
+        first_subscription = db.invoices.SubscriptionYear.min()
+        row = db(db.invoices).select(first, first_subscription).first()
+
+        years = [ datetime.date.today().year ]
+        if row[first]:
+            years.append(row[first].year)
+        if row[first_subscription]:
+            years.append(int(row[first_subscription]))
+
+        return min(years)
+
+
+    def backfill(self, year_from=None, year_to=None):
+        """
+        Calculate all months in a range of years, the db is committed after
+        each month
+        :param year_from: int - defaults to the year of the first invoice
+        :param year_to: int - defaults to the current year
+        :return: int - number of months calculated
+        """
+        db = current.db
+
+        if year_to is None:
+            year_to = datetime.date.today().year
+
+        if year_from is None:
+            year_from = min(self.get_first_year(), year_to)
+
+        count = 0
+        for year in range(int(year_from), int(year_to) + 1):
+            for month in range(1, 13):
+                query = (db.reports_revenue_months_refresh.RevenueYear == year) & \
+                        (db.reports_revenue_months_refresh.RevenueMonth == month)
+                db(query).delete()
+
+                self.refresh_month(year, month)
+                db.commit()
+                count += 1
+
+        return count
+
+
+    def get_year(self, year, school_locations_id=None, sys_organizations_id=None):
+        """
+        Revenue per category for each month in year, months marked as changed
+        are calculated first
+        :param year: int
+        :param school_locations_id: db.school_locations.id - only count revenue for location
+        :param sys_organizations_id: db.sys_organizations.id - only count revenue for organization
+        :return: dict - category: list of 12 amounts
+        """
+        db = current.db
+
+        self.refresh(year)
+
+        query = (db.reports_revenue_months.RevenueYear == year)
+        if school_locations_id:
+            query &= (db.reports_revenue_months.school_locations_id == school_locations_id)
+        if sys_organizations_id:
+            query &= (db.reports_revenue_months.sys_organizations_id == sys_organizations_id)
+
+        amount = db.reports_revenue_months.Amount.sum()
+        rows = db(query).select(db.reports_revenue_months.Category,
+                                db.reports_revenue_months.RevenueMonth,
+                                amount,
+                                groupby=db.reports_revenue_months.Category|
+                                        db.reports_revenue_months.RevenueMonth)
+
+        data = dict([ (category, [ 0 ] * 12) for category in self.categories ])
+        for row in rows:
+            category = row.reports_revenue_months.Category
+            month = row.reports_revenue_months.RevenueMonth
+            data[category][month - 1] = round(row[amount] or 0, 2)
+
+        return data
@@ -20,169 +20,16 @@ class OsSchedulerTasks:
         """
             Actually create invoices for subscriptions for a given month
         """
-        from general_helpers import get_last_day_month
-        from os_invoice import Invoice
+        from os_customers_subscriptions_invoices import CustomersSubscriptionsInvoices
 
         T = current.T
         db = current.db
-        DATE_FORMAT = current.DATE_FORMAT
-
 
         year = int(year)
         month = int(month)
 
-        firstdaythismonth = datetime.date(year, month, 1)
-        lastdaythismonth  = get_last_day_month(firstdaythismonth)
-
-        csap = db.customers_subscriptions_alt_prices
-
-        fields = [
-            db.customers_subscriptions.id,
-            db.customers_subscriptions.auth_customer_id,
-            db.customers_subscriptions.school_subscriptions_id,
-            db.customers_subscriptions.Startdate,
-            db.customers_subscriptions.Enddate,
-            db.customers_subscriptions.payment_methods_id,
-            db.school_subscriptions.Name,
-            db.school_subscriptions_price.Price,
-            db.school_subscriptions_price.tax_rates_id,
-            db.tax_rates.Percentage,
-            db.customers_subscriptions_paused.id,
-            db.invoices.id,
-            csap.id,
-            csap.Amount,
-            csap.Description
-        ]
-
-        rows = db.executesql(
-            """
-                SELECT cs.id,
-                       cs.auth_customer_id,
-                       cs.school_subscriptions_id,
-                       cs.Startdate,
-                       cs.Enddate,
-                       cs.payment_methods_id,
-                       ssu.Name,
-                       ssp.Price,
-                       ssp.tax_rates_id,
-                       tr.Percentage,
-                       csp.id,
-                       i.invoices_id,
-                       csap.id,
-                       csap.Amount,
-                       csap.Description
-                FROM customers_subscriptions cs
-                LEFT JOIN auth_user au
-                 ON au.id = cs.auth_customer_id
-                LEFT JOIN school_subscriptions ssu
-                 ON cs.school_subscriptions_id = ssu.id
-                LEFT JOIN
-                 (SELECT id,
-                         school_subscriptions_id,
-                         Startdate,
-                         Enddate,
-                         Price,
-                         tax_rates_id
-                  FROM school_subscriptions_price
-                  WHERE Startdate <= '{firstdaythismonth}' AND
-                        (Enddate >= '{firstdaythismonth}' OR Enddate IS NULL)) ssp
-                 ON ssp.school_subscriptions_id = ssu.id
-                LEFT JOIN tax_rates tr
-                 ON ssp.tax_rates_id = tr.id
-                LEFT JOIN
-                 (SELECT id,
-                         customers_subscriptions_id
-                  FROM customers_subscriptions_paused
-                  WHERE Startdate <= '{firstdaythismonth}' AND
-                        (Enddate >= '{firstdaythismonth}' OR Enddate IS NULL)) csp
-                 ON cs.id = csp.customers_subscriptions_id
-                LEFT JOIN
-                 (SELECT ics.id,
-                         ics.invoices_id,
-                         ics.customers_subscriptions_id
-                  FROM invoices_customers_subscriptions ics
-                  LEFT JOIN invoices on ics.invoices_id = invoices.id
-                  WHERE invoices.SubscriptionYear = {year} AND invoices.SubscriptionMonth = {month}) i
-                 ON i.customers_subscriptions_id = cs.id
-                LEFT JOIN
-                 (SELECT id,
-                         customers_subscriptions_id,
-                         Amount,
-                         Description
-                  FROM customers_subscriptions_alt_prices
-                  WHERE SubscriptionYear = {year} AND SubscriptionMonth = {month}) csap
-                 ON csap.customers_subscriptions_id = cs.id
-                WHERE cs.Startdate <= '{lastdaythismonth}' AND
-                      (cs.Enddate >= '{firstdaythismonth}' OR cs.Enddate IS NULL) AND
-                      ssp.Price <> 0 AND
-                      ssp.Price IS NOT NULL AND
-                      au.trashed = 'F'
-            """.format(firstdaythismonth=firstdaythismonth,
-                       lastdaythismonth =lastdaythismonth,
-                       year=year,
-                       month=month),
-          fields=fields)
-
-        igpt = db.invoices_groups_product_types(ProductType = 'subscription')
-        igID = igpt.invoices_groups_id
-
-        invoices_created = 0
-
-        # Alright, time to create some invoices
-        for row in rows:
-            if row.invoices.id:
-                # an invoice already exists, do nothing
-                continue
-            if row.customers_subscriptions_paused.id:
-                # the subscription is paused, don't create an invoice
-                continue
-            if row.customers_subscriptions_alt_prices.Amount == 0:
-                # Don't create an invoice if there's an alt price for the subscription with amount 0.
-                continue
-
-            csID = row.customers_subscriptions.id
-            cuID = row.customers_subscriptions.auth_customer_id
-            pmID = row.customers_subscriptions.payment_methods_id
-
-            subscr_name = row.school_subscriptions.Name
-
-            if row.customers_subscriptions_alt_prices.Description:
-                inv_description = row.customers_subscriptions_alt_prices.Description
-            else:
-                inv_description = description
-
-            if row.customers_subscriptions.Startdate > firstdaythismonth:
-                period_begin = row.customers_subscriptions.Startdate
-            else:
-                period_begin = firstdaythismonth
-
-            period_end = lastdaythismonth
-            if row.customers_subscriptions.Enddate:
-                if row.customers_subscriptions.Enddate >= firstdaythismonth and \
-                   row.customers_subscriptions.Enddate < lastdaythismonth:
-                    period_end = row.customers_subscriptions.Enddate
-
-
-            item_description = period_begin.strftime(DATE_FORMAT) + ' - ' + \
-                               period_end.strftime(DATE_FORMAT)
-
-            iID = db.invoices.insert(
-                invoices_groups_id = igID,
-                payment_methods_id = pmID,
-                SubscriptionYear = year,
-                SubscriptionMonth = month,
-                Description = inv_description,
-                Status = 'sent'
-            )
-
-            # create object to set Invoice# and due date
-            invoice = Invoice(iID)
-            invoice.link_to_customer(cuID)
-            invoice.link_to_customer_subscription(csID)
-            invoice.item_add_subscription(year, month)
-            invoice.set_amounts()
-
-            invoices_created += 1
+        csi = CustomersSubscriptionsInvoices()
+        invoices_created = csi.create_invoices_for_month(year, month, description)
 
         ##
         # For scheduled tasks db connection has to be committed manually
@@ -214,6 +61,24 @@ class OsSchedulerTasks:
         return T("Subscriptions for which credits were added") + ': ' + unicode(added)
 
 
+    def customers_subscriptions_credits_reconcile_balances(self):
+        """
+            Check the stored credit balance of subscriptions against all credit
+            mutations and rebuild it where it doesn't match
+        """
+        from os_customers_subscriptions_credits import CustomersSubscriptionsCredits
+
+        T = current.T
+        db = current.db
+
+        csch = CustomersSubscriptionsCredits()
+        reconciled = csch.reconcile_balances()
+
+        db.commit()
+
+        return T("Subscriptions for which the credit balance was reconciled") + ': ' + unicode(reconciled)
+
+
     def customers_memberships_renew_expired(self, year, month):
         """
             Checks if a subscription exceeds the expiration of a membership.
@@ -284,15 +149,157 @@ class OsSchedulerTasks:
         return T("Memberships renewed") + ': ' + unicode(renewed)
 
 
+    def sys_thumbnails_process(self):
+        """
+        Generate pending thumbnails and remove least recently used on demand
+        thumbnails
+        :return: string - generated / errors / removed
+        """
+        from os_thumbnails import OsThumbnails
+
+        T = current.T
+        db = current.db
+
+        os_thumbnails = OsThumbnails()
+        result = os_thumbnails.process()
+
+        db.commit()
+
+        return T("Thumbnails (Generated / Errors / Removed)") + ': (' + \
+               unicode(result['generated']) + ' / ' + \
+               unicode(result['errors']) + ' / ' + \
+               unicode(result['removed']) + ')'
+
+
+    def sys_thumbnails_remove_unreferenced(self):
+        """
+        Remove thumbnails no longer used by any record
+        :return: string - number of removed thumbnails
+        """
+        from os_thumbnails import OsThumbnails
+
+        T = current.T
+        db = current.db
+
+        os_thumbnails = OsThumbnails()
+        removed = os_thumbnails.remove_unreferenced()
+
+        db.commit()
+
+        return T("Thumbnails removed") + ': ' + unicode(removed)
+
+
+    def sys_storage_usage_reconcile(self):
+        """
+        Recalculate the used storage per table from the files in the uploads folder
+        :return: string - used space in MB
+        """
+        from os_storage_usage import OsStorageUsage
+
+        T = current.T
+        db = current.db
+
+        os_storage_usage = OsStorageUsage()
+        used = os_storage_usage.reconcile()
+
+        db.commit()
+
+        return T("Used storage (MB)") + ': ' + unicode(used / 1000 / 1000)
+
+
+    def sys_mail_outbox_process(self):
+        """
+        Send mail in db.sys_mail_outbox
+        :return: string - sent / errors
+        """
+        from os_mail_outbox import OsMailOutbox
+
+        T = current.T
+        db = current.db
+
+        outbox = OsMailOutbox()
+        result = outbox.process()
+
+        db.commit()
+
+        return T("Mail sent (Success / Errors)") + ': (' + \
+               unicode(result['sent']) + ' / ' + \
+               unicode(result['errors']) + ')'
+
+
+    def reports_revenue_refresh(self):
+        """
+        Calculate months with changed invoices again in db.reports_revenue_months
+        :return: string - number of months
+        """
+        from os_reports_revenue import ReportsRevenue
+
+        T = current.T
+        db = current.db
+
+        reports_revenue = ReportsRevenue()
+        count = reports_revenue.refresh()
+
+        db.commit()
+
+        return T("Revenue months calculated") + ': ' + unicode(count)
+
+
+    def reports_revenue_backfill(self, year_from=None, year_to=None):
+        """
+        Calculate db.reports_revenue_months for a range of years, by default
+        from the first invoice until this year
+        :param year_from: int
+        :param year_to: int
+        :return: string - number of months
+        """
+        from os_reports_revenue import ReportsRevenue
+
+        T = current.T
+        db = current.db
+
+        if year_from is not None:
+            year_from = int(year_from)
+        if year_to is not None:
+            year_to = int(year_to)
+
+        reports_revenue = ReportsRevenue()
+        count = reports_revenue.backfill(year_from, year_to)
+
+        db.commit()
+
+        return T("Revenue months calculated") + ': ' + unicode(count)
+
+
+    def exact_online_process_queue(self):
+        """
+        Send changes queued in db.integration_exact_online_queue to Exact Online.
+        Run this task every few minutes.
+        :return: string - synced / errors
+        """
+        from os_exact_online_queue import OSExactOnlineQueue
+
+        T = current.T
+        db = current.db
+
+        eo_queue = OSExactOnlineQueue()
+        result = eo_queue.process()
+
+        db.commit()
+
+        return T("Synced to Exact Online (Success / Errors)") + ': (' + \
+               unicode(result['synced']) + ' / ' + \
+               unicode(result['errors']) + ')'
+
+
     def exact_online_sync_invoices(self):
         """
         Due to a timeout in tokens, sometimes invoices don't sync immediately, as a API request
         seems to be used to aquire a new token. This function can be run every 15 minutes for
-        example to sync all unsynced invoices
+        example to queue and sync all unsynced invoices
         :return: None
         """
-        from tools import OsTools
-        from os_invoice import Invoice
+        from os_exact_online_queue import OSExactOnlineQueue
 
         T = current.T
         db = current.db
@@ -300,34 +307,15 @@ class OsSchedulerTasks:
         count_synced = 0
         count_errors = 0
 
-        os_tools = OsTools()
-        eo_authorized = os_tools.get_sys_property('exact_online_authorized')
-
-
-        if eo_authorized == 'True':
-            from os_exact_online import OSExactOnline
-
-            os_eo = OSExactOnline()
-
-            query = (db.invoices.ExactOnlineSalesEntryID == None)
-            rows = db(query).select(db.invoices.ALL)
-            for row in rows:
-                invoice = Invoice(row.id)
-
-                if not invoice.invoice_group.JournalID:
-                    os_eo._log_error(
-                        'update',
-                        'invoice',
-                        invoice.invoices_id,
-                        'No JournalID specified for invoice group'
-                    )
-                    count_errors += 1
-                else:
-                    error = os_eo.update_sales_entry(invoice)
-                    if error:
-                        count_errors += 1
-                    else:
-                        count_synced += 1
+        eo_queue = OSExactOnlineQueue()
+        if eo_queue.is_authorized():
+            eo_queue.add_unsynced_invoices()
+            result = eo_queue.process()
+
+            count_synced = result['synced']
+            count_errors = result['errors']
+
+        db.commit()
 
         return T("m_openstudio_os_scheduler_tasks_exact_online_sync_invoices_return") + ': (' + \
                unicode(count_synced) + ' / ' + \
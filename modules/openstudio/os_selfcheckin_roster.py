@@ -0,0 +1,490 @@
+# -*- coding: utf-8 -*-
+
+from gluon import *
+
+
+class SelfCheckinRoster:
+    """
+        Roster of customers booked for a class on a date, as shown on the
+        self check-in kiosk. The roster, including the subscriptions and class
+        cards of booked customers, is loaded with a fixed number of queries
+        and kept in the shared cache, so customers tapping the screen don't
+        cause new queries. Booking options of customers checking in from the
+        search results are loaded on their first tap and kept in the roster.
+        The roster of a class is cleared by callbacks on db.classes_attendance
+        when its bookings change. All rosters are cleared by callbacks on the
+        tables holding the subscriptions, class cards and memberships of
+        customers, as booking options depend on them.
+    """
+    time_expire = 600
+
+
+    def __init__(self, clsID, date):
+        """
+        :param clsID: db.classes.id
+        :param date: datetime.date
+        """
+        self.clsID = int(clsID)
+        self.date = date
+
+
+    def _get_cache_key(self):
+        """
+        :return: string - cache key for the roster of this class
+        """
+        return 'openstudio_selfcheckin_roster_' + unicode(self.clsID) + \
+               '_' + unicode(self.date)
+
+
+    # Tag of all rosters
+    cache_tag = 'selfcheckin_rosters'
+
+    # Tables with data of customers shown on, or used for booking options in the roster
+    customer_tables = [
+        'customers_subscriptions',
+        'customers_subscriptions_paused',
+        'customers_classcards',
+        'customers_memberships',
+    ]
+
+
+    def _get_cache_tag(self):
+        """
+        :return: string - cache tag for the roster of this class
+        """
+        return 'selfcheckin_roster:' + unicode(self.clsID) + ':' + unicode(self.date)
+
+
+    def _get_cache_tags(self):
+        """
+        :return: list of strings - cache tags for the roster of this class
+        """
+        return [ self.cache_tag, self._get_cache_tag() ]
+
+
+    def _get_attendance(self):
+        """
+        :return: list of dicts - bookings for this class, except cancelled ones
+        """
+        db = current.db
+
+        left = [ db.auth_user.on(db.classes_attendance.auth_customer_id ==
+                                 db.auth_user.id) ]
+        query = (db.classes_attendance.classes_id == self.clsID) & \
+                (db.classes_attendance.ClassDate == self.date) & \
+                (db.classes_attendance.BookingStatus != 'cancelled')
+        rows = db(query).select(db.classes_attendance.id,
+                                db.classes_attendance.auth_customer_id,
+                                db.classes_attendance.BookingStatus,
+                                db.auth_user.display_name,
+                                left=left,
+                                orderby=db.auth_user.display_name)
+
+        return [
+            dict(clattID=row.classes_attendance.id,
+                 cuID=row.classes_attendance.auth_customer_id,
+                 display_name=row.auth_user.display_name,
+                 status=row.classes_attendance.BookingStatus,
+                 subscriptions=[],
+                 classcards=[])
+            for row in rows
+        ]
+
+
+    def _get_subscriptions(self, cuIDs):
+        """
+        :param cuIDs: list of db.auth_user.id
+        :return: dict - {cuID: [subscription dicts]}
+        """
+        db = current.db
+
+        left = [ db.school_subscriptions.on(
+            db.customers_subscriptions.school_subscriptions_id ==
+            db.school_subscriptions.id) ]
+        query = (db.customers_subscriptions.auth_customer_id.belongs(cuIDs)) & \
+                (db.customers_subscriptions.Startdate <= self.date) & \
+                ((db.customers_subscriptions.Enddate >= self.date) |
+                 (db.customers_subscriptions.Enddate == None))
+        rows = db(query).select(db.customers_subscriptions.id,
+                                db.customers_subscriptions.auth_customer_id,
+                                db.customers_subscriptions.Startdate,
+                                db.customers_subscriptions.Enddate,
+                                db.customers_subscriptions.CreditsBalance,
+                                db.school_subscriptions.Name,
+                                left=left,
+                                orderby=db.customers_subscriptions.Startdate)
+
+        csIDs = [ row.customers_subscriptions.id for row in rows ]
+        paused = self._get_subscriptions_paused(csIDs)
+
+        subscriptions = {}
+        for row in rows:
+            cs = row.customers_subscriptions
+            subscriptions.setdefault(cs.auth_customer_id, []).append(dict(
+                name=row.school_subscriptions.Name,
+                startdate=cs.Startdate,
+                enddate=cs.Enddate,
+                credits=cs.CreditsBalance,
+                paused=cs.id in paused,
+                paused_until=paused.get(cs.id)
+            ))
+
+        return subscriptions
+
+
+    def _get_subscriptions_paused(self, csIDs):
+        """
+        :param csIDs: list of db.customers_subscriptions.id
+        :return: dict - {csID: end date of pause on date}
+        """
+        db = current.db
+
+        if not csIDs:
+            return {}
+
+        query = (db.customers_subscriptions_paused.customers_subscriptions_id.belongs(csIDs)) & \
+                (db.customers_subscriptions_paused.Startdate <= self.date) & \
+                ((db.customers_subscriptions_paused.Enddate >= self.date) |
+                 (db.customers_subscriptions_paused.Enddate == None))
+        rows = db(query).select(db.customers_subscriptions_paused.customers_subscriptions_id,
+                                db.customers_subscriptions_paused.Enddate)
+
+        return dict([ (row.customers_subscriptions_id, row.Enddate) for row in rows ])
+
+
+    def _get_classcards(self, cuIDs):
+        """
+        :param cuIDs: list of db.auth_user.id
+        :return: dict - {cuID: [class card dicts]}, only cards with classes remaining
+        """
+        db = current.db
+
+        left = [ db.school_classcards.on(
+            db.customers_classcards.school_classcards_id ==
+            db.school_classcards.id) ]
+        query = (db.customers_classcards.auth_customer_id.belongs(cuIDs)) & \
+                (db.customers_classcards.Startdate <= self.date) & \
+                ((db.customers_classcards.Enddate >= self.date) |
+                 (db.customers_classcards.Enddate == None)) & \
+                ((db.school_classcards.Classes > db.customers_classcards.ClassesTaken) |
+                 (db.school_classcards.Classes == 0) |
+                 (db.school_classcards.Unlimited == True))
+        rows = db(query).select(db.customers_classcards.id,
+                                db.customers_classcards.auth_customer_id,
+                                db.customers_classcards.Enddate,
+                                db.school_classcards.Name,
+                                db.school_classcards.Classes,
+                                db.school_classcards.Unlimited,
+                                left=left,
+                                orderby=db.customers_classcards.Enddate)
+
+        ccdIDs = [ row.customers_classcards.id for row in rows ]
+        used = self._get_classcards_used(ccdIDs)
+
+        classcards = {}
+        for row in rows:
+            ccd = row.customers_classcards
+            if row.school_classcards.Unlimited:
+                remaining = 'unlimited'
+            else:
+                remaining = (row.school_classcards.Classes or 0) - used.get(ccd.id, 0)
+                if not remaining:
+                    continue
+
+            classcards.setdefault(ccd.auth_customer_id, []).append(dict(
+                name=row.school_classcards.Name,
+                enddate=ccd.Enddate,
+                remaining=remaining,
+                unlimited=row.school_classcards.Unlimited
+            ))
+
+        return classcards
+
+
+    def _get_classcards_used(self, ccdIDs):
+        """
+        :param ccdIDs: list of db.customers_classcards.id
+        :return: dict - {ccdID: number of classes taken, excluding cancelled bookings}
+        """
+        db = current.db
+
+        if not ccdIDs:
+            return {}
+
+        count = db.classes_attendance.id.count()
+        query = (db.classes_attendance.customers_classcards_id.belongs(ccdIDs)) & \
+                (db.classes_attendance.BookingStatus != 'cancelled')
+        rows = db(query).select(db.classes_attendance.customers_classcards_id,
+                                count,
+                                groupby=db.classes_attendance.customers_classcards_id)
+
+        return dict([ (row.classes_attendance.customers_classcards_id, row[count])
+                      for row in rows ])
+
+
+    def _load(self):
+        """
+        :return: dict - roster for this class
+        """
+        db = current.db
+
+        cls = db.classes(self.clsID)
+        customers = self._get_attendance()
+
+        cuIDs = [ customer['cuID'] for customer in customers ]
+        if cuIDs:
+            subscriptions = self._get_subscriptions(cuIDs)
+            classcards = self._get_classcards(cuIDs)
+            for customer in customers:
+                customer['subscriptions'] = subscriptions.get(customer['cuID'], [])
+                customer['classcards'] = classcards.get(customer['cuID'], [])
+
+        return dict(
+            clsID=self.clsID,
+            date=self.date,
+            maxstudents=cls.Maxstudents or 0,
+            customers=customers,
+            booking_options={}
+        )
+
+
+    def get(self):
+        """
+        :return: dict - roster for this class, from cache when possible
+        """
+        from os_cache_manager import OsCacheManager
+
+        web2pytest = current.globalenv['web2pytest']
+        request = current.request
+
+        # Don't cache when running tests
+        if web2pytest.is_running_under_test(request, request.application):
+            return self._load()
+
+        ocm = OsCacheManager()
+        return ocm.get_shared(self._get_cache_key(),
+                              self._load,
+                              self._get_cache_tags(),
+                              time_expire=self.time_expire,
+                              index_tags=[ self._get_cache_tag() ])
+
+
+    def _set(self, roster):
+        """
+        Store roster in the cache, without loading it from the database
+        :param roster: dict - roster for this class
+        :return: None
+        """
+        from os_cache_manager import OsCacheManager
+
+        web2pytest = current.globalenv['web2pytest']
+        request = current.request
+
+        if web2pytest.is_running_under_test(request, request.application):
+            return
+
+        # Entries in the cache aren't replaced, clear the current one first
+        # so roster is stored under a new key
+        ocm = OsCacheManager()
+        ocm.clear_tags(self._get_cache_tag())
+        ocm.get_shared(self._get_cache_key(),
+                       lambda: roster,
+                       self._get_cache_tags(),
+                       time_expire=self.time_expire,
+                       index_tags=[ self._get_cache_tag() ])
+
+
+    def clear(self):
+        """
+        Remove the roster for this class from the cache
+        :return: None
+        """
+        from os_cache_manager import OsCacheManager
+
+        ocm = OsCacheManager()
+        ocm.clear_tags(self._get_cache_tag())
+
+
+    def get_booking_options(self, customer, roster=None):
+        """
+        :param customer: os_customer.Customer object
+        :param roster: dict - roster for this class, loaded when None
+        :return: dict - booking options of customer for this class, like
+                 AttendanceHelper.get_customer_class_booking_options. They're
+                 loaded once and kept in the roster.
+        """
+        from os_attendance_helper import AttendanceHelper
+
+        if roster is None:
+            roster = self.get()
+
+        cuID = int(customer.row.id)
+        options = roster['booking_options'].get(cuID)
+        if options is None:
+            ah = AttendanceHelper()
+            options = ah.get_customer_class_booking_options(self.clsID,
+                                                            self.date,
+                                                            customer,
+                                                            trial=True,
+                                                            list_type='selfcheckin')
+            roster['booking_options'][cuID] = options
+            self._set(roster)
+
+        return options
+
+
+    def get_full(self, roster=None):
+        """
+        :param roster: dict - roster for this class, loaded when None
+        :return: Boolean - True when there are no spaces left
+        """
+        if roster is None:
+            roster = self.get()
+
+        return len(roster['customers']) >= roster['maxstudents']
+
+
+    def check_in(self, clattID):
+        """
+        Set the booking status of a customer on the roster to attending
+        :param clattID: db.classes_attendance.id
+        :return: Boolean - True when the customer was checked in
+        """
+        from os_class_attendance import ClassAttendance
+
+        roster = self.get()
+
+        customer = None
+        for c in roster['customers']:
+            if c['clattID'] == int(clattID):
+                customer = c
+                break
+
+        if customer is None:
+            return False
+
+        if customer['status'] == 'attending':
+            return True
+
+        # Updating the booking clears the cached roster,
+        # store the checked in roster instead of loading it again.
+        ca = ClassAttendance(clattID)
+        ca.set_status('attending')
+
+        customer['status'] = 'attending'
+        self._set(roster)
+
+        return True
+
+
+    def _get_subscriptions_and_classcards_formatted(self, customer):
+        """
+        :param customer: dict - customer on the roster
+        :return: TABLE - subscriptions and class cards, like
+                 Customer.get_subscriptions_and_classcards_formatted
+        """
+        T = current.T
+        DATE_FORMAT = current.DATE_FORMAT
+
+        subscr_cards = TABLE(_class='grey small_font')
+
+        if not customer['subscriptions'] and not customer['classcards']:
+            subscr_cards.append(DIV(T("No subscription or class card"),
+                                    _class='red'))
+            return subscr_cards
+
+        if customer['subscriptions']:
+            subscription = DIV()
+            for cs in customer['subscriptions']:
+                subscr_dates = SPAN(' [', cs['startdate'].strftime(DATE_FORMAT))
+                if cs['enddate']:
+                    subscr_dates.append(' - ')
+                    subscr_dates.append(cs['enddate'].strftime(DATE_FORMAT))
+                subscr_dates.append('] ')
+
+                subscr_credits = ''
+                if cs['credits']:
+                    subscr_credits = SPAN(XML(' &bull; '), round(cs['credits'], 1), ' ',
+                                          T('Credits'))
+                subscription.append(SPAN(cs['name'], subscr_dates, subscr_credits))
+
+                if cs['paused']:
+                    paused = SPAN(T('Paused until'), ' ')
+                    if cs['paused_until']:
+                        paused.append(cs['paused_until'].strftime(DATE_FORMAT))
+                    subscription.append(SPAN(' | ', paused, _class='bold'))
+                subscription.append(BR())
+
+            subscr_cards.append(TR(subscription))
+
+        if customer['classcards']:
+            classcards = DIV()
+            for card in customer['classcards']:
+                if card['enddate']:
+                    enddate = card['enddate'].strftime(DATE_FORMAT)
+                else:
+                    enddate = T('No expiry')
+
+                classcards.append(SPAN(card['name'], XML(' &bull; '),
+                                       T('expires'), ' ',
+                                       enddate, XML(' &bull; '),
+                                       card['remaining']))
+                if not card['unlimited']:
+                    classcards.append(SPAN(' ', T("Classes remaining")))
+                classcards.append(BR())
+
+            subscr_cards.append(TR(classcards))
+
+        return subscr_cards
+
+
+    def get_checkin_list(self, roster=None, show_subscriptions=True):
+        """
+        :param roster: dict - roster for this class, loaded when None
+        :param show_subscriptions: Boolean - list subscriptions and cards of customers
+        :return: TABLE - customers booked for this class with check-in buttons
+        """
+        T = current.T
+        db = current.db
+        DATE_FORMAT = current.DATE_FORMAT
+        os_gui = current.globalenv['os_gui']
+
+        if roster is None:
+            roster = self.get()
+
+        class_full = self.get_full(roster)
+        date_formatted = self.date.strftime(DATE_FORMAT)
+
+        header = THEAD(TR(TH(),
+                          TH(T('Customer')),
+                          TH(T('Status')),
+                          TH()))
+        table = TABLE(header, _class='table table-striped table-hover')
+
+        represent_status = db.classes_attendance.BookingStatus.represent
+        for customer in roster['customers']:
+            btn = ''
+            if customer['status'] == 'attending':
+                attending = SPAN(_class='glyphicon glyphicon-ok green very_big_check')
+            else:
+                attending = SPAN(_class='glyphicon glyphicon-ok grey-light very_big_check')
+                if not class_full:
+                    btn = DIV(os_gui.get_button('noicon',
+                                                URL('selfcheckin', 'checkin_attending',
+                                                    vars={'clsID': self.clsID,
+                                                          'date': date_formatted,
+                                                          'clattID': customer['clattID']}),
+                                                title=T('Check in')),
+                              _class='pull-right')
+
+            subscr_cards = ''
+            if show_subscriptions:
+                subscr_cards = self._get_subscriptions_and_classcards_formatted(customer)
+
+            table.append(TR(TD(attending, _class='very_big_check'),
+                            TD(SPAN(customer['display_name'], _class='bold'), BR(),
+                               subscr_cards),
+                            TD(represent_status(customer['status'], None), _class='hidden-xs'),
+                            TD(btn)))
+
+        return table
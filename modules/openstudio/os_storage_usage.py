@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+import os
+import datetime
+
+from gluon import *
+
+
+class OsStorageUsage:
+    """
+        Keeps a running total of the space used in the uploads folder per table
+        in db.sys_storage_usage, so checking the storage quota doesn't have to
+        walk the uploads folder. Totals are updated by callbacks on tables with
+        upload fields and recalculated by the sys_storage_usage_reconcile task,
+        which corrects changes made without callbacks (eg. cascading deletes).
+        Files are counted for the table in the first part of their name, web2py
+        names uploads <table>.<field>.<uuid>.<name>.<ext>.
+    """
+    thumbnails = 'sys_thumbnails'
+    other = 'other'
+
+
+    def _get_uploads_folder(self):
+        """
+        :return: string - path to uploads folder
+        """
+        return os.path.join(current.request.folder, 'uploads')
+
+
+    def _get_file_size(self, name):
+        """
+        :param name: string - name of uploaded file
+        :return: int - size in bytes, 0 when the file doesn't exist
+        """
+        if not name:
+            return 0
+
+        try:
+            return os.stat(os.path.join(self._get_uploads_folder(), name)).st_size
+        except OSError:
+            return 0
+
+
+    def _get_table_name(self, name):
+        """
+        :param name: string - name of uploaded file
+        :return: string - table to count the file for
+        """
+        parts = name.split('.')
+        if len(parts) < 4:
+            return self.other
+
+        return parts[0]
+
+
+    def add(self, table_name, size):
+        """
+        Add size to the total of a table, use a negative size to subtract
+        :param table_name: string
+        :param size: int - bytes
+        :return: None
+        """
+        db = current.db
+
+        if not size:
+            return
+
+        query = (db.sys_storage_usage.TableName == table_name)
+        updated = db(query).update(
+            Bytes = db.sys_storage_usage.Bytes + size,
+            UpdatedOn = datetime.datetime.now()
+        )
+        if not updated:
+            db.sys_storage_usage.insert(
+                TableName = table_name,
+                Bytes = max(size, 0)
+            )
+
+
+    def add_file(self, name):
+        """
+        Add an uploaded file to the usage of its table
+        :param name: string - name of uploaded file
+        :return: None
+        """
+        if name:
+            self.add(self._get_table_name(name), self._get_file_size(name))
+
+
+    def remove_file(self, name):
+        """
+        Subtract an uploaded file, that's about to be deleted, from the usage
+        of its table
+        :param name: string - name of uploaded file
+        :return: None
+        """
+        if name:
+            self.add(self._get_table_name(name), -self._get_file_size(name))
+
+
+    def _get_autodelete_fields(self, table):
+        """
+        :param table: gluon.dal.Table
+        :return: list of upload fields of which files are deleted with a record
+        """
+        return [ field for field in table
+                 if field.type == 'upload' and field.autodelete ]
+
+
+    def set_callbacks(self, table):
+        """
+        Keep the usage of table up to date when records are inserted, updated
+        or deleted
+        :param table: gluon.dal.Table with upload fields
+        :return: None
+        """
+        def after_insert(fields, id):
+            for field in table:
+                if field.type == 'upload':
+                    self.add_file(fields.get(field.name))
+
+        def before_update(dbset, fields):
+            # Like web2py, files of computed upload fields are deleted on update
+            upload_fields = [ field for field in table
+                              if field.type == 'upload' and
+                                 (field.name in fields or
+                                  (field.compute and field.autodelete)) ]
+            if not upload_fields:
+                return
+
+            for row in dbset.select(*upload_fields):
+                for field in upload_fields:
+                    old_name = row[field.name]
+                    new_name = fields.get(field.name, None)
+                    if old_name == new_name:
+                        continue
+
+                    if field.autodelete:
+                        self.remove_file(old_name)
+                    self.add_file(new_name)
+
+        def before_delete(dbset):
+            upload_fields = self._get_autodelete_fields(table)
+            if not upload_fields:
+                return
+
+            for row in dbset.select(*upload_fields):
+                for field in upload_fields:
+                    self.remove_file(row[field.name])
+
+        table._after_insert.append(after_insert)
+        table._before_update.append(before_update)
+        table._before_delete.append(before_delete)
+
+
+    def reconcile(self):
+        """
+        Recalculate the usage of all tables by walking the uploads folder
+        :return: int - used bytes
+        """
+        db = current.db
+
+        uploads_folder = self._get_uploads_folder()
+        thumbs_folder = os.path.join(uploads_folder, 'thumbs')
+
+        usage = {}
+        seen = set()
+        for dirpath, dirnames, filenames in os.walk(uploads_folder):
+            for filename in filenames:
+                try:
+                    stat = os.stat(os.path.join(dirpath, filename))
+                except OSError:
+                    continue
+
+                if stat.st_ino in seen:
+                    continue
+                seen.add(stat.st_ino)
+
+                if dirpath.startswith(thumbs_folder):
+                    table_name = self.thumbnails
+                else:
+                    table_name = self._get_table_name(filename)
+
+                usage[table_name] = usage.get(table_name, 0) + stat.st_size
+
+        now = datetime.datetime.now()
+        db(db.sys_storage_usage).delete()
+        for table_name, size in usage.iteritems():
+            db.sys_storage_usage.insert(
+                TableName = table_name,
+                Bytes = size,
+                UpdatedOn = now
+            )
+
+        return sum(usage.values())
+
+
+    def get_usage(self):
+        """
+        :return: dict - {table name: used bytes}
+        """
+        db = current.db
+
+        rows = db(db.sys_storage_usage).select(db.sys_storage_usage.TableName,
+                                               db.sys_storage_usage.Bytes)
+        if not rows:
+            self.reconcile()
+            rows = db(db.sys_storage_usage).select(db.sys_storage_usage.TableName,
+                                                   db.sys_storage_usage.Bytes)
+
+        return dict([ (row.TableName, max(row.Bytes or 0, 0)) for row in rows ])
+
+
+    def get_used_mb(self):
+        """
+        :return: int - used space in MB
+        """
+        return sum(self.get_usage().values()) / 1000 / 1000
@@ -0,0 +1,454 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import hashlib
+import datetime
+
+from gluon import *
+
+
+class OsThumbnails:
+    """
+        Content addressed thumbnails for uploaded images.
+        The name of a thumbnail is made from the sha1 of the uploaded image and
+        the size of the thumbnail, so identical uploads share their thumbnails.
+        Thumbnails are listed in db.sys_thumbnails and generated by the
+        sys_thumbnails_process scheduler task. When a thumbnail is requested
+        before the task has run, it's generated right away.
+        Files are stored in uploads/thumbs/<first 2 characters of sha1>/, so the
+        autodelete of thumbnail fields only removes thumbnails made before.
+    """
+    # thumb.<sha1>.<width>x<height>[c].<ext>, c means the image is cropped to fit
+    name_regex = re.compile(r'^thumb\.(?P<sha1>[0-9a-f]{40})\.(?P<width>\d+)x(?P<height>\d+)(?P<fit>c?)\.(?P<ext>[a-z]+)$')
+    # Images uploaded to picture fields, web2py names these <table>.<field>.<uuid>.<name>.<ext>
+    upload_regex = re.compile(r'^[\w\-]+\.picture(_\d)?\.[\w\-]+(\.[\w\-]+)?\.\w+$')
+    # Sizes that can be requested using the default/thumbnail function
+    on_demand_sizes = [(100, 100), (200, 200), (300, 300), (600, 600), (800, 800)]
+    # Maximum number of on demand thumbnails, the least recently used ones are removed
+    on_demand_max = 2000
+    # Seconds a thumbnail can be cached by browsers and proxies
+    max_age = 365 * 24 * 60 * 60
+
+
+    def _get_uploads_folder(self):
+        """
+        :return: string - path to uploads folder
+        """
+        return os.path.join(current.request.folder, 'uploads')
+
+
+    def get_path(self, name, webp=False):
+        """
+        :param name: string - thumbnail name
+        :param webp: Boolean - path of the WebP variant
+        :return: string - path of thumbnail file
+        """
+        match = self.name_regex.match(name)
+
+        path = os.path.join(self._get_uploads_folder(),
+                            'thumbs',
+                            match.group('sha1')[:2],
+                            name)
+        if webp:
+            path += '.webp'
+
+        return path
+
+
+    def _get_sha1(self, path):
+        """
+        :param path: string - path of file
+        :return: string - sha1 hex digest of file contents
+        """
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                sha1.update(chunk)
+
+        return sha1.hexdigest()
+
+
+    def get_name(self, source, box, fit=True):
+        """
+        :param source: string - name of uploaded image
+        :param box: tuple(width, height)
+        :param fit: Boolean - crop the image to fill the box
+        :return: string - thumbnail name or None when the source doesn't exist
+        """
+        path = os.path.join(self._get_uploads_folder(), source)
+        if not os.path.isfile(path):
+            return None
+
+        ext = os.path.splitext(source)[1].lower().lstrip('.')
+        if ext == 'jpeg':
+            ext = 'jpg'
+
+        return 'thumb.%s.%sx%s%s.%s' % (self._get_sha1(path),
+                                        int(box[0]),
+                                        int(box[1]),
+                                        'c' if fit else '',
+                                        ext)
+
+
+    def add(self, source, box, fit=True, on_demand=False):
+        """
+        Add a thumbnail of an uploaded image to db.sys_thumbnails and queue the
+        task generating it, unless a thumbnail for the same image and size exists.
+        :param source: string - name of uploaded image
+        :param box: tuple(width, height)
+        :param fit: Boolean - crop the image to fill the box
+        :param on_demand: Boolean - thumbnail isn't referenced by a field
+        :return: string - thumbnail name or None when the source doesn't exist
+        """
+        db = current.db
+
+        if not source:
+            return None
+
+        name = self.get_name(source, box, fit)
+        if not name:
+            return None
+
+        row = db.sys_thumbnails(Name=name)
+        if row:
+            # The source this row was made from might be gone by now
+            row.update_record(
+                Source = source,
+                OnDemand = row.OnDemand and on_demand
+            )
+            if row.Status == 'generated' and os.path.isfile(self.get_path(name)):
+                return name
+
+            row.update_record(Status='pending')
+        else:
+            db.sys_thumbnails.insert(
+                Name = name,
+                Source = source,
+                Width = int(box[0]),
+                Height = int(box[1]),
+                Fit = fit,
+                OnDemand = on_demand
+            )
+
+        if not on_demand:
+            self._queue_task()
+
+        return name
+
+
+    def _queue_task(self):
+        """
+        Queue the sys_thumbnails_process task, unless it's already queued
+        :return: None
+        """
+        db = current.db
+        scheduler = current.globalenv['scheduler']
+
+        query = (db.scheduler_task.function_name == 'sys_thumbnails_process') & \
+                (db.scheduler_task.status.belongs(['QUEUED', 'ASSIGNED', 'RUNNING']))
+        if not db(query).count():
+            scheduler.queue_task('sys_thumbnails_process',
+                                 timeout=1800)
+
+
+    def webp_supported(self):
+        """
+        :return: Boolean - True when PIL can write WebP images
+        """
+        try:
+            from PIL import Image
+        except ImportError:
+            import Image
+
+        Image.init()
+
+        return 'WEBP' in Image.SAVE
+
+
+    def _resize(self, path, box, fit):
+        """
+        Downsample the image
+        :param path: string - path of image
+        :param box: tuple(width, height) - bounding box of the result image
+        :param fit: Boolean - crop the image to fill the box
+        :return: PIL Image
+        """
+        try:
+            from PIL import Image
+        except ImportError:
+            import Image
+
+        img = Image.open(path)
+        #preresize image with factor 2, 4, 8 and fast algorithm
+        factor = 1
+        while img.size[0] / factor > 2 * box[0] and img.size[1] * 2 / factor > 2 * box[1]:
+            factor *= 2
+        if factor > 1:
+            img.thumbnail((img.size[0] / factor, img.size[1] / factor), Image.NEAREST)
+
+        #calculate the cropping box and get the cropped part
+        if fit:
+            x1 = y1 = 0
+            x2, y2 = img.size
+            wRatio = 1.0 * x2 / box[0]
+            hRatio = 1.0 * y2 / box[1]
+            if hRatio > wRatio:
+                y1 = int(y2 / 2 - box[1] * wRatio / 2)
+                y2 = int(y2 / 2 + box[1] * wRatio / 2)
+            else:
+                x1 = int(x2 / 2 - box[0] * hRatio / 2)
+                x2 = int(x2 / 2 + box[0] * hRatio / 2)
+            img = img.crop((x1, y1, x2, y2))
+
+        #Resize the image with best quality algorithm ANTI-ALIAS
+        img.thumbnail(box, Image.ANTIALIAS)
+
+        return img
+
+
+    def generate(self, row):
+        """
+        Write the thumbnail (and the WebP variant when supported) for a
+        db.sys_thumbnails row
+        :param row: gluon.dal.Row - db.sys_thumbnails row
+        :return: Boolean - True when the thumbnail was generated
+        """
+        from os_storage_usage import OsStorageUsage
+
+        source_path = os.path.join(self._get_uploads_folder(), row.Source)
+        path = self.get_path(row.Name)
+        size = self._get_files_size(row.Name)
+
+        try:
+            img = self._resize(source_path, (row.Width, row.Height), row.Fit)
+
+            folder = os.path.dirname(path)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+
+            # Write to a temporary file first, so a request never gets half a file
+            tmp_path = os.path.join(folder, 'tmp.' + row.Name)
+            img.save(tmp_path)
+            os.rename(tmp_path, path)
+
+            if self.webp_supported():
+                if img.mode not in ('RGB', 'RGBA'):
+                    img = img.convert('RGBA')
+                img.save(tmp_path, format='WEBP', quality=85)
+                os.rename(tmp_path, self.get_path(row.Name, webp=True))
+        except (IOError, OSError):
+            row.update_record(Status='error')
+            return False
+
+        row.update_record(Status='generated')
+
+        OsStorageUsage().add(OsStorageUsage.thumbnails,
+                             self._get_files_size(row.Name) - size)
+
+        return True
+
+
+    def process(self, limit=500):
+        """
+        Generate pending thumbnails and remove least recently used on demand
+        thumbnails
+        :param limit: int - maximum number of thumbnails to generate
+        :return: dict(generated=int, errors=int, removed=int)
+        """
+        db = current.db
+
+        generated = 0
+        errors = 0
+
+        query = (db.sys_thumbnails.Status == 'pending')
+        rows = db(query).select(db.sys_thumbnails.ALL,
+                                orderby=db.sys_thumbnails.id,
+                                limitby=(0, limit))
+        for row in rows:
+            if self.generate(row):
+                generated += 1
+            else:
+                errors += 1
+            # Commit after each thumbnail, so requests see it's been generated
+            db.commit()
+
+        removed = self.remove_least_recently_used()
+
+        return dict(generated=generated,
+                    errors=errors,
+                    removed=removed)
+
+
+    def _get_files_size(self, name):
+        """
+        :param name: string - thumbnail name
+        :return: int - bytes used by the thumbnail and its WebP variant
+        """
+        size = 0
+        for path in [ self.get_path(name), self.get_path(name, webp=True) ]:
+            if os.path.isfile(path):
+                size += os.path.getsize(path)
+
+        return size
+
+
+    def _remove_files(self, name):
+        """
+        :param name: string - thumbnail name
+        :return: None
+        """
+        from os_storage_usage import OsStorageUsage
+
+        OsStorageUsage().add(OsStorageUsage.thumbnails,
+                             -self._get_files_size(name))
+
+        for path in [ self.get_path(name), self.get_path(name, webp=True) ]:
+            if os.path.isfile(path):
+                os.unlink(path)
+
+
+    def remove_least_recently_used(self):
+        """
+        Keep at most on_demand_max on demand thumbnails
+        :return: int - number of removed thumbnails
+        """
+        db = current.db
+
+        query = (db.sys_thumbnails.OnDemand == True)
+        count = db(query).count()
+        if count <= self.on_demand_max:
+            return 0
+
+        rows = db(query).select(db.sys_thumbnails.id,
+                                db.sys_thumbnails.Name,
+                                orderby=db.sys_thumbnails.LastAccessedOn,
+                                limitby=(0, count - self.on_demand_max))
+        for row in rows:
+            self._remove_files(row.Name)
+
+        db(db.sys_thumbnails.id.belongs([ row.id for row in rows ])).delete()
+
+        return len(rows)
+
+
+    def remove_unreferenced(self):
+        """
+        Remove thumbnails no longer referenced by thumbnail fields
+        :return: int - number of removed thumbnails
+        """
+        db = current.db
+
+        db.define_all()
+
+        referenced = set()
+        for table in db:
+            for field in table:
+                if field.type == 'upload' and field.name.startswith('thumb'):
+                    query = field.startswith('thumb.')
+                    for row in db(query).select(field, distinct=True):
+                        referenced.add(row[field])
+
+        query = (db.sys_thumbnails.OnDemand == False)
+        rows = db(query).select(db.sys_thumbnails.id,
+                                db.sys_thumbnails.Name)
+
+        removed = [ row for row in rows if row.Name not in referenced ]
+        for row in removed:
+            self._remove_files(row.Name)
+
+        db(db.sys_thumbnails.id.belongs([ row.id for row in removed ])).delete()
+
+        return len(removed)
+
+
+    def get_on_demand(self, source, size):
+        """
+        Get an on demand thumbnail, generate it when it doesn't exist yet
+        :param source: string - name of uploaded image
+        :param size: string - <width>x<height>[c], c means crop to fit
+        :return: string - thumbnail name or None
+        """
+        db = current.db
+
+        match = re.match(r'^(\d+)x(\d+)(c?)$', size or '')
+        if not match or not self.upload_regex.match(source or ''):
+            return None
+
+        box = (int(match.group(1)), int(match.group(2)))
+        fit = match.group(3) == 'c'
+        if box not in self.on_demand_sizes:
+            return None
+
+        query = (db.sys_thumbnails.Source == source) & \
+                (db.sys_thumbnails.Width == box[0]) & \
+                (db.sys_thumbnails.Height == box[1]) & \
+                (db.sys_thumbnails.Fit == fit) & \
+                (db.sys_thumbnails.Status == 'generated')
+        row = db(query).select(db.sys_thumbnails.ALL).first()
+        if row:
+            self._touch(row)
+            return row.Name
+
+        return self.add(source, box, fit, on_demand=True)
+
+
+    def _touch(self, row):
+        """
+        Update LastAccessedOn, at most once an hour to limit writes
+        :param row: gluon.dal.Row - db.sys_thumbnails row
+        :return: None
+        """
+        now = datetime.datetime.now()
+        if not row.LastAccessedOn or row.LastAccessedOn < now - datetime.timedelta(hours=1):
+            row.update_record(LastAccessedOn=now)
+
+
+    def stream(self, name):
+        """
+        Stream a thumbnail with headers allowing browsers and proxies to cache
+        it. The name changes when the image changes, so it can be cached for a
+        long time. Sends the WebP variant to browsers accepting it.
+        :param name: string - thumbnail name
+        :return: raises HTTP with the thumbnail, 304 Not Modified or 404
+        """
+        db = current.db
+        request = current.request
+        response = current.response
+
+        if not self.name_regex.match(name or ''):
+            raise HTTP(404)
+
+        path = self.get_path(name)
+        if not os.path.isfile(path):
+            # Not generated by the scheduler yet, generate it now
+            row = db.sys_thumbnails(Name=name)
+            if not row or not self.generate(row):
+                raise HTTP(404)
+
+        webp_path = self.get_path(name, webp=True)
+        accept = request.env.http_accept or ''
+        expires = datetime.datetime.utcnow() + datetime.timedelta(seconds=self.max_age)
+        headers = {
+            'Cache-Control': 'public, max-age=%s, immutable' % self.max_age,
+            'Expires': expires.strftime('%a, %d %b %Y %H:%M:%S GMT'),
+            'Vary': 'Accept',
+        }
+
+        if 'image/webp' in accept and os.path.isfile(webp_path):
+            path = webp_path
+            etag = '"%s.webp"' % name
+            headers['Content-Type'] = 'image/webp'
+        else:
+            etag = '"%s"' % name
+            headers['Content-Type'] = 'image/png' if name.endswith('.png') else \
+                                      'image/gif' if name.endswith('.gif') else \
+                                      'image/jpeg'
+        headers['ETag'] = etag
+
+        if request.env.http_if_none_match == etag:
+            raise HTTP(304, **headers)
+
+        response.headers.update(headers)
+
+        return response.stream(path, request=request)
@@ -276,7 +276,10 @@ class WorkshopProduct:
         ##
         if self.workshop.AutoSendInfoMail:
             osmail = OsMail()
-            msgID = osmail.render_email_template('workshops_info_mail', workshops_products_customers_id=wspcID)
+            msgID = osmail.render_email_template_batch(
+                'workshops_info_mail',
+                [ {'workshops_products_customers_id': wspcID} ]
+            )[0]
             osmail.send(msgID, cuID)
 
         if not waitinglist:
@@ -218,10 +218,12 @@ class WorkshopSchedule:
         if web2pytest.is_running_under_test(request, request.application):
             rows = self._get_workshops_shop()
         else:
-            cache = current.cache
+            from os_cache_manager import OsCacheManager
+
             CACHE_LONG = current.globalenv['CACHE_LONG']
             cache_key = 'openstudio_workshops_workshops_schedule_shop'
 
-            rows = cache.ram(cache_key , lambda: self._get_workshops_shop(), time_expire=CACHE_LONG)
+            ocm = OsCacheManager()
+            rows = ocm.get(cache_key, lambda: self._get_workshops_shop(), ['workshops'], time_expire=CACHE_LONG)
 
         return rows
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from gluon import *
+from pydal.objects import Row
 
 
 class OsTools:
@@ -117,7 +118,6 @@ class OsTools:
         :param value_type: Python data type eg. int
         :return: db.sys_properties.PropertyValue
         """
-        cache = current.cache
         web2pytest = current.web2pytest
         request = current.request
         CACHE_LONG = current.CACHE_LONG
@@ -128,9 +128,13 @@ class OsTools:
         if web2pytest.is_running_under_test(request, request.application):
             sprop = self._get_sys_property(value, value_type)
         else:
-            sprop = cache.ram(cache_key,
-                              lambda: self._get_sys_property(value, value_type),
-                              time_expire=CACHE_LONG)
+            from os_cache_manager import OsCacheManager
+
+            ocm = OsCacheManager()
+            sprop = ocm.get_shared(cache_key,
+                                   lambda: self._get_sys_property(value, value_type),
+                                   ['sys_properties'],
+                                   time_expire=CACHE_LONG)
 
         return sprop
 
@@ -215,4 +219,83 @@ class OsSession:
         if session_parameter:
             session[session_parameter] = value
 
-        return value
\ No newline at end of file
+        return value
+
+class OsBulkInsert:
+    """
+        Inserts many rows into a table using multi-row INSERT statements
+    """
+    def __init__(self, db_table, chunk_size=500):
+        """
+        :param db_table: gluon.dal.Table eg. db.invoices_items
+        :param chunk_size: int - max number of rows per INSERT statement
+        """
+        self.db_table = db_table
+        self.chunk_size = chunk_size
+
+
+    def _get_values(self, row):
+        """
+            Add defaults & computed fields to a row, the same way the DAL
+            does for a single insert
+        :param row: dict
+        :return: dict
+        """
+        values = {}
+        for field in self.db_table:
+            if field.type == 'id':
+                continue
+
+            if field.name in row:
+                values[field.name] = row[field.name]
+            elif field.default is not None:
+                default = field.default
+                values[field.name] = default() if callable(default) else default
+
+        for field in self.db_table:
+            if field.compute and field.name not in row:
+                try:
+                    values[field.name] = field.compute(Row(values))
+                except (KeyError, AttributeError, TypeError):
+                    pass
+
+        return values
+
+
+    def insert(self, rows):
+        """
+        :param rows: list of dicts {field_name: value}
+        :return: int - number of rows inserted
+        """
+        db = current.db
+        adapter = db._adapter
+        table = self.db_table
+
+        rows = [ self._get_values(row) for row in rows ]
+        if not rows:
+            return 0
+
+        field_names = []
+        for row in rows:
+            for name in row:
+                if name not in field_names:
+                    field_names.append(name)
+        fields = [ table[name] for name in field_names ]
+
+        for i in range(0, len(rows), self.chunk_size):
+            values = []
+            for row in rows[i:i + self.chunk_size]:
+                values.append('(' + ', '.join([
+                    adapter.represent(row.get(field.name), field.type)
+                    for field in fields
+                ]) + ')')
+
+            sql = 'INSERT INTO {table} ({fields}) VALUES {values};'.format(
+                table=table.sqlsafe,
+                fields=', '.join([ field.sqlsafe_name for field in fields ]),
+                values=', '.join(values)
+            )
+
+            db.executesql(sql)
+
+        return len(rows)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+from gluon import *
+from gluon.tools import Auth
+
+
+class OSSAuth(Auth):
+    """
+    Auth that loads the groups & permissions of the logged in user in one query
+    and answers has_membership & has_permission checks for that user from memory.
+    The loaded set is cached across requests and invalidated when
+    auth_group, auth_membership or auth_permission change.
+    """
+    permissions_cache_tag = 'auth_permissions'
+
+
+    def _load_user_permissions(self, user_id):
+        """
+        :param user_id: db.auth_user.id
+        :return: dict(groups={group_id: role}, permissions=set of (name, table_name, record_id))
+        """
+        db = self.db
+
+        left = [
+            db.auth_group.on(db.auth_membership.group_id == db.auth_group.id),
+            db.auth_permission.on(db.auth_permission.group_id == db.auth_membership.group_id)
+        ]
+        query = (db.auth_membership.user_id == user_id)
+        rows = db(query).select(db.auth_membership.group_id,
+                                db.auth_group.role,
+                                db.auth_permission.name,
+                                db.auth_permission.table_name,
+                                db.auth_permission.record_id,
+                                left=left)
+
+        groups = {}
+        permissions = set()
+        for row in rows:
+            groups[row.auth_membership.group_id] = row.auth_group.role
+            if row.auth_permission.name:
+                permissions.add((row.auth_permission.name,
+                                 row.auth_permission.table_name,
+                                 row.auth_permission.record_id or 0))
+
+        return dict(groups=groups, permissions=permissions)
+
+
+    def get_user_permissions(self, user_id):
+        """
+        :param user_id: db.auth_user.id
+        :return: dict(groups={group_id: role}, permissions=set of (name, table_name, record_id))
+        """
+        from openstudio.os_cache_manager import OsCacheManager
+
+        web2pytest = current.web2pytest
+        request = current.request
+        CACHE_LONG = current.CACHE_LONG
+
+        # Auth is created for each request, so this holds the sets for this request
+        if not hasattr(self, '_user_permissions'):
+            self._user_permissions = {}
+
+        if user_id not in self._user_permissions:
+            # Don't cache when running tests
+            if web2pytest.is_running_under_test(request, request.application):
+                user_permissions = self._load_user_permissions(user_id)
+            else:
+                ocm = OsCacheManager()
+                user_permissions = ocm.get_shared(
+                    'openstudio_auth_permissions_user_' + unicode(user_id),
+                    lambda: self._load_user_permissions(user_id),
+                    [self.permissions_cache_tag],
+                    time_expire=CACHE_LONG
+                )
+
+            self._user_permissions[user_id] = user_permissions
+
+        return self._user_permissions[user_id]
+
+
+    def clear_permissions_cache(self):
+        """
+        Clear loaded groups & permissions, for this request and in cache
+        :return: None
+        """
+        from openstudio.os_cache_manager import OsCacheManager
+
+        self._user_permissions = {}
+        OsCacheManager().clear_auth_permissions()
+
+
+    def _is_current_user(self, user_id):
+        """
+        :param user_id: db.auth_user.id or None
+        :return: Boolean - True when checking the logged in user
+        """
+        if not self.user:
+            return False
+
+        return user_id is None or unicode(user_id) == unicode(self.user.id)
+
+
+    def has_membership(self, group_id=None, user_id=None, role=None, cached=False):
+        """
+        Same as Auth.has_membership, checks for the logged in user are done in memory
+        """
+        if not self._is_current_user(user_id) or cached:
+            return Auth.has_membership(self, group_id=group_id, user_id=user_id,
+                                       role=role, cached=cached)
+
+        groups = self.get_user_permissions(self.user.id)['groups']
+
+        if not group_id:
+            return role in groups.values()
+
+        try:
+            return int(group_id) in groups
+        except (ValueError, TypeError):
+            # group_id is a role
+            return group_id in groups.values()
+
+
+    def has_permission(self, name='any', table_name='', record_id=0, user_id=None, group_id=None):
+        """
+        Same as Auth.has_permission, checks for the logged in user are done in memory
+        """
+        if (not self._is_current_user(user_id) or group_id or
+            self.settings.everybody_group_id):
+            return Auth.has_permission(self, name=name, table_name=table_name,
+                                       record_id=record_id, user_id=user_id,
+                                       group_id=group_id)
+
+        permissions = self.get_user_permissions(self.user.id)['permissions']
+
+        return (name, str(table_name), record_id or 0) in permissions
+
+
+    def requires_admin_or_permission(self, name, table_name, record_id=0):
+        """
+        Decorator to use instead of
+        @auth.requires(auth.has_membership(group_id='Admins') or
+                       auth.has_permission(name, table_name))
+        The check only runs when the decorated function is called.
+        """
+        return self.requires(
+            lambda: (self.has_membership(group_id='Admins') or
+                     self.has_permission(name, table_name, record_id))
+        )
@@ -34,13 +34,15 @@ def uploads_available_space(app_dir):
     '''
         Gets the used space for the uploads directory, returns a dictionairy 
         containing allowed, used and available space.
+        The used space is the running total kept by OsStorageUsage.
     '''
+    from openstudio.os_storage_usage import OsStorageUsage
+
     dba = current.db
     row = dba.sys_properties(Property='storage_allowed_space')
     allowed_space = int(row.PropertyValue)
     
-    uploads_dir = os.path.join(app_dir, 'uploads')
-    used_space = get_size(uploads_dir)
+    used_space = OsStorageUsage().get_used_mb()
     available_space = allowed_space - used_space
     
     full_message = DIV(BR(),
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+    Measures the time it takes to render the class schedule table for a day.
+
+    Run it from the web2py folder, using the database set in appconfig.ini:
+
+    python web2py.py -S openstudio -M -R applications/openstudio/tests/benchmarks/bench_day_table.py -A 2019-02-04 50 1
+
+    Arguments (all optional): date (default today), number of runs and the id
+    of the user to render the table for (default 1, the admin user).
+
+    The schedule rows are fetched once, so the reported render time doesn't
+    include the query. The query time is reported separately.
+"""
+
+import datetime
+import sys
+import time
+
+from openstudio.os_class_schedule import ClassSchedule
+
+
+def report(title, timings):
+    timings = sorted(timings)
+    count = len(timings)
+
+    print '%s (%s runs)' % (title, count)
+    print '  mean:   %.1f ms' % (sum(timings) / count * 1000)
+    print '  median: %.1f ms' % (timings[count // 2] * 1000)
+    print '  min:    %.1f ms' % (timings[0] * 1000)
+
+
+def main():
+    args = sys.argv[1:]
+    if len(args) > 0:
+        date = datetime.datetime.strptime(args[0], '%Y-%m-%d').date()
+    else:
+        date = datetime.date.today()
+    runs = int(args[1]) if len(args) > 1 else 25
+    auth_user_id = int(args[2]) if len(args) > 2 else 1
+
+    auth.user = db.auth_user(auth_user_id)
+
+    query_timings = []
+    for i in range(runs):
+        start = time.time()
+        rows = ClassSchedule(date).get_day_rows()
+        query_timings.append(time.time() - start)
+
+    # Warm up lookup dicts & trend cache
+    ClassSchedule(date, day_rows=rows)._get_day_table()
+
+    render_timings = []
+    for i in range(runs):
+        start = time.time()
+        result = ClassSchedule(date, day_rows=rows)._get_day_table()
+        result['table'].xml()
+        render_timings.append(time.time() - start)
+
+    print 'Day table for %s, %s classes' % (date, len(rows))
+    report('Query', query_timings)
+    report('Render table (incl. xml)', render_timings)
+
+
+main()
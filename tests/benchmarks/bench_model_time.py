@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+    Measures the time it takes to run the models of OpenStudio for a request.
+
+    Run it from the web2py folder, using the database set in appconfig.ini:
+
+    python web2py.py -S openstudio -R applications/openstudio/tests/benchmarks/bench_model_time.py -A api index 50
+
+    Arguments (all optional): controller, function, number of runs.
+
+    The models are run in a fresh environment for each run, like they are for a
+    request. Reported are the time to run the models and the time to run the
+    models and define all tables, which is what each request used to do before
+    tables were defined on first use. To compare with an older release, run the
+    script in a checkout of that release.
+"""
+
+import sys
+import time
+
+from gluon.compileapp import run_models_in
+from gluon.shell import env
+
+
+def run_models(application, controller, function, define_all=False):
+    """
+    :return: float - seconds it took to run the models
+    """
+    environment = env(application, import_models=False, c=controller, f=function)
+
+    start = time.time()
+    run_models_in(environment)
+    db = environment['db']
+    if define_all and hasattr(db, 'define_all'):
+        db.define_all()
+    seconds = time.time() - start
+
+    db.commit()
+    db.close()
+
+    return seconds
+
+
+def report(title, timings):
+    timings = sorted(timings)
+    count = len(timings)
+
+    print '%s (%s runs)' % (title, count)
+    print '  mean:   %.1f ms' % (sum(timings) / count * 1000)
+    print '  median: %.1f ms' % (timings[count // 2] * 1000)
+    print '  min:    %.1f ms' % (timings[0] * 1000)
+
+
+def main():
+    args = sys.argv[1:]
+    controller = args[0] if len(args) > 0 else 'default'
+    function = args[1] if len(args) > 1 else 'index'
+    runs = int(args[2]) if len(args) > 2 else 25
+
+    application = request.application
+
+    # Warm up caches & migrations
+    run_models(application, controller, function, define_all=True)
+
+    lazy = [ run_models(application, controller, function) for i in range(runs) ]
+    all_tables = [ run_models(application, controller, function, define_all=True)
+                   for i in range(runs) ]
+
+    print 'Model time for %s/%s' % (controller, function)
+    report('Models, tables defined on first use', lazy)
+    report('Models, all tables defined', all_tables)
+
+
+main()
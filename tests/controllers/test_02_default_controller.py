@@ -134,3 +134,64 @@ from gluon.contrib.populate import populate
 #
 #     customer_name = web2py.db.auth_user(1001).first_name.split(' ')[0]
 #     assert customer_name in client.text
+
+
+def test_thumbnail_on_demand(client, web2py):
+    """
+        Is an on demand thumbnail generated and served with cache headers?
+    """
+    import os
+    try:
+        from PIL import Image
+    except ImportError:
+        import Image
+
+    # Get random url to initialize OpenStudio environment
+    url = '/default/user/login'
+    client.get(url)
+    assert client.status == 200
+
+    source = 'school_classtypes.picture.test.thumbnail.png'
+    path = os.path.join(web2py.request.folder, 'uploads', source)
+    sources = [ path, path.replace('test', 'copy') ]
+
+    try:
+        Image.new('RGB', (640, 480), (255, 0, 0)).save(path)
+
+        url = '/default/thumbnail/100x100c/' + source
+        client.get(url)
+        assert client.status == 200
+        assert 'immutable' in client.headers['cache-control']
+
+        row = web2py.db.sys_thumbnails(Source=source)
+        assert row.OnDemand == True
+        assert row.Status == 'generated'
+        assert row.Name.endswith('.100x100c.png')
+
+        # Thumbnails of identical images are shared
+        url = '/default/thumbnail/100x100c/' + source.replace('test', 'copy')
+        Image.new('RGB', (640, 480), (255, 0, 0)).save(sources[1])
+        client.get(url)
+        assert client.status == 200
+
+        assert web2py.db(web2py.db.sys_thumbnails).count() == 1
+
+        url = '/default/download/' + row.Name
+        client.get(url)
+        assert client.status == 200
+        assert client.headers['etag'].strip('"').startswith(row.Name)
+    finally:
+        # Remove uploaded images, generated thumbnails & their records
+        thumbs = os.path.join(web2py.request.folder, 'uploads', 'thumbs')
+        names = [ row.Name for row in web2py.db(web2py.db.sys_thumbnails).select() ]
+        for folder, dirs, files in os.walk(thumbs):
+            for name in files:
+                if any([ name.startswith(n) for n in names if n ]):
+                    os.remove(os.path.join(folder, name))
+
+        for source_path in sources:
+            if os.path.exists(source_path):
+                os.remove(source_path)
+
+        web2py.db(web2py.db.sys_thumbnails).delete()
+        web2py.db.commit()
@@ -228,6 +228,34 @@ def test_load_list_birthday_icon(client, web2py):
     assert 'fa-birthday-cake' in client.text
 
 
+def test_load_list_search(client, web2py):
+    """
+        Are customers found by the start of a word in their name,
+        ignoring case and accents?
+    """
+    populate_customers(web2py, 2)
+
+    customer = web2py.db.auth_user(1001)
+    customer.first_name = u'\xc9mile'
+    customer.last_name = 'Zola'
+    customer.update_record()
+
+    web2py.db.commit()
+
+    other = web2py.db.auth_user(1002)
+
+    url = '/customers/load_list_set_search.json?name=emil'
+    client.get(url)
+    assert client.status == 200
+
+    url = '/customers/load_list?list_type=customers_index&archived=False&items_per_page=7'
+    client.get(url)
+    assert client.status == 200
+
+    assert 'Zola' in client.text
+    assert other.display_name not in client.text
+
+
 def populate_account_merge(client, web2py):
     """
         Populates all tables with reference to auth_user for user 1002
@@ -1006,6 +1034,10 @@ def test_subscription_credits_add(client, web2py):
 
     assert web2py.db(web2py.db.customers_subscriptions_credits.id > 0).count() == 1
 
+    # check the stored balance
+    cs = web2py.db.customers_subscriptions(1)
+    assert cs.CreditsBalance == data['MutationAmount']
+
 
 def test_subscription_credits_edit(client, web2py):
     """
@@ -1035,6 +1067,10 @@ def test_subscription_credits_edit(client, web2py):
     csc = web2py.db.customers_subscriptions_credits(1)
     assert csc.Description == data['Description']
 
+    # check the stored balance
+    cs = web2py.db.customers_subscriptions(1)
+    assert cs.CreditsBalance == data['MutationAmount']
+
 
 def test_subscription_credits_delete(client, web2py):
     """
@@ -1047,12 +1083,19 @@ def test_subscription_credits_delete(client, web2py):
 
     populate_customers_with_subscriptions(web2py, credits=True)
 
+    cs = web2py.db.customers_subscriptions(1)
+    assert cs.CreditsBalance == 3456
+
     url = '/customers/subscription_credits_delete?cuID=1001&csID=1&cscID=1'
     client.get(url)
     assert client.status == 200
 
     assert web2py.db(web2py.db.customers_subscriptions_credits.id > 0).count() == 0
 
+    # check the stored balance
+    cs = web2py.db.customers_subscriptions(1)
+    assert cs.CreditsBalance == 0
+
 
 def test_subscription_credits_month_expired(client, web2py):
     """
@@ -1448,6 +1491,18 @@ def test_classes_attendance_cancel_booking_and_refund_credits(client, web2py):
     query = (web2py.db.customers_subscriptions_credits.id > 0)
     assert web2py.db(query).count() == 1
 
+    # Check attendance stats for the class
+    query = (web2py.db.classes_attendance.classes_id == clatt.classes_id) & \
+            (web2py.db.classes_attendance.ClassDate == clatt.ClassDate)
+    total = web2py.db(query).count()
+    query &= (web2py.db.classes_attendance.BookingStatus != 'cancelled')
+    attending = web2py.db(query).count()
+
+    stats = web2py.db.classes_attendance_stats(classes_id=clatt.classes_id,
+                                               ClassDate=clatt.ClassDate)
+    assert stats.Attending == attending
+    assert stats.Total == total
+
 
 # def test_payments_info_add(client, web2py):
 #     """
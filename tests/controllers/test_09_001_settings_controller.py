@@ -29,6 +29,75 @@ def test_system_organizations(client, web2py):
     assert so.Name in client.text
 
 
+def test_system_storage_reconcile(client, web2py):
+    """
+        Is the used storage per table recalculated from the uploads folder?
+    """
+    # Get random url to initialize OpenStudio environment
+    url = '/default/user/login'
+    client.get(url)
+    assert client.status == 200
+
+    web2py.db.sys_storage_usage.insert(
+        TableName='customers_documents',
+        Bytes=123456789123
+    )
+    web2py.db.commit()
+
+    url = '/settings/system_storage_reconcile'
+    client.get(url)
+    assert client.status == 200
+    assert 'Used space per type' in client.text
+
+    query = (web2py.db.sys_storage_usage.Bytes == 123456789123)
+    assert web2py.db(query).count() == 0
+
+
+def test_system_storage_usage_callbacks(client, web2py):
+    """
+        Is the used storage of a table kept up to date when a file is
+        uploaded, replaced and deleted?
+    """
+    from cStringIO import StringIO
+
+    # Get random url to initialize OpenStudio environment
+    url = '/default/user/login'
+    client.get(url)
+    assert client.status == 200
+
+    db = web2py.db
+
+    def get_bytes():
+        row = db.sys_storage_usage(TableName='sys_files')
+        return row.Bytes if row else 0
+
+    bytes_before = get_bytes()
+
+    try:
+        # Upload
+        sfID = db.sys_files.insert(
+            Name='test_storage_usage',
+            SysFile=db.sys_files.SysFile.store(StringIO('a' * 1000), 'test.txt')
+        )
+        db.commit()
+        assert get_bytes() == bytes_before + 1000
+
+        # Replace
+        db(db.sys_files.id == sfID).update(
+            SysFile=db.sys_files.SysFile.store(StringIO('b' * 2500), 'test.txt')
+        )
+        db.commit()
+        assert get_bytes() == bytes_before + 2500
+
+        # Delete
+        db(db.sys_files.id == sfID).delete()
+        db.commit()
+        assert get_bytes() == bytes_before
+    finally:
+        db(db.sys_files.Name == 'test_storage_usage').delete()
+        db.commit()
+
+
 def test_system_organization_add(client, web2py):
     """
         Can we add an organization?
@@ -4,7 +4,11 @@
 
 These tests run based on webclient and need web2py server running.
 """
+import asyncore
 import datetime
+import json
+import smtpd
+import threading
 
 from gluon.contrib.populate import populate
 
@@ -120,5 +124,168 @@ def test_osmail_render_sys_notification_order_created(client, web2py):
     assert order.CustomerNote in client.text
 
 
+def test_osmail_render_template_batch(client, web2py):
+    """
+        Are many messages rendered from one template, storing each distinct
+        message once?
+    """
+    url = '/default/user/login'
+    client.get(url)
+    assert client.status == 200
+
+    populate_customers(web2py, 10)
+    populate_customers_orders(web2py)
+    populate_customers_orders_items(web2py)
+
+    messages_before = web2py.db(web2py.db.messages).count()
+
+    url = '/test_os_mail/test_osmail_render_template_batch?email_template=order_received&customers_orders_ids=1,2,1'
+    client.get(url)
+    assert client.status == 200
+
+    msgIDs = client.text.strip().split(',')
+    assert len(msgIDs) == 3
+    assert msgIDs[0] == msgIDs[2]
+    assert msgIDs[0] != msgIDs[1]
+    assert web2py.db(web2py.db.messages).count() == messages_before + 2
+
+    # Check personalised content
+    for msgID, coID in zip(msgIDs[:2], [1, 2]):
+        message = web2py.db.messages(msgID)
+        order = web2py.db.customers_orders(coID)
+        oi = web2py.db(web2py.db.customers_orders_items.customers_orders_id == coID).select().first()
+
+        assert message.msg_subject == 'Order received'
+        assert oi.ProductName in message.msg_content
+        assert order.CustomerNote in message.msg_content
+
+
+
+
+
+
+def test_osmail_template_compiled_again(client, web2py):
+    """
+        Is a cached template compiled again after it's been edited?
+    """
+    url = '/default/user/login'
+    client.get(url)
+    assert client.status == 200
+
+    content = 'Edited order received template'
+    url = '/test_os_mail/test_osmail_template_compiled_again?email_template=order_received&content=' + \
+          content.replace(' ', '+')
+    client.get(url)
+    assert client.status == 200
+
+    data = json.loads(client.text)
+    assert data['before'] != content
+    assert data['after'] == content
+
+
+class SMTPSink(smtpd.SMTPServer):
+    """
+        Local SMTP server keeping received messages in a list
+    """
+    def __init__(self, *args, **kwargs):
+        smtpd.SMTPServer.__init__(self, *args, **kwargs)
+        self.messages = []
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.messages.append((rcpttos, data))
+
+
+def test_osmail_outbox_process(client, web2py):
+    """
+        Are messages in the outbox sent using one connection to a local SMTP
+        server and is the status of customer messages updated?
+    """
+    # get a random url to init OpenStudio environment
+    url = '/default/user/login'
+    client.get(url)
+    assert client.status == 200
+
+    populate_customers(web2py, 2)
+
+    sink = SMTPSink(('127.0.0.1', 0), None)
+    thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.1})
+    thread.daemon = True
+    thread.start()
+
+    msgID = web2py.db.messages.insert(msg_subject='Outbox test',
+                                      msg_content='<html><body>Hello</body></html>')
+    for cuID in [ 1001, 1002 ]:
+        cumID = web2py.db.customers_messages.insert(auth_customer_id=cuID,
+                                                    messages_id=msgID,
+                                                    Status='queued')
+        web2py.db.sys_mail_outbox.insert(messages_id=msgID,
+                                         customers_messages_id=cumID,
+                                         MailTo=web2py.db.auth_user(cuID).email,
+                                         NextAttemptOn=datetime.datetime.now())
+
+    web2py.db.commit()
+
+    try:
+        url = '/test_os_mail/test_osmail_outbox_process?server=127.0.0.1:' + \
+              unicode(sink.socket.getsockname()[1])
+        client.get(url)
+        assert client.status == 200
+    finally:
+        sink.close()
+
+    assert len(sink.messages) == 2
+    assert 'Subject: Outbox test' in sink.messages[0][1]
+    assert sink.messages[0][0] == [ web2py.db.auth_user(1001).email ]
+
+    query = (web2py.db.sys_mail_outbox.Status == 'sent')
+    assert web2py.db(query).count() == 2
+
+    query = (web2py.db.customers_messages.Status == 'sent')
+    assert web2py.db(query).count() == 2
+
+
+def test_osmail_outbox_process_queues_retry(client, web2py):
+    """
+        Does the running outbox task queue a task to retry a message that
+        couldn't be sent?
+    """
+    import socket
+
+    # get a random url to init OpenStudio environment
+    url = '/default/user/login'
+    client.get(url)
+    assert client.status == 200
+
+    populate_customers(web2py, 1)
+
+    # Port without an SMTP server
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    msgID = web2py.db.messages.insert(msg_subject='Outbox test',
+                                      msg_content='Hello')
+    web2py.db.sys_mail_outbox.insert(messages_id=msgID,
+                                     MailTo=web2py.db.auth_user(1001).email,
+                                     NextAttemptOn=datetime.datetime.now())
+    # The task processing the outbox
+    web2py.db.scheduler_task.insert(function_name='sys_mail_outbox_process',
+                                    task_name='sys_mail_outbox_process',
+                                    status='RUNNING')
+    web2py.db.commit()
+
+    url = '/test_os_mail/test_osmail_outbox_process?server=127.0.0.1:' + unicode(port)
+    client.get(url)
+    assert client.status == 200
+    assert 'sent: 0 errors: 1' in client.text
 
+    row = web2py.db.sys_mail_outbox(1)
+    assert row.Status == 'pending'
+    assert row.Attempts == 1
 
+    query = (web2py.db.scheduler_task.function_name == 'sys_mail_outbox_process') & \
+            (web2py.db.scheduler_task.status == 'QUEUED')
+    task = web2py.db(query).select(web2py.db.scheduler_task.ALL).first()
+    assert task
+    assert task.start_time == row.NextAttemptOn
@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 
 import datetime
+import json
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
 from populate_os_tables import populate_customers_with_subscriptions
 from populate_os_tables import prepare_classes
 
@@ -52,6 +56,80 @@ def test_create_monthly_invoices(client, web2py):
     assert item.Price == ssup.Price
 
 
+def test_create_monthly_invoices_revenue(client, web2py):
+    """
+        Is the revenue of subscription invoices created in bulk shown in the
+        revenue report?
+    """
+    # Get random url to initialize OpenStudio environment
+    url = '/default/user/login'
+
+    client.get(url)
+    assert client.status == 200
+
+    populate_customers_with_subscriptions(web2py, 10)
+
+    url = '/test_automation_customer_subscriptions/' + \
+          'test_create_invoices' + \
+          '?month=1&year=2014&description=Subscription_Jan'
+    client.get(url)
+    assert client.status == 200
+
+    amount = web2py.db.invoices_amounts.TotalPriceVAT.sum()
+    revenue = web2py.db(web2py.db.invoices_amounts).select(amount).first()[amount]
+    assert revenue > 0
+
+    url = '/reports/revenue?year=2014'
+    client.get(url)
+    assert client.status == 200
+
+    url = '/reports/revenue_get_data.json'
+    client.get(url)
+    assert client.status == 200
+
+    data = json.loads(client.text)['json_data']
+    assert data['subscriptions']['datasets'][0]['data'][0] == round(revenue, 2)
+
+
+def test_create_monthly_invoices_amounts_and_numbering(client, web2py):
+    """
+        Are amounts created for all invoices and is the next invoice number
+        of the invoice group updated?
+    """
+    # Get random url to initialize OpenStudio environment
+    url = '/default/user/login'
+
+    client.get(url)
+    assert client.status == 200
+
+    populate_customers_with_subscriptions(web2py, 10)
+
+    url = '/test_automation_customer_subscriptions/' + \
+          'test_create_invoices' + \
+          '?month=1&year=2014&description=Subscription_Jan'
+    client.get(url)
+    assert client.status == 200
+
+    invoices = web2py.db(web2py.db.invoices).select(orderby=web2py.db.invoices.id)
+    assert len(invoices) > 1
+
+    # invoice numbers are reserved in one go, so they should be consecutive
+    year = unicode(datetime.date.today().year)
+    for i, invoice in enumerate(invoices):
+        assert invoice.InvoiceID == 'INV' + year + unicode(i + 1)
+
+    ig_100 = web2py.db.invoices_groups(100)
+    assert ig_100.NextID == len(invoices) + 1
+
+    # each invoice should have amounts matching its items
+    for invoice in invoices:
+        query = (web2py.db.invoices_items.invoices_id == invoice.id)
+        items = web2py.db(query).select(web2py.db.invoices_items.TotalPriceVAT)
+        amounts = web2py.db.invoices_amounts(invoices_id=invoice.id)
+        assert round(amounts.TotalPriceVAT, 2) == \
+               round(sum([ item.TotalPriceVAT for item in items ]), 2)
+
+
 def test_add_subscription_credits_for_month(client, web2py):
     """
         Are credits batch-added correctly?
@@ -113,6 +191,31 @@ def test_add_subscription_credits_for_month(client, web2py):
     assert web2py.db.customers_subscriptions_credits(3).MutationAmount == credits
 
 
+def test_add_subscription_credits_for_month_preview(client, web2py):
+    """
+        Does the preview list credits without adding them?
+    """
+    # get a random url to initialize the OS environment
+    url = '/default/user/login'
+    client.get(url)
+    assert client.status == 200
+
+    prepare_classes(web2py, credits=True)
+
+    query = (web2py.db.customers_subscriptions_credits.id > 0)
+    count_credits = web2py.db(query).count()
+
+    url = '/automation_customer_subscriptions/add_subscription_credits_for_month?year=2014&month=1&preview=on'
+    client.get(url)
+    assert client.status == 200
+
+    # Paused subscription is listed as skipped
+    assert 'Paused' in client.text
+
+    # Nothing added
+    assert web2py.db(query).count() == count_credits
+
+
 def test_subscription_credits_month_add_book_classes_for_recurring_reservations(client, web2py):
     """
         Are classes for recurring reservations booked?
@@ -163,3 +266,102 @@ def test_subscription_credits_month_add_book_classes_for_recurring_reservations(
 
     query = (web2py.db.classes_attendance.ClassDate >= '2099-01-01')
     assert web2py.db(query).count() == 2
+
+
+class FakeMollieHandler(BaseHTTPRequestHandler):
+    """
+        Answers the Mollie API calls made when collecting recurring payments
+    """
+    payments = []
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/hal+json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        # /v2/customers/<id>/mandates
+        mandates = [ { 'resource': 'mandate',
+                       'id': 'mdt_test',
+                       'status': 'valid' } ]
+        self.send_json({ 'count': len(mandates),
+                         '_embedded': { 'mandates': mandates },
+                         '_links': {} })
+
+    def do_POST(self):
+        # /v2/payments
+        length = int(self.headers.getheader('Content-Length'))
+        data = json.loads(self.rfile.read(length))
+        payment = { 'resource': 'payment',
+                    'id': 'tr_test' + str(len(self.payments) + 1),
+                    'status': 'open',
+                    'metadata': data['metadata'] }
+        self.payments.append(payment)
+        self.send_json(payment, status=201)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_collect_mollie_recurring(client, web2py):
+    """
+        Are invoices created and collected using a local fake Mollie server
+        and are subscriptions skipped when running a second time?
+    """
+    # Get random url to initialize OpenStudio environment
+    url = '/default/user/login'
+    client.get(url)
+    assert client.status == 200
+
+    populate_customers_with_subscriptions(web2py, 4)
+
+    server = HTTPServer(('127.0.0.1', 0), FakeMollieHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    web2py.db.sys_properties.insert(
+        Property='mollie_website_profile',
+        PropertyValue='test_' + 'x' * 30
+    )
+    web2py.db.sys_properties.insert(
+        Property='mollie_api_endpoint',
+        PropertyValue='http://127.0.0.1:' + unicode(server.server_port)
+    )
+
+    cs = web2py.db.customers_subscriptions(1)
+    cs.payment_methods_id = 100
+    cs.update_record()
+
+    customer = web2py.db.auth_user(cs.auth_customer_id)
+    customer.mollie_customer_id = 'cst_test'
+    customer.update_record()
+
+    web2py.db.commit()
+
+    try:
+        url = '/test_automation_customer_subscriptions/' + \
+              'test_collect_mollie_recurring?year=2014&month=1'
+        client.get(url)
+        assert client.status == 200
+
+        # Running again shouldn't create another payment
+        client.get(url)
+        assert client.status == 200
+    finally:
+        server.shutdown()
+
+    assert len(FakeMollieHandler.payments) == 1
+
+    collection = web2py.db.customers_subscriptions_mollie_collections(1)
+    assert collection.customers_subscriptions_id == 1
+    assert collection.Status == 'success'
+    assert collection.mollie_payment_id == 'tr_test1'
+
+    impi = web2py.db.invoices_mollie_payment_ids(1)
+    assert impi.invoices_id == collection.invoices_id
+    assert impi.mollie_payment_id == 'tr_test1'
+    assert web2py.db(web2py.db.invoices_mollie_payment_ids).count() == 1
@@ -717,4 +717,45 @@ def test_cancel_and_create_credit_invoice(client, web2py):
     assert web2py.db.invoices_items(5).Price == -12
     assert web2py.db.invoices_items(5).TotalPriceVAT == -120
 
-    assert "This is a credit invoice for invoice" in client.text
\ No newline at end of file
+    assert "This is a credit invoice for invoice" in client.text
+
+def test_export_invoices_tsv(client, web2py):
+    """
+        Are all invoice items and their payment dates exported?
+    """
+    populate_customers(web2py, 3)
+
+    url = '/invoices/export_invoices'
+    client.get(url)
+    assert client.status == 200
+
+    populate_invoices(web2py)
+    populate_invoices_items(web2py)
+
+    today = datetime.date.today()
+    web2py.db.invoices_payments.insert(
+        invoices_id = 1,
+        Amount = 10,
+        PaymentDate = today,
+        payment_methods_id = 1
+    )
+    web2py.db.commit()
+
+    data = {
+        'from_date': unicode(today),
+        'filetype': 'tsv',
+        'include_subscriptions': 'on'
+    }
+    client.post(url, data=data)
+    assert client.status == 200
+
+    lines = client.text.strip().split('\n')
+    # header + one line for each invoice item
+    assert len(lines) == web2py.db(web2py.db.invoices_items).count() + 1
+
+    for invoice in web2py.db(web2py.db.invoices).select():
+        assert invoice.InvoiceID in client.text
+
+    line_invoice_1 = [ line for line in lines
+                       if line.startswith(web2py.db.invoices(1).InvoiceID + '\t') ][0]
+    assert line_invoice_1.strip().endswith(unicode(today))
@@ -755,6 +755,107 @@ def test_add_batch_invoices_without_zero_lines(client, web2py):
     assert web2py.db(web2py.db.payment_batches_items).count() == 6
 
 
+def test_add_batch_invoices_preview(client, web2py):
+    """
+        Does the preview show the totals of the items a new batch would get,
+        without adding anything?
+    """
+    import json
+
+    url = '/finance/batch_add?export=collection&what=invoices'
+    client.get(url)
+    assert client.status == 200
+
+    populate_customers_with_subscriptions(web2py, 10)
+
+    # create invoices
+    inv_url = '/test_automation_customer_subscriptions/' + \
+              'test_create_invoices' + \
+              '?month=1&year=2014&description=Subscription_Jan'
+    client.get(inv_url)
+    assert client.status == 200
+
+    data = {'description':'Default invoice description'}
+    client.post(inv_url, data=data)
+    assert client.status == 200
+
+    url = '/finance/batch_add_preview.json?export=collection&what=invoices'
+    client.get(url)
+    assert client.status == 200
+
+    preview = json.loads(client.text)
+
+    # Same items as test_add_batch_invoices_without_zero_lines
+    assert preview['count'] == 6
+    # No batches have been sent to the bank, so all customers are new
+    assert preview['first']['count'] == 6
+    assert preview['recurring']['count'] == 0
+
+    sum = web2py.db.invoices_amounts.TotalPriceVAT.sum()
+    amount = web2py.db().select(sum).first()[sum]
+    assert round(preview['total'], 2) == round(amount, 2)
+
+    assert web2py.db(web2py.db.payment_batches_items).count() == 0
+
+
+def test_export_batch_sepa(client, web2py):
+    """
+        Is a collection batch exported as SEPA direct debit XML?
+    """
+    url = '/finance/batch_add?export=collection&what=invoices'
+    client.get(url)
+    assert client.status == 200
+
+    populate_customers_with_subscriptions(web2py, 10)
+
+    creditor = [
+        ['sepa_creditor_name', 'OpenStudio Yoga'],
+        ['sepa_creditor_iban', 'NL91ABNA0417164300'],
+        ['sepa_creditor_bic', 'ABNANL2A'],
+        ['sepa_creditor_id', 'NL00ZZZ000000000000'],
+    ]
+    for sys_property, value in creditor:
+        web2py.db.sys_properties.insert(Property=sys_property,
+                                        PropertyValue=value)
+    web2py.db.commit()
+
+    # create invoices
+    inv_url = '/test_automation_customer_subscriptions/' + \
+              'test_create_invoices' + \
+              '?month=1&year=2014&description=Subscription_Jan'
+    client.get(inv_url)
+    assert client.status == 200
+
+    data = {'description':'Default invoice description'}
+    client.post(inv_url, data=data)
+    assert client.status == 200
+
+    client.get(url)
+    assert client.status == 200
+
+    # Add a batch
+    data = {'Name'        : 'Test export',
+            'Description' : 'Cherry shake',
+            'Exdate'      : '2014-02-01',
+            'Note'        : 'Who loves bananas? Gorilla does!'}
+
+    client.post(url, data=data)
+    assert client.status == 200
+
+    url = '/finance/export_sepa?pbID=1'
+    client.get(url)
+    assert client.status == 200
+
+    assert '<NbOfTxs>6</NbOfTxs>' in client.text
+    assert '<SeqTp>FRST</SeqTp>' in client.text
+    assert '<SeqTp>RCUR</SeqTp>' not in client.text
+    assert '<IBAN>NL91ABNA0417164300</IBAN>' in client.text
+    assert '<ReqdColltnDt>2014-02-01</ReqdColltnDt>' in client.text
+
+    # Check the export is logged
+    assert web2py.db(web2py.db.payment_batches_exports).count() == 1
+
+
 def test_add_batch_invoices_with_zero_lines(client, web2py):
     """
         Check whether we can add a default batch and items are generated
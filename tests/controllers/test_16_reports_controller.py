@@ -7,6 +7,7 @@
 """
 
 import datetime
+import json
 
 from gluon.contrib.populate import populate
 
@@ -682,3 +683,46 @@ def test_reports_subscriptions_overview_customers_location_filter(client, web2py
     assert customer_7.display_name in client.text
 
 
+def test_reports_revenue_get_data(client, web2py):
+    """
+        Is the revenue for subscriptions listed and updated when invoice
+        amounts change?
+    """
+    populate_customers_with_subscriptions(web2py, invoices=True)
+
+    url = '/reports/revenue?year=2014'
+    client.get(url)
+    assert client.status == 200
+
+    def get_subscriptions_revenue():
+        query = (web2py.db.invoices_customers_subscriptions.invoices_id ==
+                 web2py.db.invoices_amounts.invoices_id) & \
+                (web2py.db.invoices.id == web2py.db.invoices_amounts.invoices_id) & \
+                (web2py.db.invoices.SubscriptionYear == 2014) & \
+                (web2py.db.invoices.SubscriptionMonth == 1)
+        rows = web2py.db(query).select(web2py.db.invoices_amounts.TotalPriceVAT)
+
+        return round(sum([ row.TotalPriceVAT for row in rows ]), 2)
+
+    url = '/reports/revenue_get_data.json'
+    client.get(url)
+    assert client.status == 200
+
+    data = json.loads(client.text)['json_data']
+    revenue = get_subscriptions_revenue()
+    assert revenue > 0
+    assert data['subscriptions']['datasets'][0]['data'][0] == revenue
+    assert data['total']['datasets'][0]['data'][0] == revenue
+
+    # Change the amount of an invoice, is the revenue calculated again?
+    amounts = web2py.db.invoices_amounts(invoices_id=1)
+    web2py.db(web2py.db.invoices_amounts.id == amounts.id).update(
+        TotalPriceVAT = amounts.TotalPriceVAT + 100
+    )
+    web2py.db.commit()
+
+    client.get(url)
+    assert client.status == 200
+
+    data = json.loads(client.text)['json_data']
+    assert round(data['subscriptions']['datasets'][0]['data'][0] - revenue, 2) == 100
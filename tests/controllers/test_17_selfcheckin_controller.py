@@ -94,3 +94,77 @@ def test_selfcheckin_checkin_impossible_when_full(client, web2py):
 
     assert 'This class is full' in client.text
     assert not 'Check in</button>' in client.text
+
+
+def test_selfcheckin_checkin_attending(client, web2py):
+    '''
+        Test checking in a customer on the roster of a class
+    '''
+    prepare_classes(web2py)
+
+    url = '/selfcheckin/checkin/?clsID=1&date=2014-01-06'
+    client.get(url)
+    assert client.status == 200
+
+    clatt = web2py.db.classes_attendance(1)
+    customer = web2py.db.auth_user(clatt.auth_customer_id)
+    assert customer.display_name in client.text
+    assert 'Check in</button>' in client.text
+
+    url = '/selfcheckin/checkin_attending/?clsID=1&date=2014-01-06&clattID=1'
+    client.get(url)
+    assert client.status == 200
+
+    clatt = web2py.db.classes_attendance(1)
+    assert clatt.BookingStatus == 'attending'
+
+
+def test_selfcheckin_checkin_booking_options(client, web2py):
+    '''
+        Are the booking options of a customer listed from the roster?
+    '''
+    prepare_classes(web2py)
+
+    url = '/selfcheckin/checkin_booking_options/?clsID=1&date=2014-01-06&cuID=1001'
+    client.get(url)
+    assert client.status == 200
+
+    customer = web2py.db.auth_user(1001)
+    assert customer.display_name in client.text
+
+    query = (web2py.db.customers_subscriptions.auth_customer_id == 1001)
+    cs = web2py.db(query).select(web2py.db.customers_subscriptions.ALL).first()
+    ssu = web2py.db.school_subscriptions(cs.school_subscriptions_id)
+    assert ssu.Name in client.text
+    assert 'Class card' in client.text
+    assert 'Drop in' in client.text
+
+
+def test_selfcheckin_checkin_roster_shows_credits(client, web2py):
+    '''
+        Are the credits remaining on the subscription of a booked customer
+        shown on the roster?
+    '''
+    prepare_classes(web2py)
+
+    web2py.db.sys_properties.insert(Property='selfcheckin_show_subscriptions',
+                                    PropertyValue='on')
+
+    clatt = web2py.db.classes_attendance(1)
+    query = (web2py.db.customers_subscriptions.auth_customer_id == clatt.auth_customer_id)
+    cs = web2py.db(query).select(web2py.db.customers_subscriptions.ALL).first()
+    web2py.db.customers_subscriptions_credits.insert(
+        customers_subscriptions_id=cs.id,
+        MutationType='add',
+        MutationAmount=12345
+    )
+    web2py.db.commit()
+
+    cs = web2py.db.customers_subscriptions(cs.id)
+    assert cs.CreditsBalance >= 12345
+
+    url = '/selfcheckin/checkin/?clsID=1&date=2014-01-06'
+    client.get(url)
+    assert client.status == 200
+
+    assert unicode(round(cs.CreditsBalance, 1)) + ' Credits' in client.text
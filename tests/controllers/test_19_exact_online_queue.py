@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+from populate_os_tables import populate_customers
+
+
+def prepare_exact_online_queue(web2py):
+    """
+        Authorize Exact Online & add a customer
+    """
+    populate_customers(web2py, 1)
+
+    web2py.db.sys_properties.insert(
+        Property='exact_online_authorized',
+        PropertyValue='True'
+    )
+
+    web2py.db.commit()
+
+
+def test_queue_add_coalesce(client, web2py):
+    """
+        Is an object that changes multiple times queued only once?
+    """
+    # Get random url to initialize OpenStudio environment
+    url = '/default/user/login'
+    client.get(url)
+    assert client.status == 200
+
+    prepare_exact_online_queue(web2py)
+
+    url = '/test_exact_online_queue/test_queue_add?object_name=relation&object_id=1001&action=update'
+    client.get(url)
+    assert client.status == 200
+
+    client.get(url)
+    assert client.status == 200
+
+    query = (web2py.db.integration_exact_online_queue.ObjectName == 'relation') & \
+            (web2py.db.integration_exact_online_queue.ObjectID == 1001)
+    assert web2py.db(query).count() == 1
+
+
+def test_queue_process(client, web2py):
+    """
+        Is a queued relation created in Exact Online and removed from the queue?
+    """
+    # Get random url to initialize OpenStudio environment
+    url = '/default/user/login'
+    client.get(url)
+    assert client.status == 200
+
+    prepare_exact_online_queue(web2py)
+
+    url = '/test_exact_online_queue/test_queue_add?object_name=relation&object_id=1001&action=create'
+    client.get(url)
+    assert client.status == 200
+
+    url = '/test_exact_online_queue/test_queue_process'
+    client.get(url)
+    assert client.status == 200
+    assert 'synced: 1 errors: 0' in client.text
+    assert 'relations created: 1' in client.text
+
+    assert web2py.db.auth_user(1001).exact_online_relation_id
+    assert web2py.db(web2py.db.integration_exact_online_queue).count() == 0
+
+
+def test_queue_process_retry(client, web2py):
+    """
+        Is an item that fails to sync scheduled to be tried again later?
+    """
+    # Get random url to initialize OpenStudio environment
+    url = '/default/user/login'
+    client.get(url)
+    assert client.status == 200
+
+    prepare_exact_online_queue(web2py)
+
+    url = '/test_exact_online_queue/test_queue_add?object_name=relation&object_id=1001&action=create'
+    client.get(url)
+    assert client.status == 200
+
+    url = '/test_exact_online_queue/test_queue_process?fail=True'
+    client.get(url)
+    assert client.status == 200
+    assert 'synced: 0 errors: 1' in client.text
+
+    row = web2py.db.integration_exact_online_queue(1)
+    assert row.Status == 'pending'
+    assert row.Attempts == 1
+    assert row.NextAttemptOn > datetime.datetime.now()
+    assert row.LastError
+
+    # Not due yet, so nothing should happen when processing again
+    url = '/test_exact_online_queue/test_queue_process'
+    client.get(url)
+    assert client.status == 200
+    assert 'synced: 0 errors: 0' in client.text
+
+
+def test_queue_process_added_again_during_sync(client, web2py):
+    """
+        Is an item that's added again while it's being synced kept in the
+        queue, so the new change is sent as well?
+    """
+    # Get random url to initialize OpenStudio environment
+    url = '/default/user/login'
+    client.get(url)
+    assert client.status == 200
+
+    prepare_exact_online_queue(web2py)
+
+    url = '/test_exact_online_queue/test_queue_add?object_name=relation&object_id=1001&action=update'
+    client.get(url)
+    assert client.status == 200
+
+    url = '/test_exact_online_queue/test_queue_process?readd=relation,1001,update'
+    client.get(url)
+    assert client.status == 200
+    assert 'synced: 1 errors: 0' in client.text
+
+    row = web2py.db.integration_exact_online_queue(1)
+    assert row.Status == 'pending'
+    assert row.Attempts == 0
+    assert row.Version == 1